@@ -29,5 +29,11 @@ setup(
     'PySocks',
     'requests[socks]',
     'plotly >= 4.1.0'
-  ]
+  ],
+  extras_require={
+    # Vectorized backend and numpy views of the columns of the metrics
+    'numpy': ['numpy'],
+    # Compiled backend
+    'numba': ['numpy', 'numba']
+  }
 )
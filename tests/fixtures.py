@@ -0,0 +1,60 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Helpers of the tests (synthetic snapshots loaded without console output)
+'''
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+
+# Adds the root directory of the repository into path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from whirlpool_stats.services.snapshot import Snapshot
+from whirlpool_stats.services.generator import SnapshotGenerator
+
+
+def generate_snapshot(snapshots_dir, denom, nb_mixes, nb_tx0s=None, remix_proba=0.6, seed=1):
+  '''
+  Generates the files of a synthetic snapshot
+  Parameters:
+    snapshots_dir = path of the directory storing the snapshot files
+    denom         = code identifying the snapshot (used for the filenames)
+    nb_mixes      = number of mix txs
+    nb_tx0s       = approximate number of tx0s (default = number of mixes)
+    remix_proba   = probability that an input of a mix is a remixed output
+    seed          = seed of the random generator
+  '''
+  with redirect_stdout(io.StringIO()):
+    SnapshotGenerator(nb_mixes, nb_tx0s=nb_tx0s, remix_proba=remix_proba, seed=seed).generate(snapshots_dir, denom)
+
+
+def no_progress(label, nb_done, nb_total, unit, rate, eta):
+  '''
+  Progress callback ignoring the reports
+  '''
+  pass
+
+
+def load_snapshot(snapshots_dir, denom):
+  '''
+  Returns a snapshot loaded from a directory (no console output)
+  Parameters:
+    snapshots_dir = path of the directory storing the snapshot files
+    denom         = code identifying the snapshot
+  '''
+  snapshot = Snapshot(snapshots_dir)
+  snapshot.instr.progress_callback = no_progress
+  with redirect_stdout(io.StringIO()):
+    snapshot.load(denom)
+  return snapshot
+
+
+def quiet(func, *args, **kwargs):
+  '''
+  Calls a function without console output
+  Returns the result of the function
+  '''
+  with redirect_stdout(io.StringIO()):
+    return func(*args, **kwargs)
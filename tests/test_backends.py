@@ -0,0 +1,88 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Runs the conformance checks of the backends on small synthetic snapshots
+(backends requiring packages that aren't installed are skipped)
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from fixtures import generate_snapshot, load_snapshot
+from whirlpool_stats.backends import get_backend_class
+from whirlpool_stats.backends import distributed
+from whirlpool_stats.backends.conformance import check_snapshot, SYNTHETIC_REMIX_PROBAS
+
+
+# Backends checked against the reference backend
+# (the distributed backend is checked with local workers)
+CHECKED_BACKENDS = ['python', 'numpy', 'numba']
+
+# Number of local workers of the distributed backend
+NB_LOCAL_WORKERS = 3
+
+
+class TestBackends(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.tmp_dir = tempfile.mkdtemp(prefix='wst_test_')
+    cls.l_snapshots = []
+    for remix_proba in SYNTHETIC_REMIX_PROBAS:
+      for nb_tx0s in [None, 50]:
+        denom = 'synth_%d_%s' % (int(remix_proba * 100), nb_tx0s)
+        generate_snapshot(cls.tmp_dir, denom, 500, nb_tx0s=nb_tx0s, remix_proba=remix_proba)
+        cls.l_snapshots.append(load_snapshot(cls.tmp_dir, denom))
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.tmp_dir)
+
+  def check_backend(self, name):
+    '''
+    Checks that a backend computes the same anonsets as the reference backend
+    Parameters:
+      name = name of the backend
+    '''
+    if get_backend_class(name) is None:
+      self.skipTest('backend %s not available' % name)
+    for snapshot in self.l_snapshots:
+      with self.subTest(snapshot=snapshot.denom):
+        l_results = check_snapshot(snapshot, [name])
+        self.assertEqual([r['backend'] for r in l_results], ['python'] if name == 'python' else ['python', name])
+        for result in l_results:
+          self.assertEqual(result['status'], 'ok', result['mismatches'])
+
+  def test_python(self):
+    self.check_backend('python')
+
+  def test_numpy(self):
+    self.check_backend('numpy')
+
+  def test_numba(self):
+    self.check_backend('numba')
+
+  def test_distributed(self):
+    # Small tasks, so that all the workers receive tasks
+    env = {distributed.WORKERS_ENV: 'local:%d' % NB_LOCAL_WORKERS}
+    with mock.patch.dict(os.environ, env), mock.patch.object(distributed, 'TASK_SIZE', 64):
+      try:
+        self.check_backend('distributed')
+        cluster = distributed.get_cluster()
+        self.assertEqual(len(cluster.d_processes), NB_LOCAL_WORKERS)
+        # Each worker received the graph of the last snapshot
+        self.assertEqual(len(cluster.d_digests), NB_LOCAL_WORKERS)
+        self.assertEqual(len(set(cluster.d_digests.values())), 1)
+      finally:
+        distributed.get_cluster().close()
+
+  def test_partial_range(self):
+    for name in CHECKED_BACKENDS:
+      if get_backend_class(name) is not None:
+        l_results = check_snapshot(self.l_snapshots[-1], [name], start=100, nb_rounds=50)
+        self.assertTrue(all(r['status'] == 'ok' for r in l_results), name)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,111 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Checks the resumption of an interrupted computation of the exact anonsets
+(checkpoint saved on interruption, incomplete record ignored, checkpoint
+deleted once the computation is completed)
+'''
+import glob
+import shutil
+import tempfile
+import unittest
+from fixtures import generate_snapshot, load_snapshot, quiet
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.services.backward_metrics import BackwardMetrics
+from whirlpool_stats.services.checkpoint import FN_CHECKPOINT
+
+
+# Number of mixes of the generated snapshot
+NB_MIXES = 300
+
+# Number of mix rounds computed before the interruption
+NB_ROUNDS_BEFORE_INTERRUPTION = 120
+
+
+def interrupt_after(iter_anonsets, nb_rounds, l_starts):
+  '''
+  Returns a replacement of the method iter_anonsets of a metrics object
+  raising KeyboardInterrupt after nb_rounds anonsets (simulated Ctrl-C)
+  Parameters:
+    iter_anonsets = original method
+    nb_rounds     = number of anonsets returned before the interruption
+    l_starts      = list storing the first round of each call
+  '''
+  def iter_interrupted(start=0):
+    l_starts.append(start)
+    for i, anonset in enumerate(iter_anonsets(start)):
+      if i == nb_rounds:
+        raise KeyboardInterrupt()
+      yield anonset
+  return iter_interrupted
+
+
+def record_starts(iter_anonsets, l_starts):
+  '''
+  Returns a replacement of the method iter_anonsets of a metrics object
+  storing the first round of each call
+  '''
+  def iter_recorded(start=0):
+    l_starts.append(start)
+    return iter_anonsets(start)
+  return iter_recorded
+
+
+class TestCheckpoint(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.tmp_dir = tempfile.mkdtemp(prefix='wst_test_')
+    generate_snapshot(cls.tmp_dir, 'ckpt', NB_MIXES)
+    cls.snapshot = load_snapshot(cls.tmp_dir, 'ckpt')
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.tmp_dir)
+
+  def get_checkpoint_files(self, name):
+    return glob.glob('%s/%s_ckpt_%s_*.bin' % (self.tmp_dir, FN_CHECKPOINT, name))
+
+  def check_resume(self, metrics_class, name):
+    '''
+    Interrupts the computation, appends an incomplete record
+    to the checkpoint, resumes the computation and compares the anonsets
+    with an uninterrupted computation
+    '''
+    ref_metrics = metrics_class(self.snapshot)
+    quiet(ref_metrics.compute)
+    self.assertEqual(self.get_checkpoint_files(name), [])
+
+    # Interrupted computation
+    l_starts = []
+    metrics = metrics_class(self.snapshot)
+    metrics.resumable = True
+    metrics.iter_anonsets = interrupt_after(metrics.iter_anonsets, NB_ROUNDS_BEFORE_INTERRUPTION, l_starts)
+    with self.assertRaises(KeyboardInterrupt):
+      quiet(metrics.compute)
+    l_files = self.get_checkpoint_files(name)
+    self.assertEqual(len(l_files), 1)
+
+    # Incomplete record (process killed while writing the checkpoint)
+    with open(l_files[0], 'ab') as f:
+      f.write(b'\x01\x02\x03')
+
+    # Resumed computation
+    metrics = metrics_class(self.snapshot)
+    metrics.resumable = True
+    metrics.iter_anonsets = record_starts(metrics.iter_anonsets, l_starts)
+    quiet(metrics.compute)
+    self.assertEqual(l_starts, [0, NB_ROUNDS_BEFORE_INTERRUPTION])
+    self.assertEqual(list(metrics.l_anonsets), list(ref_metrics.l_anonsets))
+    self.assertEqual(list(metrics.l_spreads), list(ref_metrics.l_spreads))
+    self.assertEqual(self.get_checkpoint_files(name), [])
+
+  def test_resume_fwd(self):
+    self.check_resume(ForwardMetrics, 'fwd')
+
+  def test_resume_bwd(self):
+    self.check_resume(BackwardMetrics, 'bwd')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,68 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Checks the atomic writes of files (the target is replaced only
+if the file is completely written, no temporary file is left)
+'''
+import os
+import shutil
+import tempfile
+import unittest
+# Adds the root directory of the repository into path
+import fixtures
+from whirlpool_stats.utils.files import atomic_path, atomic_write
+
+
+class TestFiles(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp(prefix='wst_test_')
+    self.filepath = '%s/data.csv' % self.tmp_dir
+    with open(self.filepath, 'w') as f:
+      f.write('old\n')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def read(self):
+    with open(self.filepath, 'r') as f:
+      return f.read()
+
+  def test_write(self):
+    with atomic_write(self.filepath) as f:
+      f.write('new\n')
+      # The target is unchanged until the end of the write
+      self.assertEqual(self.read(), 'old\n')
+    self.assertEqual(self.read(), 'new\n')
+    self.assertEqual(os.listdir(self.tmp_dir), ['data.csv'])
+
+  def test_binary(self):
+    with atomic_write(self.filepath, 'wb') as f:
+      f.write(b'\x00\x01')
+    with open(self.filepath, 'rb') as f:
+      self.assertEqual(f.read(), b'\x00\x01')
+
+  def test_error(self):
+    with self.assertRaises(KeyboardInterrupt):
+      with atomic_write(self.filepath) as f:
+        f.write('partial')
+        raise KeyboardInterrupt()
+    self.assertEqual(self.read(), 'old\n')
+    self.assertEqual(os.listdir(self.tmp_dir), ['data.csv'])
+
+  def test_path(self):
+    with self.assertRaises(ValueError):
+      with atomic_path(self.filepath) as tmp_filepath:
+        with open(tmp_filepath, 'w') as f:
+          f.write('partial')
+        raise ValueError()
+    self.assertEqual(os.listdir(self.tmp_dir), ['data.csv'])
+    # Nothing written
+    with self.assertRaises(FileNotFoundError):
+      with atomic_path(self.filepath) as tmp_filepath:
+        pass
+    self.assertEqual(self.read(), 'old\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Checks the startup of the interactive mode (import of whirlpool_stats.wst)
+Heavy packages must be imported by the commands needing them.
+'''
+import os
+import sys
+import subprocess
+import unittest
+
+
+# Root directory of the repository
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Packages that mustn't be imported at startup
+HEAVY_PACKAGES = ['plotly', 'requests', 'numpy']
+
+# Budget (in microseconds) of the cumulative import time of whirlpool_stats.wst
+# (measured after a first import compiling the modules, generous because
+# measures are noisy on shared machines)
+IMPORT_TIME_BUDGET = 250000
+
+
+def get_import_times(module, l_command_args=None):
+  '''
+  Returns a dictionary module => cumulative import time (in microseconds)
+  measured by python -X importtime in a new interpreter
+  Parameters:
+    module         = imported module
+    l_command_args = arguments of the command line (module executed as a script)
+                     or None if the module is only imported
+  '''
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join([ROOT_DIR, env.get('PYTHONPATH', '')]).rstrip(os.pathsep)
+  if l_command_args is None:
+    l_args = ['-c', 'import %s' % module]
+  else:
+    l_args = ['-m', module] + l_command_args
+  process = subprocess.run(
+    [sys.executable, '-X', 'importtime'] + l_args,
+    cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    universal_newlines=True, check=(l_command_args is None)
+  )
+  d_times = dict()
+  for line in process.stderr.splitlines():
+    # Format: import time: self [us] | cumulative | imported package
+    if not line.startswith('import time:'):
+      continue
+    l_fields = line[len('import time:'):].split('|')
+    if (len(l_fields) != 3) or (not l_fields[1].strip().isdigit()):
+      continue
+    d_times[l_fields[2].strip()] = int(l_fields[1])
+  return d_times
+
+
+class TestImportTime(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    # First import compiling the modules (bytecode cache)
+    get_import_times('whirlpool_stats.wst')
+    cls.d_times = get_import_times('whirlpool_stats.wst')
+
+  def test_no_heavy_packages(self):
+    for module in self.d_times.keys():
+      self.assertNotIn(module.split('.')[0], HEAVY_PACKAGES, 'module %s imported at startup' % module)
+
+  def test_subcommands(self):
+    # Arguments are checked without importing the optional backends
+    l_commands = [
+      ('batch', ['run', '--help']),
+      ('batch', ['run', '--backend=unknown']),
+      ('watcher', ['watch', '--help']),
+      ('worker', ['worker', '--help'])
+    ]
+    for service, l_command_args in l_commands:
+      d_times = get_import_times('whirlpool_stats.wst', l_command_args)
+      self.assertIn('whirlpool_stats.services.%s' % service, d_times)
+      for module in d_times.keys():
+        self.assertNotIn(module.split('.')[0], HEAVY_PACKAGES + ['numba'], 'module %s imported by %s' % (module, l_command_args))
+
+  def test_budget(self):
+    self.assertIn('whirlpool_stats.wst', self.d_times)
+    self.assertLess(self.d_times['whirlpool_stats.wst'], IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,203 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Checks the incremental updates of the watch mode: a snapshot growing
+in steps (Snapshot.load_tail + updates of the metrics) must have the same
+metrics as the snapshot loaded and computed from scratch
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from fixtures import generate_snapshot, load_snapshot, quiet
+from whirlpool_stats.utils.constants import FILENAME_TEMPLATES, FN_MIX_TXS, FN_TX0S, FN_LINKS
+from whirlpool_stats.utils.columns import ROUND_COLUMNS, TX0_COLUMNS
+from whirlpool_stats.backends import get_backend_class
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.services.backward_metrics import BackwardMetrics
+from whirlpool_stats.services.tx0s_metrics import Tx0sMetrics
+
+
+# Number of mixes of the generated snapshot
+NB_MIXES = 400
+
+# Fractions of the txs of the generated snapshot loaded by each step
+STEPS = [0.5, 0.6, 0.61, 0.8, 1.0]
+
+
+def read_rows(filepath):
+  '''
+  Returns the tuple (header, list of rows) of a snapshot file
+  Parameters:
+    filepath = path of the file
+  '''
+  with open(filepath, 'r', newline='\n') as f:
+    lines = f.read().splitlines(True)
+  return lines[0], lines[1:]
+
+
+def get_key(fn, row):
+  '''
+  Returns the tiid of the tx introduced by a row
+  (target of the links, links are appended with their target)
+  Parameters:
+    fn  = template of the filename
+    row = row of the file
+  '''
+  fields = row.split(';')
+  return int(fields[1]) if fn == FN_LINKS else int(fields[0])
+
+
+def compute_metrics(snapshot, backend_name):
+  '''
+  Computes the metrics of a snapshot
+  Returns the tuple (fwd_metrics, bwd_metrics, tx0_metrics)
+  Parameters:
+    snapshot     = snapshot
+    backend_name = name of the backend
+  '''
+  fwd_metrics = ForwardMetrics(snapshot)
+  fwd_metrics.backend_name = backend_name
+  quiet(fwd_metrics.compute)
+  bwd_metrics = BackwardMetrics(snapshot)
+  bwd_metrics.backend_name = backend_name
+  quiet(bwd_metrics.compute)
+  tx0_metrics = Tx0sMetrics(snapshot, fwd_metrics)
+  quiet(tx0_metrics.compute)
+  return fwd_metrics, bwd_metrics, tx0_metrics
+
+
+class TestIncremental(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp(prefix='wst_test_')
+    self.src_dir = '%s/src' % self.tmp_dir
+    self.dst_dir = '%s/dst' % self.tmp_dir
+    os.mkdir(self.src_dir)
+    os.mkdir(self.dst_dir)
+    generate_snapshot(self.src_dir, 'inc', NB_MIXES, nb_tx0s=NB_MIXES // 4)
+    self.d_files = dict()
+    for fn in FILENAME_TEMPLATES:
+      self.d_files[fn] = read_rows('%s/%s_inc.csv' % (self.src_dir, fn))
+    self.max_tiid = max(get_key(FN_MIX_TXS, row) for row in self.d_files[FN_MIX_TXS][1])
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def write_until(self, min_tiid, max_tiid):
+    '''
+    Appends the rows of the txs with a tiid in ]min_tiid, max_tiid] to the snapshot files
+    (files are created with their header if min_tiid is None)
+    '''
+    for fn, (header, rows) in self.d_files.items():
+      filepath = '%s/%s_inc.csv' % (self.dst_dir, fn)
+      with open(filepath, 'w' if min_tiid is None else 'a', newline='\n') as f:
+        if min_tiid is None:
+          f.write(header)
+        for row in rows:
+          key = get_key(fn, row)
+          if ((min_tiid is None) or (key > min_tiid)) and (key <= max_tiid):
+            f.write(row)
+
+  def append_row(self, fn, row):
+    '''
+    Appends a row to a snapshot file
+    '''
+    with open('%s/%s_inc.csv' % (self.dst_dir, fn), 'a', newline='\n') as f:
+      f.write(row)
+
+  def check_equal(self, l_metrics, l_ref_metrics):
+    '''
+    Checks that 2 tuples (fwd_metrics, bwd_metrics, tx0_metrics) store the same metrics
+    '''
+    fwd_metrics, bwd_metrics, tx0_metrics = l_metrics
+    ref_fwd, ref_bwd, ref_tx0 = l_ref_metrics
+    for name, _ in ROUND_COLUMNS:
+      self.assertEqual(list(fwd_metrics.columns.get_column(name)), list(ref_fwd.columns.get_column(name)), 'fwd %s' % name)
+      self.assertEqual(list(bwd_metrics.columns.get_column(name)), list(ref_bwd.columns.get_column(name)), 'bwd %s' % name)
+    for name, _ in TX0_COLUMNS:
+      self.assertEqual(list(tx0_metrics.columns.get_column(name)), list(ref_tx0.columns.get_column(name)), 'tx0 %s' % name)
+    self.assertEqual(dict(bwd_metrics.d_nb_mixes), dict(ref_bwd.d_nb_mixes))
+    self.assertEqual(dict(bwd_metrics.d_inflow), dict(ref_bwd.d_inflow))
+    self.assertEqual(dict(bwd_metrics.d_nb_active_tx0s), dict(ref_bwd.d_nb_active_tx0s))
+    self.assertEqual(dict(tx0_metrics.d_nb_new_tx0s), dict(ref_tx0.d_nb_new_tx0s))
+    self.assertEqual(tx0_metrics.d_indices, ref_tx0.d_indices)
+
+  def check_updates(self, backend_name):
+    '''
+    Grows the snapshot in steps and compares the updated metrics
+    with the metrics computed from scratch after each step
+    '''
+    if get_backend_class(backend_name) is None:
+      self.skipTest('backend %s not available' % backend_name)
+    l_limits = [int(self.max_tiid * step) for step in STEPS]
+    self.write_until(None, l_limits[0])
+    snapshot = load_snapshot(self.dst_dir, 'inc')
+    fwd_metrics, bwd_metrics, tx0_metrics = compute_metrics(snapshot, backend_name)
+
+    for min_tiid, max_tiid in zip(l_limits, l_limits[1:]):
+      self.write_until(min_tiid, max_tiid)
+      tail = quiet(snapshot.load_tail)
+      self.assertIsNotNone(tail)
+      nb_new_mixes, nb_new_tx0s, l_new_links = tail
+      self.assertGreater(nb_new_mixes, 0)
+      d_tx0_deltas = quiet(fwd_metrics.update, nb_new_mixes, l_new_links)
+      quiet(bwd_metrics.update, nb_new_mixes)
+      quiet(tx0_metrics.update, nb_new_tx0s, nb_new_mixes, d_tx0_deltas)
+
+      ref_snapshot = load_snapshot(self.dst_dir, 'inc')
+      self.assertEqual(snapshot.l_mix_txs, ref_snapshot.l_mix_txs)
+      self.assertEqual(snapshot.l_tx0s, ref_snapshot.l_tx0s)
+      self.check_equal((fwd_metrics, bwd_metrics, tx0_metrics), compute_metrics(ref_snapshot, backend_name))
+
+  def test_updates_python(self):
+    self.check_updates('python')
+
+  def test_updates_numpy(self):
+    self.check_updates('numpy')
+
+  def test_no_changes(self):
+    self.write_until(None, self.max_tiid // 2)
+    snapshot = load_snapshot(self.dst_dir, 'inc')
+    self.assertEqual(quiet(snapshot.load_tail), (0, 0, []))
+
+  def test_incomplete_row(self):
+    # A row being written is loaded by the next update
+    self.write_until(None, self.max_tiid // 2)
+    snapshot = load_snapshot(self.dst_dir, 'inc')
+    header, rows = self.d_files[FN_MIX_TXS]
+    row = [r for r in rows if get_key(FN_MIX_TXS, r) > self.max_tiid // 2][0]
+    self.append_row(FN_MIX_TXS, row[0:10])
+    self.assertEqual(quiet(snapshot.load_tail), (0, 0, []))
+    self.append_row(FN_MIX_TXS, row[10:])
+    self.assertEqual(quiet(snapshot.load_tail)[0], 1)
+
+  def test_rewritten_file(self):
+    self.write_until(None, self.max_tiid // 2)
+    snapshot = load_snapshot(self.dst_dir, 'inc')
+    # Shorter file
+    self.write_until(None, self.max_tiid // 4)
+    self.assertIsNone(quiet(snapshot.load_tail))
+
+  def test_older_tiids(self):
+    self.write_until(None, self.max_tiid // 2)
+    snapshot = load_snapshot(self.dst_dir, 'inc')
+    last_tiid = snapshot.l_mix_txs[-1]
+    self.append_row(FN_MIX_TXS, '%d;%064x;%d\n' % (last_tiid - 1, 1, snapshot.l_ts_mix_txs[-1]))
+    self.assertIsNone(quiet(snapshot.load_tail))
+
+  def test_older_tx0s(self):
+    self.write_until(None, self.max_tiid // 2)
+    snapshot = load_snapshot(self.dst_dir, 'inc')
+    self.append_row(FN_TX0S, '%d;%064x;%d;3\n' % (snapshot.l_tx0s[0], 2, snapshot.l_ts_tx0s[0]))
+    self.assertIsNone(quiet(snapshot.load_tail))
+
+  def test_links_towards_loaded_txs(self):
+    self.write_until(None, self.max_tiid // 2)
+    snapshot = load_snapshot(self.dst_dir, 'inc')
+    self.append_row(FN_LINKS, '%d;%d\n' % (snapshot.l_tx0s[-1], snapshot.l_mix_txs[-1]))
+    self.assertIsNone(quiet(snapshot.load_tail))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,123 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Checks the storage of the links between txs (each link stored once
+with its multiplicity) on a small snapshot with repeated (src, tgt) rows
+'''
+import shutil
+import tempfile
+import unittest
+from fixtures import load_snapshot, quiet
+from whirlpool_stats.utils.constants import FN_MIX_TXS, FN_TX0S, FN_LINKS
+from whirlpool_stats.services.snapshot import Snapshot
+
+
+# Rows of the snapshot files (tx0s 1 and 2, mixes 3, 4 and 5 on 3 consecutive days)
+TX0S_ROWS = [
+  'id;txid;block_ts;nb_outputs',
+  '1;%064x;86000;4' % 1,
+  '2;%064x;86100;2' % 2,
+]
+
+MIX_TXS_ROWS = [
+  'id;txid;block_ts',
+  '3;%064x;86400' % 3,
+  '4;%064x;172800' % 4,
+  '5;%064x;259200' % 5,
+]
+
+LINKS_ROWS = [
+  'src;tgt',
+  '1;3', '1;3', '2;3', '3;4', '1;4',
+  '3;4', '3;4', '2;5', '4;5', '4;5',
+]
+
+# Expected links (src, tgt) => multiplicity
+EXPECTED_LINKS = {
+  (1, 3): 2, (2, 3): 1, (1, 4): 1, (3, 4): 3, (2, 5): 1, (4, 5): 2
+}
+
+
+def write_rows(snapshots_dir, fn, rows):
+  with open('%s/%s_links.csv' % (snapshots_dir, fn), 'w', newline='\n') as f:
+    f.write(''.join('%s\n' % row for row in rows))
+
+
+class TestLinks(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp(prefix='wst_test_')
+    write_rows(self.tmp_dir, FN_TX0S, TX0S_ROWS)
+    write_rows(self.tmp_dir, FN_MIX_TXS, MIX_TXS_ROWS)
+    write_rows(self.tmp_dir, FN_LINKS, LINKS_ROWS)
+    self.snapshot = load_snapshot(self.tmp_dir, 'links')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def check_links(self, snapshot, expected_links):
+    '''
+    Checks the links stored by a snapshot
+    Parameters:
+      snapshot       = snapshot
+      expected_links = dictionary (src, tgt) => multiplicity
+    '''
+    l_links = [(src, tgt) for src, tgts in snapshot.d_links.items() for tgt in tgts]
+    # Each link is stored once
+    self.assertEqual(sorted(l_links), sorted(expected_links.keys()))
+    l_reverse_links = [(src, tgt) for tgt, srcs in snapshot.d_reverse_links.items() for src in srcs]
+    self.assertEqual(sorted(l_reverse_links), sorted(expected_links.keys()))
+    for (src, tgt), multiplicity in expected_links.items():
+      self.assertEqual(snapshot.get_multiplicity(src, tgt), multiplicity, 'link %d => %d' % (src, tgt))
+    # Number of links from each tx (multiplicities included)
+    for tiid in snapshot.l_tx0s + snapshot.l_mix_txs:
+      nb_links = sum(m for (src, tgt), m in expected_links.items() if src == tiid)
+      self.assertEqual(snapshot.get_nb_links(tiid), nb_links, 'links from %d' % tiid)
+
+  def test_duplicate_links(self):
+    self.check_links(self.snapshot, EXPECTED_LINKS)
+    self.assertEqual(self.snapshot.get_nb_links(1), 3)
+    self.assertEqual(self.snapshot.get_nb_links(3), 3)
+    self.assertEqual(self.snapshot.get_nb_links(5), 0)
+
+  def test_add_edge(self):
+    snapshot = Snapshot(self.tmp_dir)
+    snapshot.add_edge(1, 3)
+    snapshot.add_edge(1, 3, 2)
+    snapshot.add_edge(1, 4, 3)
+    snapshot.add_edge(1, 4)
+    self.assertEqual(snapshot.d_links[1], [3, 4])
+    self.assertEqual(snapshot.get_multiplicity(1, 3), 3)
+    self.assertEqual(snapshot.get_multiplicity(1, 4), 4)
+    self.assertEqual(snapshot.get_nb_links(1), 7)
+    self.assertEqual(snapshot.get_nb_links(3), 0)
+
+  def test_snapshot_until(self):
+    # Mix 5 excluded
+    snapshot = self.snapshot.get_snapshot_until(172800)
+    self.assertEqual(snapshot.l_mix_txs, [3, 4])
+    expected_links = {k: v for k, v in EXPECTED_LINKS.items() if k[1] != 5}
+    self.check_links(snapshot, expected_links)
+    self.assertEqual(snapshot.get_nb_links(4), 0)
+    # Whole snapshot
+    self.check_links(self.snapshot.get_snapshot_until(259200), EXPECTED_LINKS)
+
+  def test_graph(self):
+    snapshot = Snapshot(self.tmp_dir)
+    snapshot.set_graph(self.snapshot.get_graph())
+    self.check_links(snapshot, EXPECTED_LINKS)
+
+  def test_duplicate_links_in_tail(self):
+    with open('%s/%s_links.csv' % (self.tmp_dir, FN_MIX_TXS), 'a', newline='\n') as f:
+      f.write('6;%064x;345600\n' % 6)
+    with open('%s/%s_links.csv' % (self.tmp_dir, FN_LINKS), 'a', newline='\n') as f:
+      f.write('5;6\n4;6\n5;6\n')
+    # New links are returned row by row (1 row = 1 spent txo)
+    self.assertEqual(quiet(self.snapshot.load_tail), (1, 0, [(5, 6), (4, 6), (5, 6)]))
+    expected_links = dict(EXPECTED_LINKS)
+    expected_links.update({(5, 6): 2, (4, 6): 1})
+    self.check_links(self.snapshot, expected_links)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,58 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Checks the forward-looking anonsets of the tx0s
+'''
+import shutil
+import tempfile
+import unittest
+from fixtures import generate_snapshot, load_snapshot, quiet
+from whirlpool_stats.backends import get_available_backends
+from whirlpool_stats.backends.python_backend import PythonBackend
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.services.tx0s_metrics import Tx0sMetrics
+
+
+class TestTx0sAnonsets(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.tmp_dir = tempfile.mkdtemp(prefix='wst_test_')
+    # Few tx0s with many outputs (most tx0s have several first mixes)
+    generate_snapshot(cls.tmp_dir, 'tx0s', 400, nb_tx0s=40)
+    cls.snapshot = load_snapshot(cls.tmp_dir, 'tx0s')
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.tmp_dir)
+
+  def get_expected_anonsets(self):
+    '''
+    Returns the anonsets of the tx0s computed by the reference backend
+    (joint walk of the first mixes of each tx0)
+    '''
+    snapshot = self.snapshot
+    l_groups = [
+      sorted(set(t for t in snapshot.d_links.get(tiid, []) if t in snapshot.s_mix_txs))
+      for tiid in snapshot.l_tx0s
+    ]
+    self.assertGreater(len([g for g in l_groups if len(g) > 1]), 10)
+    return PythonBackend(snapshot).get_fwd_anonsets(l_groups)
+
+  def test_anonsets(self):
+    expected = self.get_expected_anonsets()
+    for backend_name in get_available_backends():
+      if backend_name == 'distributed':
+        continue
+      with self.subTest(backend=backend_name):
+        fwd_metrics = ForwardMetrics(self.snapshot)
+        fwd_metrics.backend_name = backend_name
+        quiet(fwd_metrics.compute)
+        tx0_metrics = Tx0sMetrics(self.snapshot, fwd_metrics)
+        quiet(tx0_metrics.compute)
+        self.assertEqual(list(tx0_metrics.l_anonsets), expected)
+        self.assertEqual(fwd_metrics.backend.name, backend_name)
+
+
+if __name__ == '__main__':
+  unittest.main()
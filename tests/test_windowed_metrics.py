@@ -0,0 +1,66 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Checks the time-windowed backward-looking anonsets
+'''
+import shutil
+import tempfile
+import unittest
+from fixtures import generate_snapshot, load_snapshot, quiet
+from whirlpool_stats.services.windowed_metrics import WindowedMetrics
+
+
+def get_recent_sources(snapshot, tiid, min_ts):
+  '''
+  Returns the number of ancestor tx0s of a mix created after a given timestamp
+  (walk of the ancestors created after the timestamp)
+  Parameters:
+    snapshot = snapshot
+    tiid     = id of the mix
+    min_ts   = minimum timestamp
+  '''
+  d_ts = dict(zip(snapshot.l_mix_txs, snapshot.l_ts_mix_txs))
+  d_ts.update(zip(snapshot.l_tx0s, snapshot.l_ts_tx0s))
+  s_visited = set()
+  stack = [tiid]
+  nb_tx0s = 0
+  while len(stack) > 0:
+    for prev_tiid in snapshot.d_reverse_links[stack.pop()]:
+      if (prev_tiid in s_visited) or (d_ts.get(prev_tiid, 0) < min_ts):
+        continue
+      s_visited.add(prev_tiid)
+      if prev_tiid in snapshot.s_mix_txs:
+        stack.append(prev_tiid)
+      elif prev_tiid in snapshot.s_tx0s:
+        nb_tx0s += 1
+  return nb_tx0s
+
+
+class TestWindowedMetrics(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.tmp_dir = tempfile.mkdtemp(prefix='wst_test_')
+    generate_snapshot(cls.tmp_dir, 'win', 600)
+    cls.snapshot = load_snapshot(cls.tmp_dir, 'win')
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.tmp_dir)
+
+  def test_window(self):
+    snapshot = self.snapshot
+    win_metrics = WindowedMetrics(snapshot)
+    for nb_days in [1, 10, 100, 1000]:
+      with self.subTest(nb_days=nb_days):
+        quiet(win_metrics.compute_window, nb_days)
+        expected = [
+          get_recent_sources(snapshot, tiid, ts - nb_days * 86400)
+          for tiid, ts in zip(snapshot.l_mix_txs, snapshot.l_ts_mix_txs)
+        ]
+        self.assertEqual(win_metrics.l_win_anonsets, expected)
+        self.assertEqual(len(win_metrics.l_win_spreads), len(expected))
+
+
+if __name__ == '__main__':
+  unittest.main()
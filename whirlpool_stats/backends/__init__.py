@@ -0,0 +1,55 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Backends computing the exact anonsets (selected at runtime)
+'''
+from importlib import import_module
+
+
+# Dictionary name => (module, class) of the backends
+BACKENDS = {
+  'python': ('whirlpool_stats.backends.python_backend', 'PythonBackend'),
+  'numpy': ('whirlpool_stats.backends.numpy_backend', 'NumpyBackend'),
+  'numba': ('whirlpool_stats.backends.numba_backend', 'NumbaBackend'),
+  'distributed': ('whirlpool_stats.backends.distributed', 'DistributedBackend')
+}
+
+# Reference backend (pure python, always available)
+DEFAULT_BACKEND = 'python'
+
+
+def get_backend_class(name):
+  '''
+  Returns the class of a backend (or None if the backend is unknown or unavailable)
+  Parameters:
+    name = name of the backend
+  '''
+  if name not in BACKENDS:
+    return None
+  module_name, class_name = BACKENDS[name]
+  backend_class = getattr(import_module(module_name), class_name)
+  return backend_class if backend_class.is_available() else None
+
+
+def get_available_backends():
+  '''
+  Returns the list of the names of the backends that can be used
+  (backends requiring libraries that aren't installed are excluded)
+  '''
+  return [name for name in BACKENDS if get_backend_class(name) is not None]
+
+
+def create_backend(name, snapshot):
+  '''
+  Returns a backend computing the anonsets of a snapshot
+  Raises a ValueError if the backend is unknown or unavailable
+  Parameters:
+    name     = name of the backend
+    snapshot = snapshot
+  '''
+  backend_class = get_backend_class(name)
+  if backend_class is None:
+    raise ValueError('Backend %s is not available (available backends: %s)' % (
+      name, ', '.join(get_available_backends())
+    ))
+  return backend_class(snapshot)
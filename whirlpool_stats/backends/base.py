@@ -0,0 +1,62 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Interface of the backends computing the exact anonsets
+'''
+
+
+class Backend(object):
+  '''
+  A backend computes the exact anonsets of a snapshot:
+  - forward-looking anonset of a mix = number of unmixed txos descending from the mix,
+  - backward-looking anonset of a mix = number of tx0s the mix descends from,
+  - forward-looking anonset of a group of mixes = number of unmixed txos
+    descending from at least one mix of the group (e.g. first mixes of a tx0).
+  All the backends must return the same values (see the conformance module).
+  '''
+
+  # Name of the backend
+  name = None
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    self.snapshot = snapshot
+
+
+  @staticmethod
+  def is_available():
+    '''
+    Checks if the libraries required by the backend are installed
+    '''
+    return True
+
+
+  def iter_fwd_anonsets(self, start=0):
+    '''
+    Yields the forward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    raise NotImplementedError()
+
+
+  def iter_bwd_anonsets(self, start=0):
+    '''
+    Yields the backward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    raise NotImplementedError()
+
+
+  def get_fwd_anonsets(self, l_groups):
+    '''
+    Returns the list of the forward-looking anonsets of groups of mixes
+    Parameters:
+      l_groups = list of lists of tiids of mixes
+    '''
+    raise NotImplementedError()
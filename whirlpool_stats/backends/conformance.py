@@ -0,0 +1,205 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Conformance checks of the backends: the anonsets computed by each backend
+must be identical to the anonsets computed by the reference backend
+(synthetic snapshots and/or snapshots stored in a directory)
+'''
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+from itertools import islice
+from contextlib import redirect_stdout
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.services.snapshot import Snapshot
+from whirlpool_stats.services.generator import SnapshotGenerator
+from whirlpool_stats.backends import create_backend, get_available_backends, DEFAULT_BACKEND
+
+
+# Default sizes (number of mix rounds) of the synthetic snapshots
+DEFAULT_SIZES = [2000, 10000]
+
+# Remix probabilities of the synthetic snapshots
+# (sparse and dense transaction graphs)
+SYNTHETIC_REMIX_PROBAS = [0.3, 0.8]
+
+
+def compute_anonsets(backend, start=0, nb_rounds=None):
+  '''
+  Computes the anonsets with a backend
+  Returns a dictionary metrics => list of anonsets
+  Parameters:
+    backend   = backend
+    start     = first mix round
+    nb_rounds = number of mix rounds (None = all the mix rounds after start)
+  '''
+  snapshot = backend.snapshot
+  end = None if nb_rounds is None else start + nb_rounds
+  # Groups of first mixes of the tx0s
+  l_groups = [snapshot.d_links.get(tiid, []) for tiid in snapshot.l_tx0s]
+  l_groups = [[t for t in group if t in snapshot.s_mix_txs] for group in l_groups[start:end]]
+  return {
+    'fwd anonset': list(islice(backend.iter_fwd_anonsets(start), nb_rounds)),
+    'bwd anonset': list(islice(backend.iter_bwd_anonsets(start), nb_rounds)),
+    'tx0 anonset': backend.get_fwd_anonsets(l_groups)
+  }
+
+
+def check_snapshot(snapshot, backends=None, start=0, nb_rounds=None):
+  '''
+  Compares the anonsets computed by a list of backends with the reference backend
+  Returns a list of dictionaries (one per backend) storing the status,
+  the first mismatches and the wall time of each backend
+  Parameters:
+    snapshot  = snapshot
+    backends  = list of names of backends (default = all available backends)
+    start     = first mix round (and first tx0)
+    nb_rounds = number of mix rounds (and tx0s) checked (None = all)
+  '''
+  if backends is None:
+    backends = get_available_backends()
+
+  l_results = []
+  d_reference = None
+  for name in [DEFAULT_BACKEND] + [b for b in backends if b != DEFAULT_BACKEND]:
+    t0 = time.time()
+    backend = create_backend(name, snapshot)
+    d_anonsets = compute_anonsets(backend, start, nb_rounds)
+    result = {'backend': name, 'status': 'ok', 'wall_time': time.time() - t0, 'mismatches': dict()}
+    if d_reference is None:
+      d_reference = d_anonsets
+    else:
+      for metrics, l_ref in d_reference.items():
+        l_values = d_anonsets[metrics]
+        l_diffs = [i for i in range(0, max(len(l_ref), len(l_values)))
+                   if (i >= len(l_ref)) or (i >= len(l_values)) or (l_ref[i] != l_values[i])]
+        if len(l_diffs) > 0:
+          result['status'] = 'mismatch'
+          result['mismatches'][metrics] = {'count': len(l_diffs), 'first': start + l_diffs[0]}
+    l_results.append(result)
+  return l_results
+
+
+def display(label, l_results):
+  '''
+  Displays the results of the checks of a snapshot
+  Parameters:
+    label     = label of the snapshot
+    l_results = list of results returned by check_snapshot()
+  '''
+  print(label)
+  for result in l_results:
+    line = '  %-8s %-9s %8.2fs' % (result['backend'], result['status'], result['wall_time'])
+    for metrics, d_mismatch in sorted(result['mismatches'].items()):
+      line += '  %s: %d differences (first at index %d)' % (metrics, d_mismatch['count'], d_mismatch['first'])
+    print(line)
+
+
+def run(sizes=DEFAULT_SIZES, working_dir=None, denoms=None, backends=None,
+        start=0, nb_rounds=None, seed=1):
+  '''
+  Runs the conformance checks
+  Returns the number of backends producing different results than the reference backend
+  Parameters:
+    sizes       = list of sizes of the synthetic snapshots (number of mix rounds)
+    working_dir = path of the directory storing the real snapshots
+    denoms      = list of denominations of the real snapshots
+    backends    = list of names of backends (default = all available backends)
+    start       = first mix round (and first tx0) checked
+    nb_rounds   = number of mix rounds (and tx0s) checked (None = all)
+    seed        = seed of the random generator
+  '''
+  nb_failures = 0
+  tmp_dir = tempfile.mkdtemp(prefix='wst_conformance_')
+
+  try:
+    l_snapshots = []
+    for nb_mixes in sizes:
+      for remix_proba in SYNTHETIC_REMIX_PROBAS:
+        denom = 'synth%d_%d' % (nb_mixes, int(remix_proba * 100))
+        with redirect_stdout(sys.stderr):
+          SnapshotGenerator(nb_mixes, remix_proba=remix_proba, seed=seed).generate(tmp_dir, denom)
+        label = 'Synthetic snapshot (%d mixes, remix probability = %.1f)' % (nb_mixes, remix_proba)
+        l_snapshots.append((label, tmp_dir, denom))
+    for denom in (denoms or []):
+      l_snapshots.append(('Snapshot %s (%s)' % (denom, working_dir), working_dir, denom))
+
+    for label, snapshots_dir, denom in l_snapshots:
+      snapshot = Snapshot(snapshots_dir)
+      with redirect_stdout(sys.stderr):
+        snapshot.load(denom)
+      l_results = check_snapshot(snapshot, backends, start, nb_rounds)
+      display(label, l_results)
+      nb_failures += len([r for r in l_results if r['status'] != 'ok'])
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+  return nb_failures
+
+
+def usage():
+  '''
+  Usage message for this module
+  '''
+  sys.stdout.write('python conformance.py [--sizes=2000,10000] [--workdir=/tmp] [--denoms=05,005,001]')
+  sys.stdout.write(' [--backends=numpy,numba] [--start=0] [--rounds=1000] [--seed=1]\n')
+  sys.stdout.write('\n\n[-n OR --sizes] = Sizes (number of mix rounds) of the synthetic snapshots (0 = none).')
+  sys.stdout.write('\n\n[-w OR --workdir] = Path of the directory storing the real snapshots.')
+  sys.stdout.write('\n\n[-d OR --denoms] = Denominations of the real snapshots checked (default: none).')
+  sys.stdout.write('\n\n[-b OR --backends] = Backends compared with the reference backend (default: all available).')
+  sys.stdout.write('\n\n[--start] = First mix round (and first tx0) checked.')
+  sys.stdout.write('\n\n[--rounds] = Number of mix rounds (and tx0s) checked (default: all).')
+  sys.stdout.write('\n\n[-s OR --seed] = Seed of the random generator of the synthetic snapshots.')
+  sys.stdout.write('\n\nExit codes: 0 = identical results, 1 = differences found, 2 = invalid arguments.\n')
+  sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  # Initializes the parameters
+  sizes = DEFAULT_SIZES
+  working_dir = '/tmp'
+  denoms = []
+  backends = None
+  start = 0
+  nb_rounds = None
+  seed = 1
+  argv = sys.argv[1:]
+
+  # Processes the command line arguments
+  try:
+    opts, args = getopt.getopt(
+      argv,
+      'hn:w:d:b:s:',
+      ['help', 'sizes=', 'workdir=', 'denoms=', 'backends=', 'start=', 'rounds=', 'seed=']
+    )
+  except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      sys.exit()
+    elif opt in ('-n', '--sizes'):
+      sizes = [int(s) for s in arg.split(',') if int(s) > 0]
+    elif opt in ('-w', '--workdir'):
+      working_dir = arg
+    elif opt in ('-d', '--denoms'):
+      denoms = [d.strip() for d in arg.split(',')]
+    elif opt in ('-b', '--backends'):
+      backends = [b.strip() for b in arg.split(',')]
+    elif opt == '--start':
+      start = int(arg)
+    elif opt == '--rounds':
+      nb_rounds = int(arg)
+    elif opt in ('-s', '--seed'):
+      seed = int(arg)
+
+  if (backends is not None) and any(b not in get_available_backends() for b in backends):
+    sys.stdout.write('Available backends: %s\n' % ', '.join(get_available_backends()))
+    sys.exit(2)
+
+  nb_failures = run(sizes, working_dir, denoms, backends, start, nb_rounds, seed)
+  sys.exit(1 if nb_failures > 0 else 0)
@@ -0,0 +1,374 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Backend distributing the computation of the anonsets to worker processes
+(local processes or processes running on other machines, see services/worker.py)
+
+The coordinator (this backend) splits the mix rounds into ranges and the groups
+of mixes into chunks, and hands them to the workers over multiprocessing
+connections. Each worker receives the transaction graph of the snapshot once
+(workers don't need the snapshot files) and computes its tasks with a local backend.
+Results are gathered in order, so that the metrics using this backend
+(checkpoints, progress reports, quantile sketches) are unchanged.
+
+Limitation: the work is split by ranges of mix rounds only, so every worker
+holds the whole graph and the coordinator loads the whole snapshot (the memory
+needed by the largest snapshot isn't reduced, only the computation time).
+
+Workers are set by environment variables:
+  WST_WORKERS = comma separated list of addresses of workers (host:port)
+                or local:<n>[:<backend>] for n worker processes started on this machine
+                (computing their tasks with a given backend, default = python)
+  WST_AUTHKEY = secret shared with the remote workers (mandatory for remote workers)
+'''
+import os
+import hashlib
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import Client, wait
+from whirlpool_stats.backends.base import Backend
+from whirlpool_stats.backends import DEFAULT_BACKEND
+
+
+# Environment variable storing the addresses of the workers
+WORKERS_ENV = 'WST_WORKERS'
+
+# Environment variable storing the secret shared with the workers
+AUTHKEY_ENV = 'WST_AUTHKEY'
+
+# Prefix of the specification of local workers (local:<nb_workers>[:<backend>])
+LOCAL_PREFIX = 'local:'
+
+# Number of mix rounds (or groups of mixes) per task
+TASK_SIZE = 512
+
+# Messages exchanged with the workers
+# - coordinator => worker: (MSG_LOAD, digest, graph), (MSG_TASK, task_id, task)
+# - worker => coordinator: (MSG_LOADED, digest), (MSG_RESULT, task_id, values), (MSG_ERROR, message)
+MSG_LOAD = 'load'
+MSG_LOADED = 'loaded'
+MSG_TASK = 'task'
+MSG_RESULT = 'result'
+MSG_ERROR = 'error'
+
+# Types of tasks
+# - (TASK_FWD, start, end) = forward-looking anonsets of the mix rounds [start, end)
+# - (TASK_BWD, start, end) = backward-looking anonsets of the mix rounds [start, end)
+# - (TASK_GROUPS, l_groups) = forward-looking anonsets of groups of mixes
+TASK_FWD = 'fwd'
+TASK_BWD = 'bwd'
+TASK_GROUPS = 'groups'
+
+
+def get_graph_digest(graph):
+  '''
+  Returns the digest identifying a transaction graph (see Snapshot.get_graph)
+  Parameters:
+    graph = transaction graph
+  '''
+  h = hashlib.blake2b(digest_size=16)
+  h.update(str(graph['denom']).encode('utf-8'))
+  for key in sorted(graph.keys()):
+    if key != 'denom':
+      h.update(key.encode('utf-8'))
+      h.update(graph[key].tobytes())
+  return h.hexdigest()
+
+
+class Cluster(object):
+  '''
+  Connections to the workers (established on demand, reestablished
+  after a failure of a worker)
+  '''
+
+  def __init__(self, spec, authkey=None):
+    '''
+    Constructor
+    Parameters:
+      spec    = addresses of the workers (host:port,host:port) or local:<nb_workers>[:<backend>]
+      authkey = secret shared with the remote workers (bytes)
+    '''
+    self.spec = spec
+    self.authkey = authkey
+    # Number of local worker processes (0 = remote workers)
+    self.nb_local = 0
+    # Backend used by the local workers
+    self.local_backend = DEFAULT_BACKEND
+    # List of addresses of the remote workers
+    self.l_addresses = []
+    if spec.startswith(LOCAL_PREFIX):
+      nb_local, _, backend = spec[len(LOCAL_PREFIX):].partition(':')
+      if not nb_local.isdigit() or (int(nb_local) == 0):
+        raise ValueError('Invalid number of local workers (%s)' % spec)
+      self.nb_local = int(nb_local)
+      if len(backend) > 0:
+        self.local_backend = backend
+    else:
+      for address in spec.split(','):
+        host, _, port = address.strip().rpartition(':')
+        if (len(host) == 0) or not port.isdigit():
+          raise ValueError('Invalid address of worker (%s)' % address)
+        self.l_addresses.append((host, int(port)))
+      if authkey is None:
+        raise ValueError('A secret shared with the workers is mandatory (%s)' % AUTHKEY_ENV)
+    # Dictionary slot => connection (slot = index of the local process or of the address)
+    self.d_connections = dict()
+    # Dictionary slot => local process
+    self.d_processes = dict()
+    # Dictionary connection => digest of the graph loaded by the worker
+    self.d_digests = dict()
+    # Set of slots of the unreachable workers (reported once)
+    self.s_unreachable = set()
+
+
+  def get_nb_slots(self):
+    '''
+    Returns the number of workers
+    '''
+    return self.nb_local if self.nb_local > 0 else len(self.l_addresses)
+
+
+  def connect(self):
+    '''
+    Connects to the workers that aren't connected
+    (local workers are started if needed)
+    Returns the list of connections (unreachable workers are ignored)
+    '''
+    for slot in range(0, self.get_nb_slots()):
+      if slot in self.d_connections:
+        continue
+      if self.nb_local > 0:
+        # Local worker process communicating through a pipe
+        from whirlpool_stats.services.worker import serve_connection
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+          target=serve_connection,
+          args=(child_conn, self.local_backend),
+          daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self.d_processes[slot] = process
+        self.d_connections[slot] = conn
+      else:
+        try:
+          self.d_connections[slot] = Client(self.l_addresses[slot], authkey=self.authkey)
+          self.s_unreachable.discard(slot)
+        except (OSError, multiprocessing.AuthenticationError) as e:
+          if slot not in self.s_unreachable:
+            print('  Worker %s:%d unreachable (%s)' % (self.l_addresses[slot] + (e,)))
+            self.s_unreachable.add(slot)
+    return list(self.d_connections.values())
+
+
+  def drop(self, conn):
+    '''
+    Closes the connection to a worker (reestablished by the next call to connect)
+    Parameters:
+      conn = connection
+    '''
+    for slot, c in list(self.d_connections.items()):
+      if c is conn:
+        del self.d_connections[slot]
+        process = self.d_processes.pop(slot, None)
+        if process is not None:
+          process.terminate()
+    self.d_digests.pop(conn, None)
+    try:
+      conn.close()
+    except OSError:
+      pass
+
+
+  def run(self, graph, digest, l_tasks, instr=None):
+    '''
+    Executes a list of tasks on the workers (a worker receives a new task as soon
+    as it returns the result of its previous task, tasks of a failed worker are
+    handed to the other workers)
+    Yields the results of the tasks in the order of the list
+    Parameters:
+      graph   = transaction graph of the snapshot (sent to the workers that don't have it)
+      digest  = digest of the graph
+      l_tasks = list of tasks
+      instr   = instrumentation of the snapshot (optional)
+    '''
+    pending = deque(range(0, len(l_tasks)))
+    # Dictionary connection => id of the task being executed by the worker
+    d_busy = dict()
+    d_results = dict()
+    next_id = 0
+    # Flag indicating if the workers must be (re)connected
+    reconnect = True
+
+    # Hands the next pending task to a worker (returns False if the worker failed)
+    def dispatch(conn):
+      if len(pending) == 0:
+        return True
+      task_id = pending.popleft()
+      try:
+        if self.d_digests.get(conn) != digest:
+          conn.send((MSG_LOAD, digest, graph))
+          self.d_digests[conn] = digest
+        conn.send((MSG_TASK, task_id, l_tasks[task_id]))
+        d_busy[conn] = task_id
+      except (OSError, ValueError):
+        pending.appendleft(task_id)
+        self.drop(conn)
+        return False
+      return True
+
+    try:
+      while next_id < len(l_tasks):
+        # Hands the pending tasks to the idle workers
+        l_connections = self.connect() if reconnect else list(self.d_connections.values())
+        reconnect = False
+        for conn in l_connections:
+          if (conn not in d_busy) and not dispatch(conn):
+            reconnect = True
+        if len(d_busy) == 0:
+          raise RuntimeError('No worker available (%s = %s)' % (WORKERS_ENV, self.spec))
+
+        for conn in wait(list(d_busy.keys())):
+          try:
+            msg = conn.recv()
+          except (EOFError, OSError):
+            # The task of a failed worker is handed to another worker
+            pending.appendleft(d_busy.pop(conn))
+            self.drop(conn)
+            reconnect = True
+            continue
+          if msg[0] == MSG_LOADED:
+            continue
+          if msg[0] == MSG_ERROR:
+            raise RuntimeError('Worker error: %s' % msg[1])
+          task_id = d_busy.pop(conn)
+          d_results[task_id] = msg[2]
+          if instr is not None:
+            instr.count('distributed_tasks', 1)
+          if not dispatch(conn):
+            reconnect = True
+
+        while next_id in d_results:
+          yield d_results.pop(next_id)
+          next_id += 1
+
+    finally:
+      # Workers still busy (interrupted computation) are dropped
+      # (their results would be received by the next computation)
+      for conn in list(d_busy.keys()):
+        self.drop(conn)
+
+
+  def close(self):
+    '''
+    Closes the connections to the workers (and stops the local workers)
+    '''
+    for conn in list(self.d_connections.values()):
+      self.drop(conn)
+
+
+# Cluster shared by the backends of the process (created on demand)
+_cluster = None
+
+
+def get_cluster():
+  '''
+  Returns the cluster of workers set by the environment variables
+  '''
+  global _cluster
+  spec = os.environ.get(WORKERS_ENV, '').strip()
+  if (_cluster is None) or (_cluster.spec != spec):
+    if _cluster is not None:
+      _cluster.close()
+    authkey = os.environ.get(AUTHKEY_ENV)
+    _cluster = Cluster(spec, authkey.encode('utf-8') if authkey else None)
+  return _cluster
+
+
+class DistributedBackend(Backend):
+
+  name = 'distributed'
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    super().__init__(snapshot)
+    self.cluster = get_cluster()
+    # Transaction graph of the snapshot and its digest (computed on demand)
+    self.graph = None
+    self.digest = None
+
+
+  @staticmethod
+  def is_available():
+    '''
+    Checks if workers are set (see WST_WORKERS)
+    '''
+    return len(os.environ.get(WORKERS_ENV, '').strip()) > 0
+
+
+  def run(self, l_tasks):
+    '''
+    Executes a list of tasks on the workers
+    Yields the results of the tasks in order
+    Parameters:
+      l_tasks = list of tasks
+    '''
+    if self.graph is None:
+      self.graph = self.snapshot.get_graph()
+      self.digest = get_graph_digest(self.graph)
+    return self.cluster.run(self.graph, self.digest, l_tasks, self.snapshot.instr)
+
+
+  def iter_anonsets(self, task_type, start):
+    '''
+    Yields the anonsets of the mix rounds computed by the workers
+    Parameters:
+      task_type = TASK_FWD or TASK_BWD
+      start     = first mix round
+    '''
+    nb_mixes = len(self.snapshot.l_mix_txs)
+    l_tasks = [
+      (task_type, s, min(s + TASK_SIZE, nb_mixes))
+      for s in range(start, nb_mixes, TASK_SIZE)
+    ]
+    for values in self.run(l_tasks):
+      for anonset in values:
+        yield anonset
+
+
+  def iter_fwd_anonsets(self, start=0):
+    '''
+    Yields the forward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    return self.iter_anonsets(TASK_FWD, start)
+
+
+  def iter_bwd_anonsets(self, start=0):
+    '''
+    Yields the backward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    return self.iter_anonsets(TASK_BWD, start)
+
+
+  def get_fwd_anonsets(self, l_groups):
+    '''
+    Returns the list of the forward-looking anonsets of groups of mixes
+    Parameters:
+      l_groups = list of lists of tiids of mixes
+    '''
+    l_tasks = [
+      (TASK_GROUPS, l_groups[s:s+TASK_SIZE])
+      for s in range(0, len(l_groups), TASK_SIZE)
+    ]
+    l_anonsets = []
+    for values in self.run(l_tasks):
+      l_anonsets.extend(values)
+    return l_anonsets
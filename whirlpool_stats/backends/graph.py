@@ -0,0 +1,70 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A compact representation of the transaction graph of a snapshot
+(adjacency lists stored in flat arrays) shared by the array-based backends
+'''
+from array import array
+from whirlpool_stats.utils.constants import *
+
+
+class TxGraph(object):
+  '''
+  Nodes are numbered by mix round (mixes) followed by tx0 index (tx0s).
+  The children of node i are indices[indptr[i]:indptr[i+1]] (compressed sparse rows).
+  '''
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    self.snapshot = snapshot
+    self.nb_mixes = len(snapshot.l_mix_txs)
+    self.nb_nodes = self.nb_mixes + len(snapshot.l_tx0s)
+    # Dictionary tiid => node
+    self.d_nodes = dict(zip(snapshot.l_mix_txs, range(0, self.nb_mixes)))
+    self.d_nodes.update(zip(snapshot.l_tx0s, range(self.nb_mixes, self.nb_nodes)))
+    # Links towards the next mixes (forward-looking walks)
+    self.fwd_indptr, self.fwd_indices = self.build_adjacency(snapshot.d_links, snapshot.l_mix_txs, True)
+    # Links towards the previous mixes and tx0s (backward-looking walks)
+    self.bwd_indptr, self.bwd_indices = self.build_adjacency(snapshot.d_reverse_links, snapshot.l_mix_txs, False)
+    # Weights summed by the walks
+    # (unmixed txos of the mixes for forward-looking walks, 1 per tx0 for backward-looking walks)
+    self.fwd_weights = array('l', [0] * self.nb_nodes)
+    for node, tiid in enumerate(snapshot.l_mix_txs):
+      self.fwd_weights[node] = NB_PARTICIPANTS - snapshot.get_nb_links(tiid)
+    self.bwd_weights = array('l', [0] * self.nb_mixes + [1] * (self.nb_nodes - self.nb_mixes))
+
+
+  def build_adjacency(self, d_adjacency, l_tiids, mixes_only):
+    '''
+    Returns the arrays (indptr, indices) of the adjacency lists of the mixes
+    (tx0s have no adjacency list)
+    Parameters:
+      d_adjacency = dictionary tiid => list of distinct tiids
+      l_tiids     = ordered list of the tiids of the mixes
+      mixes_only  = flag indicating if only the links towards mixes are kept
+    '''
+    d_nodes = self.d_nodes
+    nb_mixes = self.nb_mixes
+    indptr = array('l', [0])
+    indices = array('l')
+    for tiid in l_tiids:
+      for tgt in d_adjacency.get(tiid, []):
+        node = d_nodes.get(tgt)
+        if (node is not None) and ((not mixes_only) or (node < nb_mixes)):
+          indices.append(node)
+      indptr.append(len(indices))
+    indptr.extend([len(indices)] * (self.nb_nodes - nb_mixes))
+    return indptr, indices
+
+
+  def get_nodes(self, l_tiids):
+    '''
+    Returns the list of nodes of a list of txs (unknown txs are ignored)
+    Parameters:
+      l_tiids = list of tiids
+    '''
+    return [self.d_nodes[t] for t in l_tiids if t in self.d_nodes]
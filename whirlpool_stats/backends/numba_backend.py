@@ -0,0 +1,161 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Backend computing the anonsets with a walk per mix round
+compiled to machine code by numba (requires numpy and numba)
+
+Walks use an explicit stack and an array of marks (node => id of the last walk
+that reached the node) so that no memory is allocated or reset between 2 walks.
+'''
+from whirlpool_stats.backends.base import Backend
+from whirlpool_stats.backends.graph import TxGraph
+
+try:
+  import numpy as np
+  from numba import njit
+except ImportError:
+  np = None
+  njit = None
+
+
+# Number of mix rounds processed per call to the compiled code
+CHUNK_SIZE = 1024
+
+
+def walk_groups(group_indptr, group_nodes, indptr, indices, weights, marks, stack, first_mark, results):
+  '''
+  Walks the graph from groups of nodes
+  (results[i] = sum of the weights of the nodes reachable from the i-th group)
+  Returns the number of visited nodes
+  Parameters:
+    group_indptr = offsets of the groups in group_nodes
+    group_nodes  = concatenated groups of nodes
+    indptr       = offsets of the adjacency lists
+    indices      = concatenated adjacency lists
+    weights      = weights of the nodes
+    marks        = array node => mark of the last walk that reached the node
+    stack        = array used as a stack (size >= number of nodes)
+    first_mark   = mark of the walk of the first group
+    results      = array storing the results
+  '''
+  nb_visited = 0
+  for g in range(0, group_indptr.shape[0] - 1):
+    mark = first_mark + g
+    total = 0
+    top = 0
+    for k in range(group_indptr[g], group_indptr[g+1]):
+      node = group_nodes[k]
+      if marks[node] != mark:
+        marks[node] = mark
+        stack[top] = node
+        top += 1
+    while top > 0:
+      top -= 1
+      node = stack[top]
+      total += weights[node]
+      nb_visited += 1
+      for k in range(indptr[node], indptr[node+1]):
+        next_node = indices[k]
+        if marks[next_node] != mark:
+          marks[next_node] = mark
+          stack[top] = next_node
+          top += 1
+    results[g] = total
+  return nb_visited
+
+
+if njit is not None:
+  walk_groups = njit(nogil=True)(walk_groups)
+
+
+class NumbaBackend(Backend):
+
+  name = 'numba'
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    super().__init__(snapshot)
+    graph = TxGraph(snapshot)
+    self.graph = graph
+    self.fwd_indptr = np.frombuffer(graph.fwd_indptr, dtype='l')
+    self.fwd_indices = np.frombuffer(graph.fwd_indices, dtype='l')
+    self.fwd_weights = np.frombuffer(graph.fwd_weights, dtype='l')
+    self.bwd_indptr = np.frombuffer(graph.bwd_indptr, dtype='l')
+    self.bwd_indices = np.frombuffer(graph.bwd_indices, dtype='l')
+    self.bwd_weights = np.frombuffer(graph.bwd_weights, dtype='l')
+    self.marks = np.full(graph.nb_nodes, -1, dtype=np.int64)
+    self.stack = np.zeros(graph.nb_nodes, dtype=np.int64)
+    # Mark of the next walk
+    self.next_mark = 0
+
+
+  @staticmethod
+  def is_available():
+    '''
+    Checks if numba is installed
+    '''
+    return njit is not None
+
+
+  def iter_fwd_anonsets(self, start=0):
+    '''
+    Yields the forward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    for anonset in self.iter_anonsets(start, self.fwd_indptr, self.fwd_indices, self.fwd_weights, 'fwd'):
+      yield anonset
+
+
+  def iter_bwd_anonsets(self, start=0):
+    '''
+    Yields the backward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    for anonset in self.iter_anonsets(start, self.bwd_indptr, self.bwd_indices, self.bwd_weights, 'bwd'):
+      yield anonset
+
+
+  def get_fwd_anonsets(self, l_groups):
+    '''
+    Returns the list of the forward-looking anonsets of groups of mixes
+    Parameters:
+      l_groups = list of lists of tiids of mixes
+    '''
+    l_nodes = [self.graph.get_nodes(group) for group in l_groups]
+    group_indptr = np.zeros(len(l_nodes) + 1, dtype=np.int64)
+    group_indptr[1:] = np.cumsum([len(nodes) for nodes in l_nodes])
+    group_nodes = np.asarray([n for nodes in l_nodes for n in nodes], dtype=np.int64)
+    results = self.walk(group_indptr, group_nodes, self.fwd_indptr, self.fwd_indices, self.fwd_weights, 'tx0')
+    return [int(v) for v in results]
+
+
+  def iter_anonsets(self, start, indptr, indices, weights, category):
+    '''
+    Yields the anonsets of the mix rounds (compiled walks by chunks of mix rounds)
+    '''
+    nb_mixes = self.graph.nb_mixes
+    for i in range(start, nb_mixes, CHUNK_SIZE):
+      nodes = np.arange(i, min(i + CHUNK_SIZE, nb_mixes), dtype=np.int64)
+      group_indptr = np.arange(0, nodes.shape[0] + 1, dtype=np.int64)
+      for anonset in self.walk(group_indptr, nodes, indptr, indices, weights, category):
+        yield int(anonset)
+
+
+  def walk(self, group_indptr, group_nodes, indptr, indices, weights, category):
+    '''
+    Walks the graph from groups of nodes
+    Returns the array of the sums of the weights of the nodes reachable from each group
+    '''
+    nb_groups = group_indptr.shape[0] - 1
+    results = np.zeros(nb_groups, dtype=np.int64)
+    nb_visited = walk_groups(group_indptr, group_nodes, indptr, indices, weights,
+                             self.marks, self.stack, self.next_mark, results)
+    self.next_mark += nb_groups
+    self.snapshot.instr.count('%s_nodes_visited' % category, int(nb_visited))
+    return results
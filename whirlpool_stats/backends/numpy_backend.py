@@ -0,0 +1,157 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Vectorized backend computing the anonsets of blocks of 64 mix rounds
+with a single breadth-first walk propagating 64-bit masks (requires numpy)
+
+Bit i of the mask of a node is set if the node is reachable from the i-th
+source of the block. Consecutive mix rounds share most of their descendants
+(or ancestors), each node is visited once per block instead of once per round.
+'''
+from whirlpool_stats.backends.base import Backend
+from whirlpool_stats.backends.graph import TxGraph
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+
+# Number of sources walked together (bits of a mask)
+BLOCK_SIZE = 64
+
+# Number of nodes processed per chunk when the masks are unpacked
+CHUNK_SIZE = 1 << 16
+
+
+class NumpyBackend(Backend):
+
+  name = 'numpy'
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    super().__init__(snapshot)
+    graph = TxGraph(snapshot)
+    self.graph = graph
+    # Views of the arrays of the graph (no copy)
+    self.fwd_indptr = np.frombuffer(graph.fwd_indptr, dtype='l')
+    self.fwd_indices = np.frombuffer(graph.fwd_indices, dtype='l')
+    self.fwd_weights = np.frombuffer(graph.fwd_weights, dtype='l')
+    self.bwd_indptr = np.frombuffer(graph.bwd_indptr, dtype='l')
+    self.bwd_indices = np.frombuffer(graph.bwd_indices, dtype='l')
+    self.bwd_weights = np.frombuffer(graph.bwd_weights, dtype='l')
+    # Masks of the nodes (reset after each walk)
+    self.masks = np.zeros(graph.nb_nodes, dtype=np.uint64)
+
+
+  @staticmethod
+  def is_available():
+    '''
+    Checks if numpy is installed
+    '''
+    return np is not None
+
+
+  def iter_fwd_anonsets(self, start=0):
+    '''
+    Yields the forward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    for anonset in self.iter_anonsets(start, self.fwd_indptr, self.fwd_indices, self.fwd_weights, 'fwd'):
+      yield anonset
+
+
+  def iter_bwd_anonsets(self, start=0):
+    '''
+    Yields the backward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    for anonset in self.iter_anonsets(start, self.bwd_indptr, self.bwd_indices, self.bwd_weights, 'bwd'):
+      yield anonset
+
+
+  def get_fwd_anonsets(self, l_groups):
+    '''
+    Returns the list of the forward-looking anonsets of groups of mixes
+    Parameters:
+      l_groups = list of lists of tiids of mixes
+    '''
+    l_anonsets = []
+    for i in range(0, len(l_groups), BLOCK_SIZE):
+      l_sources = [self.graph.get_nodes(group) for group in l_groups[i:i+BLOCK_SIZE]]
+      l_anonsets.extend(self.walk(l_sources, self.fwd_indptr, self.fwd_indices, self.fwd_weights, 'tx0'))
+    return l_anonsets
+
+
+  def iter_anonsets(self, start, indptr, indices, weights, category):
+    '''
+    Yields the anonsets of the mix rounds (walks by blocks of mix rounds)
+    '''
+    nb_mixes = self.graph.nb_mixes
+    for i in range(start, nb_mixes, BLOCK_SIZE):
+      l_sources = [[node] for node in range(i, min(i + BLOCK_SIZE, nb_mixes))]
+      for anonset in self.walk(l_sources, indptr, indices, weights, category):
+        yield anonset
+
+
+  def walk(self, l_sources, indptr, indices, weights, category):
+    '''
+    Walks the graph from up to 64 groups of sources
+    Returns the list of the sums of the weights of the nodes reachable from each group
+    Parameters:
+      l_sources = list of lists of nodes
+      indptr    = offsets of the adjacency lists
+      indices   = concatenated adjacency lists
+      weights   = weights of the nodes
+      category  = category of the walk (name of the counter of visited nodes)
+    '''
+    masks = self.masks
+    nb_groups = len(l_sources)
+    for bit, sources in enumerate(l_sources):
+      if len(sources) > 0:
+        nodes = np.asarray(sources, dtype='l')
+        masks[nodes] |= np.uint64(1) << np.uint64(bit)
+    frontier = np.unique(np.asarray([n for sources in l_sources for n in sources], dtype='l'))
+    l_visited = [frontier]
+
+    while frontier.size > 0:
+      # Gathers the links of the frontier
+      starts = indptr[frontier]
+      lengths = indptr[frontier + 1] - starts
+      nb_links = int(lengths.sum())
+      if nb_links == 0:
+        break
+      offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(nb_links)
+      targets = indices[offsets]
+      values = np.repeat(masks[frontier], lengths)
+      # Merges the masks propagated towards each target
+      order = np.argsort(targets, kind='stable')
+      targets = targets[order]
+      bounds = np.flatnonzero(np.concatenate(([True], targets[1:] != targets[:-1])))
+      targets = targets[bounds]
+      values = np.bitwise_or.reduceat(values[order], bounds)
+      # Targets whose mask has changed are walked again
+      old_masks = masks[targets]
+      new_masks = old_masks | values
+      changed = new_masks != old_masks
+      l_visited.append(targets[changed & (old_masks == 0)])
+      masks[targets] = new_masks
+      frontier = targets[changed]
+
+    # Sums the weights of the nodes per bit of their masks
+    visited = np.concatenate(l_visited)
+    self.snapshot.instr.count('%s_nodes_visited' % category, int(visited.size))
+    sums = np.zeros(BLOCK_SIZE, dtype=np.int64)
+    for i in range(0, visited.size, CHUNK_SIZE):
+      nodes = visited[i:i+CHUNK_SIZE]
+      bits = np.unpackbits(masks[nodes].astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+      sums += weights[nodes].astype(np.int64) @ bits.astype(np.int64)
+    masks[visited] = 0
+
+    return [int(v) for v in sums[0:nb_groups]]
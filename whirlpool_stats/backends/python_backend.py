@@ -0,0 +1,116 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Reference backend computing the anonsets with a walk per mix round
+over the dictionaries of the snapshot (pure python)
+'''
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.backends.base import Backend
+
+
+class PythonBackend(Backend):
+
+  name = 'python'
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    super().__init__(snapshot)
+    # Set of txs that have been processed by the current walk
+    self.s_processed_txs = set()
+
+
+  def iter_fwd_anonsets(self, start=0):
+    '''
+    Yields the forward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    l_mix_txs = self.snapshot.l_mix_txs
+    for mix_round in range(start, len(l_mix_txs)):
+      tiid = l_mix_txs[mix_round]
+      # Resets the set of txs already reached during this walk
+      self.s_processed_txs.clear()
+      # Computes the anonset
+      anonset = self.get_nb_descendants(tiid)
+      self.snapshot.instr.count('fwd_nodes_visited', len(self.s_processed_txs))
+      yield anonset
+
+
+  def iter_bwd_anonsets(self, start=0):
+    '''
+    Yields the backward-looking anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    l_mix_txs = self.snapshot.l_mix_txs
+    for mix_round in range(start, len(l_mix_txs)):
+      tiid = l_mix_txs[mix_round]
+      # Resets the set of txs already reached during this walk
+      self.s_processed_txs.clear()
+      # Computes the anonset
+      anonset = self.get_nb_sources(tiid)
+      self.snapshot.instr.count('bwd_nodes_visited', len(self.s_processed_txs))
+      yield anonset
+
+
+  def get_fwd_anonsets(self, l_groups):
+    '''
+    Returns the list of the forward-looking anonsets of groups of mixes
+    (joint walk per group, descendants shared by several mixes are counted once)
+    Parameters:
+      l_groups = list of lists of tiids of mixes
+    '''
+    l_anonsets = []
+    for group in l_groups:
+      self.s_processed_txs.clear()
+      anonset = 0
+      for tiid in group:
+        if tiid not in self.s_processed_txs:
+          anonset += self.get_nb_descendants(tiid)
+      self.snapshot.instr.count('tx0_nodes_visited', len(self.s_processed_txs))
+      l_anonsets.append(anonset)
+    return l_anonsets
+
+
+  def get_nb_descendants(self, tiid):
+    '''
+    Gets the number of descendant UTXOs composing the forward-looking anonset of a tx
+    (= number of unspents + number of mixed txos that have left the pool)
+    Parameters:
+      tiid = id of the transaction
+    '''
+    next_tiids = self.snapshot.d_links[tiid]
+    nb_utxos = NB_PARTICIPANTS - self.snapshot.get_nb_links(tiid)
+
+    for next_tiid in next_tiids:
+      if next_tiid not in self.s_processed_txs:
+        if next_tiid in self.snapshot.s_mix_txs:
+          nb_utxos += self.get_nb_descendants(next_tiid)
+
+    self.s_processed_txs.add(tiid)
+    return nb_utxos
+
+
+  def get_nb_sources(self, tiid):
+    '''
+    Gets the number of ancestor tx0s found for a tx
+    Parameters:
+      tiid = id of the transaction
+    '''
+    nb_tx0s = 0
+    prev_tiids = self.snapshot.d_reverse_links[tiid]
+
+    for prev_tiid in prev_tiids:
+      if prev_tiid not in self.s_processed_txs:
+        if prev_tiid in self.snapshot.s_mix_txs:
+          nb_tx0s += self.get_nb_sources(prev_tiid)
+        elif prev_tiid in self.snapshot.s_tx0s:
+          nb_tx0s += 1
+          self.s_processed_txs.add(prev_tiid)
+
+    self.s_processed_txs.add(tiid)
+    return nb_tx0s
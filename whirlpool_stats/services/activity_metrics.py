@@ -0,0 +1,294 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Daily rollups of the activity metrics answering date range queries:
+- additive metrics (mixes, inflow, tx0s created) are stored as daily arrays
+  with their prefix sums (total over a date range in O(1)),
+- distinct active tx0s over a date range are counted with a range index
+  over the days of activity of the tx0s (no rescan of the reverse links).
+Daily values can be re-bucketed by week or by month.
+'''
+from array import array
+from datetime import datetime
+from whirlpool_stats.utils.date import get_day_index, to_timestamp, to_utcdate, SECONDS_PER_DAY
+from whirlpool_stats.services.range_index import RangeIndex
+
+
+# List of activity metrics
+ACTIVITY_METRICS = ['mixes', 'inflow', 'tx0s_created', 'tx0s_active']
+
+# Additive activity metrics (stored with their prefix sums)
+ADDITIVE_METRICS = ['mixes', 'inflow', 'tx0s_created']
+
+# List of periods used for re-bucketing the daily values
+ALL_PERIODS = ['day', 'week', 'month']
+
+
+def to_day_index(date):
+  '''
+  Returns the index of the day of an utc datetime
+  Parameters:
+    date = utc datetime
+  '''
+  return get_day_index(to_timestamp(date))
+
+
+def to_day_date(day):
+  '''
+  Returns the utc datetime (0h00) of the index of a day
+  Parameters:
+    day = index of the day
+  '''
+  return to_utcdate(day * SECONDS_PER_DAY)
+
+
+def get_buckets(first_day, last_day, period):
+  '''
+  Splits a range of days into buckets (calendar weeks starting on mondays
+  or calendar months, first and last buckets are truncated to the range)
+  Returns a list of tuples (first_day, last_day)
+  Parameters:
+    first_day = index of the first day
+    last_day  = index of the last day (included)
+    period    = day, week or month
+  '''
+  l_buckets = []
+  start = first_day
+  while start <= last_day:
+    if period == 'day':
+      end = start
+    elif period == 'week':
+      # 01/01/1970 is a thursday
+      end = start - (start + 3) % 7 + 6
+    else:
+      date = to_day_date(start)
+      if date.month == 12:
+        next_month = datetime(date.year + 1, 1, 1)
+      else:
+        next_month = datetime(date.year, date.month + 1, 1)
+      end = to_day_index(next_month) - 1
+    end = min(end, last_day)
+    l_buckets.append((start, end))
+    start = end + 1
+  return l_buckets
+
+
+class ActivityMetrics(object):
+  '''
+  Rollups of the activity metrics of the active snapshot
+  (built on demand from the backward-looking and tx0s metrics)
+  '''
+
+  def __init__(self, bwd_metrics, tx0_metrics):
+    '''
+    Constructor
+    Parameters:
+      bwd_metrics = Backward-looking metrics
+      tx0_metrics = Tx0s metrics
+    '''
+    self.bwd_metrics = bwd_metrics
+    self.tx0_metrics = tx0_metrics
+    self.snapshot = bwd_metrics.snapshot
+    self.reset()
+
+
+  def reset(self):
+    '''
+    Resets the rollups (e.g. when a new snapshot is loaded)
+    '''
+    # Index of the first day of the rollups
+    self.first_day = None
+    # Number of days of the rollups (first_day to last day of activity)
+    self.nb_days = 0
+    # Dictionary metrics => array of daily values
+    self.d_daily = dict()
+    # Dictionary metrics => array of prefix sums of the daily values
+    # (d_cumuls[m][i] = sum of the values of the i first days)
+    self.d_cumuls = dict()
+    # Range index over the days of activity of the tx0s
+    # (value = previous day of activity of the tx0, -1 if none)
+    self.active_index = None
+    # Number of mix rounds and tx0s covered by the rollups
+    self.nb_rounds = 0
+    self.nb_tx0s = 0
+
+
+  def build(self):
+    '''
+    Builds the rollups if they don't cover all the mix rounds and tx0s of the snapshot
+    '''
+    nb_rounds = len(self.bwd_metrics.columns)
+    nb_tx0s = len(self.tx0_metrics.columns)
+    if (self.first_day is not None) and (self.nb_rounds == nb_rounds) and (self.nb_tx0s == nb_tx0s):
+      return
+
+    instr = self.snapshot.instr
+    with instr.phase('rollup activity'):
+      self.reset()
+      self.nb_rounds = nb_rounds
+      self.nb_tx0s = nb_tx0s
+
+      d_sources = {
+        'mixes': self.bwd_metrics.d_nb_mixes,
+        'inflow': self.bwd_metrics.d_inflow,
+        'tx0s_created': self.tx0_metrics.d_nb_new_tx0s,
+        'tx0s_active': self.bwd_metrics.d_nb_active_tx0s
+      }
+      l_days = [to_day_index(date) for d in d_sources.values() for date in d.keys()]
+      if len(l_days) == 0:
+        return
+      self.first_day = min(l_days)
+      self.nb_days = max(l_days) - self.first_day + 1
+
+      # Daily arrays and prefix sums
+      for name, d_values in d_sources.items():
+        daily = array('q', [0] * self.nb_days)
+        for date, value in d_values.items():
+          daily[to_day_index(date) - self.first_day] = value
+        self.d_daily[name] = daily
+        if name in ADDITIVE_METRICS:
+          cumuls = array('q', [0] * (self.nb_days + 1))
+          total = 0
+          for i, value in enumerate(daily):
+            total += value
+            cumuls[i + 1] = total
+          self.d_cumuls[name] = cumuls
+
+      self.build_active_index()
+
+
+  def build_active_index(self):
+    '''
+    Builds the range index over the days of activity of the tx0s
+    A tx0 active during a range of days [a, b] has a single day of activity
+    in this range with a previous day of activity < a (its first one)
+    '''
+    snapshot = self.snapshot
+    s_tx0s = snapshot.s_tx0s
+    l_mix_days = self.bwd_metrics.columns.day
+    # Dictionary tiid => last day of activity
+    d_last_days = dict()
+    # Days of activity (chronological order) and previous days of activity
+    l_timestamps = array('q')
+    l_prev_days = array('q')
+
+    for tiid, day in zip(snapshot.l_mix_txs, l_mix_days):
+      for prev_tiid in snapshot.d_reverse_links[tiid]:
+        if prev_tiid in s_tx0s:
+          last_day = d_last_days.get(prev_tiid, -1)
+          if last_day != day:
+            l_timestamps.append(day * SECONDS_PER_DAY)
+            l_prev_days.append(last_day)
+            d_last_days[prev_tiid] = day
+
+    self.active_index = RangeIndex(l_prev_days, l_timestamps)
+
+
+  def get_day_range(self, from_date=None, to_date=None):
+    '''
+    Returns the range of days (first_day, last_day) of the rollups
+    restricted to a date range (last_day < first_day if the range is empty)
+    Parameters:
+      from_date = first date (None = first day of activity)
+      to_date   = last date included (None = last day of activity)
+    '''
+    self.build()
+    first_day = self.first_day if self.first_day is not None else 0
+    last_day = first_day + self.nb_days - 1
+    if from_date is not None:
+      first_day = max(first_day, to_day_index(from_date))
+    if to_date is not None:
+      last_day = min(last_day, to_day_index(to_date))
+    return first_day, last_day
+
+
+  def get_total(self, metrics, first_day, last_day):
+    '''
+    Returns the value of a metrics over a range of days
+    (sum of the daily values or number of distinct active tx0s)
+    Parameters:
+      metrics   = name of the metrics
+      first_day = index of the first day
+      last_day  = index of the last day (included)
+    '''
+    self.build()
+    if self.first_day is None:
+      return 0
+    first_day = max(first_day, self.first_day)
+    last_day = min(last_day, self.first_day + self.nb_days - 1)
+    if last_day < first_day:
+      return 0
+    if metrics == 'tx0s_active':
+      return self.active_index.count_range(
+        -1,
+        first_day - 1,
+        first_day * SECONDS_PER_DAY,
+        last_day * SECONDS_PER_DAY
+      )
+    cumuls = self.d_cumuls[metrics]
+    return cumuls[last_day - self.first_day + 1] - cumuls[first_day - self.first_day]
+
+
+  def get_series(self, metrics, period='day', from_date=None, to_date=None):
+    '''
+    Returns the values of a metrics by period over a date range
+    Returns a tuple (list of dates of the periods, list of values)
+    Parameters:
+      metrics   = name of the metrics
+      period    = day, week or month
+      from_date = first date (None = first day of activity)
+      to_date   = last date included (None = last day of activity)
+    '''
+    first_day, last_day = self.get_day_range(from_date, to_date)
+    l_dates = []
+    l_values = []
+    for start, end in get_buckets(first_day, last_day, period):
+      l_dates.append(to_day_date(start))
+      if period == 'day':
+        l_values.append(self.d_daily[metrics][start - self.first_day])
+      else:
+        l_values.append(self.get_total(metrics, start, end))
+    return l_dates, l_values
+
+
+  def display(self, period='day', from_date=None, to_date=None):
+    '''
+    Displays the totals of the activity metrics over a date range
+    and their values by period
+    Parameters:
+      period    = day, week or month
+      from_date = first date (None = first day of activity)
+      to_date   = last date included (None = last day of activity)
+    '''
+    first_day, last_day = self.get_day_range(from_date, to_date)
+    if last_day < first_day:
+      print('No activity in this date range.')
+      return
+
+    print('Activity from %s to %s (pools %s):' % (
+      to_day_date(first_day).strftime('%d/%m/%Y'),
+      to_day_date(last_day).strftime('%d/%m/%Y'),
+      self.snapshot.denom
+    ))
+    for metrics in ACTIVITY_METRICS:
+      print('  %-14s = %d' % (metrics, self.get_total(metrics, first_day, last_day)))
+    print('')
+
+    print('%-10s  %10s  %10s  %12s  %11s' % (period, 'mixes', 'inflow', 'tx0s_created', 'tx0s_active'))
+    for row in self.iter_rows(period, from_date, to_date):
+      print('%-10s  %10d  %10d  %12d  %11d' % row)
+
+
+  def iter_rows(self, period='day', from_date=None, to_date=None):
+    '''
+    Iterates over the values of the activity metrics by period over a date range
+    Yields tuples (date, mixes, inflow, tx0s_created, tx0s_active)
+    Parameters:
+      period    = day, week or month
+      from_date = first date (None = first day of activity)
+      to_date   = last date included (None = last day of activity)
+    '''
+    first_day, last_day = self.get_day_range(from_date, to_date)
+    l_series = [self.get_series(m, period, from_date, to_date)[1] for m in ACTIVITY_METRICS]
+    for i, (start, _) in enumerate(get_buckets(first_day, last_day, period)):
+      yield (to_day_date(start).strftime('%d/%m/%Y'),) + tuple(s[i] for s in l_series)
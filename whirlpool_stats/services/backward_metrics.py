@@ -3,8 +3,14 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 
 A class computing a set of metrics for the mixed UTXOs (backward-looking)
 '''
+from bisect import bisect_left
 from collections import defaultdict
-from whirlpool_stats.utils.date import get_datetime_of_day
+from itertools import chain
+from whirlpool_stats.utils.date import get_datetime_of_day, get_day_index, to_timestamp
+from whirlpool_stats.utils.columns import Columns, ROUND_COLUMNS
+from whirlpool_stats.services.checkpoint import Checkpoint
+from whirlpool_stats.backends import create_backend, DEFAULT_BACKEND
+from whirlpool_stats.utils.hyperloglog import HyperLogLog, merge_registers, estimate_cardinality, get_error
 
 
 class BackwardMetrics(object):
@@ -16,12 +22,20 @@ class BackwardMetrics(object):
       snapshot = snapshot
     '''
     self.snapshot = snapshot
-    # Set of txs that have been processed
-    self.s_processed_txs = set()
-    # List of anonsets ordered by mix round
-    self.l_anonsets = []
-    # List of spreads ordered by mix round
-    self.l_spreads = []
+    # Precision of the HyperLogLog sketches used for approximate anonsets
+    # (None = exact anonsets)
+    self.approx_precision = None
+    # Name of the backend computing the exact anonsets (see whirlpool_stats.backends)
+    self.backend_name = DEFAULT_BACKEND
+    # Backend used by the last computation
+    self.backend = None
+    # Results ordered by mix round (columns anonset, spread, day)
+    self.columns = Columns(ROUND_COLUMNS)
+    # Quantile sketches updated with the metrics (optional)
+    self.summary = None
+    # Flag indicating if the computation of exact anonsets is checkpointed
+    # (resumed from the last checkpoint if it's interrupted)
+    self.resumable = False
     # Dictionary date => nb_mixes
     self.d_nb_mixes = defaultdict(int)
     # Dictionary date => inflow
@@ -30,74 +44,226 @@ class BackwardMetrics(object):
     self.d_nb_active_tx0s = defaultdict(int)
 
 
+  @property
+  def l_anonsets(self):
+    '''
+    Column of the anonsets ordered by mix round
+    '''
+    return self.columns.anonset
+
+
+  @property
+  def l_spreads(self):
+    '''
+    Column of the spreads ordered by mix round
+    '''
+    return self.columns.spread
+
+
+  def get_error(self):
+    '''
+    Returns the relative standard error of the anonsets (0 for exact anonsets)
+    '''
+    return 0.0 if self.approx_precision is None else get_error(self.approx_precision)
+
+
   def compute(self):
     '''
     Computes the metrics (backward-looking)
     '''
-    print('Start computing metrics (backward-looking)')
+    instr = self.snapshot.instr
 
-    # Resets data structures storing the results
-    self.l_anonsets = []
-    self.l_spreads = []
-    self.d_nb_mixes = defaultdict(int)
-    self.d_inflow = defaultdict(int)
-    self.d_nb_active_tx0s = defaultdict(int)
+    with instr.phase('compute bwd'):
+      print('Start computing metrics (backward-looking)')
 
-    # Dictionary day => set od active tx0s
-    d_tmp_active_tx0s = defaultdict(set)
+      # Resets data structures storing the results
+      self.columns.reset()
+      l_anonsets = self.columns.anonset
+      l_spreads = self.columns.spread
+      l_days = self.columns.day
+      summary = self.summary
+      if summary is not None:
+        summary.reset(['bwd anonset', 'bwd spread'])
+      self.d_nb_mixes = defaultdict(int)
+      self.d_inflow = defaultdict(int)
+      self.d_nb_active_tx0s = defaultdict(int)
 
-    # Iterates over the ordered list of mix txs
-    # and computes their anonsets and spreads (backward-looking)
-    mix_round = 0
-    nb_mixes = len(self.snapshot.l_mix_txs)
-
-    for tiid in self.snapshot.l_mix_txs:
-      # Resets the set of txs already reached during this walk
-      self.s_processed_txs.clear()
-      # Computes the anonset
-      anonset = self.get_nb_sources(tiid)
-      self.l_anonsets.append(anonset)
-      # Computes the spread
-      nb_past_tx0s = len(list(filter(lambda x: x < tiid, self.snapshot.l_tx0s)))
-      spread = float(anonset) * 100.0 / float(nb_past_tx0s)
-      self.l_spreads.append(spread)
-      # Updates activity metrics
-      day = get_datetime_of_day(self.snapshot.l_ts_mix_txs[mix_round])
-      self.d_nb_mixes[day] += 1
-      prev_tiids = self.snapshot.d_reverse_links[tiid]
-      for prev_tiid in prev_tiids:
-        if prev_tiid in self.snapshot.s_tx0s:
-          self.d_inflow[day] += 1
-          d_tmp_active_tx0s[day].add(prev_tiid)
-      # Displays a trace
-      if mix_round % 100 == 0:
-        pct_progress = mix_round * 100 / nb_mixes
-        print('  Computed metrics for round %d (%d%%)' % (mix_round, pct_progress))
-      mix_round += 1
+      # Dictionary day => set od active tx0s
+      d_tmp_active_tx0s = defaultdict(set)
+
+      # Sorted list of tx0s (used for counting the tx0s preceding a mix)
+      l_sorted_tx0s = sorted(self.snapshot.l_tx0s)
+
+      # Iterates over the ordered list of mix txs
+      # and computes their anonsets and spreads (backward-looking)
+      mix_round = 0
+      nb_mixes = len(self.snapshot.l_mix_txs)
+      progress = instr.progress('Computed metrics for', nb_mixes)
+
+      checkpoint = None
+      if self.approx_precision is None:
+        self.backend = create_backend(self.backend_name, self.snapshot)
+        l_done = []
+        if self.resumable:
+          # Reuses the anonsets computed before an interruption
+          checkpoint = Checkpoint(self.snapshot, 'bwd')
+          l_done = checkpoint.load()[0:nb_mixes]
+          if len(l_done) > 0:
+            print('  Resuming from mix round %d' % len(l_done))
+            instr.count('bwd_resumed_rounds', len(l_done))
+        anonsets = chain(l_done, self.iter_anonsets(len(l_done)))
+      else:
+        anonsets = self.iter_approx_anonsets()
+
+      try:
+        for anonset in anonsets:
+          tiid = self.snapshot.l_mix_txs[mix_round]
+          l_anonsets.append(anonset)
+          # Computes the spread
+          nb_past_tx0s = bisect_left(l_sorted_tx0s, tiid)
+          spread = float(anonset) * 100.0 / float(nb_past_tx0s)
+          l_spreads.append(spread)
+          ts = self.snapshot.l_ts_mix_txs[mix_round]
+          l_days.append(get_day_index(ts))
+          # Updates the quantile sketches
+          if summary is not None:
+            summary.update('bwd anonset', ts, anonset)
+            summary.update('bwd spread', ts, spread)
+          # Updates activity metrics
+          day = get_datetime_of_day(ts)
+          self.d_nb_mixes[day] += 1
+          prev_tiids = self.snapshot.d_reverse_links[tiid]
+          for prev_tiid in prev_tiids:
+            if prev_tiid in self.snapshot.s_tx0s:
+              self.d_inflow[day] += self.snapshot.get_multiplicity(prev_tiid, tiid)
+              d_tmp_active_tx0s[day].add(prev_tiid)
+          mix_round += 1
+          # Reports the progress
+          progress.update(mix_round)
+          # Checkpoints the anonsets computed so far
+          if checkpoint is not None:
+            checkpoint.update(l_anonsets)
+      except BaseException:
+        # Saves the anonsets computed before the interruption (e.g. Ctrl-C)
+        if checkpoint is not None:
+          checkpoint.save(l_anonsets)
+        raise
 
-    # Fills d_nb_active_tx0s
-    for k,v in d_tmp_active_tx0s.items():
-      self.d_nb_active_tx0s[k] = len(v)
+      if checkpoint is not None:
+        checkpoint.clear()
 
-    print('Done!')
+      # Fills d_nb_active_tx0s
+      for k,v in d_tmp_active_tx0s.items():
+        self.d_nb_active_tx0s[k] = len(v)
 
+      instr.count('bwd_rounds', nb_mixes)
 
-  def get_nb_sources(self, tiid):
+      if self.approx_precision is not None:
+        print('Approximate anonsets (relative standard error = %.2f%%)' % (self.get_error() * 100))
+      print('Done!')
+
+
+  def update(self, nb_new_mixes):
+    '''
+    Computes the exact metrics of the mix txs appended to the snapshot
+    (see Snapshot.load_tail). Metrics of the previous mix rounds don't change
+    (new txs can't be ancestors of the previous mixes).
+    Parameters:
+      nb_new_mixes = number of mix txs appended to the snapshot
+    '''
+    snapshot = self.snapshot
+    instr = snapshot.instr
+
+    with instr.phase('update bwd'):
+      nb_mixes = len(snapshot.l_mix_txs)
+      nb_old_mixes = nb_mixes - nb_new_mixes
+      l_sorted_tx0s = sorted(snapshot.l_tx0s)
+      summary = self.summary
+      s_days = set()
+
+      self.backend = create_backend(self.backend_name, snapshot)
+      mix_round = nb_old_mixes
+      for anonset in self.iter_anonsets(nb_old_mixes):
+        tiid = snapshot.l_mix_txs[mix_round]
+        ts = snapshot.l_ts_mix_txs[mix_round]
+        self.columns.append('anonset', anonset)
+        nb_past_tx0s = bisect_left(l_sorted_tx0s, tiid)
+        spread = float(anonset) * 100.0 / float(nb_past_tx0s)
+        self.columns.append('spread', spread)
+        self.columns.append('day', get_day_index(ts))
+        if summary is not None:
+          summary.update('bwd anonset', ts, anonset)
+          summary.update('bwd spread', ts, spread)
+        day = get_datetime_of_day(ts)
+        s_days.add(day)
+        self.d_nb_mixes[day] += 1
+        for prev_tiid in snapshot.d_reverse_links[tiid]:
+          if prev_tiid in snapshot.s_tx0s:
+            self.d_inflow[day] += snapshot.get_multiplicity(prev_tiid, tiid)
+        mix_round += 1
+
+      # Recounts the active tx0s of the days having new mixes
+      for day in s_days:
+        start_ts = to_timestamp(day)
+        first_round = bisect_left(snapshot.l_ts_mix_txs, start_ts)
+        last_round = bisect_left(snapshot.l_ts_mix_txs, start_ts + 86400)
+        s_active_tx0s = set()
+        for tiid in snapshot.l_mix_txs[first_round:last_round]:
+          for prev_tiid in snapshot.d_reverse_links[tiid]:
+            if prev_tiid in snapshot.s_tx0s:
+              s_active_tx0s.add(prev_tiid)
+        # Days without active tx0s are absent (as in compute())
+        if len(s_active_tx0s) > 0:
+          self.d_nb_active_tx0s[day] = len(s_active_tx0s)
+
+      instr.count('bwd_rounds', nb_new_mixes)
+
+
+  def iter_anonsets(self, start=0):
     '''
-    Gets the number of ancestor tx0s found for a tx
+    Computes the exact anonsets with the selected backend
+    Yields the anonsets ordered by mix round
     Parameters:
-      tiid = id of the transaction
-    '''
-    nb_tx0s = 0
-    prev_tiids = self.snapshot.d_reverse_links[tiid]
-    
-    for prev_tiid in prev_tiids:
-      if prev_tiid not in self.s_processed_txs:
-        if prev_tiid in self.snapshot.s_mix_txs:
-          nb_tx0s += self.get_nb_sources(prev_tiid)
-        elif prev_tiid in self.snapshot.s_tx0s:
-          nb_tx0s += 1
-          self.s_processed_txs.add(prev_tiid)
-    
-    self.s_processed_txs.add(tiid)
-    return nb_tx0s
+      start = first mix round
+    '''
+    return self.backend.iter_bwd_anonsets(start)
+
+
+  def iter_approx_anonsets(self):
+    '''
+    Computes approximate anonsets by propagating HyperLogLog sketches
+    of the ancestor tx0s along the links (single pass in mix round order)
+    Sketches are released as soon as they're no longer needed
+    Yields the anonsets ordered by mix round
+    '''
+    snapshot = self.snapshot
+    hll = HyperLogLog(self.approx_precision)
+    m = hll.m
+    p = hll.p
+
+    # Last mix round using the sketch of each mix
+    d_rounds = dict(zip(snapshot.l_mix_txs, range(0, len(snapshot.l_mix_txs))))
+    d_last_use = dict()
+    for tiid in snapshot.l_mix_txs:
+      next_rounds = [d_rounds[t] for t in snapshot.d_links[tiid] if t in d_rounds]
+      if len(next_rounds) > 0:
+        d_last_use[tiid] = max(next_rounds)
+
+    # Dictionary tiid => registers of the sketch
+    d_sketches = dict()
+    mix_round = 0
+
+    for tiid in snapshot.l_mix_txs:
+      registers = 0
+      for prev_tiid in snapshot.d_reverse_links[tiid]:
+        if prev_tiid in snapshot.s_mix_txs:
+          registers = merge_registers(registers, d_sketches.get(prev_tiid, 0), m)
+          # Releases the sketch of the previous mix if it's no longer needed
+          if d_last_use.get(prev_tiid) == mix_round:
+            d_sketches.pop(prev_tiid, None)
+        elif prev_tiid in snapshot.s_tx0s:
+          registers = merge_registers(registers, hll.singleton(prev_tiid), m)
+      if tiid in d_last_use:
+        d_sketches[tiid] = registers
+      mix_round += 1
+      yield estimate_cardinality(registers, p)
@@ -0,0 +1,225 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Non-interactive mode processing one or several denominations
+in parallel worker processes
+'''
+import sys
+import json
+import time
+import getopt
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.services.snapshot import Snapshot
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.services.backward_metrics import BackwardMetrics
+from whirlpool_stats.services.tx0s_metrics import Tx0sMetrics
+from whirlpool_stats.services.summary import MetricsSummary
+from whirlpool_stats.services.exporter import Exporter
+from whirlpool_stats.backends import BACKENDS, DEFAULT_BACKEND, get_backend_class
+
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+
+
+def process_denom(task):
+  '''
+  Processes a denomination (download, load, export, report)
+  Messages are printed on stderr (stdout is reserved to the timings)
+  Returns a dictionary storing the status and the timings of each step
+  Parameters:
+    task = tuple (working_dir, denom, socks5, download, export, report, nb_report_workers, backend)
+  '''
+  working_dir, denom, socks5, download, export, report, nb_report_workers, backend = task
+  result = {'denom': denom, 'status': 'ok', 'timings': {}}
+  timings = result['timings']
+  step = None
+  snapshot = None
+
+  with redirect_stdout(sys.stderr):
+    try:
+      if download:
+        step = 'download'
+        start = time.time()
+        from whirlpool_stats.services.downloader import Downloader
+        Downloader().download(working_dir, [denom], socks5)
+        timings[step] = time.time() - start
+
+      step = 'load'
+      start = time.time()
+      snapshot = Snapshot(working_dir)
+      snapshot.load(denom)
+      timings[step] = time.time() - start
+
+      step = 'compute'
+      start = time.time()
+      summary = MetricsSummary()
+      summary.set_denom(denom)
+      fwd_metrics = ForwardMetrics(snapshot)
+      fwd_metrics.summary = summary
+      fwd_metrics.resumable = True
+      fwd_metrics.backend_name = backend
+      fwd_metrics.compute()
+      bwd_metrics = BackwardMetrics(snapshot)
+      bwd_metrics.summary = summary
+      bwd_metrics.resumable = True
+      bwd_metrics.backend_name = backend
+      bwd_metrics.compute()
+      tx0_metrics = Tx0sMetrics(snapshot, fwd_metrics)
+      tx0_metrics.compute()
+      timings[step] = time.time() - start
+      result['summary'] = summary.to_dict()['percentiles']['all']
+
+      if export:
+        step = 'export'
+        start = time.time()
+        Exporter(fwd_metrics, bwd_metrics, tx0_metrics).export(working_dir)
+        timings[step] = time.time() - start
+
+      if report:
+        step = 'report'
+        start = time.time()
+        from whirlpool_stats.services.metrics_plotter import Plotter
+        from whirlpool_stats.services.reporter import Reporter
+        plotter = Plotter(fwd_metrics, bwd_metrics, tx0_metrics)
+        filepath = '%s/whirlpool_%s_report.html' % (working_dir, denom)
+        Reporter(working_dir).report({denom: plotter}, filepath, False, nb_report_workers)
+        timings[step] = time.time() - start
+
+    except Exception as e:
+      result['status'] = 'error'
+      result['step'] = step
+      result['error'] = '%s: %s' % (type(e).__name__, e)
+
+  # Adds the measures of the processing phases
+  if snapshot is not None:
+    result['stats'] = snapshot.instr.to_dict()
+
+  return result
+
+
+def run(working_dir, denoms, socks5=None, download=False, export=False, report=False, nb_workers=None,
+        backend=DEFAULT_BACKEND):
+  '''
+  Processes a list of denominations in parallel worker processes
+  Returns a dictionary storing the status and the timings of the run
+  Parameters:
+    working_dir = path of the directory storing the snapshot and exported files
+    denoms      = list of codes identifying the mix denominations
+    socks5      = url of the socks5 proxy to use (or None)
+    download    = flag indicating if the snapshots must be downloaded
+    export      = flag indicating if the metrics must be exported
+    report      = flag indicating if a html report must be generated
+    nb_workers  = number of worker processes (default = one per denomination)
+    backend     = name of the backend computing the exact anonsets
+  '''
+  start = time.time()
+  nb_cpus = multiprocessing.cpu_count()
+  if nb_workers is None:
+    nb_workers = min(len(denoms), nb_cpus)
+  nb_workers = max(1, nb_workers)
+  nb_report_workers = max(1, nb_cpus // nb_workers)
+  tasks = [
+    (working_dir, d, socks5, download, export, report, nb_report_workers, backend)
+    for d in denoms
+  ]
+
+  with ProcessPoolExecutor(nb_workers) as executor:
+    l_results = list(executor.map(process_denom, tasks))
+
+  nb_errors = len([r for r in l_results if r['status'] != 'ok'])
+  return {
+    'status': 'ok' if nb_errors == 0 else 'error',
+    'wall_time': time.time() - start,
+    'nb_workers': nb_workers,
+    'denoms': l_results
+  }
+
+
+def main(argv):
+  '''
+  Main function of the run subcommand
+  Returns the exit code
+  Parameters:
+    argv = list of command line arguments
+  '''
+  working_dir = '/tmp'
+  denoms = ALL_DENOMS
+  socks5 = None
+  download = False
+  export = False
+  report = False
+  nb_workers = None
+  backend = DEFAULT_BACKEND
+
+  try:
+    opts, args = getopt.getopt(
+      argv,
+      'hw:d:s:j:b:',
+      ['help', 'workdir=', 'denoms=', 'socks5=', 'workers=', 'backend=', 'download', 'export', 'report']
+    )
+  except getopt.GetoptError:
+    usage()
+    return EXIT_USAGE
+
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      return EXIT_OK
+    elif opt in ('-w', '--workdir'):
+      working_dir = arg
+    elif opt in ('-d', '--denoms'):
+      denoms = [d.strip() for d in arg.split(',')]
+    elif opt in ('-s', '--socks5'):
+      socks5 = arg
+    elif opt in ('-j', '--workers'):
+      if not arg.isdigit():
+        usage()
+        return EXIT_USAGE
+      nb_workers = int(arg)
+    elif opt in ('-b', '--backend'):
+      backend = arg
+    elif opt == '--download':
+      download = True
+    elif opt == '--export':
+      export = True
+    elif opt == '--report':
+      report = True
+
+  if (len(args) > 0) or any(d not in ALL_DENOMS for d in denoms) or \
+    (backend not in BACKENDS):
+    usage()
+    return EXIT_USAGE
+  # Only the selected backend is imported (numpy and numba are slow to import)
+  if get_backend_class(backend) is None:
+    sys.stderr.write('Backend %s is not available (missing package).\n' % backend)
+    return EXIT_USAGE
+
+  result = run(working_dir, denoms, socks5, download, export, report, nb_workers, backend)
+  sys.stdout.write(json.dumps(result) + '\n')
+  sys.stdout.flush()
+  return EXIT_OK if result['status'] == 'ok' else EXIT_FAILURE
+
+
+def usage():
+  '''
+  Usage message for the run subcommand
+  '''
+  sys.stderr.write('python wst.py run [--workdir=/tmp] [--denoms=05,005,001] [--socks5=localhost:9050]')
+  sys.stderr.write(' [--workers=3] [--backend=python] [--download] [--export] [--report]\n')
+  sys.stderr.write('\n\n[-w OR --workdir] = Path of the directory storing the snapshot and exported files.')
+  sys.stderr.write('\n\n[-d OR --denoms] = List of codes identifying the mix denominations to process (default: all).')
+  sys.stderr.write('\n\n[-s OR --socks5] = Url of the socks5 proxy to use for downloading the snapshots.')
+  sys.stderr.write('\n\n[-j OR --workers] = Number of worker processes (default: one per denomination).')
+  sys.stderr.write('\n\n[-b OR --backend] = Backend computing the exact anonsets (%s, default: %s).' % (', '.join(BACKENDS), DEFAULT_BACKEND))
+  sys.stderr.write('\n\n[--download] = Downloads the snapshots before processing them.')
+  sys.stderr.write('\n\n[--export] = Exports the computed metrics (csv format).')
+  sys.stderr.write('\n\n[--report] = Renders all the charts in a html file per denomination.')
+  sys.stderr.write('\n\nTimings are written on stdout (json format), messages are written on stderr.')
+  sys.stderr.write('\nExit codes: 0 = success, 1 = failure of at least one denomination, 2 = invalid arguments.\n')
+  sys.stderr.flush()
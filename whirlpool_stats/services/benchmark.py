@@ -0,0 +1,289 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A benchmark suite measuring the time and the memory used by the processing phases
+(load, computations, export, scoring) for synthetic snapshots of increasing sizes
+'''
+import os
+import sys
+import json
+import getopt
+import random
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.services.generator import SnapshotGenerator
+from whirlpool_stats.services.snapshot import Snapshot
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.services.backward_metrics import BackwardMetrics
+from whirlpool_stats.services.tx0s_metrics import Tx0sMetrics
+from whirlpool_stats.services.exporter import Exporter
+from whirlpool_stats.backends import BACKENDS, DEFAULT_BACKEND, get_backend_class
+from whirlpool_stats.utils.instrumentation import get_rss_growth
+
+
+# Default sizes (number of mix rounds) of the benchmarks
+# (larger sizes require a faster backend, e.g. --backend=numba --sizes=100000,1000000)
+DEFAULT_SIZES = [2000, 5000, 10000]
+
+# Number of txs scored by the scoring benchmark
+NB_SCORED_TXS = 10000
+
+# Default tolerance used for detecting regressions (10%)
+DEFAULT_TOLERANCE = 0.1
+
+# Minimum growth of the rss during a phase (in bytes) compared with the baseline
+# (smaller variations are dominated by the allocator and by the previous phases)
+MIN_RSS_GROWTH = 4 * 1048576
+
+
+def run_benchmark(task):
+  '''
+  Runs the benchmark for a given snapshot size
+  (should be executed in a dedicated process in order to get meaningful measures of memory)
+  Returns a dictionary phase => measures
+  Parameters:
+    task = tuple (nb_mixes, working_dir, seed, trace_memory, backend_name)
+  '''
+  nb_mixes, working_dir, seed, trace_memory, backend_name = task
+  denom = 'bench%d' % nb_mixes
+  # Private directory storing the files of the benchmark (removed at the end)
+  tmp_dir = tempfile.mkdtemp(prefix='wst_bench_', dir=working_dir)
+
+  try:
+    with redirect_stdout(open(os.devnull, 'w')):
+      instr = bench_phases(tmp_dir, denom, nb_mixes, seed, trace_memory, backend_name)
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+  results = dict()
+  for d_phase in instr.l_phases:
+    results[d_phase['name']] = {
+      'wall_time': d_phase['wall_time'],
+      'cpu_time': d_phase['cpu_time'],
+      'rss_start': d_phase['rss_start'],
+      'rss_end': d_phase['rss_end'],
+      'rss_growth': get_rss_growth(d_phase),
+      'process_peak_rss': d_phase['process_peak_rss'],
+      'peak_traced': d_phase['peak_traced']
+    }
+  return results
+
+
+def bench_phases(working_dir, denom, nb_mixes, seed, trace_memory, backend_name):
+  '''
+  Executes the processing phases for a synthetic snapshot
+  Returns the instrumentation of the snapshot
+  Parameters:
+    working_dir  = directory storing the files of the snapshot and the exported files
+    denom        = code identifying the snapshot
+    nb_mixes     = number of mix rounds
+    seed         = seed of the random generator
+    trace_memory = flag indicating if memory allocations are traced with tracemalloc
+    backend_name = name of the backend computing the exact anonsets
+  '''
+  # Generates the snapshot
+  generator = SnapshotGenerator(nb_mixes, seed=seed)
+  generator.generate(working_dir, denom)
+
+  snapshot = Snapshot(working_dir)
+  snapshot.instr.trace_memory = trace_memory
+  snapshot.load(denom)
+  instr = snapshot.instr
+  fwd_metrics = ForwardMetrics(snapshot)
+  fwd_metrics.backend_name = backend_name
+  fwd_metrics.compute()
+  bwd_metrics = BackwardMetrics(snapshot)
+  bwd_metrics.backend_name = backend_name
+  bwd_metrics.compute()
+  tx0_metrics = Tx0sMetrics(snapshot, fwd_metrics)
+  tx0_metrics.compute()
+  Exporter(fwd_metrics, bwd_metrics, tx0_metrics).export(working_dir)
+
+  # Scores a random sample of mix txs and tx0s
+  rand = random.Random(seed)
+  l_prefixes = list(snapshot.d_txids.keys()) + list(snapshot.d_tx0s.keys())
+  l_prefixes = [rand.choice(l_prefixes) for _ in range(0, NB_SCORED_TXS)]
+  with instr.phase('score'):
+    for prefix in l_prefixes:
+      if prefix in snapshot.d_txids:
+        mix_round = snapshot.d_txids[prefix]
+        scores = (
+          fwd_metrics.l_anonsets[mix_round],
+          fwd_metrics.l_spreads[mix_round],
+          bwd_metrics.l_anonsets[mix_round],
+          bwd_metrics.l_spreads[mix_round]
+        )
+      else:
+        scores = tx0_metrics.get_metrics(prefix)
+
+  return instr
+
+
+def run(sizes=DEFAULT_SIZES, working_dir=None, seed=1, trace_memory=False, backend_name=DEFAULT_BACKEND):
+  '''
+  Runs the benchmarks
+  Returns a dictionary size => phase => measures
+  Parameters:
+    sizes        = list of snapshot sizes (number of mix rounds)
+    working_dir  = directory storing the private temporary directories of the benchmarks
+                   (default = directory of the temporary files of the system)
+    seed         = seed of the random generator
+    trace_memory = flag indicating if memory allocations are traced with tracemalloc
+    backend_name = name of the backend computing the exact anonsets
+  '''
+  d_results = dict()
+  for nb_mixes in sizes:
+    sys.stderr.write('Running benchmark for %d mix rounds\n' % nb_mixes)
+    # Each benchmark is executed in a fresh process
+    with ProcessPoolExecutor(1) as executor:
+      task = (nb_mixes, working_dir, seed, trace_memory, backend_name)
+      d_results[str(nb_mixes)] = executor.submit(run_benchmark, task).result()
+  return d_results
+
+
+def compare(d_results, d_baseline, tolerance=DEFAULT_TOLERANCE):
+  '''
+  Displays the results and compares them with a baseline
+  Returns the number of regressions (wall time or growth of the rss during a phase
+  above the baseline + tolerance)
+  Parameters:
+    d_results  = results of the benchmarks
+    d_baseline = results stored in the baseline (or None)
+    tolerance  = tolerance (ratio)
+  '''
+  nb_regressions = 0
+  print('%-10s %-14s %12s %12s %9s %14s %14s %9s' % (
+    'size', 'phase', 'wall (s)', 'base (s)', 'ratio', 'growth (MB)', 'base (MB)', 'ratio'
+  ))
+
+  for size in sorted(d_results.keys(), key=int):
+    for phase, d_measures in d_results[size].items():
+      d_base = None
+      if (d_baseline is not None) and (size in d_baseline):
+        d_base = d_baseline[size].get(phase)
+      l_cols = [size, phase, '%.3f' % d_measures['wall_time']]
+      for k in ['wall_time', 'rss_growth']:
+        value = d_measures.get(k)
+        base_value = d_base.get(k) if d_base is not None else None
+        if k == 'rss_growth':
+          l_cols.append('%.1f' % (value / 1048576.0) if value is not None else '-')
+        if (value is None) or (base_value is None):
+          l_cols += ['-', '-']
+          continue
+        if k == 'rss_growth':
+          # Variations of memory below MIN_RSS_GROWTH are considered as equal
+          ratio = float(max(value, MIN_RSS_GROWTH)) / float(max(base_value, MIN_RSS_GROWTH))
+        elif base_value > 0:
+          ratio = float(value) / float(base_value)
+        else:
+          l_cols += ['-', '-']
+          continue
+        flag = ''
+        if ratio > 1.0 + tolerance:
+          nb_regressions += 1
+          flag = ' !'
+        base_str = '%.3f' % base_value if k == 'wall_time' else '%.1f' % (base_value / 1048576.0)
+        l_cols += [base_str, '%.2f%s' % (ratio, flag)]
+      print('%-10s %-14s %12s %12s %9s %14s %14s %9s' % tuple(l_cols))
+
+  return nb_regressions
+
+
+def main(argv):
+  '''
+  Main function
+  Returns the exit code (1 if a regression is detected)
+  Parameters:
+    argv = list of command line arguments
+  '''
+  sizes = DEFAULT_SIZES
+  working_dir = None
+  seed = 1
+  trace_memory = False
+  baseline_path = None
+  save_path = None
+  tolerance = DEFAULT_TOLERANCE
+  backend_name = DEFAULT_BACKEND
+
+  try:
+    opts, args = getopt.getopt(
+      argv,
+      'hn:w:s:b:o:t:m',
+      ['help', 'sizes=', 'workdir=', 'seed=', 'baseline=', 'save=', 'tolerance=', 'memory', 'backend=']
+    )
+  except getopt.GetoptError:
+    usage()
+    return 2
+
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      return 0
+    elif opt in ('-n', '--sizes'):
+      sizes = [int(n) for n in arg.split(',')]
+    elif opt in ('-w', '--workdir'):
+      working_dir = arg
+    elif opt in ('-s', '--seed'):
+      seed = int(arg)
+    elif opt in ('-b', '--baseline'):
+      baseline_path = arg
+    elif opt in ('-o', '--save'):
+      save_path = arg
+    elif opt in ('-t', '--tolerance'):
+      tolerance = float(arg)
+    elif opt in ('-m', '--memory'):
+      trace_memory = True
+    elif opt == '--backend':
+      backend_name = arg
+
+  if (backend_name not in BACKENDS) or (backend_name == 'distributed'):
+    usage()
+    return 2
+  if get_backend_class(backend_name) is None:
+    print('Backend %s is not available (missing package).' % backend_name)
+    return 2
+
+  d_results = run(sizes, working_dir, seed, trace_memory, backend_name)
+
+  d_baseline = None
+  if baseline_path is not None:
+    with open(baseline_path, 'r') as f:
+      d_baseline = json.load(f)
+
+  nb_regressions = compare(d_results, d_baseline, tolerance)
+
+  if save_path is not None:
+    with open(save_path, 'w') as f:
+      json.dump(d_results, f, indent=2)
+    print('Results saved in %s' % save_path)
+
+  if nb_regressions > 0:
+    print('%d regression(s) detected' % nb_regressions)
+    return 1
+  return 0
+
+
+def usage():
+  '''
+  Usage message for this module
+  '''
+  sys.stdout.write('python benchmark.py [--sizes=2000,5000,10000] [--workdir=/tmp] [--seed=1] [--backend=python]')
+  sys.stdout.write(' [--baseline=baseline.json] [--save=results.json] [--tolerance=0.1] [--memory]\n')
+  sys.stdout.write('\n\n[-n OR --sizes] = List of snapshot sizes (number of mix rounds).')
+  sys.stdout.write('\n    Sizes above 10000 require a faster backend (e.g. --backend=numba).')
+  sys.stdout.write('\n\n[-w OR --workdir] = Directory storing the private temporary directories (default: temporary directory).')
+  sys.stdout.write('\n\n[--backend] = Backend computing the exact anonsets (python, numpy, numba).')
+  sys.stdout.write('\n\n[-s OR --seed] = Seed of the random generator.')
+  sys.stdout.write('\n\n[-b OR --baseline] = Path of a json file storing the results used as a baseline')
+  sys.stdout.write('\n    (baseline of the default sizes with the python backend: benchmarks/baseline_python.json).')
+  sys.stdout.write('\n\n[-o OR --save] = Path of the json file storing the results (e.g. new baseline).')
+  sys.stdout.write('\n\n[-t OR --tolerance] = Tolerance used for detecting regressions (default: 0.1 = 10%).')
+  sys.stdout.write('\n\n[-m OR --memory] = Traces the memory allocations with tracemalloc (slower).')
+  sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
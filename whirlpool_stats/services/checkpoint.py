@@ -0,0 +1,119 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class checkpointing the partial results of a long computation
+(anonsets computed round by round) so that an interrupted computation
+can be resumed from the last checkpointed round
+'''
+import os
+import glob
+import time
+from array import array
+
+
+# Minimum interval between 2 checkpoints (in seconds)
+CHECKPOINT_INTERVAL = 30.0
+
+# Maximum share of the computation time spent writing checkpoints
+MAX_OVERHEAD = 0.02
+
+# Filename template of the checkpoints
+FN_CHECKPOINT = 'whirlpool_checkpoint'
+
+
+class Checkpoint(object):
+
+  def __init__(self, snapshot, name, interval=CHECKPOINT_INTERVAL):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+      name     = name of the checkpointed computation (e.g. fwd, bwd)
+      interval = minimum interval between 2 checkpoints (in seconds)
+    '''
+    self.snapshot = snapshot
+    self.name = name
+    self.interval = interval
+    # Path of the checkpoint file (keyed by the hash of the snapshot)
+    self.filepath = None
+    # Number of values already written in the checkpoint file
+    self.nb_saved = 0
+    # Time of the last checkpoint
+    self.last_save = None
+
+
+  def get_pattern(self):
+    '''
+    Returns the pattern of the names of the checkpoint files of this computation
+    '''
+    filename = '%s_%s_%s_*.bin' % (FN_CHECKPOINT, self.snapshot.denom, self.name)
+    return '%s/%s' % (self.snapshot.snapshots_dir, filename)
+
+
+  def load(self):
+    '''
+    Loads the values stored by the checkpoint of the snapshot
+    (checkpoints of previous versions of the snapshot are deleted)
+    Returns the list of values (empty list if there's no checkpoint)
+    '''
+    snapshot_hash = self.snapshot.get_hash()
+    self.filepath = self.get_pattern().replace('*', snapshot_hash[0:16])
+    self.last_save = time.time()
+    self.nb_saved = 0
+
+    for filepath in glob.glob(self.get_pattern()):
+      if filepath != self.filepath:
+        os.remove(filepath)
+
+    values = array('q')
+    if os.path.isfile(self.filepath):
+      with open(self.filepath, 'rb') as f:
+        data = f.read()
+      # Ignores an incomplete record written when the process was killed
+      nb_bytes = len(data) - len(data) % values.itemsize
+      values.frombytes(data[0:nb_bytes])
+      self.nb_saved = len(values)
+      if nb_bytes != len(data):
+        with open(self.filepath, 'r+b') as f:
+          f.truncate(nb_bytes)
+
+    return values.tolist()
+
+
+  def update(self, values):
+    '''
+    Checkpoints the values if the checkpoint interval has elapsed
+    Parameters:
+      values = list of values computed so far
+    '''
+    if time.time() - self.last_save >= self.interval:
+      self.save(values)
+
+
+  def save(self, values):
+    '''
+    Appends the values computed since the last checkpoint to the checkpoint file
+    The interval is adjusted so that the time spent writing
+    the checkpoints stays below MAX_OVERHEAD
+    Parameters:
+      values = list of values computed so far
+    '''
+    start = time.time()
+    if len(values) > self.nb_saved:
+      with open(self.filepath, 'ab') as f:
+        array('q', values[self.nb_saved:]).tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+      self.nb_saved = len(values)
+    self.last_save = time.time()
+    self.interval = max(self.interval, (self.last_save - start) / MAX_OVERHEAD)
+    self.snapshot.instr.count('%s_checkpoints' % self.name, 1)
+
+
+  def clear(self):
+    '''
+    Deletes the checkpoint (computation completed)
+    '''
+    if (self.filepath is not None) and os.path.isfile(self.filepath):
+      os.remove(self.filepath)
+    self.nb_saved = 0
@@ -0,0 +1,116 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class computing the growth of the backward-looking anonsets
+with the number of remix hops (anonset reached at depth 1, 2, ... k)
+'''
+from statistics import median
+
+
+# Default maximum depth
+DEFAULT_MAX_DEPTH = 10
+
+
+class DepthMetrics(object):
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    self.snapshot = snapshot
+    # Maximum depth of the curves (None = not computed)
+    self.max_depth = None
+    # List of lists of cumulative anonsets (one list per depth, ordered by mix round)
+    # l_depth_anonsets[d-1][r] = number of ancestor tx0s of mix round r
+    #                            reached with at most d-1 intermediate mixes
+    self.l_depth_anonsets = []
+
+
+  def reset(self):
+    '''
+    Resets the results (e.g. when a new snapshot is loaded)
+    '''
+    self.max_depth = None
+    self.l_depth_anonsets = []
+
+
+  def compute(self, max_depth=DEFAULT_MAX_DEPTH):
+    '''
+    Computes the cumulative backward-looking anonsets of all mix rounds
+    for the depths 1 to max_depth
+
+    Ancestors are expanded level by level (level-synchronous BFS),
+    so that a single walk per mix round provides the whole curve.
+    The frontiers and the set of visited txs are shared by all the walks.
+    Parameters:
+      max_depth = maximum depth
+    '''
+    snapshot = self.snapshot
+    instr = snapshot.instr
+
+    with instr.phase('compute depth'):
+      print('Start computing anonsets by depth (max depth = %d)' % max_depth)
+
+      self.max_depth = max_depth
+      self.l_depth_anonsets = [[] for d in range(0, max_depth)]
+
+      d_reverse_links = snapshot.d_reverse_links
+      s_mix_txs = snapshot.s_mix_txs
+      s_tx0s = snapshot.s_tx0s
+      # Buffers shared by all the walks
+      s_visited = set()
+      frontier = []
+      next_frontier = []
+
+      nb_mixes = len(snapshot.l_mix_txs)
+      progress = instr.progress('Computed metrics for', nb_mixes)
+      nb_visited = 0
+
+      for mix_round in range(0, nb_mixes):
+        s_visited.clear()
+        del frontier[:]
+        frontier.append(snapshot.l_mix_txs[mix_round])
+        nb_tx0s = 0
+
+        for depth in range(0, max_depth):
+          # Expands the frontier by one level
+          del next_frontier[:]
+          for tiid in frontier:
+            for prev_tiid in d_reverse_links[tiid]:
+              if prev_tiid not in s_visited:
+                s_visited.add(prev_tiid)
+                if prev_tiid in s_mix_txs:
+                  next_frontier.append(prev_tiid)
+                elif prev_tiid in s_tx0s:
+                  nb_tx0s += 1
+          self.l_depth_anonsets[depth].append(nb_tx0s)
+          frontier, next_frontier = next_frontier, frontier
+          # Stops the walk if all the ancestors have been reached
+          if len(frontier) == 0:
+            for d in range(depth + 1, max_depth):
+              self.l_depth_anonsets[d].append(nb_tx0s)
+            break
+
+        nb_visited += len(s_visited)
+        progress.update(mix_round + 1)
+
+      instr.count('depth_nodes_visited', nb_visited)
+      print('Done!')
+
+
+  def get_curve(self, mix_round):
+    '''
+    Returns the list of cumulative anonsets of a mix round (depths 1 to max_depth)
+    Parameters:
+      mix_round = mix round
+    '''
+    return [l_anonsets[mix_round] for l_anonsets in self.l_depth_anonsets]
+
+
+  def get_median_curve(self):
+    '''
+    Returns the list of median cumulative anonsets (depths 1 to max_depth)
+    '''
+    return [median(l_anonsets) for l_anonsets in self.l_depth_anonsets]
@@ -0,0 +1,585 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Comparison of 2 versions of the snapshot of a denomination
+(new, removed and modified mix txs, tx0s and links, rewrites of the history
+and deltas of the anonsets exported for each version).
+
+Snapshot files are streamed once. Each row is reduced to integers (id and hash
+of the row for txs, packed (tgt, src) for links) stored in arrays sorted by id.
+OXT publishes the rows ordered by id, the arrays are compared with a linear merge
+(files not ordered by id are sorted once).
+'''
+import os
+import sys
+import getopt
+import hashlib
+import heapq
+from array import array
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.utils.date import to_utcdate
+from whirlpool_stats.utils.files import atomic_write
+from whirlpool_stats.utils.instrumentation import Instrumentation
+
+
+# Exit codes
+EXIT_IDENTICAL = 0
+EXIT_APPENDED = 1
+EXIT_USAGE = 2
+EXIT_REWRITTEN = 3
+
+# Default number of largest deltas displayed per metrics
+DEFAULT_TOP = 10
+
+# Number of bits used by a tiid in the packed key of a link
+LINK_KEY_BITS = 32
+
+# Metrics compared (category => filename template, index column, anonset column)
+DIFF_METRICS = [
+  ('fwd', 'whirlpool_%s_forward_metrics.csv', 0, 1),
+  ('bwd', 'whirlpool_%s_backward_metrics.csv', 0, 1),
+  ('tx0', 'whirlpool_%s_tx0_metrics.csv', 0, 4)
+]
+
+
+def iter_rows(filepath):
+  '''
+  Yields the rows of a snapshot file (raw lines without the end of line)
+  Parameters:
+    filepath = path of the file
+  '''
+  with open(filepath, 'rb') as f:
+    next(f, None)  # skips the headers
+    for line in f:
+      line = line.rstrip(b'\r\n')
+      if len(line) > 0:
+        yield line
+
+
+def hash_row(line):
+  '''
+  Returns the hash of a row (64 bits integer)
+  Parameters:
+    line = raw line
+  '''
+  return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'little')
+
+
+class TxsIndex(object):
+
+  def __init__(self, filepath):
+    '''
+    Constructor
+    Streams a file of txs (mix txs or tx0s) and indexes its rows
+    Parameters:
+      filepath = path of the file
+    '''
+    # Ids of the txs in file order (position = mix round or tx0 index)
+    self.ids = array('q')
+    # Hashes of the rows in file order
+    self.hashes = array('Q')
+    # Timestamps of the txs in file order
+    self.timestamps = array('q')
+    # Positions ordered by id (None if the file is ordered by id)
+    self.order = None
+
+    is_sorted = True
+    last_id = None
+    for line in iter_rows(filepath):
+      fields = line.split(b';')
+      tiid = int(fields[0])
+      if (last_id is not None) and (tiid < last_id):
+        is_sorted = False
+      last_id = tiid
+      self.ids.append(tiid)
+      self.hashes.append(hash_row(line))
+      self.timestamps.append(int(fields[2]))
+
+    if not is_sorted:
+      self.order = array('q', sorted(range(len(self.ids)), key=self.ids.__getitem__))
+
+
+  def __len__(self):
+    return len(self.ids)
+
+
+  def iter_sorted(self):
+    '''
+    Yields the tuples (id, position) ordered by id
+    '''
+    if self.order is None:
+      return zip(self.ids, range(len(self.ids)))
+    return ((self.ids[p], p) for p in self.order)
+
+
+  def get_max_id(self):
+    '''
+    Returns the largest id (or -1 if the file is empty)
+    '''
+    if len(self.ids) == 0:
+      return -1
+    return self.ids[-1] if self.order is None else self.ids[self.order[-1]]
+
+
+class LinksIndex(object):
+
+  def __init__(self, filepath):
+    '''
+    Constructor
+    Streams a file of links and stores the sorted packed keys (tgt, src)
+    Links are published ordered by target, only the links of a target are sorted
+    (the whole array is sorted if the file isn't ordered by target).
+    Parameters:
+      filepath = path of the file
+    '''
+    self.keys = array('Q')
+
+    is_sorted = True
+    l_group = []
+    last_tgt = None
+    for line in iter_rows(filepath):
+      fields = line.split(b';')
+      src = int(fields[0])
+      tgt = int(fields[1])
+      if tgt != last_tgt:
+        l_group.sort()
+        self.keys.extend(l_group)
+        l_group = []
+        if (last_tgt is not None) and (tgt < last_tgt):
+          is_sorted = False
+        last_tgt = tgt
+      l_group.append((tgt << LINK_KEY_BITS) | src)
+    l_group.sort()
+    self.keys.extend(l_group)
+
+    if not is_sorted:
+      self.keys = array('Q', sorted(self.keys))
+
+
+  def __len__(self):
+    return len(self.keys)
+
+
+def merge_txs(old_index, new_index):
+  '''
+  Merges 2 indexes of txs
+  Yields the tuples (id, old position or None, new position or None) ordered by id
+  Parameters:
+    old_index = index of the old version of the file
+    new_index = index of the new version of the file
+  '''
+  it_old = old_index.iter_sorted()
+  it_new = new_index.iter_sorted()
+  old = next(it_old, None)
+  new = next(it_new, None)
+  while (old is not None) or (new is not None):
+    if (new is None) or ((old is not None) and (old[0] < new[0])):
+      yield old[0], old[1], None
+      old = next(it_old, None)
+    elif (old is None) or (new[0] < old[0]):
+      yield new[0], None, new[1]
+      new = next(it_new, None)
+    else:
+      yield old[0], old[1], new[1]
+      old = next(it_old, None)
+      new = next(it_new, None)
+
+
+def merge_links(old_index, new_index):
+  '''
+  Merges 2 indexes of links (multisets of packed keys)
+  Yields the tuples (key, flag) with flag = -1 for a removed link, +1 for an added link
+  Parameters:
+    old_index = index of the old version of the file
+    new_index = index of the new version of the file
+  '''
+  old_keys = old_index.keys
+  new_keys = new_index.keys
+  i = 0
+  j = 0
+  while (i < len(old_keys)) or (j < len(new_keys)):
+    if (j == len(new_keys)) or ((i < len(old_keys)) and (old_keys[i] < new_keys[j])):
+      yield old_keys[i], -1
+      i += 1
+    elif (i == len(old_keys)) or (new_keys[j] < old_keys[i]):
+      yield new_keys[j], 1
+      j += 1
+    else:
+      i += 1
+      j += 1
+
+
+def load_anonsets(filepath, idx_col, anonset_col, nb_items):
+  '''
+  Loads the anonsets exported in a metrics file
+  Returns an array index => anonset (-1 if missing) or None if the file doesn't exist
+  Parameters:
+    filepath    = path of the file
+    idx_col     = index of the column storing the mix round (or the tx0 index)
+    anonset_col = index of the column storing the anonset
+    nb_items    = number of mix rounds (or tx0s) of the snapshot
+  '''
+  if not os.path.isfile(filepath):
+    return None
+  anonsets = array('q', [-1]) * nb_items
+  for line in iter_rows(filepath):
+    fields = line.split(b';')
+    idx = int(fields[idx_col])
+    if (idx < nb_items) and (len(fields[anonset_col]) > 0):
+      anonsets[idx] = int(fields[anonset_col])
+  return anonsets
+
+
+class SnapshotDiff(object):
+
+  def __init__(self, old_dir, new_dir, denom):
+    '''
+    Constructor
+    Parameters:
+      old_dir = path of the directory storing the old version of the snapshot
+      new_dir = path of the directory storing the new version of the snapshot
+      denom   = code identifying the mix denomination
+    '''
+    self.old_dir = old_dir
+    self.new_dir = new_dir
+    self.denom = denom
+    # Measures of the processing phases
+    self.instr = Instrumentation()
+    # Dictionary category (mix, tx0, link) => counters of changes
+    self.d_changes = dict()
+    # Ordered list of the reasons why the history has been rewritten
+    self.l_rewrites = []
+    # First mix round of the new snapshot directly modified by a rewrite (or None)
+    self.first_rewritten_round = None
+    # Dictionary metrics => statistics of the deltas of the anonsets (or None if not exported)
+    self.d_deltas = dict()
+    # Ordered list of deltas (category, new index, id, old index, old anonset, new anonset)
+    self.l_deltas = []
+    # Indexes of the mix txs (used to date the mix rounds)
+    self.new_mixes = None
+
+
+  def get_filepath(self, snapshots_dir, fn):
+    '''
+    Returns the path of a snapshot file
+    Parameters:
+      snapshots_dir = path of the directory storing the snapshot
+      fn            = filename template
+    '''
+    return '%s/%s_%s.csv' % (snapshots_dir, fn, self.denom)
+
+
+  def compute(self):
+    '''
+    Compares the 2 versions of the snapshot
+    '''
+    print('Start comparing the snapshots for %s denomination' % self.denom)
+
+    with self.instr.phase('diff index'):
+      old_mixes = TxsIndex(self.get_filepath(self.old_dir, FN_MIX_TXS))
+      new_mixes = TxsIndex(self.get_filepath(self.new_dir, FN_MIX_TXS))
+      old_tx0s = TxsIndex(self.get_filepath(self.old_dir, FN_TX0S))
+      new_tx0s = TxsIndex(self.get_filepath(self.new_dir, FN_TX0S))
+      old_links = LinksIndex(self.get_filepath(self.old_dir, FN_LINKS))
+      new_links = LinksIndex(self.get_filepath(self.new_dir, FN_LINKS))
+      self.new_mixes = new_mixes
+      for lbl, o_index in [('mix_txs', new_mixes), ('tx0s', new_tx0s), ('links', new_links)]:
+        self.instr.count(lbl, len(o_index))
+
+    print('  Snapshot files indexed')
+
+    with self.instr.phase('diff rows'):
+      last_id = max(old_mixes.get_max_id(), old_tx0s.get_max_id())
+      s_new_ids = set()
+      s_rewritten_ids = set()
+      l_matches = []
+      for category, old_index, new_index in [('mix', old_mixes, new_mixes), ('tx0', old_tx0s, new_tx0s)]:
+        d_counters = {'added': 0, 'removed': 0, 'changed': 0, 'inserted': 0}
+        matches = (array('q'), array('q'))
+        for tiid, old_pos, new_pos in merge_txs(old_index, new_index):
+          if old_pos is None:
+            d_counters['added'] += 1
+            s_new_ids.add(tiid)
+            # New tx inserted before the last tx of the old snapshot
+            if tiid <= last_id:
+              d_counters['inserted'] += 1
+              s_rewritten_ids.add(tiid)
+          elif new_pos is None:
+            d_counters['removed'] += 1
+          else:
+            matches[0].append(old_pos)
+            matches[1].append(new_pos)
+            if old_index.hashes[old_pos] != new_index.hashes[new_pos]:
+              d_counters['changed'] += 1
+              s_rewritten_ids.add(tiid)
+        self.d_changes[category] = d_counters
+        l_matches.append(matches)
+
+      d_counters = {'added': 0, 'removed': 0, 'retargeted': 0}
+      for key, flag in merge_links(old_links, new_links):
+        tgt = key >> LINK_KEY_BITS
+        if flag < 0:
+          d_counters['removed'] += 1
+          s_rewritten_ids.add(tgt)
+        else:
+          d_counters['added'] += 1
+          # New input of a tx already published
+          if tgt not in s_new_ids:
+            d_counters['retargeted'] += 1
+            s_rewritten_ids.add(tgt)
+      self.d_changes['link'] = d_counters
+
+      self.set_rewrites(new_mixes, s_rewritten_ids)
+
+    print('  Rows compared')
+
+    with self.instr.phase('diff metrics'):
+      self.l_deltas = []
+      for (category, template, idx_col, anonset_col), o_matches in zip(
+        DIFF_METRICS, [l_matches[0], l_matches[0], l_matches[1]]
+      ):
+        nb_old = len(old_tx0s) if category == 'tx0' else len(old_mixes)
+        nb_new = len(new_tx0s) if category == 'tx0' else len(new_mixes)
+        new_ids = new_tx0s.ids if category == 'tx0' else new_mixes.ids
+        old_anonsets = load_anonsets('%s/%s' % (self.old_dir, template % self.denom), idx_col, anonset_col, nb_old)
+        new_anonsets = load_anonsets('%s/%s' % (self.new_dir, template % self.denom), idx_col, anonset_col, nb_new)
+        if (old_anonsets is None) or (new_anonsets is None):
+          self.d_deltas[category] = None
+          continue
+        self.d_deltas[category] = self.compare_anonsets(
+          category, o_matches, old_anonsets, new_anonsets, new_ids
+        )
+
+    print('  Anonsets compared')
+    print('Done!')
+
+
+  def set_rewrites(self, new_mixes, s_rewritten_ids):
+    '''
+    Sets the reasons why the history has been rewritten
+    and the first mix round directly modified by a rewrite
+    Parameters:
+      new_mixes       = index of the mix txs of the new snapshot
+      s_rewritten_ids = set of ids of the txs modified by a rewrite
+    '''
+    self.l_rewrites = []
+    d_mix = self.d_changes['mix']
+    d_tx0 = self.d_changes['tx0']
+    d_link = self.d_changes['link']
+    for nb, lbl in [
+      (d_mix['removed'], 'mix txs removed'),
+      (d_mix['changed'], 'mix txs modified'),
+      (d_mix['inserted'], 'mix txs inserted before the last tx of the old snapshot'),
+      (d_tx0['removed'], 'tx0s removed'),
+      (d_tx0['changed'], 'tx0s modified'),
+      (d_tx0['inserted'], 'tx0s inserted before the last tx of the old snapshot'),
+      (d_link['removed'], 'links removed'),
+      (d_link['retargeted'], 'links added towards txs of the old snapshot')
+    ]:
+      if nb > 0:
+        self.l_rewrites.append('%d %s' % (nb, lbl))
+
+    self.first_rewritten_round = None
+    if len(s_rewritten_ids) > 0:
+      for mix_round, tiid in enumerate(new_mixes.ids):
+        if tiid in s_rewritten_ids:
+          self.first_rewritten_round = mix_round
+          break
+
+
+  def compare_anonsets(self, category, o_matches, old_anonsets, new_anonsets, new_ids):
+    '''
+    Compares the anonsets of the txs present in both snapshots
+    Returns a dictionary storing the statistics of the deltas
+    Parameters:
+      category     = category of the metrics (fwd, bwd, tx0)
+      o_matches    = tuple (array of old positions, array of new positions) of the common txs
+      old_anonsets = array old position => anonset
+      new_anonsets = array new position => anonset
+      new_ids      = array new position => id of the tx
+    '''
+    d_stats = {'compared': 0, 'increased': 0, 'decreased': 0, 'max_increase': 0, 'max_decrease': 0}
+    for old_pos, new_pos in zip(*o_matches):
+      old_value = old_anonsets[old_pos]
+      new_value = new_anonsets[new_pos]
+      if (old_value < 0) or (new_value < 0):
+        continue
+      d_stats['compared'] += 1
+      delta = new_value - old_value
+      if delta == 0:
+        continue
+      if delta > 0:
+        d_stats['increased'] += 1
+        d_stats['max_increase'] = max(d_stats['max_increase'], delta)
+      else:
+        d_stats['decreased'] += 1
+        d_stats['max_decrease'] = min(d_stats['max_decrease'], delta)
+      self.l_deltas.append((category, new_pos, new_ids[new_pos], old_pos, old_value, new_value))
+    return d_stats
+
+
+  def has_changes(self):
+    '''
+    Checks if the 2 versions of the snapshot are different
+    '''
+    return any(v > 0 for d_counters in self.d_changes.values() for v in d_counters.values())
+
+
+  def display(self, top=DEFAULT_TOP):
+    '''
+    Displays the differences between the 2 versions of the snapshot
+    Parameters:
+      top = number of largest deltas displayed per metrics
+    '''
+    print('Snapshot %s: %s => %s' % (self.denom, self.old_dir, self.new_dir))
+    print('')
+    print('%-8s  %10s  %10s  %10s' % ('', 'added', 'removed', 'modified'))
+    for category, lbl in [('mix', 'mix txs'), ('tx0', 'tx0s'), ('link', 'links')]:
+      d_counters = self.d_changes[category]
+      print('%-8s  %10d  %10d  %10s' % (
+        lbl,
+        d_counters['added'],
+        d_counters['removed'],
+        d_counters['changed'] if 'changed' in d_counters else '-'
+      ))
+    print('')
+
+    if len(self.l_rewrites) == 0:
+      print('History: unchanged (rows appended only)')
+    else:
+      print('History: REWRITTEN')
+      for lbl in self.l_rewrites:
+        print('  %s' % lbl)
+      if self.first_rewritten_round is not None:
+        ts = self.new_mixes.timestamps[self.first_rewritten_round]
+        print('  first modified mix round = %d (%s)' % (
+          self.first_rewritten_round,
+          to_utcdate(ts).strftime('%d/%m/%Y')
+        ))
+
+    for category, template, idx_col, anonset_col in DIFF_METRICS:
+      print('')
+      d_stats = self.d_deltas.get(category)
+      lbl = 'Tx0s' if category == 'tx0' else '%s-looking' % ('Forward' if category == 'fwd' else 'Backward')
+      if d_stats is None:
+        print('%s anonsets: not compared (%s not exported in both directories)' % (lbl, template % self.denom))
+        continue
+      nb_changed = d_stats['increased'] + d_stats['decreased']
+      print('%s anonsets: %d/%d changed (%d increased, max +%d / %d decreased, max %d)' % (
+        lbl, nb_changed, d_stats['compared'],
+        d_stats['increased'], d_stats['max_increase'],
+        d_stats['decreased'], d_stats['max_decrease']
+      ))
+      l_top = heapq.nlargest(
+        top,
+        (d for d in self.l_deltas if d[0] == category),
+        key=lambda d: abs(d[5] - d[4])
+      )
+      if len(l_top) > 0:
+        lbl_idx = 'tx0 index' if category == 'tx0' else 'mix round'
+        print('  %-10s  %-10s  %10s  %10s  %10s' % (lbl_idx, 'old index', 'old', 'new', 'delta'))
+        for item in l_top:
+          print('  %-10d  %-10d  %10d  %10d  %+10d' % (item[1], item[3], item[4], item[5], item[5] - item[4]))
+
+
+  def export(self, filepath):
+    '''
+    Exports the deltas of the anonsets (csv format)
+    Parameters:
+      filepath = path of the file
+    '''
+    with atomic_write(filepath) as f:
+      f.write('metrics;index;id;old_index;old_anonset;new_anonset;delta\n')
+      for category, new_pos, tiid, old_pos, old_value, new_value in self.l_deltas:
+        f.write('%s;%d;%d;%d;%d;%d;%d\n' % (
+          category, new_pos, tiid, old_pos, old_value, new_value, new_value - old_value
+        ))
+    print('Exported the deltas of the anonsets in %s' % filepath)
+
+
+  def get_exit_code(self):
+    '''
+    Returns the exit code summarizing the comparison
+    '''
+    if len(self.l_rewrites) > 0:
+      return EXIT_REWRITTEN
+    return EXIT_APPENDED if self.has_changes() else EXIT_IDENTICAL
+
+
+def main(argv):
+  '''
+  Main function of the diff subcommand
+  Returns the exit code
+  Parameters:
+    argv = list of command line arguments
+  '''
+  old_dir = None
+  new_dir = '/tmp'
+  denoms = ALL_DENOMS
+  output_dir = None
+  top = DEFAULT_TOP
+
+  try:
+    opts, args = getopt.getopt(
+      argv,
+      'ho:n:d:t:',
+      ['help', 'old=', 'new=', 'denoms=', 'top=', 'output=']
+    )
+  except getopt.GetoptError:
+    usage()
+    return EXIT_USAGE
+
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      return EXIT_IDENTICAL
+    elif opt in ('-o', '--old'):
+      old_dir = arg
+    elif opt in ('-n', '--new'):
+      new_dir = arg
+    elif opt in ('-d', '--denoms'):
+      denoms = [d.strip() for d in arg.split(',')]
+    elif opt in ('-t', '--top'):
+      if not arg.isdigit():
+        usage()
+        return EXIT_USAGE
+      top = int(arg)
+    elif opt == '--output':
+      output_dir = arg
+
+  if (len(args) > 0) or (old_dir is None) or any(d not in ALL_DENOMS for d in denoms):
+    usage()
+    return EXIT_USAGE
+
+  exit_code = EXIT_IDENTICAL
+  for denom in denoms:
+    diff = SnapshotDiff(old_dir, new_dir, denom)
+    try:
+      diff.compute()
+    except (OSError, ValueError, IndexError) as e:
+      sys.stderr.write('Unable to compare the snapshots for %s denomination (%s)\n' % (denom, e))
+      return EXIT_USAGE
+    print('')
+    diff.display(top)
+    print('')
+    if output_dir is not None:
+      diff.export('%s/whirlpool_%s_diff.csv' % (output_dir, denom))
+    exit_code = max(exit_code, diff.get_exit_code())
+
+  return exit_code
+
+
+def usage():
+  '''
+  Usage message for the diff subcommand
+  '''
+  sys.stderr.write('python wst.py diff --old=/data/previous [--new=/tmp] [--denoms=05,005,001] [--top=10] [--output=/tmp]\n')
+  sys.stderr.write('\n\n[-o OR --old] = Path of the directory storing the old version of the snapshots.')
+  sys.stderr.write('\n\n[-n OR --new] = Path of the directory storing the new version of the snapshots.')
+  sys.stderr.write('\n\n[-d OR --denoms] = List of codes identifying the mix denominations to compare (default: all).')
+  sys.stderr.write('\n\n[-t OR --top] = Number of largest deltas of anonsets displayed per metrics (default: 10).')
+  sys.stderr.write('\n\n[--output] = Exports the deltas of the anonsets in whirlpool_<denom>_diff.csv in this directory.')
+  sys.stderr.write('\n\nDeltas of anonsets are computed from the metrics exported in both directories (see run --export).')
+  sys.stderr.write('\nExit codes: 0 = identical snapshots, 1 = rows appended, 2 = invalid arguments or missing files,')
+  sys.stderr.write(' 3 = history rewritten.\n')
+  sys.stderr.flush()
@@ -3,11 +3,28 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 
 A class allowing to download the latest snapshots of Whirpool's transaction graph.
 '''
+import os
 import sys
+import json
+import time
 import getopt
-import requests
 from random import randint
+from email.utils import parsedate_to_datetime
 from whirlpool_stats.utils.constants import *
+from whirlpool_stats.utils.files import atomic_write
+
+
+# Number of bytes already stored locally requested again with the tail of a file
+# (used to check that the remote file is the local file with appended rows)
+TAIL_OVERLAP = 4096
+
+# Maximum interval (in seconds) between 2 full downloads of a file
+# (the check of the overlap is a heuristic, a rewrite of the remote file
+# preserving its last bytes is only detected by a full download)
+FULL_SYNC_INTERVAL = 86400
+
+# Filename template of the validators of the downloaded files (etag, last-modified)
+FN_SYNC_STATE = 'whirlpool_sync_state'
 
 
 class Downloader(object):
@@ -34,13 +51,7 @@ class Downloader(object):
     self.socks5 = socks5
 
     # Creates a requests session
-    session = requests.session()
-    session.proxies = {}
-  
-    # Sets the tor proxy if needed
-    if self.socks5 is not None:
-      session.proxies['http'] = 'socks5h://' + self.socks5
-      session.proxies['https'] = 'socks5h://' + self.socks5
+    session = self.get_session()
   
     # Downloads snaphshot files for the requested denoms
     for d in self.denoms:
@@ -58,6 +69,142 @@ class Downloader(object):
       print('Download complete\n')
 
 
+  def get_session(self):
+    '''
+    Returns a requests session (using the socks5 proxy if needed)
+    '''
+    # requests is imported here because it's slow to import
+    import requests
+    session = requests.session()
+    session.proxies = {}
+    if self.socks5 is not None:
+      session.proxies['http'] = 'socks5h://' + self.socks5
+      session.proxies['https'] = 'socks5h://' + self.socks5
+    return session
+
+
+  def sync(self, snapshots_dir, denom, socks5=None):
+    '''
+    Downloads the parts of the snapshot files of a denomination
+    that have changed since the last synchronization
+    (conditional requests + range requests for the appended rows)
+    Returns a dictionary filename => status (unchanged, appended, replaced)
+    Parameters:
+      snapshots_dir = path of the directory that will store snapshot files
+      denom         = code identifying the mix denomination
+      socks5        = url of the socks5 proxy to use (or None)
+    '''
+    self.snapshots_dir = snapshots_dir
+    self.denoms = [denom]
+    self.socks5 = socks5
+    session = self.get_session()
+
+    state_path = '%s/%s_%s.json' % (snapshots_dir, FN_SYNC_STATE, denom)
+    d_state = dict()
+    if os.path.isfile(state_path):
+      with open(state_path, 'r') as f:
+        d_state = json.load(f)
+
+    d_status = dict()
+    for fn in FILENAME_TEMPLATES:
+      filename = '%s_%s.csv' % (fn, denom)
+      filepath = '%s/%s' % (snapshots_dir, filename)
+      d_status[filename] = self.sync_file(session, filename, filepath, d_state)
+
+    with atomic_write(state_path) as f:
+      json.dump(d_state, f)
+    return d_status
+
+
+  def sync_file(self, session, filename, filepath, d_state):
+    '''
+    Synchronizes a snapshot file
+    Returns the status of the file (unchanged, appended, replaced)
+
+    The tail of the file is requested if the file has changed (range request
+    starting TAIL_OVERLAP bytes before the end of the local file). The new bytes are
+    appended if the overlap matches the end of the local file. Only the end of the
+    file is checked (heuristic), so the file is downloaded entirely and compared
+    with the local file at least every FULL_SYNC_INTERVAL seconds. The file is
+    also downloaded entirely if the range request fails (e.g. file truncated).
+    Parameters:
+      session  = requests session
+      filename = name of the file
+      filepath = local path of the file
+      d_state  = dictionary filename => validators of the local files (updated)
+    '''
+    url = '%s/%s' % (BASE_URL_SNAPSHOTS, filename)
+    d_file = d_state.get(filename, dict())
+    size = os.path.getsize(filepath) if os.path.isfile(filepath) else 0
+    headers = dict()
+    now = time.time()
+    last_full_sync = d_file.get('full_sync', 0)
+
+    # Validators are only used if the local file hasn't been modified since
+    if (size > 0) and (d_file.get('size') == size):
+      if d_file.get('etag') is not None:
+        headers['If-None-Match'] = d_file['etag']
+      if d_file.get('last_modified') is not None:
+        headers['If-Modified-Since'] = d_file['last_modified']
+      # Requests the tail of the file (servers not supporting ranges return the file)
+      if now - last_full_sync < FULL_SYNC_INTERVAL:
+        offset = max(0, size - TAIL_OVERLAP)
+        headers['Range'] = 'bytes=%d-' % offset
+
+    r = session.get(url, headers=headers)
+    if r.status_code == 304:
+      return 'unchanged'
+    if ('Range' in headers) and (r.status_code not in [200, 206]):
+      # Range not satisfiable (remote file shorter than the local file)
+      # or failed range request, downloads the file entirely
+      r = session.get(url)
+    r.raise_for_status()
+
+    status = 'replaced'
+    content = r.content
+    if r.status_code == 206:
+      # Checks that the overlap matches the end of the local file
+      with open(filepath, 'rb') as f:
+        f.seek(offset)
+        local_tail = f.read()
+      range_start = r.headers.get('Content-Range', '').replace('bytes ', '').split('-')[0]
+      if (range_start == str(offset)) and content.startswith(local_tail):
+        new_bytes = content[len(local_tail):]
+        with open(filepath, 'ab') as f:
+          f.write(new_bytes)
+        status = 'appended' if len(new_bytes) > 0 else 'unchanged'
+      else:
+        # Remote file rewritten, downloads it entirely
+        r = session.get(url)
+        r.raise_for_status()
+        content = r.content
+
+    if r.status_code == 200:
+      last_full_sync = now
+      if (size > 0) and (len(content) >= size):
+        with open(filepath, 'rb') as f:
+          if content.startswith(f.read()):
+            status = 'appended' if len(content) > size else 'unchanged'
+      # Writes the file atomically (readers never see a partial file)
+      with atomic_write(filepath, 'wb') as f:
+        f.write(content)
+
+    # Dates the local file with the modification date of the remote file
+    last_modified = r.headers.get('Last-Modified')
+    if last_modified is not None:
+      ts = parsedate_to_datetime(last_modified).timestamp()
+      os.utime(filepath, (ts, ts))
+
+    d_state[filename] = {
+      'etag': r.headers.get('ETag'),
+      'last_modified': last_modified,
+      'size': os.path.getsize(filepath),
+      'full_sync': last_full_sync
+    }
+    print('  %s %s' % (filename, status))
+    return status
+
+
 def main(snapshots_dir, denoms=ALL_DENOMS, socks5=None):
   '''
   Main function
@@ -3,33 +3,58 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 
 A class exporting the computed metrics in CSV format
 '''
+from whirlpool_stats.utils.files import atomic_write
+
 
 class Exporter(object):
 
-  def __init__(self, fwd_metrics, bwd_metrics, tx0_metrics):
+  def __init__(self, fwd_metrics, bwd_metrics, tx0_metrics, win_metrics=None,
+               depth_metrics=None, activity_metrics=None):
     '''
     Constructor
     Parameters:
-      fwd_metrics = Forward-looking metrics
-      bwd_metrics = Backward-looking metrics
-      tx0_metrics = Tx0s metrics
+      fwd_metrics      = Forward-looking metrics
+      bwd_metrics      = Backward-looking metrics
+      tx0_metrics      = Tx0s metrics
+      win_metrics      = Time-windowed metrics (optional)
+      depth_metrics    = Anonsets by depth (optional)
+      activity_metrics = Rollups of the activity metrics (optional)
     '''
     self.fwd_metrics = fwd_metrics
     self.bwd_metrics = bwd_metrics
     self.tx0_metrics = tx0_metrics
+    self.win_metrics = win_metrics
+    self.depth_metrics = depth_metrics
+    self.activity_metrics = activity_metrics
 
 
   def export(self, export_dir):
     '''
     Exports the computed metrics for the active snapshot (csv format)
     Files are exported in a given directory or in the working directory if none provided
+    (each file is written in a temporary file renamed once complete)
     Examples:
       export /tmp  => exports the results in the /tmp directory
       export       => exports the results in the working directory
     '''
-    self.export_fwd_metrics(export_dir)
-    self.export_bwd_metrics(export_dir)
-    self.export_activity_metrics(export_dir)
+    instr = self.fwd_metrics.snapshot.instr
+
+    with instr.phase('export'):
+      self.export_fwd_metrics(export_dir)
+      self.export_bwd_metrics(export_dir)
+      self.export_activity_metrics(export_dir)
+      if self.activity_metrics is not None:
+        for period in ['week', 'month']:
+          self.export_activity_rollups(export_dir, period)
+      self.export_tx0_metrics(export_dir)
+      if self.win_metrics is not None:
+        self.export_windowed_metrics(export_dir)
+      if (self.depth_metrics is not None) and (self.depth_metrics.max_depth is not None):
+        self.export_depth_metrics(export_dir)
+      if self.fwd_metrics.summary is not None:
+        self.export_summary(export_dir)
+
+    self.export_stats(export_dir)
     
 
   def export_fwd_metrics(self, export_dir):
@@ -41,19 +66,14 @@ class Exporter(object):
     filename = 'whirlpool_%s_forward_metrics.csv' % self.fwd_metrics.snapshot.denom
     filepath = '%s/%s' % (export_dir, filename)
 
-    f = open(filepath, 'w')
-    line = 'mix_round;anonset;spread\n'
-    f.write(line)
-
-    for r in range(0, len(self.fwd_metrics.l_anonsets)):
-      line = '%d;%d;%.2f\n' % (
-        r,
-        self.fwd_metrics.l_anonsets[r],
-        self.fwd_metrics.l_spreads[r]
-      )
+    with atomic_write(filepath) as f:
+      line = 'mix_round;anonset;spread\n'
       f.write(line)
 
-    f.close()
+      columns = self.fwd_metrics.columns
+      for r, (anonset, spread) in enumerate(zip(columns.anonset, columns.spread)):
+        line = '%d;%d;%.2f\n' % (r, anonset, spread)
+        f.write(line)
     print('Exported forward-looking metrics in %s' % filepath)
 
 
@@ -67,19 +87,14 @@ class Exporter(object):
     filename = 'whirlpool_%s_backward_metrics.csv' % self.bwd_metrics.snapshot.denom
     filepath = '%s/%s' % (export_dir, filename)
 
-    f = open(filepath, 'w')
-    line = 'mix_round;anonset;spread\n'
-    f.write(line)
-
-    for r in range(0, len(self.bwd_metrics.l_anonsets)):
-      line = '%d;%d;%.2f\n' % (
-        r,
-        self.bwd_metrics.l_anonsets[r],
-        self.bwd_metrics.l_spreads[r]
-      )
+    with atomic_write(filepath) as f:
+      line = 'mix_round;anonset;spread\n'
       f.write(line)
 
-    f.close()
+      columns = self.bwd_metrics.columns
+      for r, (anonset, spread) in enumerate(zip(columns.anonset, columns.spread)):
+        line = '%d;%d;%.2f\n' % (r, anonset, spread)
+        f.write(line)
     print('Exported backward-looking metrics in %s' % filepath)
 
 
@@ -93,20 +108,166 @@ class Exporter(object):
     filename = 'whirlpool_%s_activity_metrics.csv' % self.bwd_metrics.snapshot.denom
     filepath = '%s/%s' % (export_dir, filename)
 
-    f = open(filepath, 'w')
-    line = 'date;nb_mixes;inflow;nb_new_tx0s;nb_active_tx0s\n'
-    f.write(line)
-
-    for k,v in self.bwd_metrics.d_nb_mixes.items():
-      day = k.strftime('%d/%m/%Y')
-      line = '%s;%d;%d;%d;%d\n' % (
-        day,
-        v, 
-        self.bwd_metrics.d_inflow[k],
-        self.tx0_metrics.d_nb_new_tx0s[k],
-        self.bwd_metrics.d_nb_active_tx0s[k]
-      )
+    with atomic_write(filepath) as f:
+      line = 'date;nb_mixes;inflow;nb_new_tx0s;nb_active_tx0s\n'
       f.write(line)
 
-    f.close()
+      for k,v in self.bwd_metrics.d_nb_mixes.items():
+        day = k.strftime('%d/%m/%Y')
+        line = '%s;%d;%d;%d;%d\n' % (
+          day,
+          v, 
+          self.bwd_metrics.d_inflow[k],
+          self.tx0_metrics.d_nb_new_tx0s[k],
+          self.bwd_metrics.d_nb_active_tx0s[k]
+        )
+        f.write(line)
     print('Exported activity metrics in %s' % filepath)
+
+
+  def export_activity_rollups(self, export_dir, period, from_date=None, to_date=None):
+    '''
+    Exports the activity metrics by period over a date range
+    Parameters:
+      export_dir = export directory
+      period     = day, week or month
+      from_date  = first date (None = first day of activity)
+      to_date    = last date included (None = last day of activity)
+    '''
+    filename = 'whirlpool_%s_activity_%s.csv' % (self.bwd_metrics.snapshot.denom, period)
+    filepath = '%s/%s' % (export_dir, filename)
+
+    with atomic_write(filepath) as f:
+      line = '%s;nb_mixes;inflow;nb_new_tx0s;nb_active_tx0s\n' % period
+      f.write(line)
+
+      for row in self.activity_metrics.iter_rows(period, from_date, to_date):
+        line = '%s;%d;%d;%d;%d\n' % row
+        f.write(line)
+    print('Exported activity metrics by %s in %s' % (period, filepath))
+
+
+  def export_tx0_metrics(self, export_dir):
+    '''
+    Exports the Tx0s metrics
+    Parameters:
+      export_dir = export directory
+    '''
+    filename = 'whirlpool_%s_tx0_metrics.csv' % self.tx0_metrics.snapshot.denom
+    filepath = '%s/%s' % (export_dir, filename)
+
+    with atomic_write(filepath) as f:
+      line = 'tx0_index;nb_outputs;nb_mixed_outputs;nb_counterparties;anonset\n'
+      f.write(line)
+
+      columns = self.tx0_metrics.columns
+      l_anonsets = columns.anonset
+      for idx, (nb_outputs, nb_mixed_outputs, nb_counterparties) in enumerate(zip(
+        columns.nb_outputs, columns.nb_mixed_outputs, columns.nb_counterparties
+      )):
+        line = '%d;%d;%d;%d;%s\n' % (
+          idx,
+          nb_outputs,
+          nb_mixed_outputs,
+          nb_counterparties,
+          l_anonsets[idx] if idx < len(l_anonsets) else ''
+        )
+        f.write(line)
+    print('Exported Tx0s metrics in %s' % filepath)
+
+
+  def export_windowed_metrics(self, export_dir):
+    '''
+    Exports the time-windowed metrics (if they have been computed)
+    Parameters:
+      export_dir = export directory
+    '''
+    win_metrics = self.win_metrics
+    denom = win_metrics.snapshot.denom
+
+    if win_metrics.nb_days is not None:
+      filename = 'whirlpool_%s_windowed_metrics.csv' % denom
+      filepath = '%s/%s' % (export_dir, filename)
+
+      with atomic_write(filepath) as f:
+        line = 'mix_round;window_days;anonset;spread\n'
+        f.write(line)
+
+        for r in range(0, len(win_metrics.l_win_anonsets)):
+          line = '%d;%d;%d;%.2f\n' % (
+            r,
+            win_metrics.nb_days,
+            win_metrics.l_win_anonsets[r],
+            win_metrics.l_win_spreads[r]
+          )
+          f.write(line)
+      print('Exported windowed backward-looking metrics in %s' % filepath)
+
+    if win_metrics.asof_date is not None:
+      filename = 'whirlpool_%s_asof_metrics.csv' % denom
+      filepath = '%s/%s' % (export_dir, filename)
+      asof_day = win_metrics.asof_date.strftime('%d/%m/%Y')
+
+      with atomic_write(filepath) as f:
+        line = 'mix_round;asof_date;anonset;spread\n'
+        f.write(line)
+
+        for r in range(0, len(win_metrics.l_asof_anonsets)):
+          line = '%d;%s;%d;%.2f\n' % (
+            r,
+            asof_day,
+            win_metrics.l_asof_anonsets[r],
+            win_metrics.l_asof_spreads[r]
+          )
+          f.write(line)
+      print('Exported as-of forward-looking metrics in %s' % filepath)
+
+
+  def export_depth_metrics(self, export_dir):
+    '''
+    Exports the backward-looking anonsets by depth
+    Parameters:
+      export_dir = export directory
+    '''
+    depth_metrics = self.depth_metrics
+    filename = 'whirlpool_%s_depth_metrics.csv' % depth_metrics.snapshot.denom
+    filepath = '%s/%s' % (export_dir, filename)
+
+    with atomic_write(filepath) as f:
+      l_cols = ['depth_%d' % d for d in range(1, depth_metrics.max_depth + 1)]
+      line = 'mix_round;%s\n' % ';'.join(l_cols)
+      f.write(line)
+
+      nb_rounds = len(depth_metrics.l_depth_anonsets[0]) if depth_metrics.max_depth > 0 else 0
+      for r in range(0, nb_rounds):
+        line = '%d;%s\n' % (
+          r,
+          ';'.join([str(v) for v in depth_metrics.get_curve(r)])
+        )
+        f.write(line)
+    print('Exported anonsets by depth in %s' % filepath)
+
+
+  def export_summary(self, export_dir):
+    '''
+    Exports the per-day and all-time percentiles of the anonsets and spreads
+    (json file also storing the quantile sketches, see command summary merge)
+    Parameters:
+      export_dir = export directory
+    '''
+    filename = 'whirlpool_%s_summary.json' % self.fwd_metrics.snapshot.denom
+    filepath = '%s/%s' % (export_dir, filename)
+    self.fwd_metrics.summary.save(filepath)
+    print('Exported summary in %s' % filepath)
+
+
+  def export_stats(self, export_dir):
+    '''
+    Exports the measures of the processing phases (json sidecar file)
+    Parameters:
+      export_dir = export directory
+    '''
+    filename = 'whirlpool_%s_stats.json' % self.fwd_metrics.snapshot.denom
+    filepath = '%s/%s' % (export_dir, filename)
+    self.fwd_metrics.snapshot.instr.save(filepath)
+    print('Exported processing stats in %s' % filepath)
@@ -0,0 +1,499 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class forecasting the growth of the forward-looking anonsets of the recent mixes
+under simulated future mixes (what-if scenarios, Monte Carlo runs)
+
+Each run appends synthetic mixes to a copy-on-write view of the recent mix rounds
+of the snapshot. Mixes arrive at a given rate (mixes per day) and each input of a
+mix is a remixed output with a given probability (remix ratio). The remixed output
+is taken from the mix confirmed at a delay drawn from the delays between the mixes
+and their remixes observed in the last days of the snapshot. Both parameters
+default to the values observed in the snapshot.
+
+Forward-looking anonsets are updated incrementally (see ForwardMetrics.update):
+a new mix adds its outputs to the anonsets of the recent mixes it descends from
+and a remixed output is removed from the anonsets of the recent mixes its mix
+descends from. Each mix stores the set of recent mixes it descends from
+as a bitmask and the variations of the anonsets are accumulated in bit-sliced
+counters (plane j = bit j of the counters of all the recent mixes).
+
+Runs are independent (run i uses its own random generator derived from the seed)
+and executed in parallel by worker processes.
+'''
+import random
+import multiprocessing
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.utils.date import SECONDS_PER_DAY, to_utcdate
+from whirlpool_stats.utils.files import atomic_write
+from whirlpool_stats.services.preview import get_percentile
+
+
+# Default number of days simulated
+DEFAULT_HORIZON = 28
+
+# Default number of days of recent mixes whose anonsets are forecasted
+DEFAULT_RECENT_DAYS = 7
+
+# Default number of Monte Carlo runs
+DEFAULT_NB_RUNS = 200
+
+# Number of days of the snapshot used for estimating the parameters of the simulation
+CALIBRATION_DAYS = 30
+
+# Number of days between 2 horizons of the forecast
+FORECAST_STEP = 7
+
+# Percentiles of the forecast bands
+FORECAST_PERCENTILES = [5, 25, 50, 75, 95]
+
+# Maximum number of draws of the mix providing a remixed input
+# (the input is a new input if all the drawn mixes are fully spent)
+MAX_DRAWS = 10
+
+
+def add_to_counters(planes, mask, weight):
+  '''
+  Adds a weight to the counters selected by a mask
+  Parameters:
+    planes = list of bit planes of the counters (plane j = bit j of all the counters)
+    mask   = bitmask of the counters
+    weight = weight added (> 0)
+  '''
+  j = 0
+  while weight > 0:
+    if weight & 1:
+      # Ripple-carry addition of the mask at plane j
+      carry = mask
+      k = j
+      while carry:
+        while k >= len(planes):
+          planes.append(0)
+        plane = planes[k]
+        planes[k] = plane ^ carry
+        carry &= plane
+        k += 1
+    weight >>= 1
+    j += 1
+
+
+def get_counters(planes, nb_counters):
+  '''
+  Returns the list of the values of bit-sliced counters
+  Parameters:
+    planes      = list of bit planes of the counters
+    nb_counters = number of counters
+  '''
+  l_values = [0] * nb_counters
+  for j, plane in enumerate(planes):
+    weight = 1 << j
+    bits = bin(plane)[:1:-1]
+    idx = bits.find('1')
+    while idx >= 0:
+      l_values[idx] += weight
+      idx = bits.find('1', idx + 1)
+  return l_values
+
+
+class SimulatedView(object):
+  '''
+  Copy-on-write view of the recent mix rounds of a snapshot extended with simulated mixes
+  (data of the snapshot are shared by all the views, a view only stores its modifications)
+  Mixes of the view are identified by their index (recent mix rounds, then simulated mixes)
+  '''
+
+  def __init__(self, forecast):
+    '''
+    Constructor
+    Parameters:
+      forecast = forecast storing the data of the recent mix rounds
+    '''
+    self.forecast = forecast
+    self.nb_recent = len(forecast.l_masks)
+    # Dictionary index of a recent mix => number of unspent outputs
+    # (overlay of the numbers of unspent outputs of the snapshot)
+    self.d_unspent = dict()
+    # Timestamps, bitmasks of the recent ancestors and numbers of unspent outputs
+    # of the simulated mixes
+    self.l_ts = []
+    self.l_masks = []
+    self.l_unspent = []
+    # List of simulated links (index of the source, index of the target)
+    self.l_links = []
+    # Bit planes of the increments and of the decrements of the anonsets of the recent mixes
+    self.l_gains = []
+    self.l_losses = []
+
+
+  def find_mix(self, ts):
+    '''
+    Returns the index of the last mix confirmed at or before a timestamp
+    (-1 if the mix precedes the recent mix rounds)
+    Parameters:
+      ts = unix timestamp
+    '''
+    if (len(self.l_ts) > 0) and (ts >= self.l_ts[0]):
+      return self.nb_recent + bisect_right(self.l_ts, ts) - 1
+    return bisect_right(self.forecast.l_ts, ts) - 1
+
+
+  def spend(self, idx):
+    '''
+    Spends an unspent output of a mix
+    Returns True if the mix had an unspent output
+    Parameters:
+      idx = index of the mix
+    '''
+    if idx >= self.nb_recent:
+      sim_idx = idx - self.nb_recent
+      if self.l_unspent[sim_idx] == 0:
+        return False
+      self.l_unspent[sim_idx] -= 1
+    else:
+      nb_unspent = self.d_unspent.get(idx, self.forecast.l_unspent[idx])
+      if nb_unspent == 0:
+        return False
+      self.d_unspent[idx] = nb_unspent - 1
+    return True
+
+
+  def get_mask(self, idx):
+    '''
+    Returns the bitmask of the recent mixes a mix descends from
+    Parameters:
+      idx = index of the mix
+    '''
+    if idx >= self.nb_recent:
+      return self.l_masks[idx - self.nb_recent]
+    return self.forecast.l_masks[idx]
+
+
+  def add_mix(self, ts, l_sources):
+    '''
+    Appends a simulated mix and its links to the view
+    Parameters:
+      ts        = timestamp of the mix
+      l_sources = list of the indices of the mixes providing its remixed inputs
+                  (one item per remixed input, -1 = mix preceding the recent mix rounds)
+    '''
+    idx = self.nb_recent + len(self.l_ts)
+    mask = 0
+    for src in l_sources:
+      if src >= 0:
+        src_mask = self.get_mask(src)
+        # The remixed output leaves the anonsets of the ancestors of its mix
+        if src_mask:
+          add_to_counters(self.l_losses, src_mask, 1)
+        mask |= src_mask
+      self.l_links.append((src, idx))
+    # The outputs of the new mix join the anonsets of its ancestors
+    if mask:
+      add_to_counters(self.l_gains, mask, NB_PARTICIPANTS)
+    self.l_ts.append(ts)
+    self.l_masks.append(mask)
+    self.l_unspent.append(NB_PARTICIPANTS)
+
+
+  def get_anonsets(self):
+    '''
+    Returns the forward-looking anonsets of the recent mix rounds
+    '''
+    l_gains = get_counters(self.l_gains, self.nb_recent)
+    l_losses = get_counters(self.l_losses, self.nb_recent)
+    return array('q', [
+      anonset + gain - loss
+      for anonset, gain, loss in zip(self.forecast.l_anonsets, l_gains, l_losses)
+    ])
+
+
+class Forecast(object):
+
+  def __init__(self, snapshot, fwd_metrics):
+    '''
+    Constructor
+    Parameters:
+      snapshot    = snapshot
+      fwd_metrics = forward-looking metrics of the snapshot
+    '''
+    self.snapshot = snapshot
+    self.fwd_metrics = fwd_metrics
+    # Parameters of the simulation
+    self.nb_days = DEFAULT_HORIZON
+    self.mix_rate = None
+    self.remix_ratio = None
+    self.nb_runs = DEFAULT_NB_RUNS
+    self.seed = None
+    # Delays (in seconds) between the mixes and their remixes observed in the snapshot
+    self.l_remix_delays = []
+    # First recent mix round (mix rounds whose anonsets are forecasted)
+    self.first_round = 0
+    # Timestamps, bitmasks of the recent ancestors (bit i = recent mix round first_round + i),
+    # numbers of unspent outputs and anonsets of the recent mix rounds
+    self.l_ts = []
+    self.l_masks = []
+    self.l_unspent = []
+    self.l_anonsets = []
+    # List of the horizons of the forecast (in days)
+    self.l_horizons = []
+    # Dictionary (horizon, percentile) => list of the forecasted anonsets of the recent mix rounds
+    self.d_bands = dict()
+
+
+  def calibrate(self, calibration_days=CALIBRATION_DAYS):
+    '''
+    Estimates the parameters of the simulation from the last days of the snapshot
+    (mixing rate, remix ratio and delays between the mixes and their remixes)
+    Parameters:
+      calibration_days = number of days of the snapshot used for the estimation
+    '''
+    snapshot = self.snapshot
+    l_ts_mix_txs = snapshot.l_ts_mix_txs
+    last_ts = l_ts_mix_txs[-1]
+    start = bisect_right(l_ts_mix_txs, last_ts - calibration_days * SECONDS_PER_DAY)
+    nb_mixes = len(l_ts_mix_txs) - start
+
+    # Mixing rate over the calibration period (or over the snapshot if it's shorter)
+    nb_days = min(calibration_days, (last_ts - l_ts_mix_txs[0]) / float(SECONDS_PER_DAY))
+    self.mix_rate = nb_mixes / max(nb_days, 1.0)
+
+    # Remixed inputs of the mixes of the calibration period
+    d_rounds = dict(zip(snapshot.l_mix_txs, range(0, len(snapshot.l_mix_txs))))
+    self.l_remix_delays = []
+    for mix_round in range(start, len(l_ts_mix_txs)):
+      tgt = snapshot.l_mix_txs[mix_round]
+      for src in snapshot.d_reverse_links.get(tgt, []):
+        src_round = d_rounds.get(src)
+        if src_round is not None:
+          delay = l_ts_mix_txs[mix_round] - l_ts_mix_txs[src_round]
+          self.l_remix_delays.extend([delay] * snapshot.get_multiplicity(src, tgt))
+    self.remix_ratio = len(self.l_remix_delays) / float(max(nb_mixes * NB_PARTICIPANTS, 1))
+
+
+  def prepare(self, recent_days):
+    '''
+    Prepares the data of the recent mix rounds shared by the runs
+    Parameters:
+      recent_days = number of days of recent mixes whose anonsets are forecasted
+    '''
+    snapshot = self.snapshot
+    l_ts_mix_txs = snapshot.l_ts_mix_txs
+    nb_mixes = len(l_ts_mix_txs)
+    self.first_round = bisect_right(l_ts_mix_txs, l_ts_mix_txs[-1] - recent_days * SECONDS_PER_DAY)
+    self.l_ts = l_ts_mix_txs[self.first_round:]
+    self.l_anonsets = list(self.fwd_metrics.l_anonsets[self.first_round:nb_mixes])
+
+    # A recent mix descends from itself and from the recent ancestors of its sources
+    d_indices = dict()
+    self.l_masks = []
+    self.l_unspent = []
+    for idx, tiid in enumerate(snapshot.l_mix_txs[self.first_round:]):
+      mask = 1 << idx
+      for src in snapshot.d_reverse_links.get(tiid, []):
+        src_idx = d_indices.get(src)
+        if src_idx is not None:
+          mask |= self.l_masks[src_idx]
+      d_indices[tiid] = idx
+      self.l_masks.append(mask)
+      self.l_unspent.append(max(NB_PARTICIPANTS - snapshot.get_nb_links(tiid), 0))
+
+
+  def get_horizons(self):
+    '''
+    Returns the list of the horizons of the forecast (in days)
+    '''
+    l_horizons = list(range(FORECAST_STEP, self.nb_days, FORECAST_STEP))
+    return l_horizons + [self.nb_days]
+
+
+  def simulate(self, run_id):
+    '''
+    Simulates a run
+    Returns the list of the forecasted anonsets of the recent mix rounds at each horizon
+    Parameters:
+      run_id = index of the run
+    '''
+    rand = random.Random('%d-%d' % (self.seed, run_id))
+    view = SimulatedView(self)
+    start_ts = self.l_ts[-1]
+    l_horizon_ts = [start_ts + h * SECONDS_PER_DAY for h in self.l_horizons]
+    rate = self.mix_rate / SECONDS_PER_DAY
+    l_results = []
+
+    ts = start_ts
+    while len(l_results) < len(l_horizon_ts):
+      # Delay between 2 mixes (exponential distribution, no mix if the rate is null)
+      ts = ts + rand.expovariate(rate) if rate > 0 else l_horizon_ts[-1] + 1
+      # Anonsets at the horizons passed by the new mix
+      while (len(l_results) < len(l_horizon_ts)) and (ts > l_horizon_ts[len(l_results)]):
+        l_results.append(view.get_anonsets())
+      if len(l_results) == len(l_horizon_ts):
+        break
+      # Selects the remixed inputs of the new mix
+      l_sources = []
+      for _ in range(0, NB_PARTICIPANTS):
+        if (rand.random() >= self.remix_ratio) or (len(self.l_remix_delays) == 0):
+          continue
+        for _ in range(0, MAX_DRAWS):
+          src = view.find_mix(ts - rand.choice(self.l_remix_delays))
+          if (src < 0) or view.spend(src):
+            l_sources.append(src)
+            break
+      view.add_mix(ts, l_sources)
+
+    return l_results
+
+
+  def compute(self, nb_days=DEFAULT_HORIZON, recent_days=DEFAULT_RECENT_DAYS, mix_rate=None,
+              remix_ratio=None, nb_runs=DEFAULT_NB_RUNS, seed=None, nb_workers=None):
+    '''
+    Forecasts the forward-looking anonsets of the recent mix rounds
+    Parameters:
+      nb_days     = number of days simulated
+      recent_days = number of days of recent mixes whose anonsets are forecasted
+      mix_rate    = number of mixes per day (None = rate observed in the snapshot)
+      remix_ratio = probability that an input is a remixed output (None = ratio observed in the snapshot)
+      nb_runs     = number of Monte Carlo runs
+      seed        = seed of the random generators (or None)
+      nb_workers  = number of worker processes (default = number of cpus)
+    '''
+    instr = self.snapshot.instr
+
+    with instr.phase('forecast'):
+      print('Start forecasting the forward-looking anonsets')
+
+      self.calibrate()
+      if mix_rate is not None:
+        self.mix_rate = mix_rate
+      if remix_ratio is not None:
+        self.remix_ratio = remix_ratio
+      self.nb_days = nb_days
+      self.nb_runs = nb_runs
+      self.seed = seed if seed is not None else random.randrange(1 << 32)
+      self.l_horizons = self.get_horizons()
+      self.prepare(recent_days)
+      print('  %d recent mix rounds, %.1f mixes/day, remix ratio %.2f, %d runs (seed %d)' % (
+        len(self.l_masks), self.mix_rate, self.remix_ratio, self.nb_runs, self.seed
+      ))
+
+      # Runs are executed by worker processes inheriting the forecast through fork
+      # (runs are executed by this process as a fallback)
+      if nb_workers is None:
+        nb_workers = multiprocessing.cpu_count()
+      nb_workers = max(1, min(nb_workers, nb_runs))
+      executor = None
+      if (nb_workers > 1) and ('fork' in multiprocessing.get_all_start_methods()):
+        executor = ProcessPoolExecutor(
+          nb_workers,
+          mp_context=multiprocessing.get_context('fork'),
+          initializer=_init_worker,
+          initargs=(self,)
+        )
+
+      progress = instr.progress('Simulated', nb_runs, 'runs')
+      l_runs = []
+      l_futures = []
+      try:
+        if executor is None:
+          for run_id in range(0, nb_runs):
+            l_runs.append(self.simulate(run_id))
+            progress.update(len(l_runs))
+        else:
+          l_futures = [executor.submit(_simulate, run_id) for run_id in range(0, nb_runs)]
+          for future in l_futures:
+            l_runs.append(future.result())
+            progress.update(len(l_runs))
+      finally:
+        if executor is not None:
+          # Pending runs of an interrupted forecast are cancelled
+          for future in l_futures:
+            future.cancel()
+          executor.shutdown(wait=True)
+
+      # Percentile bands of each recent mix round at each horizon
+      self.d_bands = dict()
+      for h_idx, horizon in enumerate(self.l_horizons):
+        l_bands = [[] for _ in FORECAST_PERCENTILES]
+        for idx in range(0, len(self.l_masks)):
+          sorted_values = sorted(run[h_idx][idx] for run in l_runs)
+          for p_idx, pct in enumerate(FORECAST_PERCENTILES):
+            l_bands[p_idx].append(get_percentile(sorted_values, pct)[0])
+        for p_idx, pct in enumerate(FORECAST_PERCENTILES):
+          self.d_bands[(horizon, pct)] = l_bands[p_idx]
+
+      instr.count('forecast_runs', nb_runs)
+      instr.count('forecast_rounds', len(self.l_masks))
+
+      print('Done!')
+
+
+  def display(self):
+    '''
+    Displays the median of the forecast bands of the recent mix rounds at each horizon
+    '''
+    nb_recent = len(self.l_masks)
+    if nb_recent == 0:
+      print('No forecast.')
+      return
+
+    print('')
+    print('Forward-looking anonsets of the %d mix rounds confirmed since %s' % (
+      nb_recent, to_utcdate(self.l_ts[0]).strftime('%d/%m/%Y %H:%M')
+    ))
+    print('(median over the mix rounds of the percentiles of the %d runs)' % self.nb_runs)
+    print('')
+    print('%-10s %s' % ('horizon', ' '.join(['%10s' % ('p%d' % p) for p in FORECAST_PERCENTILES])))
+    median = get_percentile(sorted(self.l_anonsets), 50)[0]
+    print('%-10s %s' % ('now', ' '.join(['%10d' % median for _ in FORECAST_PERCENTILES])))
+    for horizon in self.l_horizons:
+      l_cols = [
+        '%10d' % get_percentile(sorted(self.d_bands[(horizon, pct)]), 50)[0]
+        for pct in FORECAST_PERCENTILES
+      ]
+      print('%-10s %s' % ('+%d days' % horizon, ' '.join(l_cols)))
+
+
+  def save(self, export_dir):
+    '''
+    Exports the forecast bands of each recent mix round at each horizon (csv format)
+    Parameters:
+      export_dir = export directory
+    '''
+    filename = 'whirlpool_%s_forecast.csv' % self.snapshot.denom
+    filepath = '%s/%s' % (export_dir, filename)
+
+    with atomic_write(filepath) as f:
+      line = 'mix_round;anonset;horizon;%s\n' % ';'.join(['p%d' % p for p in FORECAST_PERCENTILES])
+      f.write(line)
+
+      for idx in range(0, len(self.l_masks)):
+        for horizon in self.l_horizons:
+          l_values = [str(self.d_bands[(horizon, pct)][idx]) for pct in FORECAST_PERCENTILES]
+          line = '%d;%d;%d;%s\n' % (self.first_round + idx, self.l_anonsets[idx], horizon, ';'.join(l_values))
+          f.write(line)
+    print('Exported forecast in %s' % filepath)
+
+
+# Forecast computed by the worker process
+_forecast = None
+
+
+def _init_worker(forecast):
+  '''
+  Initializes a worker process
+  Parameters:
+    forecast = forecast being computed (inherited through fork)
+  '''
+  global _forecast
+  _forecast = forecast
+
+
+def _simulate(run_id):
+  '''
+  Simulates a run of the forecast being computed (executed by a worker process)
+  Parameters:
+    run_id = index of the run
+  '''
+  return _forecast.simulate(run_id)
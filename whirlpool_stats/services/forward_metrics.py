@@ -3,7 +3,14 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 
 A class computing a set of metrics for the mixed UTXOs (forward-looking)
 '''
+from itertools import chain
+from collections import defaultdict
 from whirlpool_stats.utils.constants import *
+from whirlpool_stats.utils.date import get_day_index
+from whirlpool_stats.utils.columns import Columns, ROUND_COLUMNS
+from whirlpool_stats.services.checkpoint import Checkpoint
+from whirlpool_stats.backends import create_backend, DEFAULT_BACKEND
+from whirlpool_stats.utils.hyperloglog import HyperLogLog, merge_registers, estimate_cardinality, get_error
 
 
 class ForwardMetrics(object):
@@ -15,66 +22,297 @@ class ForwardMetrics(object):
       snapshot = snapshot
     '''
     self.snapshot = snapshot
-    # Set of txs that have been processed
-    self.s_processed_txs = set()
-    # List of anonsets ordered by mix round
-    self.l_anonsets = []
-    # List of spreads ordered by mix round
-    self.l_spreads = []
+    # Precision of the HyperLogLog sketches used for approximate anonsets
+    # (None = exact anonsets)
+    self.approx_precision = None
+    # Name of the backend computing the exact anonsets (see whirlpool_stats.backends)
+    self.backend_name = DEFAULT_BACKEND
+    # Backend used by the last computation
+    self.backend = None
+    # Results ordered by mix round (columns anonset, spread, day)
+    self.columns = Columns(ROUND_COLUMNS)
+    # Quantile sketches updated with the metrics (optional)
+    self.summary = None
+    # Flag indicating if the computation of exact anonsets is checkpointed
+    # (resumed from the last checkpoint if it's interrupted)
+    self.resumable = False
+    # Dictionary tiid tx0 => anonset of the outputs of the tx0
+    # (computed by the approximate pass, see Tx0sMetrics)
+    self.d_tx0_anonsets = dict()
+
+
+  @property
+  def l_anonsets(self):
+    '''
+    Column of the anonsets ordered by mix round
+    '''
+    return self.columns.anonset
+
+
+  @property
+  def l_spreads(self):
+    '''
+    Column of the spreads ordered by mix round
+    '''
+    return self.columns.spread
+
+
+  def get_error(self):
+    '''
+    Returns the relative standard error of the anonsets (0 for exact anonsets)
+    '''
+    return 0.0 if self.approx_precision is None else get_error(self.approx_precision)
 
 
   def compute(self):
     '''
     Computes the metrics (forward-looking)
     '''
-    print('Start computing metrics (forward-looking)')
+    instr = self.snapshot.instr
+
+    with instr.phase('compute fwd'):
+      print('Start computing metrics (forward-looking)')
 
-    # Resets data structures storing the results
-    self.l_anonsets = []
-    self.l_spreads = []
+      # Resets data structures storing the results
+      self.columns.reset()
+      l_anonsets = self.columns.anonset
+      l_spreads = self.columns.spread
+      l_days = self.columns.day
+      summary = self.summary
+      if summary is not None:
+        summary.reset(['fwd anonset', 'fwd spread'])
+      self.d_tx0_anonsets = dict()
 
-    # Iterates over the ordered list of mix txs
-    # and computes their anonset
-    mix_round = 0
+      # Computes the number of unmixed txos created by the mixes
+      # starting from each mix round (suffix sums)
+      nb_mixes = len(self.snapshot.l_mix_txs)
+      l_later_unmixed_txos = self.get_later_unmixed_txos()
+
+      # Iterates over the ordered list of mix txs
+      # and computes their anonset
+      mix_round = 0
+      progress = instr.progress('Computed metrics for', nb_mixes)
+
+      checkpoint = None
+      if self.approx_precision is None:
+        self.backend = create_backend(self.backend_name, self.snapshot)
+        l_done = []
+        if self.resumable:
+          # Reuses the anonsets computed before an interruption
+          checkpoint = Checkpoint(self.snapshot, 'fwd')
+          l_done = checkpoint.load()[0:nb_mixes]
+          if len(l_done) > 0:
+            print('  Resuming from mix round %d' % len(l_done))
+            instr.count('fwd_resumed_rounds', len(l_done))
+        anonsets = chain(l_done, self.iter_anonsets(len(l_done)))
+      else:
+        anonsets = self.iter_approx_anonsets()
+
+      try:
+        for anonset in anonsets:
+          l_anonsets.append(anonset)
+          # Computes the spread
+          nb_later_unmixed_txos = l_later_unmixed_txos[mix_round]
+          spread = float(anonset) * 100.0 / float(nb_later_unmixed_txos)
+          l_spreads.append(spread)
+          ts = self.snapshot.l_ts_mix_txs[mix_round]
+          l_days.append(get_day_index(ts))
+          # Updates the quantile sketches
+          if summary is not None:
+            summary.update('fwd anonset', ts, anonset)
+            summary.update('fwd spread', ts, spread)
+          mix_round += 1
+          # Reports the progress
+          progress.update(mix_round)
+          # Checkpoints the anonsets computed so far
+          if checkpoint is not None:
+            checkpoint.update(l_anonsets)
+      except BaseException:
+        # Saves the anonsets computed before the interruption (e.g. Ctrl-C)
+        if checkpoint is not None:
+          checkpoint.save(l_anonsets)
+        raise
+
+      if checkpoint is not None:
+        checkpoint.clear()
+
+      instr.count('fwd_rounds', nb_mixes)
+
+      if self.approx_precision is not None:
+        print('Approximate anonsets (relative standard error = %.2f%%)' % (self.get_error() * 100))
+      print('Done!')
+
+
+  def get_later_unmixed_txos(self):
+    '''
+    Returns the list of the numbers of unmixed txos created by the mixes
+    starting from each mix round (suffix sums)
+    '''
     nb_mixes = len(self.snapshot.l_mix_txs)
+    l_later_unmixed_txos = [0] * (nb_mixes + 1)
+    for j in range(nb_mixes - 1, -1, -1):
+      tiid_round_j = self.snapshot.l_mix_txs[j]
+      nb_remixes = self.snapshot.get_nb_links(tiid_round_j)
+      l_later_unmixed_txos[j] = l_later_unmixed_txos[j+1] + NB_PARTICIPANTS - nb_remixes
+    return l_later_unmixed_txos
+
+
+  def update(self, nb_new_mixes, l_new_links):
+    '''
+    Updates the exact metrics after new mix txs have been appended to the snapshot
+    (see Snapshot.load_tail)
 
-    for tiid in self.snapshot.l_mix_txs:
-      # Resets the set of txs already reached during this walk
-      self.s_processed_txs.clear()
-      # Computes the anonset
-      anonset = self.get_nb_descendants(tiid)
-      self.l_anonsets.append(anonset)
-      # Computes the spread
-      nb_later_unmixed_txos = 0
-      for j in range(mix_round, len(self.snapshot.l_mix_txs)):
-        tiid_round_j = self.snapshot.l_mix_txs[j]
-        nb_remixes = len(self.snapshot.d_links[tiid_round_j])
-        nb_later_unmixed_txos += NB_PARTICIPANTS - nb_remixes
-      spread = float(anonset) * 100.0 / float(nb_later_unmixed_txos)
-      self.l_spreads.append(spread)
-      # Displays a trace
-      if mix_round % 100 == 0:
-        pct_progress = mix_round * 100 / nb_mixes
-        print('  Computed metrics for round %d (%d%%)' % (mix_round, pct_progress))
-      mix_round += 1
-
-    print('Done!')
-
-
-  def get_nb_descendants(self, tiid):
-    '''
-    Gets the number of descendant UTXOs composing the forward-looking anonset of a tx
-    (= number of unspents + number of mixed txos that have left the pool) 
+    A new mix adds its unmixed txos to the anonsets of all its ancestors
+    and a new link removes the remixed txo from the anonsets of the ancestors
+    of its source. Variations are propagated with a backward walk from each
+    new mix and from each source of a new link. Anonsets of the new mixes
+    are computed with the usual walks (their descendants are new mixes).
+    Returns a dictionary tiid tx0 => variation of the anonset of the tx0
     Parameters:
-      tiid = id of the transaction
-    '''
-    next_tiids = self.snapshot.d_links[tiid]
-    nb_utxos = NB_PARTICIPANTS - len(next_tiids)
-    
-    for next_tiid in next_tiids:
-      if next_tiid not in self.s_processed_txs:
-        if next_tiid in self.snapshot.s_mix_txs:
-          nb_utxos += self.get_nb_descendants(next_tiid)
-  
-    self.s_processed_txs.add(tiid)
-    return nb_utxos
+      nb_new_mixes = number of mix txs appended to the snapshot
+      l_new_links  = list of links (src, tgt) appended to the snapshot
+    '''
+    snapshot = self.snapshot
+    instr = snapshot.instr
+
+    with instr.phase('update fwd'):
+      nb_mixes = len(snapshot.l_mix_txs)
+      nb_old_mixes = nb_mixes - nb_new_mixes
+      d_rounds = dict(zip(snapshot.l_mix_txs[0:nb_old_mixes], range(0, nb_old_mixes)))
+
+      # Variations of the numbers of unmixed txos (sources of the walks)
+      l_sources = []
+      for tiid in snapshot.l_mix_txs[nb_old_mixes:]:
+        l_sources.append((tiid, NB_PARTICIPANTS - snapshot.get_nb_links(tiid)))
+      d_nb_new_remixes = defaultdict(int)
+      for src, tgt in l_new_links:
+        if src in d_rounds:
+          d_nb_new_remixes[src] += 1
+      for tiid, nb_new_remixes in d_nb_new_remixes.items():
+        l_sources.append((tiid, -nb_new_remixes))
+
+      # Propagates the variations to the ancestors
+      d_deltas = defaultdict(int)
+      for src, delta in l_sources:
+        s_ancestors = set([src])
+        stack = [src]
+        while len(stack) > 0:
+          tiid = stack.pop()
+          for prev_tiid in snapshot.d_reverse_links.get(tiid, []):
+            if prev_tiid not in s_ancestors:
+              s_ancestors.add(prev_tiid)
+              stack.append(prev_tiid)
+        for tiid in s_ancestors:
+          d_deltas[tiid] += delta
+        instr.count('fwd_nodes_visited', len(s_ancestors))
+
+      d_tx0_deltas = dict()
+      for tiid, delta in d_deltas.items():
+        if tiid in d_rounds:
+          self.l_anonsets[d_rounds[tiid]] += delta
+        elif tiid in snapshot.s_tx0s:
+          d_tx0_deltas[tiid] = delta
+
+      # Computes the anonsets of the new mixes
+      self.backend = create_backend(self.backend_name, snapshot)
+      self.columns.extend('anonset', self.iter_anonsets(nb_old_mixes))
+      self.columns.extend('day', [get_day_index(ts) for ts in snapshot.l_ts_mix_txs[nb_old_mixes:]])
+
+      # Spreads of all the mix rounds depend on the txos created by the new mixes
+      l_later_unmixed_txos = self.get_later_unmixed_txos()
+      self.columns.set_column('spread', (
+        float(self.l_anonsets[r]) * 100.0 / float(l_later_unmixed_txos[r])
+        for r in range(0, nb_mixes)
+      ))
+
+      # Rebuilds the quantile sketches (past values have changed)
+      summary = self.summary
+      if summary is not None:
+        summary.reset(['fwd anonset', 'fwd spread'])
+        for r in range(0, nb_mixes):
+          ts = snapshot.l_ts_mix_txs[r]
+          summary.update('fwd anonset', ts, self.l_anonsets[r])
+          summary.update('fwd spread', ts, self.l_spreads[r])
+
+      instr.count('fwd_updated_rounds', len([t for t in d_deltas if t in d_rounds]))
+      instr.count('fwd_rounds', nb_new_mixes)
+
+    return d_tx0_deltas
+
+
+  def iter_anonsets(self, start=0):
+    '''
+    Computes the exact anonsets with the selected backend
+    Yields the anonsets ordered by mix round
+    Parameters:
+      start = first mix round
+    '''
+    return self.backend.iter_fwd_anonsets(start)
+
+
+  def iter_approx_anonsets(self):
+    '''
+    Computes approximate anonsets by propagating HyperLogLog sketches
+    of the descendant unmixed txos along the reverse links
+    (single pass in reverse mix round order)
+    Sketches are released as soon as they're no longer needed
+
+    The sketches of the first mixes of each tx0 are also merged
+    into a sketch of the tx0 (anonsets of the tx0s stored in d_tx0_anonsets)
+    Yields the anonsets ordered by mix round
+    '''
+    snapshot = self.snapshot
+    hll = HyperLogLog(self.approx_precision)
+    m = hll.m
+    p = hll.p
+
+    # First mix round using the sketch of each mix
+    nb_mixes = len(snapshot.l_mix_txs)
+    d_rounds = dict(zip(snapshot.l_mix_txs, range(0, nb_mixes)))
+    d_first_use = dict()
+    for tiid in snapshot.l_mix_txs:
+      prev_rounds = [d_rounds[t] for t in snapshot.d_reverse_links[tiid] if t in d_rounds]
+      if len(prev_rounds) > 0:
+        d_first_use[tiid] = min(prev_rounds)
+
+    # First mix round of each tx0 (its sketch is complete once this round is processed)
+    d_tx0_first_round = dict()
+    for tiid in snapshot.l_tx0s:
+      next_rounds = [d_rounds[t] for t in snapshot.d_links.get(tiid, []) if t in d_rounds]
+      if len(next_rounds) > 0:
+        d_tx0_first_round[tiid] = min(next_rounds)
+
+    # Dictionaries tiid => registers of the sketch (mixes and tx0s)
+    d_sketches = dict()
+    d_tx0_sketches = dict()
+    l_anonsets = [0] * nb_mixes
+
+    for mix_round in range(nb_mixes - 1, -1, -1):
+      tiid = snapshot.l_mix_txs[mix_round]
+      next_tiids = snapshot.d_links[tiid]
+      registers = 0
+      # Adds the unmixed txos of the mix
+      for i in range(0, NB_PARTICIPANTS - snapshot.get_nb_links(tiid)):
+        registers = merge_registers(registers, hll.singleton(tiid * NB_PARTICIPANTS + i), m)
+      # Merges the sketches of the next mixes
+      for next_tiid in next_tiids:
+        if next_tiid in snapshot.s_mix_txs:
+          registers = merge_registers(registers, d_sketches.get(next_tiid, 0), m)
+          # Releases the sketch of the next mix if it's no longer needed
+          if d_first_use.get(next_tiid) == mix_round:
+            d_sketches.pop(next_tiid, None)
+      if tiid in d_first_use:
+        d_sketches[tiid] = registers
+      l_anonsets[mix_round] = estimate_cardinality(registers, p)
+      # Merges the sketch into the sketches of the tx0s spent by this mix
+      for prev_tiid in snapshot.d_reverse_links[tiid]:
+        if prev_tiid in snapshot.s_tx0s:
+          tx0_registers = merge_registers(d_tx0_sketches.get(prev_tiid, 0), registers, m)
+          if d_tx0_first_round[prev_tiid] == mix_round:
+            d_tx0_sketches.pop(prev_tiid, None)
+            self.d_tx0_anonsets[prev_tiid] = estimate_cardinality(tx0_registers, p)
+          else:
+            d_tx0_sketches[prev_tiid] = tx0_registers
+
+    for anonset in l_anonsets:
+      yield anonset
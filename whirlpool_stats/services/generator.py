@@ -0,0 +1,215 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class generating synthetic snapshots of Whirpool's transaction graph
+(same format as the snapshots published by OXT)
+'''
+import sys
+import getopt
+import random
+from whirlpool_stats.utils.constants import *
+
+
+# Default timestamp of the first tx0 (june 2019)
+DEFAULT_START_TS = 1560000000
+
+
+class SnapshotGenerator(object):
+
+  def __init__(self, nb_mixes, nb_tx0s=None, remix_proba=0.6,
+               nb_participants=NB_PARTICIPANTS, nb_days=365,
+               start_ts=DEFAULT_START_TS, seed=None):
+    '''
+    Constructor
+    Parameters:
+      nb_mixes        = number of mix txs
+      nb_tx0s         = approximate number of tx0s
+                        (default = number of mixes)
+      remix_proba     = probability that an input of a mix is a remixed output
+      nb_participants = number of participants per mix
+      nb_days         = number of days covered by the snapshot
+      start_ts        = timestamp of the first tx0
+      seed            = seed of the random generator (or None)
+    '''
+    self.nb_mixes = nb_mixes
+    self.nb_tx0s = nb_tx0s if nb_tx0s is not None else nb_mixes
+    self.remix_proba = remix_proba
+    self.nb_participants = nb_participants
+    self.nb_days = nb_days
+    self.start_ts = start_ts
+    self.rand = random.Random(seed)
+
+
+  def get_txid(self):
+    '''
+    Returns a random txid
+    '''
+    return '%064x' % self.rand.getrandbits(256)
+
+
+  def generate(self, snapshots_dir, denom):
+    '''
+    Generates a snapshot and stores its files in a directory
+    Parameters:
+      snapshots_dir = path of the directory storing the snapshot files
+      denom         = code identifying the mix denomination (used for the filenames)
+    '''
+    rand = self.rand
+    filepaths = ['%s/%s_%s.csv' % (snapshots_dir, f, denom) for f in FILENAME_TEMPLATES]
+    f_mixes = open(filepaths[0], 'w', newline='\n')
+    f_tx0s = open(filepaths[1], 'w', newline='\n')
+    f_links = open(filepaths[2], 'w', newline='\n')
+    f_mixes.write('id;txid;block_ts\n')
+    f_tx0s.write('id;txid;block_ts;nb_outputs\n')
+    f_links.write('src;tgt\n')
+
+    # Average number of outputs per tx0
+    nb_fresh = self.nb_mixes * self.nb_participants * (1.0 - self.remix_proba)
+    avg_outputs = max(1, int(round(nb_fresh / max(self.nb_tx0s, 1))))
+    # Average delay between 2 mixes
+    delay = self.nb_days * 86400.0 / max(self.nb_mixes, 1)
+
+    # Ids of the txs (tx0s and mixes share the same ordered sequence)
+    next_tiid = 1
+    # Unspent outputs of the mixes (tiid of the mix, one item per output)
+    l_unspent_mix_txos = []
+    # Unspent outputs of the tx0s (tiid of the tx0, one item per output)
+    l_unspent_tx0_txos = []
+    nb_tx0s = 0
+    last_ts_tx0 = self.start_ts
+
+    for mix_round in range(0, self.nb_mixes):
+      ts = self.start_ts + int((mix_round + 1) * delay)
+      inputs = []
+      # Selects the remixed inputs
+      # (every mix after the initial mix contains at least one remixed utxo)
+      nb_remixes = 0
+      for _ in range(0, self.nb_participants):
+        if rand.random() < self.remix_proba:
+          nb_remixes += 1
+      if len(l_unspent_mix_txos) > 0:
+        nb_remixes = max(nb_remixes, 1)
+      nb_remixes = min(nb_remixes, len(l_unspent_mix_txos))
+      for _ in range(0, nb_remixes):
+        inputs.append(self.pop_random(l_unspent_mix_txos))
+      # Selects the inputs coming from tx0s (creates new tx0s if needed)
+      while len(inputs) < self.nb_participants:
+        if len(l_unspent_tx0_txos) == 0:
+          nb_outputs = rand.randint(1, 2 * avg_outputs - 1)
+          ts_tx0 = max(last_ts_tx0, ts - rand.randint(0, int(delay)))
+          last_ts_tx0 = ts_tx0
+          f_tx0s.write('%d;%s;%d;%d\n' % (next_tiid, self.get_txid(), ts_tx0, nb_outputs))
+          l_unspent_tx0_txos += [next_tiid] * nb_outputs
+          next_tiid += 1
+          nb_tx0s += 1
+        inputs.append(self.pop_random(l_unspent_tx0_txos))
+      # Stores the mix
+      tiid = next_tiid
+      next_tiid += 1
+      f_mixes.write('%d;%s;%d\n' % (tiid, self.get_txid(), ts))
+      for src in inputs:
+        f_links.write('%d;%d\n' % (src, tiid))
+      l_unspent_mix_txos += [tiid] * self.nb_participants
+
+    f_mixes.close()
+    f_tx0s.close()
+    f_links.close()
+
+    print('Generated snapshot for %s denomination (%d mixes, %d tx0s)' % (denom, self.nb_mixes, nb_tx0s))
+
+
+  def pop_random(self, l_items):
+    '''
+    Removes a random item from a list
+    Returns the item
+    Parameters:
+      l_items = list
+    '''
+    idx = self.rand.randrange(len(l_items))
+    item = l_items[idx]
+    l_items[idx] = l_items[-1]
+    l_items.pop()
+    return item
+
+
+def main(snapshots_dir, denom, nb_mixes, nb_tx0s=None, remix_proba=0.6,
+         nb_participants=NB_PARTICIPANTS, nb_days=365, seed=None):
+  '''
+  Main function
+  Parameters:
+    snapshots_dir   = path of the directory storing the snapshot files
+    denom           = code identifying the mix denomination
+    nb_mixes        = number of mix txs
+    nb_tx0s         = approximate number of tx0s
+    remix_proba     = probability that an input of a mix is a remixed output
+    nb_participants = number of participants per mix
+    nb_days         = number of days covered by the snapshot
+    seed            = seed of the random generator
+  '''
+  generator = SnapshotGenerator(nb_mixes, nb_tx0s, remix_proba, nb_participants, nb_days, seed=seed)
+  generator.generate(snapshots_dir, denom)
+
+
+def usage():
+  '''
+  Usage message for this module
+  '''
+  sys.stdout.write('python generator.py [--target_dir=/tmp] [--denom=05] [--mixes=10000] [--tx0s=10000]')
+  sys.stdout.write(' [--remix=0.6] [--participants=5] [--days=365] [--seed=1]\n')
+  sys.stdout.write('\n\n[-t OR --target_dir] = Path of the directory that will store the snapshot files.')
+  sys.stdout.write('\n\n[-d OR --denom] = Code used for the names of the snapshot files.')
+  sys.stdout.write('\n\n[-m OR --mixes] = Number of mix transactions.')
+  sys.stdout.write('\n\n[-x OR --tx0s] = Approximate number of tx0s (default: number of mixes).')
+  sys.stdout.write('\n\n[-r OR --remix] = Probability that an input of a mix is a remixed output.')
+  sys.stdout.write('\n\n[-p OR --participants] = Number of participants per mix.')
+  sys.stdout.write('\n\n[-n OR --days] = Number of days covered by the snapshot.')
+  sys.stdout.write('\n\n[-s OR --seed] = Seed of the random generator.')
+  sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  # Initializes the parameters
+  target_dir = '/tmp'
+  denom = DENOM_05
+  nb_mixes = 10000
+  nb_tx0s = None
+  remix_proba = 0.6
+  nb_participants = NB_PARTICIPANTS
+  nb_days = 365
+  seed = None
+  argv = sys.argv[1:]
+
+  # Processes the command line arguments
+  try:
+    opts, args = getopt.getopt(
+      argv,
+      'ht:d:m:x:r:p:n:s:',
+      ['help', 'target_dir=', 'denom=', 'mixes=', 'tx0s=', 'remix=', 'participants=', 'days=', 'seed=']
+    )
+  except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      sys.exit()
+    elif opt in ('-t', '--target_dir'):
+      target_dir = arg
+    elif opt in ('-d', '--denom'):
+      denom = arg
+    elif opt in ('-m', '--mixes'):
+      nb_mixes = int(arg)
+    elif opt in ('-x', '--tx0s'):
+      nb_tx0s = int(arg)
+    elif opt in ('-r', '--remix'):
+      remix_proba = float(arg)
+    elif opt in ('-p', '--participants'):
+      nb_participants = int(arg)
+    elif opt in ('-n', '--days'):
+      nb_days = int(arg)
+    elif opt in ('-s', '--seed'):
+      seed = int(arg)
+
+  # Generates the snapshot
+  main(target_dir, denom, nb_mixes, nb_tx0s, remix_proba, nb_participants, nb_days, seed)
@@ -0,0 +1,352 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Background execution of the long commands of the interactive mode
+(download, load, export, report, forecast)
+
+Jobs are executed one at a time by a worker thread, in the order of their
+submission, so that the shell stays responsive while they run. Messages printed
+by a job are stored in its output, its progress is recorded from the progress
+reports of the instrumentation and a job is cancelled cooperatively
+(JobCancelled is raised by its next progress report or by its next check).
+'''
+import sys
+import time
+import threading
+import traceback
+from collections import deque
+from datetime import timedelta
+from whirlpool_stats.utils.instrumentation import print_progress
+
+
+# Status of the jobs
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+# Maximum number of lines of output kept per job
+MAX_OUTPUT_LINES = 1000
+
+
+class JobCancelled(Exception):
+  '''
+  Exception raised in the thread of a job cancelled by the user
+  '''
+  pass
+
+
+class Job(object):
+
+  def __init__(self, job_id, command, target):
+    '''
+    Constructor
+    Parameters:
+      job_id  = id of the job
+      command = command executed by the job
+      target  = function executed by the job
+    '''
+    self.job_id = job_id
+    self.command = command
+    self.target = target
+    self.status = JOB_QUEUED
+    # Timestamps of the submission, of the start and of the end of the job
+    self.submitted = time.time()
+    self.started = None
+    self.ended = None
+    # Error message of a failed job
+    self.error = None
+    # Last progress report (label, nb_done, nb_total, unit, rate, eta)
+    self.progress = None
+    # Last lines printed by the job (and current line)
+    self.l_output = deque(maxlen=MAX_OUTPUT_LINES)
+    self.line = ''
+    # Flag set when the user requests the cancellation of the job
+    self.cancel_requested = threading.Event()
+    # Flag indicating if the end of the job has been reported to the user
+    self.reported = False
+
+
+  def is_finished(self):
+    '''
+    Checks if the job is finished (done, failed or cancelled)
+    '''
+    return self.status in [JOB_DONE, JOB_FAILED, JOB_CANCELLED]
+
+
+  def write(self, text):
+    '''
+    Appends a text printed by the job to its output
+    Parameters:
+      text = text
+    '''
+    l_lines = (self.line + text).split('\n')
+    self.l_output.extend(l_lines[:-1])
+    self.line = l_lines[-1]
+
+
+  def get_elapsed(self):
+    '''
+    Returns the duration of the job (in seconds) or None if it hasn't started
+    '''
+    if self.started is None:
+      return None
+    return (self.ended if self.ended is not None else time.time()) - self.started
+
+
+  def get_progress_label(self):
+    '''
+    Returns a label describing the progress of the job
+    '''
+    if self.status != JOB_RUNNING:
+      return self.status
+    if self.progress is None:
+      return 'running'
+    label, nb_done, nb_total, unit, rate, eta = self.progress
+    pct_progress = nb_done * 100 / nb_total if nb_total > 0 else 100
+    return 'running - %s %d/%d %s (%d%%) - ETA %s' % (
+      label.lower(), nb_done, nb_total, unit, pct_progress, timedelta(seconds=int(eta))
+    )
+
+
+  def display(self, nb_lines=10):
+    '''
+    Displays the status of the job and its last lines of output
+    Parameters:
+      nb_lines = number of lines of output displayed
+    '''
+    elapsed = self.get_elapsed()
+    print('Job %d: %s' % (self.job_id, self.command))
+    print('  status   = %s' % self.get_progress_label())
+    print('  duration = %s' % (timedelta(seconds=int(elapsed)) if elapsed is not None else '-'))
+    if self.error is not None:
+      print('  error    = %s' % self.error)
+    l_lines = [l for l in self.l_output if len(l.strip()) > 0]
+    if len(self.line.strip()) > 0:
+      l_lines.append(self.line)
+    if len(l_lines) > 0:
+      print('  output:')
+      for line in l_lines[-nb_lines:]:
+        print('    %s' % line)
+
+
+class JobOutput(object):
+  '''
+  File-like object replacing sys.stdout: messages printed by the worker
+  thread are stored in the output of the job being executed
+  '''
+
+  def __init__(self, job_table, stream):
+    '''
+    Constructor
+    Parameters:
+      job_table = table of the jobs
+      stream    = stream receiving the messages of the other threads
+    '''
+    self.job_table = job_table
+    self.stream = stream
+
+
+  def write(self, text):
+    job = self.job_table.get_current_job()
+    if job is None:
+      return self.stream.write(text)
+    job.write(text)
+    return len(text)
+
+
+  def flush(self):
+    self.stream.flush()
+
+
+  def __getattr__(self, name):
+    return getattr(self.stream, name)
+
+
+class JobTable(object):
+
+  def __init__(self):
+    '''
+    Constructor
+    '''
+    # Ordered list of the jobs
+    self.l_jobs = []
+    # Queue of the jobs waiting for the worker thread
+    self.queue = deque()
+    self.cond = threading.Condition()
+    # Worker thread (started with the first job)
+    self.thread = None
+    # Job being executed by the worker thread
+    self.current = None
+
+
+  def submit(self, command, target):
+    '''
+    Adds a job to the queue
+    Returns the job
+    Parameters:
+      command = command executed by the job
+      target  = function executed by the job
+    '''
+    with self.cond:
+      job = Job(len(self.l_jobs) + 1, command, target)
+      self.l_jobs.append(job)
+      self.queue.append(job)
+      if self.thread is None:
+        # Messages printed by the jobs are stored in their output
+        if not isinstance(sys.stdout, JobOutput):
+          sys.stdout = JobOutput(self, sys.stdout)
+        self.thread = threading.Thread(target=self.run, name='wst-jobs', daemon=True)
+        self.thread.start()
+      self.cond.notify()
+    return job
+
+
+  def run(self):
+    '''
+    Main loop of the worker thread
+    '''
+    while True:
+      with self.cond:
+        while len(self.queue) == 0:
+          self.cond.wait()
+        job = self.queue.popleft()
+        job.status = JOB_RUNNING
+        job.started = time.time()
+        self.current = job
+
+      try:
+        job.target()
+        status = JOB_DONE
+      except JobCancelled:
+        status = JOB_CANCELLED
+      except Exception as e:
+        status = JOB_FAILED
+        job.error = '%s: %s' % (type(e).__name__, e)
+        job.write(traceback.format_exc())
+
+      with self.cond:
+        job.status = status
+        job.ended = time.time()
+        self.current = None
+        self.cond.notify_all()
+
+
+  def get_job(self, job_id=None):
+    '''
+    Returns a job (None if it doesn't exist)
+    Parameters:
+      job_id = id of the job (None = job being executed or last job)
+    '''
+    if job_id is None:
+      if self.current is not None:
+        return self.current
+      return self.l_jobs[-1] if len(self.l_jobs) > 0 else None
+    if 0 < job_id <= len(self.l_jobs):
+      return self.l_jobs[job_id - 1]
+    return None
+
+
+  def get_current_job(self):
+    '''
+    Returns the job executed by the current thread (None if it isn't the worker thread)
+    '''
+    if threading.current_thread() is not self.thread:
+      return None
+    return self.current
+
+
+  def cancel(self, job):
+    '''
+    Cancels a job (a queued job is removed from the queue,
+    a running job is stopped by its next progress report)
+    Returns True if the cancellation has been requested
+    Parameters:
+      job = job
+    '''
+    with self.cond:
+      if job.status == JOB_QUEUED:
+        self.queue.remove(job)
+        job.status = JOB_CANCELLED
+        job.ended = time.time()
+        return True
+      if job.status == JOB_RUNNING:
+        job.cancel_requested.set()
+        return True
+    return False
+
+
+  def cancel_all(self, timeout=None):
+    '''
+    Cancels all the jobs and waits for the end of the running job
+    Parameters:
+      timeout = maximum delay (in seconds) or None
+    '''
+    for job in self.l_jobs:
+      self.cancel(job)
+    with self.cond:
+      self.cond.wait_for(lambda: self.current is None, timeout)
+
+
+  def check_cancelled(self):
+    '''
+    Raises JobCancelled if the job executed by the current thread has been cancelled
+    '''
+    job = self.get_current_job()
+    if (job is not None) and job.cancel_requested.is_set():
+      raise JobCancelled()
+
+
+  def progress_callback(self, label, nb_done, nb_total, unit, rate, eta):
+    '''
+    Progress callback of the instrumentation
+    (progress of the jobs is recorded, other progress reports are printed)
+    Parameters:
+      label    = label of the task
+      nb_done  = number of items processed
+      nb_total = total number of items
+      unit     = name of the items
+      rate     = number of items processed per second
+      eta      = estimated remaining time (in seconds)
+    '''
+    job = self.get_current_job()
+    if job is None:
+      print_progress(label, nb_done, nb_total, unit, rate, eta)
+      return
+    job.progress = (label, nb_done, nb_total, unit, rate, eta)
+    self.check_cancelled()
+
+
+  def pop_finished(self):
+    '''
+    Returns the list of the finished jobs not reported yet
+    '''
+    with self.cond:
+      l_finished = [j for j in self.l_jobs if j.is_finished() and not j.reported]
+      for job in l_finished:
+        job.reported = True
+    return l_finished
+
+
+  def display(self):
+    '''
+    Displays the table of the jobs
+    '''
+    if len(self.l_jobs) == 0:
+      print('No job.')
+      return
+    print('%4s  %-9s  %9s  %s' % ('id', 'status', 'duration', 'command'))
+    for job in self.l_jobs:
+      elapsed = job.get_elapsed()
+      progress = ''
+      if (job.status == JOB_RUNNING) and (job.progress is not None):
+        _, nb_done, nb_total, _, _, _ = job.progress
+        progress = ' (%d%%)' % (nb_done * 100 / nb_total if nb_total > 0 else 100)
+      print('%4d  %-9s  %9s  %s%s' % (
+        job.job_id,
+        job.status,
+        str(timedelta(seconds=int(elapsed))) if elapsed is not None else '-',
+        job.command,
+        progress
+      ))
@@ -4,30 +4,89 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 A class allowing to plot metrics
 '''
 from whirlpool_stats.utils.charts import *
+from whirlpool_stats.utils.columns import get_positions, select
+from whirlpool_stats.services.activity_metrics import ActivityMetrics
+
+
+# List of all available charts (category, metrics)
+ALL_CHARTS = [
+  ('fwd', 'anonset'),
+  ('fwd', 'spread'),
+  ('bwd', 'anonset'),
+  ('bwd', 'spread'),
+  ('act', 'inflow'),
+  ('act', 'mixes'),
+  ('act', 'tx0s_created'),
+  ('act', 'tx0s_active'),
+  ('tx0', 'outputs'),
+  ('tx0', 'hr'),
+  ('tx0', 'hrout'),
+  ('tx0', 'hrdist'),
+  ('tx0', 'anonset')
+]
 
 
 class Plotter(object):
 
-  def __init__(self, fwd_metrics, bwd_metrics, tx0_metrics):
+  def __init__(self, fwd_metrics, bwd_metrics, tx0_metrics, win_metrics=None,
+               depth_metrics=None, activity_metrics=None):
     '''
     Constructor
     Parameters:
-      fwd_metrics = Forward-looking metrics
-      bwd_metrics = Backward-looking metrics
-      tx0_metrics = Tx0s metrics
+      fwd_metrics      = Forward-looking metrics
+      bwd_metrics      = Backward-looking metrics
+      tx0_metrics      = Tx0s metrics
+      win_metrics      = Time-windowed metrics (optional)
+      depth_metrics    = Anonsets by depth (optional)
+      activity_metrics = Rollups of the activity metrics (built from bwd_metrics
+                         and tx0_metrics if not provided)
     '''
     self.fwd_metrics = fwd_metrics
     self.bwd_metrics = bwd_metrics
     self.tx0_metrics = tx0_metrics
+    self.win_metrics = win_metrics
+    self.depth_metrics = depth_metrics
+    if activity_metrics is None:
+      activity_metrics = ActivityMetrics(bwd_metrics, tx0_metrics)
+    self.activity_metrics = activity_metrics
 
 
-  def plot(self, category, metrics, log_scale):
+  def plot(self, category, metrics, log_scale, max_points=DEFAULT_MAX_POINTS, density=False,
+           period='day', from_date=None, to_date=None):
     '''
     Plots a metrics identified by a category and a name
     Parameters:
-      category  = category
-      metrics   = name
-      log_scale = flag indicating if z-axis should use a log scale
+      category   = category
+      metrics    = name
+      log_scale  = flag indicating if z-axis should use a log scale
+      max_points = maximum number of points displayed by a scatterplot
+      density    = flag indicating if large scatterplots should be displayed as a density chart
+      period     = period of the activity metrics (day, week, month)
+      from_date  = first date of the activity metrics (None = first day of activity)
+      to_date    = last date of the activity metrics (None = last day of activity)
+    '''
+    instr = self.fwd_metrics.snapshot.instr
+
+    with instr.phase('plot %s %s' % (category, metrics)):
+      self.get_chart(category, metrics, log_scale, max_points, density, True,
+                     period, from_date, to_date)
+
+
+  def get_chart(self, category, metrics, log_scale, max_points=DEFAULT_MAX_POINTS,
+                density=False, show=False, period='day', from_date=None, to_date=None):
+    '''
+    Builds the chart of a metrics identified by a category and a name
+    Returns the plotly figure (or None if the metrics is invalid)
+    Parameters:
+      category   = category
+      metrics    = name
+      log_scale  = flag indicating if z-axis should use a log scale
+      max_points = maximum number of points displayed by a scatterplot
+      density    = flag indicating if large scatterplots should be displayed as a density chart
+      show       = flag indicating if the chart should be displayed in a browser
+      period     = period of the activity metrics (day, week, month)
+      from_date  = first date of the activity metrics (None = first day of activity)
+      to_date    = last date of the activity metrics (None = last day of activity)
     '''
     # Backward/Forward looking metrics
     if category in ['fwd', 'bwd']:
@@ -41,8 +100,8 @@ class Plotter(object):
       # Anonset
       if metrics == 'anonset':
         chart_type = CT_SCATTERPLOT
-        y_values = o_metrics.l_anonsets
-        x_values = list(range(0, len(y_values)))
+        y_values = o_metrics.columns.get_view('anonset')
+        x_values = get_positions(len(y_values))
         lbl_x = 'mix round'
         lbl_y = 'anonset'
         chart_title = 'Whirlpool %s %s (pools %s)' %\
@@ -51,8 +110,8 @@ class Plotter(object):
       # Spread
       elif metrics == 'spread':
         chart_type = CT_SCATTERPLOT
-        y_values = o_metrics.l_spreads
-        x_values = list(range(0, len(y_values)))
+        y_values = o_metrics.columns.get_view('spread')
+        x_values = get_positions(len(y_values))
         lbl_x = 'mix round'
         lbl_y = 'spread'
         chart_title = 'Whirlpool %s %s (pools %s)' %\
@@ -60,7 +119,72 @@ class Plotter(object):
       # Invalid name
       else:
         print('Invalid metrics (values: anonset, spread).')
-        return
+        return None
+
+
+    # Time-windowed metrics
+    elif category in ['win', 'asof']:
+      o_metrics = self.win_metrics
+      if category == 'win':
+        if (o_metrics is None) or (o_metrics.nb_days is None):
+          print('Windowed metrics not computed (see command window).')
+          return None
+        l_anonsets = o_metrics.l_win_anonsets
+        l_spreads = o_metrics.l_win_spreads
+        lbl_direction = 'backward-looking (%d days window)' % o_metrics.nb_days
+      else:
+        if (o_metrics is None) or (o_metrics.asof_date is None):
+          print('As-of metrics not computed (see command asof).')
+          return None
+        l_anonsets = o_metrics.l_asof_anonsets
+        l_spreads = o_metrics.l_asof_spreads
+        lbl_direction = 'forward-looking (as of %s)' % o_metrics.asof_date.strftime('%d/%m/%Y')
+
+      if metrics in ['anonset', 'spread']:
+        chart_type = CT_SCATTERPLOT
+        y_values = l_anonsets if metrics == 'anonset' else l_spreads
+        x_values = list(range(0, len(y_values)))
+        lbl_x = 'mix round'
+        lbl_y = metrics
+        chart_title = 'Whirlpool %s %s (pools %s)' %\
+          (lbl_direction, lbl_y, o_metrics.snapshot.denom)
+      # Invalid name
+      else:
+        print('Invalid metrics (values: anonset, spread).')
+        return None
+
+
+    # Anonsets by depth
+    elif category == 'depth':
+      o_metrics = self.depth_metrics
+      if (o_metrics is None) or (o_metrics.max_depth is None):
+        print('Anonsets by depth not computed (see command depth).')
+        return None
+
+      # Median cumulative anonset by depth
+      if metrics == 'median':
+        chart_type = CT_LINEARCHART
+        y_values = o_metrics.get_median_curve()
+        x_values = list(range(1, len(y_values) + 1))
+        lbl_x = 'depth (remix hops)'
+        lbl_y = 'median anonset'
+        chart_title = 'Whirlpool backward-looking anonset by depth (pools %s)' %\
+          o_metrics.snapshot.denom
+
+      # Cumulative anonsets reached at a given depth
+      elif metrics.isdigit() and (1 <= int(metrics) <= o_metrics.max_depth):
+        chart_type = CT_SCATTERPLOT
+        y_values = o_metrics.l_depth_anonsets[int(metrics) - 1]
+        x_values = list(range(0, len(y_values)))
+        lbl_x = 'mix round'
+        lbl_y = 'anonset at depth %s' % metrics
+        chart_title = 'Whirlpool backward-looking %s (pools %s)' %\
+          (lbl_y, o_metrics.snapshot.denom)
+
+      # Invalid name
+      else:
+        print('Invalid metrics (values: median, 1-%d).' % o_metrics.max_depth)
+        return None
 
 
     # Tx0s metrics
@@ -71,19 +195,17 @@ class Plotter(object):
       # Number of outputs created by the Tx0s
       if metrics == 'outputs':
         chart_type = CT_SCATTERPLOT
-        l_metrics = list(o_metrics.d_metrics.values())
-        y_values = [item[2] for item in l_metrics]
-        x_values = [item[3] for item in l_metrics]
+        y_values = o_metrics.columns.get_view('nb_outputs')
+        x_values = get_positions(len(y_values))
         lbl_x = 'tx0 index'
         lbl_y = '#outputs created by Tx0'
         chart_title = 'Whirlpool Tx0s #Outputs (pools %s)' % o_metrics.snapshot.denom
 
-      # Heterogeneity ratio
+      # Heterogeneity ratio (tx0s having mixed outputs)
       elif metrics == 'hr':
         chart_type = CT_SCATTERPLOT
-        l_metrics = list(o_metrics.d_metrics.values())
-        y_values = [float(item[1]) / float(item[0]) for item in l_metrics]
-        x_values = [item[3] for item in l_metrics]
+        x_values = o_metrics.get_mixed_tx0s()
+        y_values = select(o_metrics.get_heterogeneity_ratios(), x_values)
         lbl_x = 'tx0 index'
         lbl_y = 'heterogeneity ratio (#counterparties / #mixed outputs)'
         chart_title = 'Whirlpool %s (pools %s)' %\
@@ -92,9 +214,9 @@ class Plotter(object):
       # Heterogeneity ratio VS number of mixed Tx0s outputs
       elif metrics == 'hrout':
         chart_type = CT_SCATTERPLOT
-        l_metrics = list(o_metrics.d_metrics.values())
-        y_values = [float(item[1]) / float(item[0]) for item in l_metrics]
-        x_values = [item[0] for item in l_metrics]
+        l_indices = o_metrics.get_mixed_tx0s()
+        y_values = select(o_metrics.get_heterogeneity_ratios(), l_indices)
+        x_values = select(o_metrics.columns.get_view('nb_mixed_outputs'), l_indices)
         lbl_x = '#outputs mixed'
         lbl_y = 'heterogeneity ratio'
         chart_title = 'Whirlpool %s vs %s (pools %s)' %\
@@ -103,79 +225,83 @@ class Plotter(object):
       # Distribution of Tx0s per heterogeneity ratio
       elif metrics == 'hrdist':
         chart_type = CT_BARCHART
-        l_metrics = list(o_metrics.d_metrics.values())
-        x_values = [float(item[1]) / float(item[0]) for item in l_metrics]
+        x_values = select(o_metrics.get_heterogeneity_ratios(), o_metrics.get_mixed_tx0s())
         lbl_x = 'heterogeneity ratio'
         lbl_y = 'percentage of all Tx0s'
         chart_title = 'Whirlpool distribution of Tx0s per %s (pools %s)' %\
           (lbl_x, o_metrics.snapshot.denom)
 
+      # Forward-looking anonsets of the Tx0s outputs
+      elif metrics == 'anonset':
+        if len(o_metrics.l_anonsets) == 0:
+          print('Anonsets of the Tx0s not computed.')
+          return None
+        chart_type = CT_SCATTERPLOT
+        y_values = o_metrics.columns.get_view('anonset')
+        x_values = get_positions(len(y_values))
+        lbl_x = 'tx0 index'
+        lbl_y = 'forward-looking anonset'
+        chart_title = 'Whirlpool Tx0s %s (pools %s)' %\
+          (lbl_y, o_metrics.snapshot.denom)
+
       # Invalid name
       else:
-        print('Invalid metrics (values: outputs, hr, hrout, hrdist).')
-        return
+        print('Invalid metrics (values: outputs, hr, hrout, hrdist, anonset).')
+        return None
 
 
-    # Activity metrics
+    # Activity metrics (daily values or values by week/month over a date range)
     elif category == 'act':
-      # Daily inflow
+      o_metrics = self.activity_metrics
+      chart_type = CT_LINEARCHART
+      lbl_x = 'date' if period == 'day' else period
+      lbl_period = {'day': 'daily', 'week': 'weekly', 'month': 'monthly'}[period]
+
+      # Inflow
       if metrics == 'inflow':
-        o_metrics = self.bwd_metrics
-        chart_type = CT_LINEARCHART
-        l_inflow = sorted(o_metrics.d_inflow.items())
-        x_values, y_values = zip(*l_inflow)
-        lbl_x = 'date'
         lbl_y = 'inflow (#UTXOs entering the pool)'
-        chart_title = 'Whirlpool daily inflow (pools %s)' % o_metrics.snapshot.denom
+        chart_title = 'Whirlpool %s inflow (pools %s)' % (lbl_period, o_metrics.snapshot.denom)
 
-      # Daily number of mixes
+      # Number of mixes
       elif metrics == 'mixes':
-        o_metrics = self.bwd_metrics
-        chart_type = CT_LINEARCHART
-        l_nb_mixes = sorted(o_metrics.d_nb_mixes.items())
-        x_values, y_values = zip(*l_nb_mixes)
-        lbl_x = 'date'
         lbl_y = 'mixes'
-        chart_title = 'Whirlpool mixes (pools %s)' % o_metrics.snapshot.denom
+        chart_title = 'Whirlpool %s mixes (pools %s)' % (lbl_period, o_metrics.snapshot.denom)
 
-      # Daily number of active Tx0s
+      # Number of distinct active Tx0s
       elif metrics == 'tx0s_active':
-        o_metrics = self.bwd_metrics
-        chart_type = CT_LINEARCHART
-        l_nb_mixes = sorted(o_metrics.d_nb_active_tx0s.items())
-        x_values, y_values = zip(*l_nb_mixes)
-        lbl_x = 'date'
         lbl_y = 'active tx0s'
-        chart_title = 'Whirlpool active Tx0s (pools %s)' % o_metrics.snapshot.denom
+        chart_title = 'Whirlpool %s active Tx0s (pools %s)' % (lbl_period, o_metrics.snapshot.denom)
 
-      # Daily number of created Tx0s
+      # Number of created Tx0s
       elif metrics == 'tx0s_created':
-        o_metrics = self.tx0_metrics
-        chart_type = CT_LINEARCHART
-        l_tx0s = sorted(o_metrics.d_nb_new_tx0s.items())
-        x_values, y_values = zip(*l_tx0s)
-        lbl_x = 'date'
         lbl_y = 'tx0s created'
-        chart_title = 'Whirlpool Tx0s created (pools %s)' % o_metrics.snapshot.denom
+        chart_title = 'Whirlpool %s Tx0s created (pools %s)' % (lbl_period, o_metrics.snapshot.denom)
 
       # Invalid name
       else:
         print('Invalid metrics (values: inflow, mixes, tx0s_created, tx0s_active).')
-        return
+        return None
+
+      x_values, y_values = o_metrics.get_series(metrics, period, from_date, to_date)
+      if len(x_values) == 0:
+        print('No activity in this date range.')
+        return None
 
 
     # Unknown category
     else:
-      print('Invalid category (values: fwd, bwd, act, tx0).')
-      return
+      print('Invalid category (values: fwd, bwd, win, asof, depth, act, tx0).')
+      return None
 
 
-    print('Preparing the chart...')
+    if show:
+      print('Preparing the chart...')
     
-    # Plots the chart
+    # Builds (and plots) the chart
     if chart_type == CT_SCATTERPLOT:
-      scatterplot(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y)
+      return scatterplot(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y,
+                         max_points, density, show)
     elif chart_type == CT_BARCHART:
-      barchart(x_values, chart_title, lbl_x, lbl_y)
+      return barchart(x_values, chart_title, lbl_x, lbl_y, show)
     elif chart_type == CT_LINEARCHART:
-      linearchart(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y)
+      return linearchart(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y, show)
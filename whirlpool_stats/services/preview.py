@@ -0,0 +1,160 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class estimating the distributions of the anonsets and spreads of a snapshot
+from a stratified random sample of mix rounds (fast preview computed in a fixed time budget)
+'''
+import math
+import time
+import random
+from bisect import bisect_left
+from collections import defaultdict
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.utils.date import get_datetime_of_day
+from whirlpool_stats.backends.python_backend import PythonBackend
+
+
+# Default time budget (in seconds)
+DEFAULT_TIME_BUDGET = 30
+
+# Percentiles displayed by the preview
+PREVIEW_PERCENTILES = [1, 10, 50, 90, 99]
+
+# Z-score used for the confidence intervals (95%)
+Z_95 = 1.96
+
+
+def get_percentile(sorted_values, pct, nb_population=None, z=Z_95):
+  '''
+  Estimates a percentile and its confidence interval from a sample
+  (distribution-free interval based on the order statistics of the sample)
+  Returns a tuple (estimate, lower bound, upper bound)
+  Parameters:
+    sorted_values = sorted list of sampled values
+    pct           = percentile (0-100)
+    nb_population = size of the sampled population (or None if infinite)
+    z             = z-score of the confidence level
+  '''
+  n = len(sorted_values)
+  q = pct / 100.0
+  idx = min(int(q * n), n - 1)
+  half_width = z * math.sqrt(n * q * (1.0 - q))
+  # Finite population correction
+  if (nb_population is not None) and (nb_population > 1):
+    half_width *= math.sqrt(max(nb_population - n, 0) / float(nb_population - 1))
+  idx_low = max(int(math.floor(q * n - half_width)), 0)
+  idx_high = min(int(math.ceil(q * n + half_width)), n - 1)
+  return sorted_values[idx], sorted_values[idx_low], sorted_values[idx_high]
+
+
+class Preview(object):
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    self.snapshot = snapshot
+    # Dictionary metrics name => list of sampled values
+    self.d_samples = defaultdict(list)
+    # Number of sampled mix rounds
+    self.nb_samples = 0
+
+
+  def get_sampling_order(self, rand):
+    '''
+    Computes a stratified random order of the mix rounds
+    (any prefix of the list samples each day proportionally to its number of mixes)
+    Returns the ordered list of mix rounds
+    Parameters:
+      rand = random generator
+    '''
+    d_days = defaultdict(list)
+    for mix_round in range(0, len(self.snapshot.l_mix_txs)):
+      day = get_datetime_of_day(self.snapshot.l_ts_mix_txs[mix_round])
+      d_days[day].append(mix_round)
+
+    l_keys = []
+    for l_rounds in d_days.values():
+      rand.shuffle(l_rounds)
+      nb_rounds = float(len(l_rounds))
+      for i in range(0, len(l_rounds)):
+        l_keys.append(((i + rand.random()) / nb_rounds, l_rounds[i]))
+    l_keys.sort()
+    return [k[1] for k in l_keys]
+
+
+  def compute(self, time_budget=DEFAULT_TIME_BUDGET, seed=None):
+    '''
+    Computes the exact metrics of a stratified sample of mix rounds
+    until the time budget is exhausted
+    Parameters:
+      time_budget = time budget (in seconds)
+      seed        = seed of the random generator (or None)
+    '''
+    snapshot = self.snapshot
+    start = time.time()
+    self.d_samples = defaultdict(list)
+    self.nb_samples = 0
+
+    with snapshot.instr.phase('preview'):
+      print('Start computing preview (time budget = %ds)' % time_budget)
+
+      rand = random.Random(seed)
+      l_order = self.get_sampling_order(rand)
+
+      # Data used for computing the spreads
+      l_sorted_tx0s = sorted(snapshot.l_tx0s)
+      nb_mixes = len(snapshot.l_mix_txs)
+      l_later_unmixed_txos = [0] * (nb_mixes + 1)
+      for j in range(nb_mixes - 1, -1, -1):
+        nb_remixes = snapshot.get_nb_links(snapshot.l_mix_txs[j])
+        l_later_unmixed_txos[j] = l_later_unmixed_txos[j+1] + NB_PARTICIPANTS - nb_remixes
+
+      # Reuses the walks of the reference backend
+      backend = PythonBackend(snapshot)
+
+      for mix_round in l_order:
+        if time.time() - start > time_budget:
+          break
+        tiid = snapshot.l_mix_txs[mix_round]
+        # Backward-looking metrics
+        backend.s_processed_txs.clear()
+        anonset = backend.get_nb_sources(tiid)
+        self.d_samples['bwd anonset'].append(anonset)
+        nb_past_tx0s = bisect_left(l_sorted_tx0s, tiid)
+        self.d_samples['bwd spread'].append(float(anonset) * 100.0 / float(nb_past_tx0s))
+        # Forward-looking metrics
+        backend.s_processed_txs.clear()
+        anonset = backend.get_nb_descendants(tiid)
+        self.d_samples['fwd anonset'].append(anonset)
+        self.d_samples['fwd spread'].append(float(anonset) * 100.0 / float(l_later_unmixed_txos[mix_round]))
+        self.nb_samples += 1
+
+      snapshot.instr.count('preview_samples', self.nb_samples)
+      print('Computed metrics for %d/%d mix rounds in %.1fs' % (self.nb_samples, nb_mixes, time.time() - start))
+
+
+  def display(self, percentiles=PREVIEW_PERCENTILES):
+    '''
+    Displays the estimated percentiles and their 95% confidence intervals
+    Parameters:
+      percentiles = list of percentiles
+    '''
+    if self.nb_samples == 0:
+      print('No mix round sampled.')
+      return
+
+    print('')
+    print('%-12s %s' % ('metrics', '  '.join(['%-24s' % ('p%d [95%% ci]' % p) for p in percentiles])))
+    for name in ['bwd anonset', 'bwd spread', 'fwd anonset', 'fwd spread']:
+      sorted_values = sorted(self.d_samples[name])
+      l_cols = []
+      for pct in percentiles:
+        estimate, low, high = get_percentile(sorted_values, pct, len(self.snapshot.l_mix_txs))
+        if name.endswith('spread'):
+          l_cols.append('%-24s' % ('%.1f%% [%.1f-%.1f]' % (estimate, low, high)))
+        else:
+          l_cols.append('%-24s' % ('%d [%d-%d]' % (estimate, low, high)))
+      print('%-12s %s' % (name, '  '.join(l_cols)))
@@ -0,0 +1,332 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Sorted indexes over the computed metrics answering range queries
+(k lowest/highest values, values in a range) restricted to a date range
+without rescanning the lists of metrics
+'''
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+
+# Number of consecutive items stored in a leaf block of the index
+DEFAULT_BLOCK_SIZE = 64
+
+# List of indexed metrics (category, metrics)
+INDEXED_METRICS = [
+  ('fwd', 'anonset'),
+  ('fwd', 'spread'),
+  ('bwd', 'anonset'),
+  ('bwd', 'spread'),
+  ('tx0', 'hr')
+]
+
+
+def iter_segment(level, start, end, reverse=False):
+  '''
+  Iterates over the positions of a segment of a level (without copying it)
+  '''
+  indices = range(end - 1, start - 1, -1) if reverse else range(start, end)
+  for i in indices:
+    yield level[i]
+
+
+class RangeIndex(object):
+  '''
+  Merge sort tree over a list of values ordered chronologically
+
+  Level j of the tree stores the positions of the values sorted by value
+  inside each segment of block_size * 2^j consecutive positions.
+  A date range is mapped to a range of positions decomposed into
+  O(log n) segments searched by dichotomy (+ 2 partial blocks scanned).
+  '''
+
+  def __init__(self, values, timestamps, ids=None, block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Constructor
+    Parameters:
+      values     = list of values
+      timestamps = sorted list of the timestamps of the values
+      ids        = list of the ids of the values (default = positions)
+      block_size = number of positions per leaf block
+    '''
+    self.values = values
+    self.timestamps = timestamps
+    self.ids = ids
+    self.block_size = block_size
+    # List of arrays (one per level) of positions sorted by value inside each segment
+    self.l_levels = []
+    self.build()
+
+
+  def build(self):
+    '''
+    Builds the levels of the tree
+    '''
+    nb_values = len(self.values)
+    key = self.values.__getitem__
+    seg_size = self.block_size
+    level = array('l')
+    for s in range(0, nb_values, seg_size):
+      level.extend(sorted(range(s, min(s + seg_size, nb_values)), key=key))
+    self.l_levels.append(level)
+
+    while seg_size < nb_values:
+      # Segments of a level are the concatenation of 2 sorted segments of the previous level
+      # (merged in linear time by the sort)
+      prev_level = level
+      seg_size *= 2
+      level = array('l')
+      for s in range(0, nb_values, seg_size):
+        level.extend(sorted(prev_level[s:s+seg_size], key=key))
+      self.l_levels.append(level)
+
+
+  def get_positions(self, from_ts=None, to_ts=None):
+    '''
+    Returns the range of positions [start, end) of the values in a date range
+    Parameters:
+      from_ts = minimum timestamp (None = no minimum)
+      to_ts   = maximum timestamp (None = no maximum)
+    '''
+    start = 0 if from_ts is None else bisect_left(self.timestamps, from_ts)
+    end = len(self.values) if to_ts is None else bisect_right(self.timestamps, to_ts)
+    return start, max(start, end)
+
+
+  def get_segments(self, start, end):
+    '''
+    Decomposes a range of positions
+    Returns a tuple (list of segments (level array, start, end), list of positions
+    of the partial blocks)
+    Parameters:
+      start = first position
+      end   = last position (excluded)
+    '''
+    bs = self.block_size
+    first_block = (start + bs - 1) // bs
+    last_block = end // bs
+    if first_block >= last_block:
+      return [], list(range(start, end))
+
+    l_positions = list(range(start, first_block * bs)) + list(range(last_block * bs, end))
+    l_segments = []
+    lo = first_block
+    hi = last_block
+    depth = 0
+    while lo < hi:
+      seg_size = bs << depth
+      if lo & 1:
+        l_segments.append((self.l_levels[depth], lo * seg_size, min((lo + 1) * seg_size, end)))
+        lo += 1
+      if hi & 1:
+        hi -= 1
+        l_segments.append((self.l_levels[depth], hi * seg_size, min((hi + 1) * seg_size, end)))
+      lo >>= 1
+      hi >>= 1
+      depth += 1
+    return l_segments, l_positions
+
+
+  def lower_bound(self, level, start, end, value):
+    '''
+    Returns the index of the first position of a segment with a value >= value
+    '''
+    values = self.values
+    while start < end:
+      mid = (start + end) // 2
+      if values[level[mid]] < value:
+        start = mid + 1
+      else:
+        end = mid
+    return start
+
+
+  def upper_bound(self, level, start, end, value):
+    '''
+    Returns the index of the first position of a segment with a value > value
+    '''
+    values = self.values
+    while start < end:
+      mid = (start + end) // 2
+      if values[level[mid]] <= value:
+        start = mid + 1
+      else:
+        end = mid
+    return start
+
+
+  def get_results(self, l_positions):
+    '''
+    Returns the list of tuples (id, value) of a list of positions
+    '''
+    ids = self.ids
+    values = self.values
+    if ids is None:
+      return [(p, values[p]) for p in l_positions]
+    return [(ids[p], values[p]) for p in l_positions]
+
+
+  def get_lowest(self, k, from_ts=None, to_ts=None):
+    '''
+    Returns the k lowest values in a date range
+    (list of tuples (id, value) sorted by value)
+    Parameters:
+      k       = number of values
+      from_ts = minimum timestamp (None = no minimum)
+      to_ts   = maximum timestamp (None = no maximum)
+    '''
+    return self.get_extremes(k, from_ts, to_ts, False)
+
+
+  def get_highest(self, k, from_ts=None, to_ts=None):
+    '''
+    Returns the k highest values in a date range
+    (list of tuples (id, value) sorted by decreasing value)
+    Parameters:
+      k       = number of values
+      from_ts = minimum timestamp (None = no minimum)
+      to_ts   = maximum timestamp (None = no maximum)
+    '''
+    return self.get_extremes(k, from_ts, to_ts, True)
+
+
+  def get_extremes(self, k, from_ts, to_ts, highest):
+    '''
+    Merges the sorted segments of a date range until k values are found
+    '''
+    start, end = self.get_positions(from_ts, to_ts)
+    l_segments, l_positions = self.get_segments(start, end)
+    key = self.values.__getitem__
+
+    streams = [sorted(l_positions, key=key, reverse=highest)]
+    for level, s, e in l_segments:
+      streams.append(iter_segment(level, s, e, highest))
+
+    merged = heapq.merge(*streams, key=key, reverse=highest)
+    return self.get_results(islice(merged, k))
+
+
+  def get_range(self, min_value, max_value, from_ts=None, to_ts=None):
+    '''
+    Returns the values in a range of values and a date range
+    (list of tuples (id, value) in chronological order)
+    Parameters:
+      min_value = minimum value
+      max_value = maximum value
+      from_ts   = minimum timestamp (None = no minimum)
+      to_ts     = maximum timestamp (None = no maximum)
+    '''
+    start, end = self.get_positions(from_ts, to_ts)
+    l_segments, l_positions = self.get_segments(start, end)
+    values = self.values
+
+    l_found = [p for p in l_positions if min_value <= values[p] <= max_value]
+    for level, s, e in l_segments:
+      i = self.lower_bound(level, s, e, min_value)
+      j = self.upper_bound(level, i, e, max_value)
+      l_found.extend(level[i:j])
+
+    l_found.sort()
+    return self.get_results(l_found)
+
+
+  def count_range(self, min_value, max_value, from_ts=None, to_ts=None):
+    '''
+    Returns the number of values in a range of values and a date range
+    (computed without fetching the values)
+    Parameters:
+      min_value = minimum value
+      max_value = maximum value
+      from_ts   = minimum timestamp (None = no minimum)
+      to_ts     = maximum timestamp (None = no maximum)
+    '''
+    start, end = self.get_positions(from_ts, to_ts)
+    l_segments, l_positions = self.get_segments(start, end)
+    values = self.values
+
+    nb_found = sum(1 for p in l_positions if min_value <= values[p] <= max_value)
+    for level, s, e in l_segments:
+      i = self.lower_bound(level, s, e, min_value)
+      nb_found += self.upper_bound(level, i, e, max_value) - i
+    return nb_found
+
+
+class MetricsIndexes(object):
+  '''
+  Range indexes over the metrics of the active snapshot
+  (built on demand when a metrics is queried for the first time)
+  '''
+
+  def __init__(self, fwd_metrics, bwd_metrics, tx0_metrics):
+    '''
+    Constructor
+    Parameters:
+      fwd_metrics = Forward-looking metrics
+      bwd_metrics = Backward-looking metrics
+      tx0_metrics = Tx0s metrics
+    '''
+    self.fwd_metrics = fwd_metrics
+    self.bwd_metrics = bwd_metrics
+    self.tx0_metrics = tx0_metrics
+    # Dictionary (category, metrics) => range index
+    self.d_indexes = dict()
+    # Dictionaries mix round / tx0 index => txid prefix (built on demand)
+    self.d_mix_prefixes = None
+    self.d_tx0_prefixes = None
+
+
+  def reset(self):
+    '''
+    Resets the indexes (e.g. when a new snapshot is loaded)
+    '''
+    self.d_indexes = dict()
+    self.d_mix_prefixes = None
+    self.d_tx0_prefixes = None
+
+
+  def get_txid_prefix(self, category, item_id):
+    '''
+    Returns the txid prefix of an item returned by a query
+    Parameters:
+      category = category of the queried metrics
+      item_id  = id of the item (mix round or tx0 index)
+    '''
+    if category == 'tx0':
+      if self.d_tx0_prefixes is None:
+        self.d_tx0_prefixes = {v: k for k, v in self.tx0_metrics.d_indices.items()}
+      return self.d_tx0_prefixes.get(item_id, '')
+    if self.d_mix_prefixes is None:
+      self.d_mix_prefixes = {v: k for k, v in self.fwd_metrics.snapshot.d_txids.items()}
+    return self.d_mix_prefixes.get(item_id, '')
+
+
+  def get_index(self, category, metrics):
+    '''
+    Returns the range index of a metrics (or None if the metrics isn't indexed)
+    Parameters:
+      category = category
+      metrics  = name
+    '''
+    if (category, metrics) not in INDEXED_METRICS:
+      return None
+
+    if (category, metrics) not in self.d_indexes:
+      snapshot = self.fwd_metrics.snapshot
+      with snapshot.instr.phase('index %s %s' % (category, metrics)):
+        if category == 'tx0':
+          # Heterogeneity ratios of the tx0s having mixed outputs
+          ids = [int(idx) for idx in self.tx0_metrics.get_mixed_tx0s()]
+          ratios = self.tx0_metrics.get_heterogeneity_ratios()
+          values = [float(ratios[idx]) for idx in ids]
+          timestamps = [snapshot.l_ts_tx0s[idx] for idx in ids]
+          index = RangeIndex(values, timestamps, ids)
+        else:
+          o_metrics = self.fwd_metrics if category == 'fwd' else self.bwd_metrics
+          values = o_metrics.l_anonsets if metrics == 'anonset' else o_metrics.l_spreads
+          index = RangeIndex(values, snapshot.l_ts_mix_txs)
+      self.d_indexes[(category, metrics)] = index
+
+    return self.d_indexes[(category, metrics)]
@@ -0,0 +1,326 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A reachability index over the transaction graph of a snapshot
+answering "is this tx an ancestor of this mix, and how many hops separate them"
+
+Each tx is labeled with an interval [low, rank] per randomized DFS of the graph,
+rank being the post-order rank of the tx and low the minimum rank of its descendants.
+A tx can only reach another tx if the intervals of the latter are nested
+in the intervals of the former, so that most negative queries are answered
+without walking the graph and the walks of the positive queries only visit
+txs that may lie on a path between the 2 txs.
+'''
+import os
+import random
+from array import array
+from whirlpool_stats.utils.files import atomic_write
+
+
+# Version of the format of the persisted index
+# (header line "version hash nb_labels nb_txs" followed by the arrays of ranks and lows)
+INDEX_VERSION = 2
+
+# Type of the values of the label arrays (64-bit signed integers)
+LABEL_TYPECODE = 'q'
+
+# Maximum length of the header of the persisted index
+MAX_HEADER_LENGTH = 256
+
+# Filename template of the persisted index
+FN_REACH_INDEX = 'whirlpool_reach_index'
+
+# Default number of interval labels per tx
+DEFAULT_NB_LABELS = 3
+
+
+class ReachIndex(object):
+
+  def __init__(self, snapshot, nb_labels=DEFAULT_NB_LABELS, seed=None):
+    '''
+    Constructor
+    Parameters:
+      snapshot  = snapshot
+      nb_labels = number of interval labels per tx (number of DFS)
+      seed      = seed of the random generator (or None)
+    '''
+    self.snapshot = snapshot
+    self.nb_labels = nb_labels
+    self.seed = seed
+    # Hash of the indexed snapshot (None = index not built)
+    self.snapshot_hash = None
+    # Dictionary tiid => index of the tx in the label arrays
+    self.d_indices = dict()
+    # Lists of arrays (one array per label) storing the ranks and lows of the txs
+    self.l_ranks = []
+    self.l_lows = []
+
+
+  def get_filepath(self):
+    '''
+    Returns the path of the file storing the index of the snapshot
+    '''
+    filename = '%s_%s.bin' % (FN_REACH_INDEX, self.snapshot.denom)
+    return '%s/%s' % (self.snapshot.snapshots_dir, filename)
+
+
+  def load_or_build(self):
+    '''
+    Loads the index persisted with the snapshot
+    or builds it (and persists it) if it doesn't match the snapshot
+    '''
+    if not self.load(self.snapshot.get_hash()):
+      self.build()
+      self.save()
+
+
+  def load(self, snapshot_hash):
+    '''
+    Loads the persisted index
+    Returns True if the index has been loaded, False otherwise
+    Parameters:
+      snapshot_hash = hash of the snapshot (the index is ignored if it doesn't match)
+    '''
+    filepath = self.get_filepath()
+    if not os.path.isfile(filepath):
+      return False
+
+    with self.snapshot.instr.phase('load index'):
+      d_indices = self.get_indices()
+      nb_txs = len(d_indices)
+      l_ranks = []
+      l_lows = []
+      try:
+        with open(filepath, 'rb') as f:
+          l_fields = f.readline(MAX_HEADER_LENGTH).decode('ascii').split()
+          if (len(l_fields) != 4) or (l_fields[0] != str(INDEX_VERSION)) or (l_fields[1] != snapshot_hash):
+            return False
+          if (l_fields[3] != str(nb_txs)) or (not l_fields[2].isdigit()) or (int(l_fields[2]) == 0):
+            return False
+          for i in range(0, int(l_fields[2])):
+            for l_labels in [l_ranks, l_lows]:
+              labels = array(LABEL_TYPECODE)
+              labels.fromfile(f, nb_txs)
+              l_labels.append(labels)
+          if len(f.read(1)) > 0:
+            # Unexpected trailing data
+            return False
+      except (OSError, ValueError, EOFError):
+        return False
+      self.snapshot_hash = snapshot_hash
+      self.d_indices = d_indices
+      self.l_ranks = l_ranks
+      self.l_lows = l_lows
+      self.nb_labels = len(l_ranks)
+
+    print('  Reachability index loaded')
+    return True
+
+
+  def save(self):
+    '''
+    Persists the index next to the snapshot files
+    '''
+    filepath = self.get_filepath()
+    nb_txs = len(self.d_indices)
+    with atomic_write(filepath, 'wb') as f:
+      header = '%d %s %d %d\n' % (INDEX_VERSION, self.snapshot_hash, self.nb_labels, nb_txs)
+      f.write(header.encode('ascii'))
+      for ranks, lows in zip(self.l_ranks, self.l_lows):
+        ranks.tofile(f)
+        lows.tofile(f)
+    # Index persisted by previous versions (never loaded)
+    legacy_filepath = '%s.pickle' % filepath[:-len('.bin')]
+    if os.path.isfile(legacy_filepath):
+      os.remove(legacy_filepath)
+
+
+  def get_indices(self):
+    '''
+    Returns a dictionary tiid => index of the tx in the label arrays
+    (mix txs ordered by mix round followed by the tx0s)
+    '''
+    snapshot = self.snapshot
+    l_txs = snapshot.l_mix_txs + snapshot.l_tx0s
+    return dict(zip(l_txs, range(0, len(l_txs))))
+
+
+  def build(self):
+    '''
+    Builds the index (one randomized post-order DFS per label)
+    '''
+    snapshot = self.snapshot
+    instr = snapshot.instr
+
+    with instr.phase('build index'):
+      print('  Building reachability index')
+
+      rand = random.Random(self.seed)
+      d_indices = self.get_indices()
+      nb_txs = len(d_indices)
+      l_txs = snapshot.l_mix_txs + snapshot.l_tx0s
+
+      # Children of the txs (indices)
+      l_children = [
+        [d_indices[t] for t in snapshot.d_links.get(tiid, []) if t in d_indices]
+        for tiid in l_txs
+      ]
+      # Roots of the graph (txs without parents)
+      l_roots = [
+        d_indices[tiid] for tiid in l_txs
+        if len(snapshot.d_reverse_links.get(tiid, [])) == 0
+      ]
+
+      self.l_ranks = []
+      self.l_lows = []
+
+      for i in range(0, self.nb_labels):
+        ranks = array(LABEL_TYPECODE, [0]) * nb_txs
+        lows = array(LABEL_TYPECODE, [0]) * nb_txs
+        visited = bytearray(nb_txs)
+        next_rank = 1
+        rand.shuffle(l_roots)
+
+        for root in l_roots:
+          visited[root] = 1
+          children = l_children[root][:]
+          rand.shuffle(children)
+          stack = [(root, children)]
+          low = nb_txs + 1
+          l_low_stack = [low]
+          while len(stack) > 0:
+            node, children = stack[-1]
+            if len(children) > 0:
+              child = children.pop()
+              if visited[child]:
+                # Already labeled (the graph is a DAG)
+                if lows[child] < l_low_stack[-1]:
+                  l_low_stack[-1] = lows[child]
+              else:
+                visited[child] = 1
+                grand_children = l_children[child][:]
+                rand.shuffle(grand_children)
+                stack.append((child, grand_children))
+                l_low_stack.append(nb_txs + 1)
+            else:
+              # Post-order labeling
+              stack.pop()
+              ranks[node] = next_rank
+              low = min(l_low_stack.pop(), next_rank)
+              lows[node] = low
+              next_rank += 1
+              if len(l_low_stack) > 0 and low < l_low_stack[-1]:
+                l_low_stack[-1] = low
+
+        self.l_ranks.append(ranks)
+        self.l_lows.append(lows)
+
+      self.d_indices = d_indices
+      self.snapshot_hash = snapshot.get_hash()
+      instr.count('index_labels', nb_txs * self.nb_labels)
+
+
+  def may_reach(self, src, tgt):
+    '''
+    Checks if a tx may reach another tx
+    Returns False if tgt is certainly not a descendant of src
+    Parameters:
+      src = index of the source tx
+      tgt = index of the target tx
+    '''
+    for i in range(0, self.nb_labels):
+      ranks = self.l_ranks[i]
+      lows = self.l_lows[i]
+      if (ranks[tgt] > ranks[src]) or (lows[tgt] < lows[src]):
+        return False
+    return True
+
+
+  def get_distance(self, src, tgt):
+    '''
+    Returns the number of hops of the shortest path from a tx to a mix
+    (or None if the mix isn't a descendant of the tx)
+
+    The shortest path is searched with a bidirectional BFS
+    only expanding the txs that may lie on a path from src to tgt
+    Parameters:
+      src = tiid of the source tx (tx0 or mix)
+      tgt = tiid of the target mix
+    '''
+    d_indices = self.d_indices
+    if (src not in d_indices) or (tgt not in d_indices):
+      return None
+    if src == tgt:
+      return 0
+
+    idx_src = d_indices[src]
+    idx_tgt = d_indices[tgt]
+    if not self.may_reach(idx_src, idx_tgt):
+      return None
+
+    snapshot = self.snapshot
+    # Dictionaries tiid => distance from src / to tgt
+    d_fwd = {src: 0}
+    d_bwd = {tgt: 0}
+    fwd_frontier = [src]
+    bwd_frontier = [tgt]
+
+    while (len(fwd_frontier) > 0) and (len(bwd_frontier) > 0):
+      # Expands the smallest frontier by one level
+      if len(fwd_frontier) <= len(bwd_frontier):
+        d_visited, d_other, frontier = d_fwd, d_bwd, fwd_frontier
+        d_next_txs = snapshot.d_links
+        is_fwd = True
+      else:
+        d_visited, d_other, frontier = d_bwd, d_fwd, bwd_frontier
+        d_next_txs = snapshot.d_reverse_links
+        is_fwd = False
+
+      next_frontier = []
+      min_dist = None
+      for tiid in frontier:
+        dist = d_visited[tiid] + 1
+        for next_tiid in d_next_txs.get(tiid, []):
+          if next_tiid in d_visited:
+            continue
+          idx = d_indices.get(next_tiid)
+          if idx is None:
+            continue
+          if is_fwd and not self.may_reach(idx, idx_tgt):
+            continue
+          if (not is_fwd) and not self.may_reach(idx_src, idx):
+            continue
+          d_visited[next_tiid] = dist
+          next_frontier.append(next_tiid)
+          if next_tiid in d_other:
+            total_dist = dist + d_other[next_tiid]
+            if (min_dist is None) or (total_dist < min_dist):
+              min_dist = total_dist
+
+      if min_dist is not None:
+        return min_dist
+
+      if is_fwd:
+        fwd_frontier = next_frontier
+      else:
+        bwd_frontier = next_frontier
+
+    return None
+
+
+  def trace(self, tx0_prefix, mix_prefix):
+    '''
+    Checks if a tx (tx0 or mix) identified by its txid prefix
+    is an ancestor of a mix identified by its txid prefix
+    Returns the number of hops separating them (None if not an ancestor)
+    Parameters:
+      tx0_prefix = txid prefix of the source tx
+      mix_prefix = txid prefix of the mix
+    '''
+    snapshot = self.snapshot
+    if tx0_prefix in snapshot.d_tx0s:
+      src = snapshot.d_tx0s[tx0_prefix]
+    else:
+      src = snapshot.l_mix_txs[snapshot.d_txids[tx0_prefix]]
+    tgt = snapshot.l_mix_txs[snapshot.d_txids[mix_prefix]]
+    return self.get_distance(src, tgt)
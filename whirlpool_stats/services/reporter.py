@@ -0,0 +1,162 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class generating a self-contained report (HTML/PNG) of all the charts
+without requiring a display or a browser
+'''
+import os
+import threading
+import multiprocessing
+from contextlib import ExitStack
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from plotly.offline import get_plotlyjs
+from whirlpool_stats.utils.files import atomic_write
+from whirlpool_stats.services.snapshot import Snapshot
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.services.backward_metrics import BackwardMetrics
+from whirlpool_stats.services.tx0s_metrics import Tx0sMetrics
+from whirlpool_stats.services.metrics_plotter import Plotter, ALL_CHARTS
+
+
+# Plotters used for rendering the charts
+# (inherited by the worker processes when they're forked)
+_l_plotters = []
+
+
+def _render_chart(task):
+  '''
+  Renders a chart
+  Returns a tuple (html div, png image or None)
+  Parameters:
+    task = tuple (index of the plotter, category, metrics, flag png)
+  '''
+  idx, category, metrics, png = task
+  fig = _l_plotters[idx].get_chart(category, metrics, False)
+  if fig is None:
+    return None, None
+
+  div = fig.to_html(full_html=False, include_plotlyjs=False)
+  img = None
+  if png:
+    try:
+      img = fig.to_image(format='png', width=1200, height=700)
+    except (ImportError, ValueError):
+      # Static images require the kaleido package
+      img = None
+  return div, img
+
+
+class Reporter(object):
+
+  def __init__(self, snapshots_dir):
+    '''
+    Constructor
+    Parameters:
+      snapshots_dir = path of the directory storing the snapshot files
+    '''
+    self.snapshots_dir = snapshots_dir
+
+
+  def get_plotter(self, denom):
+    '''
+    Loads the snapshot of a given denomination, computes its metrics
+    Returns a plotter for these metrics
+    Parameters:
+      denom = code identifying the mix denomination
+    '''
+    snapshot = Snapshot(self.snapshots_dir)
+    snapshot.load(denom)
+    fwd_metrics = ForwardMetrics(snapshot)
+    fwd_metrics.compute()
+    bwd_metrics = BackwardMetrics(snapshot)
+    bwd_metrics.compute()
+    tx0_metrics = Tx0sMetrics(snapshot, fwd_metrics)
+    tx0_metrics.compute()
+    return Plotter(fwd_metrics, bwd_metrics, tx0_metrics)
+
+
+  def report(self, d_plotters, filepath, png=False, nb_workers=None):
+    '''
+    Renders all the charts for a set of denominations in a single HTML file
+    (plotly.js is embedded once in the file)
+    Parameters:
+      d_plotters = dictionary denom => plotter
+      filepath   = path of the HTML file
+      png        = flag indicating if a PNG file should also be written for each chart
+      nb_workers = number of worker processes (default = number of cpus)
+    '''
+    # Measures the report for each snapshot
+    with ExitStack() as stack:
+      for plotter in d_plotters.values():
+        stack.enter_context(plotter.fwd_metrics.snapshot.instr.phase('report'))
+      self.render(d_plotters, filepath, png, nb_workers)
+
+
+  def render(self, d_plotters, filepath, png=False, nb_workers=None):
+    '''
+    Renders the charts and writes the HTML file
+    Parameters:
+      d_plotters = dictionary denom => plotter
+      filepath   = path of the HTML file
+      png        = flag indicating if a PNG file should also be written for each chart
+      nb_workers = number of worker processes (default = number of cpus)
+    '''
+    global _l_plotters
+
+    denoms = sorted(d_plotters.keys())
+    _l_plotters = [d_plotters[d] for d in denoms]
+    tasks = [(idx, c, m, png) for idx in range(0, len(denoms)) for (c, m) in ALL_CHARTS]
+
+    print('Rendering %d charts' % len(tasks))
+
+    # Renders the charts in parallel
+    # (worker processes inherit the metrics through fork, threads are used as a fallback)
+    # Processes are only forked by the main thread: forking from another thread
+    # (e.g. a background job of the shell) may copy locks held by the other threads
+    if nb_workers is None:
+      nb_workers = multiprocessing.cpu_count()
+    nb_workers = max(1, min(nb_workers, len(tasks)))
+    if ('fork' in multiprocessing.get_all_start_methods()) and \
+      (threading.current_thread() is threading.main_thread()):
+      executor = ProcessPoolExecutor(nb_workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+      executor = ThreadPoolExecutor(nb_workers)
+    with executor:
+      results = list(executor.map(_render_chart, tasks))
+
+    _l_plotters = []
+
+    # Writes the html file
+    l_html = [
+      '<!DOCTYPE html>',
+      '<html>',
+      '<head>',
+      '<meta charset="utf-8">',
+      '<title>Whirlpool Stats report</title>',
+      '<script type="text/javascript">%s</script>' % get_plotlyjs(),
+      '</head>',
+      '<body style="background-color:#111111;color:#9f9f9f;font-family:Courier New, monospace">',
+      '<h1>Whirlpool Stats report</h1>',
+      '<p>Generated on %s UTC</p>' % datetime.utcnow().strftime('%d/%m/%Y %H:%M:%S')
+    ]
+    for i in range(0, len(tasks)):
+      idx, category, metrics, _ = tasks[i]
+      div, img = results[i]
+      if (category, metrics) == ALL_CHARTS[0]:
+        l_html.append('<h2>Pools %s</h2>' % denoms[idx])
+      if div is not None:
+        l_html.append(div)
+      if img is not None:
+        filename = 'whirlpool_%s_%s_%s.png' % (denoms[idx], category, metrics)
+        with open('%s/%s' % (os.path.dirname(os.path.abspath(filepath)), filename), 'wb') as f:
+          f.write(img)
+    l_html.append('</body>')
+    l_html.append('</html>')
+
+    with atomic_write(filepath) as f:
+      f.write('\n'.join(l_html))
+
+    if png and any(r[1] is None for r in results if r[0] is not None):
+      print('PNG files require the kaleido package (pip3 install kaleido)')
+    print('Report written in %s' % filepath)
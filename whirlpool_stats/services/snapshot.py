@@ -3,9 +3,14 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 
 A class storing the snapshot for a given denom
 '''
+import os
 import csv
+import hashlib
+from array import array
+from bisect import bisect_right
 from collections import defaultdict
 from whirlpool_stats.utils.constants import *
+from whirlpool_stats.utils.instrumentation import Instrumentation
 
 
 class Snapshot(object):
@@ -18,6 +23,8 @@ class Snapshot(object):
     '''
     self.snapshots_dir = snapshots_dir
     self.denom = None
+    # Measures of the processing phases
+    self.instr = Instrumentation()
     # Data reset
     self.reset_data()
 
@@ -40,14 +47,24 @@ class Snapshot(object):
     self.l_mix_txs = []
     # Ordered list of mix txs block timestamps
     self.l_ts_mix_txs = []
-    # Dictionary of links between txs (src => tgt)
+    # Dictionary of links between txs (src => list of distinct tgts)
     self.d_links = defaultdict(list)
-    # Dictionary of reverse links between txs (tgt => src)
+    # Dictionary of reverse links between txs (tgt => list of distinct srcs)
     self.d_reverse_links = defaultdict(list)
+    # Dictionary (src, tgt) => multiplicity of the link
+    # (number of txos of src spent by tgt, only stored if > 1)
+    self.d_multiplicities = dict()
+    # Dictionary src => number of links in excess of the distinct tgts
+    # (sum of the multiplicities - number of distinct tgts, only stored if > 0)
+    self.d_nb_duplicates = dict()
     # Dictionary txid => mix_round
     self.d_txids = defaultdict(int)
     # Dictionary txid => tiid tx0
     self.d_tx0s = defaultdict(int)
+    # Hash of the snapshot files (computed on demand)
+    self.snapshot_hash = None
+    # Dictionary filename => number of bytes of the file already loaded
+    self.d_offsets = dict()
 
 
   def set_dir(self, snapshots_dir):
@@ -68,63 +85,313 @@ class Snapshot(object):
     # Data reset
     self.reset_data()
     self.denom = denom
+    self.instr.reset()
 
-    print('Start loading snapshot for %s denomination' % self.denom)
+    with self.instr.phase('load'):
+      print('Start loading snapshot for %s denomination' % self.denom)
 
-    # Loads the mix txs
-    filename = '%s_%s.csv' % (FN_MIX_TXS, self.denom)
-    filepath = '%s/%s' % (self.snapshots_dir, filename)
+      # Loads the mix txs
+      filename = '%s_%s.csv' % (FN_MIX_TXS, self.denom)
+      filepath = '%s/%s' % (self.snapshots_dir, filename)
+
+      with open(filepath, newline='\n') as csvfile:
+        file_reader = csv.reader(csvfile, delimiter=';')
+        next(file_reader, None)  # skips the headers
+        for row in file_reader:
+          self.add_mix_tx(row)
+        self.d_offsets[filename] = csvfile.tell()
+
+      print('  Mix txs loaded')
+
+      # Loads the tx0s
+      filename = '%s_%s.csv' % (FN_TX0S, self.denom)
+      filepath = '%s/%s' % (self.snapshots_dir, filename)
+
+      with open(filepath, newline='\n') as csvfile:
+        file_reader = csv.reader(csvfile, delimiter=';')
+        next(file_reader, None)  # skips the headers
+        for row in file_reader:
+          self.add_tx0(row)
+        self.d_offsets[filename] = csvfile.tell()
+
+      print('  Tx0s loaded')
+
+      # Loads the relationships between txs
+      filename = '%s_%s.csv' % (FN_LINKS, self.denom)
+      filepath = '%s/%s' % (self.snapshots_dir, filename)
+      # Links share the int objects of the tiids of the txs
+      d_tiids = dict(zip(self.l_mix_txs, self.l_mix_txs))
+      d_tiids.update(zip(self.l_tx0s, self.l_tx0s))
+
+      with open(filepath, newline='\n') as csvfile:
+        file_reader = csv.reader(csvfile, delimiter=';')
+        next(file_reader, None)  # skips the headers
+        for row in file_reader:
+          self.add_link(row, d_tiids)
+        self.d_offsets[filename] = csvfile.tell()
+
+      print('  Tx links loaded')
+
+      self.instr.count('mix_txs', len(self.l_mix_txs))
+      self.instr.count('tx0s', len(self.l_tx0s))
+      nb_distinct_links = sum(len(v) for v in self.d_links.values())
+      self.instr.count('links', nb_distinct_links + sum(self.d_nb_duplicates.values()))
+      self.instr.count('distinct_links', nb_distinct_links)
+
+      print('Done!')
+
+
+  def add_mix_tx(self, row):
+    '''
+    Adds a mix tx (row of the mix txs file)
+    Parameters:
+      row = list of fields (id, txid, block_ts)
+    '''
+    tiid = int(row[0])
+    mix_round = len(self.l_mix_txs)
+    self.l_mix_txs.append(tiid)
+    self.s_mix_txs.add(tiid)
+    txid_prefix = row[1][0:2*TXID_PREFIX_LENGTH]
+    self.d_txids[txid_prefix] = mix_round
+    ts = int(row[2])
+    self.l_ts_mix_txs.append(ts)
+
+
+  def add_tx0(self, row):
+    '''
+    Adds a tx0 (row of the tx0s file)
+    Parameters:
+      row = list of fields (id, txid, block_ts, nb_outputs)
+    '''
+    tiid = int(row[0])
+    self.l_tx0s.append(tiid)
+    self.s_tx0s.add(tiid)
+    txid_prefix = row[1][0:2*TXID_PREFIX_LENGTH]
+    self.d_tx0s[txid_prefix] = tiid
+    ts = int(row[2])
+    self.l_ts_tx0s.append(ts)
+    nb_utxos = int(row[3])
+    self.l_utxos_tx0s.append(nb_utxos)
+
+
+  def add_link(self, row, d_tiids=None):
+    '''
+    Adds a link between 2 txs (row of the links file)
+    Parameters:
+      row     = list of fields (src, tgt)
+      d_tiids = dictionary tiid => tiid stored by the lists of txs (or None)
+    '''
+    src = int(row[0])
+    tgt = int(row[1])
+    if d_tiids is not None:
+      src = d_tiids.get(src, src)
+      tgt = d_tiids.get(tgt, tgt)
+    self.add_edge(src, tgt)
+
+
+  def add_edge(self, src, tgt, multiplicity=1):
+    '''
+    Adds a link between 2 txs (a link already known increments its multiplicity)
+    Parameters:
+      src          = tiid of the source tx
+      tgt          = tiid of the target tx
+      multiplicity = number of txos of src spent by tgt
+    '''
+    tgts = self.d_links[src]
+    if tgt in tgts:
+      key = (src, tgt)
+      self.d_multiplicities[key] = self.d_multiplicities.get(key, 1) + multiplicity
+      self.d_nb_duplicates[src] = self.d_nb_duplicates.get(src, 0) + multiplicity
+    else:
+      tgts.append(tgt)
+      self.d_reverse_links[tgt].append(src)
+      if multiplicity > 1:
+        self.d_multiplicities[(src, tgt)] = multiplicity
+        self.d_nb_duplicates[src] = self.d_nb_duplicates.get(src, 0) + multiplicity - 1
+
+
+  def get_multiplicity(self, src, tgt):
+    '''
+    Returns the multiplicity of the link between 2 linked txs
+    Parameters:
+      src = tiid of the source tx
+      tgt = tiid of the target tx
+    '''
+    return self.d_multiplicities.get((src, tgt), 1)
 
-    with open(filepath, newline='\n') as csvfile:
-      file_reader = csv.reader(csvfile, delimiter=';')
-      next(file_reader, None)  # skips the headers
-      mix_round = 0
-      for row in file_reader:
-        tiid = int(row[0])
-        self.l_mix_txs.append(tiid)
-        self.s_mix_txs.add(tiid)
-        txid_prefix = row[1][0:2*TXID_PREFIX_LENGTH]
-        self.d_txids[txid_prefix] = mix_round
-        ts = int(row[2])
-        self.l_ts_mix_txs.append(ts)
-        mix_round += 1
-    
-    print('  Mix txs loaded')
-
-    # Loads the tx0s
-    filename = '%s_%s.csv' % (FN_TX0S, self.denom)
-    filepath = '%s/%s' % (self.snapshots_dir, filename)
 
-    with open(filepath, newline='\n') as csvfile:
-      file_reader = csv.reader(csvfile, delimiter=';')
-      next(file_reader, None)  # skips the headers
-      for row in file_reader:
-        tiid = int(row[0])
-        self.l_tx0s.append(tiid)
-        self.s_tx0s.add(tiid)
-        txid_prefix = row[1][0:2*TXID_PREFIX_LENGTH]
-        self.d_tx0s[txid_prefix] = tiid
-        ts = int(row[2])
-        self.l_ts_tx0s.append(ts)
-        nb_utxos = int(row[3])
-        self.l_utxos_tx0s.append(nb_utxos)
-
-    print('  Tx0s loaded')
-
-    # Loads the relationships between txs
-    filename = '%s_%s.csv' % (FN_LINKS, self.denom)
+  def get_nb_links(self, tiid):
+    '''
+    Returns the number of links from a tx (multiplicities included)
+    = number of txos of the tx spent by later txs
+    Parameters:
+      tiid = tiid of the tx
+    '''
+    return len(self.d_links.get(tiid, [])) + self.d_nb_duplicates.get(tiid, 0)
+
+
+  def read_tail(self, filename):
+    '''
+    Returns the rows appended to a snapshot file since it was loaded
+    (or None if the file has been rewritten)
+    Parameters:
+      filename = name of the file
+    '''
     filepath = '%s/%s' % (self.snapshots_dir, filename)
+    offset = self.d_offsets.get(filename)
+    if (offset is None) or (os.path.getsize(filepath) < offset):
+      return None
+    with open(filepath, 'rb') as f:
+      f.seek(offset)
+      data = f.read()
+    # Ignores an incomplete last row (file being written)
+    nb_bytes = data.rfind(b'\n') + 1
+    self.d_offsets[filename] = offset + nb_bytes
+    lines = data[0:nb_bytes].decode('utf-8').splitlines()
+    return [row for row in csv.reader(lines, delimiter=';') if len(row) > 0]
+
+
+  def load_tail(self):
+    '''
+    Loads the rows appended to the files of the snapshot since it was loaded
+    (new mix txs, tx0s and links are appended to the data structures)
+    Returns a tuple (nb_new_mixes, nb_new_tx0s, list of new links (src, tgt))
+    or None if the snapshot can't be updated incrementally (files rewritten,
+    new txs older than the loaded txs, new links towards loaded txs).
+    The snapshot must be reloaded in this case.
+    '''
+    with self.instr.phase('load tail'):
+      d_rows = dict()
+      for fn in FILENAME_TEMPLATES:
+        filename = '%s_%s.csv' % (fn, self.denom)
+        d_rows[fn] = self.read_tail(filename)
+        if d_rows[fn] is None:
+          return None
+
+      # Checks that the new txs follow the loaded txs
+      last_tiid = max(self.l_mix_txs[-1:] + self.l_tx0s[-1:] + [0])
+      new_tiids = [int(row[0]) for row in d_rows[FN_MIX_TXS] + d_rows[FN_TX0S]]
+      if any(tiid <= last_tiid for tiid in new_tiids):
+        return None
+      s_new_tiids = set(new_tiids)
+      l_new_links = [(int(row[0]), int(row[1])) for row in d_rows[FN_LINKS]]
+      if any(tgt not in s_new_tiids for src, tgt in l_new_links):
+        return None
+
+      for row in d_rows[FN_MIX_TXS]:
+        self.add_mix_tx(row)
+      for row in d_rows[FN_TX0S]:
+        self.add_tx0(row)
+      for row in d_rows[FN_LINKS]:
+        self.add_link(row)
+      self.snapshot_hash = None
+
+      nb_new_mixes = len(d_rows[FN_MIX_TXS])
+      nb_new_tx0s = len(d_rows[FN_TX0S])
+      self.instr.count('mix_txs', nb_new_mixes)
+      self.instr.count('tx0s', nb_new_tx0s)
+      self.instr.count('links', len(l_new_links))
+
+    return nb_new_mixes, nb_new_tx0s, l_new_links
+
+
+  def get_hash(self):
+    '''
+    Returns the hash (sha256) of the files of the loaded snapshot
+    (used as a key by the data derived from the snapshot and persisted)
+    '''
+    if self.snapshot_hash is None:
+      h = hashlib.sha256()
+      for fn in FILENAME_TEMPLATES:
+        filepath = '%s/%s_%s.csv' % (self.snapshots_dir, fn, self.denom)
+        with open(filepath, 'rb') as f:
+          for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+      self.snapshot_hash = h.hexdigest()
+    return self.snapshot_hash
+
+
+  def get_graph(self):
+    '''
+    Returns the transaction graph of the snapshot (mix txs, tx0s and links
+    stored in arrays, see set_graph)
+    '''
+    links_src = array('q')
+    links_tgt = array('q')
+    links_mult = array('q')
+    for src, tgts in self.d_links.items():
+      links_src.extend([src] * len(tgts))
+      links_tgt.extend(tgts)
+      links_mult.extend([self.get_multiplicity(src, tgt) for tgt in tgts])
+    return {
+      'denom': self.denom,
+      'mix_txs': array('q', self.l_mix_txs),
+      'ts_mix_txs': array('q', self.l_ts_mix_txs),
+      'tx0s': array('q', self.l_tx0s),
+      'ts_tx0s': array('q', self.l_ts_tx0s),
+      'utxos_tx0s': array('q', self.l_utxos_tx0s),
+      'links_src': links_src,
+      'links_tgt': links_tgt,
+      'links_mult': links_mult
+    }
+
+
+  def set_graph(self, graph):
+    '''
+    Replaces the data of the snapshot by a transaction graph returned by get_graph
+    (txids aren't part of the graph)
+    Parameters:
+      graph = transaction graph
+    '''
+    self.reset_data()
+    self.denom = graph['denom']
+    self.l_mix_txs = graph['mix_txs'].tolist()
+    self.l_ts_mix_txs = graph['ts_mix_txs'].tolist()
+    self.s_mix_txs = set(self.l_mix_txs)
+    self.l_tx0s = graph['tx0s'].tolist()
+    self.l_ts_tx0s = graph['ts_tx0s'].tolist()
+    self.l_utxos_tx0s = graph['utxos_tx0s'].tolist()
+    self.s_tx0s = set(self.l_tx0s)
+    # Links share the int objects of the tiids of the txs
+    d_tiids = dict(zip(self.l_mix_txs, self.l_mix_txs))
+    d_tiids.update(zip(self.l_tx0s, self.l_tx0s))
+    for src, tgt, multiplicity in zip(graph['links_src'], graph['links_tgt'], graph['links_mult']):
+      self.add_edge(d_tiids.get(src, src), d_tiids.get(tgt, tgt), multiplicity)
+
+
+  def get_snapshot_until(self, ts):
+    '''
+    Returns a new snapshot restricted to the txs confirmed
+    at or before a given timestamp (state of the snapshot at this date)
+    Parameters:
+      ts = unix timestamp
+    '''
+    snapshot = Snapshot(self.snapshots_dir)
+    snapshot.denom = self.denom
+    snapshot.instr = self.instr
+
+    # Mix txs and tx0s are ordered chronologically
+    nb_mixes = bisect_right(self.l_ts_mix_txs, ts)
+    nb_tx0s = bisect_right(self.l_ts_tx0s, ts)
+
+    snapshot.l_mix_txs = self.l_mix_txs[0:nb_mixes]
+    snapshot.l_ts_mix_txs = self.l_ts_mix_txs[0:nb_mixes]
+    snapshot.s_mix_txs = set(snapshot.l_mix_txs)
+    snapshot.l_tx0s = self.l_tx0s[0:nb_tx0s]
+    snapshot.l_ts_tx0s = self.l_ts_tx0s[0:nb_tx0s]
+    snapshot.l_utxos_tx0s = self.l_utxos_tx0s[0:nb_tx0s]
+    snapshot.s_tx0s = set(snapshot.l_tx0s)
 
-    with open(filepath, newline='\n') as csvfile:
-      file_reader = csv.reader(csvfile, delimiter=';')
-      next(file_reader, None)  # skips the headers
-      for row in file_reader:
-        src = int(row[0])
-        tgt = int(row[1])
-        self.d_links[src].append(tgt)
-        self.d_reverse_links[tgt].append(src)
+    for txid_prefix, mix_round in self.d_txids.items():
+      if mix_round < nb_mixes:
+        snapshot.d_txids[txid_prefix] = mix_round
+    for txid_prefix, tiid in self.d_tx0s.items():
+      if tiid in snapshot.s_tx0s:
+        snapshot.d_tx0s[txid_prefix] = tiid
 
-    print('  Tx links loaded')
-    
-    print('Done!')
+    # Keeps the links between the remaining txs
+    for tgt in snapshot.l_mix_txs:
+      for src in self.d_reverse_links.get(tgt, []):
+        snapshot.add_edge(src, tgt, self.get_multiplicity(src, tgt))
 
+    return snapshot
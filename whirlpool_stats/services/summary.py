@@ -0,0 +1,203 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class maintaining per-day and all-time quantile sketches of the anonsets and spreads
+(updated by the metrics classes while they compute the metrics)
+'''
+import json
+from collections import defaultdict
+from whirlpool_stats.utils.kll import KLLSketch, DEFAULT_K
+from whirlpool_stats.utils.date import to_utcdate
+from whirlpool_stats.utils.files import atomic_write
+
+
+# List of summarized metrics
+SUMMARY_METRICS = [
+  'fwd anonset',
+  'fwd spread',
+  'bwd anonset',
+  'bwd spread'
+]
+
+# Percentiles displayed and exported by the summary
+SUMMARY_PERCENTILES = [1, 10, 50, 90, 99]
+
+
+class MetricsSummary(object):
+
+  def __init__(self, k=DEFAULT_K):
+    '''
+    Constructor
+    Parameters:
+      k = size parameter of the quantile sketches
+    '''
+    self.k = k
+    # List of the denominations summarized by the sketches
+    self.l_denoms = []
+    # Dictionary metrics => all-time sketch
+    self.d_sketches = dict()
+    # Dictionary metrics => dictionary timestamp of day => sketch of the day
+    self.d_day_sketches = defaultdict(dict)
+
+
+  def reset(self, l_metrics=SUMMARY_METRICS):
+    '''
+    Resets the sketches of a list of metrics (e.g. before they're computed)
+    Parameters:
+      l_metrics = list of metrics
+    '''
+    for metrics in l_metrics:
+      self.d_sketches[metrics] = KLLSketch(self.k)
+      self.d_day_sketches[metrics] = dict()
+
+
+  def set_denom(self, denom):
+    '''
+    Sets the denomination summarized by the sketches
+    Parameters:
+      denom = denomination code
+    '''
+    self.l_denoms = [denom]
+
+
+  def update(self, metrics, ts, value):
+    '''
+    Adds a value to the all-time sketch and to the sketch of its day
+    Parameters:
+      metrics = name of the metrics
+      ts      = timestamp of the mix
+      value   = value
+    '''
+    self.d_sketches[metrics].update(value)
+    day = ts - ts % 86400
+    d_days = self.d_day_sketches[metrics]
+    sketch = d_days.get(day)
+    if sketch is None:
+      sketch = KLLSketch(self.k)
+      d_days[day] = sketch
+    sketch.update(value)
+
+
+  def merge(self, other):
+    '''
+    Merges another summary into this summary (e.g. summary of another denomination)
+    Parameters:
+      other = summary
+    '''
+    self.l_denoms.extend(other.l_denoms)
+    for metrics, sketch in other.d_sketches.items():
+      if metrics not in self.d_sketches:
+        self.d_sketches[metrics] = KLLSketch(self.k)
+      self.d_sketches[metrics].merge(sketch)
+    for metrics, d_days in other.d_day_sketches.items():
+      for day, sketch in d_days.items():
+        if day not in self.d_day_sketches[metrics]:
+          self.d_day_sketches[metrics][day] = KLLSketch(self.k)
+        self.d_day_sketches[metrics][day].merge(sketch)
+
+
+  def get_percentiles(self, sketch, percentiles=SUMMARY_PERCENTILES):
+    '''
+    Returns a dictionary percentile label => estimated value
+    Parameters:
+      sketch      = quantile sketch
+      percentiles = list of percentiles
+    '''
+    values = sketch.get_quantiles([p / 100.0 for p in percentiles])
+    return dict(zip(['p%d' % p for p in percentiles], values))
+
+
+  def get_days(self):
+    '''
+    Returns the sorted list of the days having sketches (timestamps)
+    '''
+    s_days = set()
+    for d_days in self.d_day_sketches.values():
+      s_days.update(d_days.keys())
+    return sorted(s_days)
+
+
+  def display(self, day=None):
+    '''
+    Displays the all-time percentiles (or the percentiles of a given day)
+    Parameters:
+      day = timestamp of the day (None = all-time)
+    '''
+    if len(self.d_sketches) == 0:
+      print('No summary available (load a snapshot first).')
+      return
+
+    if day is None:
+      print('All-time summary (pools %s)' % ', '.join(self.l_denoms))
+    else:
+      print('Summary of %s (pools %s)' % (to_utcdate(day).strftime('%d/%m/%Y'), ', '.join(self.l_denoms)))
+    print('')
+    print('%-12s %10s  %s' % ('metrics', 'count', '  '.join(['%10s' % ('p%d' % p) for p in SUMMARY_PERCENTILES])))
+
+    for metrics in SUMMARY_METRICS:
+      if day is None:
+        sketch = self.d_sketches.get(metrics)
+      else:
+        sketch = self.d_day_sketches[metrics].get(day)
+      if (sketch is None) or (sketch.count == 0):
+        print('%-12s %10d' % (metrics, 0))
+        continue
+      d_pcts = self.get_percentiles(sketch)
+      fmt = '%10.2f' if metrics.endswith('spread') else '%10d'
+      l_cols = [fmt % d_pcts['p%d' % p] for p in SUMMARY_PERCENTILES]
+      print('%-12s %10d  %s' % (metrics, sketch.count, '  '.join(l_cols)))
+
+
+  def to_dict(self):
+    '''
+    Returns the summary as a dictionary (json serializable)
+    storing the percentiles and the sketches (used for merging summaries)
+    '''
+    d_summary = {
+      'denoms': self.l_denoms,
+      'percentiles': {'all': dict(), 'days': dict()},
+      'sketches': {'all': dict(), 'days': dict()}
+    }
+    for metrics, sketch in self.d_sketches.items():
+      d_summary['percentiles']['all'][metrics] = self.get_percentiles(sketch)
+      d_summary['sketches']['all'][metrics] = sketch.to_dict()
+    for metrics, d_days in self.d_day_sketches.items():
+      for day in sorted(d_days.keys()):
+        str_day = to_utcdate(day).strftime('%Y-%m-%d')
+        d_pcts = d_summary['percentiles']['days'].setdefault(str_day, dict())
+        d_pcts[metrics] = self.get_percentiles(d_days[day])
+        d_sketches = d_summary['sketches']['days'].setdefault(str(day), dict())
+        d_sketches[metrics] = d_days[day].to_dict()
+    return d_summary
+
+
+  def save(self, filepath):
+    '''
+    Saves the summary in a json file
+    Parameters:
+      filepath = path of the file
+    '''
+    with atomic_write(filepath) as f:
+      json.dump(self.to_dict(), f)
+
+
+  @staticmethod
+  def load(filepath):
+    '''
+    Loads a summary saved in a json file
+    Returns the summary
+    Parameters:
+      filepath = path of the file
+    '''
+    with open(filepath, 'r') as f:
+      d_summary = json.load(f)
+
+    summary = MetricsSummary()
+    summary.l_denoms = d_summary['denoms']
+    for metrics, d_sketch in d_summary['sketches']['all'].items():
+      summary.d_sketches[metrics] = KLLSketch.from_dict(d_sketch)
+      summary.k = d_sketch['k']
+    for day, d_metrics in d_summary['sketches']['days'].items():
+      for metrics, d_sketch in d_metrics.items():
+        summary.d_day_sketches[metrics][int(day)] = KLLSketch.from_dict(d_sketch)
+    return summary
@@ -3,66 +3,267 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 
 A class computing a set of metrics for the Tx0s
 '''
+from array import array
 from collections import defaultdict
 from whirlpool_stats.utils.date import get_datetime_of_day
+from whirlpool_stats.utils.columns import Columns, TX0_COLUMNS, get_numpy
 
 
 class Tx0sMetrics(object):
 
-  def __init__(self, snapshot= None):
+  def __init__(self, snapshot= None, fwd_metrics=None):
     '''
     Constructor
     Parameters:
-      snapshot = snapshot
+      snapshot    = snapshot
+      fwd_metrics = Forward-looking metrics (reused for the anonsets of the tx0s)
     '''
     self.snapshot = snapshot
-    # Dictionary txid_prefix => (nb_outputs_tx0, nb_counterparties)
-    self.d_metrics = dict()
+    self.fwd_metrics = fwd_metrics
+    # Results ordered by tx0 index (columns nb_outputs, nb_mixed_outputs, nb_counterparties, anonset)
+    # Anonsets are the forward-looking anonsets of the outputs of the tx0s
+    # (empty column if the forward-looking metrics aren't available)
+    self.columns = Columns(TX0_COLUMNS)
+    # Dictionary txid_prefix => tx0 index
+    self.d_indices = dict()
     # Dictionary date => nb_new_tx0s
     self.d_nb_new_tx0s = defaultdict(int)
 
 
+  @property
+  def l_anonsets(self):
+    '''
+    Column of the forward-looking anonsets ordered by tx0 index
+    '''
+    return self.columns.anonset
+
+
   def compute(self):
     '''
     Computes the metrics
     '''
-    print('Start computing metrics for the Tx0s')
+    instr = self.snapshot.instr
 
-    # Resets data structures storing the results
-    self.d_metrics = dict()
-    self.d_nb_new_tx0s = defaultdict(int)
+    with instr.phase('compute tx0'):
+      print('Start computing metrics for the Tx0s')
+
+      # Resets data structures storing the results
+      self.columns.reset()
+      self.d_nb_new_tx0s = defaultdict(int)
+
+      # Iterates over the Tx0s
+      nb_processed = 0
+      nb_tx0s = len(self.snapshot.l_tx0s)
+      progress = instr.progress('Computed metrics for', nb_tx0s, 'tx0s')
+
+      for tiid in self.snapshot.l_tx0s:
+        # Stores the results
+        self.set_tx0_metrics(tiid, nb_processed)
+        # Updates the #tx0s created per day
+        day = get_datetime_of_day(self.snapshot.l_ts_tx0s[nb_processed])
+        self.d_nb_new_tx0s[day] += 1
+        # Reports the progress
+        nb_processed += 1
+        progress.update(nb_processed)
+
+      d_indices = dict(zip(self.snapshot.l_tx0s, range(0, nb_tx0s)))
+      self.d_indices = {prefix: d_indices[tiid] for prefix, tiid in self.snapshot.d_tx0s.items()}
+
+      instr.count('tx0s_processed', nb_processed)
+
+      # Computes the forward-looking anonsets of the tx0s
+      if self.fwd_metrics is not None:
+        self.compute_anonsets()
+
+      print('Done!')
+
+
+  def get_metrics(self, prefix):
+    '''
+    Returns the tuple (nb_spent_txos, nb_counterparties, nb_txos, idx) of a tx0
+    Parameters:
+      prefix = txid prefix of the tx0
+    '''
+    idx = self.d_indices[prefix]
+    columns = self.columns
+    return (columns.nb_mixed_outputs[idx], columns.nb_counterparties[idx], columns.nb_outputs[idx], idx)
+
+
+  def set_tx0_metrics(self, tiid, idx):
+    '''
+    Computes the metrics of a tx0 and stores them in the columns
+    Parameters:
+      tiid = id of the tx0
+      idx  = index of the tx0 (appended if idx is the number of tx0s already stored)
+    '''
+    nb_spent_txos, nb_counterparties, nb_txos, idx = self.get_tx0_metrics(tiid, idx)
+    columns = self.columns
+    if idx == len(columns):
+      columns.append('nb_outputs', nb_txos)
+      columns.append('nb_mixed_outputs', nb_spent_txos)
+      columns.append('nb_counterparties', nb_counterparties)
+    else:
+      columns.nb_outputs[idx] = nb_txos
+      columns.nb_mixed_outputs[idx] = nb_spent_txos
+      columns.nb_counterparties[idx] = nb_counterparties
+
+
+  def get_tx0_metrics(self, tiid, idx):
+    '''
+    Returns the tuple (nb_spent_txos, nb_counterparties, nb_txos, idx) of a tx0
+    Parameters:
+      tiid = id of the tx0
+      idx  = index of the tx0
+    '''
+    s_counterparties = set()
+    # Gets the number of outputs created by the current Tx0
+    nb_txos = self.snapshot.l_utxos_tx0s[idx]
+    # Gets the number of spent outputs for the current Tx0
+    first_mixes = self.snapshot.d_links[tiid]
+    nb_spent_txos = self.snapshot.get_nb_links(tiid)
+    # Lists the Tx0s acting as counterparties 
+    # for the first mixes of the current Tx0
+    for tiid_mix in first_mixes:
+      prev_tiids = self.snapshot.d_reverse_links[tiid_mix]
+      # Checks if counterparty comes from a Tx0
+      for prev_tiid in prev_tiids:
+        if prev_tiid in self.snapshot.s_tx0s:
+          s_counterparties.add(prev_tiid)
+    # Gets number of tx0s counterparties for the current Tx0
+    # (remove 1 for the current Tx0)
+    nb_counterparties = len(s_counterparties) - 1
+    return (nb_spent_txos, nb_counterparties, nb_txos, idx)
+
+
+  def update(self, nb_new_tx0s, nb_new_mixes, d_tx0_deltas):
+    '''
+    Updates the exact metrics after new txs have been appended to the snapshot
+    (see Snapshot.load_tail and ForwardMetrics.update)
+    Only the new tx0s and the tx0s spent by the new mixes are recomputed.
+    Parameters:
+      nb_new_tx0s  = number of tx0s appended to the snapshot
+      nb_new_mixes = number of mix txs appended to the snapshot
+      d_tx0_deltas = dictionary tiid tx0 => variation of the anonset of the tx0
+    '''
+    snapshot = self.snapshot
+    instr = snapshot.instr
+
+    with instr.phase('update tx0'):
+      nb_tx0s = len(snapshot.l_tx0s)
+      nb_old_tx0s = nb_tx0s - nb_new_tx0s
+      d_indices = dict(zip(snapshot.l_tx0s, range(0, nb_tx0s)))
+      d_prefixes = {tiid: prefix for prefix, tiid in snapshot.d_tx0s.items()}
+
+      # New tx0s (appended in tx0 index order)
+      for idx in range(nb_old_tx0s, nb_tx0s):
+        tiid = snapshot.l_tx0s[idx]
+        self.set_tx0_metrics(tiid, idx)
+        self.d_indices[d_prefixes[tiid]] = idx
+        day = get_datetime_of_day(snapshot.l_ts_tx0s[idx])
+        self.d_nb_new_tx0s[day] += 1
+
+      # Tx0s spent by the new mixes
+      s_updated = set()
+      for tiid_mix in snapshot.l_mix_txs[len(snapshot.l_mix_txs) - nb_new_mixes:]:
+        for prev_tiid in snapshot.d_reverse_links[tiid_mix]:
+          if (prev_tiid in snapshot.s_tx0s) and (d_indices[prev_tiid] < nb_old_tx0s):
+            s_updated.add(prev_tiid)
+
+      for tiid in s_updated:
+        self.set_tx0_metrics(tiid, d_indices[tiid])
+
+      instr.count('tx0s_processed', nb_new_tx0s + len(s_updated))
+
+      if self.fwd_metrics is not None:
+        for tiid, delta in d_tx0_deltas.items():
+          idx = d_indices[tiid]
+          if idx < nb_old_tx0s:
+            self.l_anonsets[idx] += delta
+        d_rounds = dict(zip(snapshot.l_mix_txs, range(0, len(snapshot.l_mix_txs))))
+        self.columns.extend('anonset', self.get_anonsets(snapshot.l_tx0s[nb_old_tx0s:], d_rounds))
+
+
+  def compute_anonsets(self):
+    '''
+    Computes the forward-looking anonsets of the outputs of the tx0s
+    (union of the forward-looking anonsets of their first mixes)
+
+    Anonsets of the first mixes are reused for the tx0s having a single first mix.
+    Other tx0s are processed by the backend of the forward-looking metrics
+    (a single walk shared by all their first mixes).
+    Approximate anonsets are computed by the forward-looking metrics
+    (merge of the sketches of the first mixes).
+    '''
+    snapshot = self.snapshot
+    fwd_metrics = self.fwd_metrics
+
+    if fwd_metrics.approx_precision is not None:
+      self.columns.set_column('anonset', [fwd_metrics.d_tx0_anonsets.get(tiid, 0) for tiid in snapshot.l_tx0s])
+      return
+
+    d_rounds = dict(zip(snapshot.l_mix_txs, range(0, len(snapshot.l_mix_txs))))
+    self.columns.set_column('anonset', self.get_anonsets(snapshot.l_tx0s, d_rounds))
 
-    # Iterates over the Tx0s
-    nb_processed = 0
-    nb_tx0s = len(self.snapshot.d_tx0s.keys())
-
-    for prefix, tiid in self.snapshot.d_tx0s.items():
-      s_counterparties = set()
-      # Gets the number of outputs created by the current Tx0
-      nb_txos = self.snapshot.l_utxos_tx0s[nb_processed]
-      # Gets the number of spent outputs for the current Tx0
-      first_mixes = self.snapshot.d_links[tiid]
-      nb_spent_txos = len(first_mixes)
-      # Lists the Tx0s acting as counterparties 
-      # for the first mixes of the current Tx0
-      for tiid_mix in first_mixes:
-        prev_tiids = self.snapshot.d_reverse_links[tiid_mix]
-        # Checks if counterparty comes from a Tx0
-        for prev_tiid in prev_tiids:
-          if prev_tiid in self.snapshot.s_tx0s:
-            s_counterparties.add(prev_tiid)
-      # Gets number of tx0s counterparties for the current Tx0
-      # (remove 1 for the current Tx0)
-      nb_counterparties = len(s_counterparties) - 1
-      # Stores the results
-      self.d_metrics[prefix] = (nb_spent_txos, nb_counterparties, nb_txos, nb_processed)
-      # Updates the #tx0s created per day
-      day = get_datetime_of_day(self.snapshot.l_ts_tx0s[nb_processed])
-      self.d_nb_new_tx0s[day] += 1
-      # Displays a trace
-      nb_processed += 1
-      if nb_processed % 100 == 0:
-        pct_progress = nb_processed * 100 / nb_tx0s
-        print('  Computed metrics for %d tx0s (%d%%)' % (nb_processed, pct_progress))
-
-    print('Done!')
+
+  def get_anonsets(self, l_tiids, d_rounds):
+    '''
+    Returns the list of the exact forward-looking anonsets of the outputs of tx0s
+    Parameters:
+      l_tiids  = list of tiids of tx0s
+      d_rounds = dictionary tiid mix => mix round
+    '''
+    fwd_metrics = self.fwd_metrics
+    l_anonsets = []
+    # Tx0s having several first mixes (joint walks computed by the backend)
+    l_groups = []
+    l_group_indices = []
+    nb_reused = 0
+
+    for tiid in l_tiids:
+      first_mixes = set([t for t in self.snapshot.d_links.get(tiid, []) if t in d_rounds])
+      if len(first_mixes) == 0:
+        # Outputs of the tx0 not mixed yet
+        l_anonsets.append(0)
+      elif len(first_mixes) == 1:
+        l_anonsets.append(fwd_metrics.l_anonsets[d_rounds[first_mixes.pop()]])
+        nb_reused += 1
+      else:
+        # Descendants shared by several first mixes are counted once
+        l_group_indices.append(len(l_anonsets))
+        l_groups.append(sorted(first_mixes))
+        l_anonsets.append(0)
+
+    for idx, anonset in zip(l_group_indices, fwd_metrics.backend.get_fwd_anonsets(l_groups)):
+      l_anonsets[idx] = anonset
+
+    self.snapshot.instr.count('tx0_anonsets_reused', nb_reused)
+    return l_anonsets
+
+
+  def get_mixed_tx0s(self):
+    '''
+    Returns the indices of the tx0s having mixed outputs
+    '''
+    nb_mixed_outputs = self.columns.get_view('nb_mixed_outputs')
+    np = get_numpy()
+    if np is None:
+      return [idx for idx, nb in enumerate(nb_mixed_outputs) if nb > 0]
+    return np.flatnonzero(nb_mixed_outputs > 0)
+
+
+  def get_heterogeneity_ratios(self):
+    '''
+    Returns the heterogeneity ratios (#counterparties / #mixed outputs) ordered by tx0 index
+    (nan for the tx0s without mixed outputs)
+    '''
+    nb_mixed_outputs = self.columns.get_view('nb_mixed_outputs')
+    nb_counterparties = self.columns.get_view('nb_counterparties')
+    np = get_numpy()
+    if np is None:
+      return array('d', [
+        float(nb_cp) / float(nb) if nb > 0 else float('nan')
+        for nb_cp, nb in zip(nb_counterparties, nb_mixed_outputs)
+      ])
+    ratios = np.full(len(nb_mixed_outputs), np.nan)
+    np.divide(nb_counterparties, nb_mixed_outputs, out=ratios, where=nb_mixed_outputs > 0)
+    return ratios
@@ -0,0 +1,315 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Non-interactive mode refreshing the metrics of one or several denominations
+on a schedule. The rows appended to the snapshots are loaded in the snapshots
+kept in memory, the metrics are updated incrementally and the exported files
+are rewritten atomically.
+'''
+import os
+import sys
+import json
+import time
+import getopt
+from contextlib import redirect_stdout
+from whirlpool_stats.utils.constants import *
+from whirlpool_stats.utils.files import atomic_write
+from whirlpool_stats.services.snapshot import Snapshot
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.services.backward_metrics import BackwardMetrics
+from whirlpool_stats.services.tx0s_metrics import Tx0sMetrics
+from whirlpool_stats.services.summary import MetricsSummary
+from whirlpool_stats.services.exporter import Exporter
+from whirlpool_stats.backends import BACKENDS, DEFAULT_BACKEND, get_backend_class
+
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+
+# Default interval between 2 checks (in seconds)
+DEFAULT_INTERVAL = 600
+
+# Filename template of the status of the refreshes
+FN_WATCH_STATUS = 'whirlpool_watch_status'
+
+
+class Watcher(object):
+
+  def __init__(self, working_dir, denom, socks5=None, download=True, backend=DEFAULT_BACKEND):
+    '''
+    Constructor
+    Parameters:
+      working_dir = path of the directory storing the snapshot and exported files
+      denom       = code identifying the mix denomination
+      socks5      = url of the socks5 proxy to use (or None)
+      download    = flag indicating if the snapshots are downloaded
+                    (otherwise the files of the working directory are watched)
+      backend     = name of the backend computing the exact anonsets
+    '''
+    self.working_dir = working_dir
+    self.denom = denom
+    self.socks5 = socks5
+    self.download = download
+    self.backend = backend
+    # Snapshot and metrics kept in memory between 2 refreshes
+    self.snapshot = None
+    self.fwd_metrics = None
+    self.bwd_metrics = None
+    self.tx0_metrics = None
+    # Status of the last check and of the last refresh
+    self.d_status = {
+      'denom': denom,
+      'status': 'ok',
+      'last_check': None,
+      'last_refresh': None,
+      'mode': None,
+      'nb_refreshes': 0,
+      'nb_new_mixes': 0,
+      'duration': None,
+      'latency': None
+    }
+
+
+  def get_filepaths(self):
+    '''
+    Returns the list of paths of the snapshot files
+    '''
+    return ['%s/%s_%s.csv' % (self.working_dir, fn, self.denom) for fn in FILENAME_TEMPLATES]
+
+
+  def has_grown(self):
+    '''
+    Checks if rows have been appended to the snapshot files since they were loaded
+    '''
+    for filepath in self.get_filepaths():
+      filename = os.path.basename(filepath)
+      if os.path.getsize(filepath) != self.snapshot.d_offsets.get(filename):
+        return True
+    return False
+
+
+  def load(self):
+    '''
+    Loads the snapshot and computes the metrics from scratch
+    '''
+    self.snapshot = Snapshot(self.working_dir)
+    self.snapshot.load(self.denom)
+    summary = MetricsSummary()
+    summary.set_denom(self.denom)
+    self.fwd_metrics = ForwardMetrics(self.snapshot)
+    self.fwd_metrics.summary = summary
+    self.fwd_metrics.resumable = True
+    self.fwd_metrics.backend_name = self.backend
+    self.fwd_metrics.compute()
+    self.bwd_metrics = BackwardMetrics(self.snapshot)
+    self.bwd_metrics.summary = summary
+    self.bwd_metrics.resumable = True
+    self.bwd_metrics.backend_name = self.backend
+    self.bwd_metrics.compute()
+    self.tx0_metrics = Tx0sMetrics(self.snapshot, self.fwd_metrics)
+    self.tx0_metrics.compute()
+
+
+  def update(self, tail):
+    '''
+    Updates the metrics with the txs appended to the snapshot
+    Parameters:
+      tail = tuple returned by Snapshot.load_tail()
+    '''
+    nb_new_mixes, nb_new_tx0s, l_new_links = tail
+    d_tx0_deltas = self.fwd_metrics.update(nb_new_mixes, l_new_links)
+    self.bwd_metrics.update(nb_new_mixes)
+    self.tx0_metrics.update(nb_new_tx0s, nb_new_mixes, d_tx0_deltas)
+
+
+  def refresh(self):
+    '''
+    Checks if the snapshot has changed and refreshes the metrics and the exported files
+    Returns the status of the watcher (dictionary)
+    '''
+    start = time.time()
+    d_status = self.d_status
+    d_status['last_check'] = start
+
+    try:
+      replaced = False
+      if self.download:
+        from whirlpool_stats.services.downloader import Downloader
+        d_files = Downloader().sync(self.working_dir, self.denom, self.socks5)
+        replaced = 'replaced' in d_files.values()
+
+      if (self.snapshot is None) or replaced:
+        mode = 'full'
+      elif not self.has_grown():
+        mode = None
+      else:
+        self.snapshot.instr.reset()
+        nb_mixes = len(self.snapshot.l_mix_txs)
+        tail = self.snapshot.load_tail()
+        if tail is None:
+          mode = 'full'
+        elif (tail[0] == 0) and (tail[1] == 0) and (len(tail[2]) == 0):
+          mode = None
+        else:
+          mode = 'incremental'
+          self.update(tail)
+
+      if mode == 'full':
+        nb_mixes = len(self.snapshot.l_mix_txs) if self.snapshot is not None else 0
+        self.load()
+
+      d_status['status'] = 'ok'
+      d_status.pop('error', None)
+      if mode is None:
+        return d_status
+
+      Exporter(self.fwd_metrics, self.bwd_metrics, self.tx0_metrics).export(self.working_dir)
+
+      end = time.time()
+      data_ts = max([os.path.getmtime(fp) for fp in self.get_filepaths()])
+      d_status['last_refresh'] = end
+      d_status['mode'] = mode
+      d_status['nb_refreshes'] += 1
+      d_status['nb_new_mixes'] = len(self.snapshot.l_mix_txs) - nb_mixes
+      d_status['duration'] = end - start
+      # Delay between the last modification of the snapshot and the refreshed exports
+      d_status['latency'] = end - data_ts
+
+    except Exception as e:
+      d_status['status'] = 'error'
+      d_status['error'] = '%s: %s' % (type(e).__name__, e)
+      # Metrics may be partially updated, they're recomputed by the next refresh
+      self.snapshot = None
+
+    return d_status
+
+
+def save_status(working_dir, l_watchers):
+  '''
+  Saves the status of the watchers in a json file (written atomically)
+  Parameters:
+    working_dir = path of the directory storing the snapshot and exported files
+    l_watchers  = list of watchers
+  '''
+  filepath = '%s/%s.json' % (working_dir, FN_WATCH_STATUS)
+  with atomic_write(filepath) as f:
+    json.dump({w.denom: w.d_status for w in l_watchers}, f, indent=2)
+
+
+def run(working_dir, denoms, socks5=None, download=True, interval=DEFAULT_INTERVAL, once=False,
+        backend=DEFAULT_BACKEND):
+  '''
+  Refreshes the metrics of a list of denominations every interval seconds
+  Messages are printed on stderr, the status of each refresh is written on stdout
+  Parameters:
+    working_dir = path of the directory storing the snapshot and exported files
+    denoms      = list of codes identifying the mix denominations
+    socks5      = url of the socks5 proxy to use (or None)
+    download    = flag indicating if the snapshots are downloaded
+    interval    = interval between 2 checks (in seconds)
+    once        = flag indicating if a single check is done
+    backend     = name of the backend computing the exact anonsets
+  '''
+  l_watchers = [Watcher(working_dir, d, socks5, download, backend) for d in denoms]
+  nb_errors = 0
+
+  while True:
+    start = time.time()
+    nb_errors = 0
+    for watcher in l_watchers:
+      with redirect_stdout(sys.stderr):
+        d_status = watcher.refresh()
+      if d_status['status'] != 'ok':
+        nb_errors += 1
+      if d_status['last_refresh'] is not None and d_status['last_refresh'] >= start:
+        sys.stdout.write(json.dumps(d_status) + '\n')
+        sys.stdout.flush()
+    save_status(working_dir, l_watchers)
+    if once:
+      break
+    time.sleep(max(0, start + interval - time.time()))
+
+  return EXIT_OK if nb_errors == 0 else EXIT_FAILURE
+
+
+def main(argv):
+  '''
+  Main function of the watch subcommand
+  Returns the exit code
+  Parameters:
+    argv = list of command line arguments
+  '''
+  working_dir = '/tmp'
+  denoms = ALL_DENOMS
+  socks5 = None
+  download = True
+  interval = DEFAULT_INTERVAL
+  once = False
+  backend = DEFAULT_BACKEND
+
+  try:
+    opts, args = getopt.getopt(
+      argv,
+      'hw:d:s:i:b:',
+      ['help', 'workdir=', 'denoms=', 'socks5=', 'interval=', 'backend=', 'local', 'once']
+    )
+  except getopt.GetoptError:
+    usage()
+    return EXIT_USAGE
+
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      return EXIT_OK
+    elif opt in ('-w', '--workdir'):
+      working_dir = arg
+    elif opt in ('-d', '--denoms'):
+      denoms = [d.strip() for d in arg.split(',')]
+    elif opt in ('-s', '--socks5'):
+      socks5 = arg
+    elif opt in ('-i', '--interval'):
+      if not arg.isdigit():
+        usage()
+        return EXIT_USAGE
+      interval = int(arg)
+    elif opt in ('-b', '--backend'):
+      backend = arg
+    elif opt == '--local':
+      download = False
+    elif opt == '--once':
+      once = True
+
+  if (len(args) > 0) or any(d not in ALL_DENOMS for d in denoms) or \
+    (backend not in BACKENDS):
+    usage()
+    return EXIT_USAGE
+  # Only the selected backend is imported (numpy and numba are slow to import)
+  if get_backend_class(backend) is None:
+    sys.stderr.write('Backend %s is not available (missing package).\n' % backend)
+    return EXIT_USAGE
+
+  try:
+    return run(working_dir, denoms, socks5, download, interval, once, backend)
+  except KeyboardInterrupt:
+    return EXIT_OK
+
+
+def usage():
+  '''
+  Usage message for the watch subcommand
+  '''
+  sys.stderr.write('python wst.py watch [--workdir=/tmp] [--denoms=05,005,001] [--socks5=localhost:9050]')
+  sys.stderr.write(' [--interval=600] [--backend=python] [--local] [--once]\n')
+  sys.stderr.write('\n\n[-w OR --workdir] = Path of the directory storing the snapshot and exported files.')
+  sys.stderr.write('\n\n[-d OR --denoms] = List of codes identifying the mix denominations to watch (default: all).')
+  sys.stderr.write('\n\n[-s OR --socks5] = Url of the socks5 proxy to use for downloading the snapshots.')
+  sys.stderr.write('\n\n[-i OR --interval] = Interval between 2 checks of the snapshots (in seconds, default: 600).')
+  sys.stderr.write('\n\n[-b OR --backend] = Backend computing the exact anonsets (%s, default: %s).' % (', '.join(BACKENDS), DEFAULT_BACKEND))
+  sys.stderr.write('\n\n[--local] = Watches the snapshot files of the working directory (no download).')
+  sys.stderr.write('\n\n[--once] = Checks the snapshots once and exits.')
+  sys.stderr.write('\n\nThe status of each refresh is written on stdout (json format) and in %s.json' % FN_WATCH_STATUS)
+  sys.stderr.write('\n(duration = wall time of the refresh, latency = delay since the last modification of the snapshot).')
+  sys.stderr.write('\nExit codes: 0 = success, 1 = failure of the last check of a denomination, 2 = invalid arguments.\n')
+  sys.stderr.flush()
@@ -0,0 +1,194 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A class computing time-windowed variants of the anonsets:
+- backward-looking anonsets only counting the tx0s of the last N days
+- forward-looking anonsets as of a given date
+'''
+from bisect import bisect_left, bisect_right
+from heapq import heappush, heappop
+from whirlpool_stats.utils.date import to_timestamp
+from whirlpool_stats.services.forward_metrics import ForwardMetrics
+from whirlpool_stats.backends import DEFAULT_BACKEND
+
+
+class WindowedMetrics(object):
+
+  def __init__(self, snapshot):
+    '''
+    Constructor
+    Parameters:
+      snapshot = snapshot
+    '''
+    self.snapshot = snapshot
+    # Name of the backend computing the forward-looking anonsets (see whirlpool_stats.backends)
+    self.backend_name = DEFAULT_BACKEND
+    # Size of the window (in days) of the backward-looking anonsets
+    self.nb_days = None
+    # List of windowed backward-looking anonsets ordered by mix round
+    self.l_win_anonsets = []
+    # List of windowed backward-looking spreads ordered by mix round
+    self.l_win_spreads = []
+    # Date of the forward-looking anonsets
+    self.asof_date = None
+    # List of forward-looking anonsets as of asof_date ordered by mix round
+    # (mixes confirmed after this date are ignored)
+    self.l_asof_anonsets = []
+    # List of forward-looking spreads as of asof_date ordered by mix round
+    self.l_asof_spreads = []
+
+
+  def reset(self):
+    '''
+    Resets the results (e.g. when a new snapshot is loaded)
+    '''
+    self.nb_days = None
+    self.l_win_anonsets = []
+    self.l_win_spreads = []
+    self.asof_date = None
+    self.l_asof_anonsets = []
+    self.l_asof_spreads = []
+
+
+  def compute_window(self, nb_days):
+    '''
+    Computes the backward-looking anonsets counting only the tx0s
+    created during the last nb_days days before each mix
+
+    Single sweep over the mix rounds: the set of the recent ancestor tx0s of a mix
+    is the union of the sets of its parents, stored as a bitset of the tx0s
+    sorted by timestamp. Paths between a tx0 and a mix are chronological,
+    so the bitset of a mix only keeps the tx0s of its own window
+    (the windows of its descendants start later).
+    The bitset of a mix is released once all its child mixes have been computed
+    or once it falls out of the window of the current mix round.
+    Parameters:
+      nb_days = size of the window (in days)
+    '''
+    snapshot = self.snapshot
+    instr = snapshot.instr
+
+    with instr.phase('compute window'):
+      print('Start computing backward-looking metrics (window = %d days)' % nb_days)
+
+      self.nb_days = nb_days
+      self.l_win_anonsets = []
+      self.l_win_spreads = []
+      window = nb_days * 86400
+      nb_mixes = len(snapshot.l_mix_txs)
+      # Tx0s sorted by timestamp (position = bit of the bitsets)
+      l_tx0s = sorted(zip(snapshot.l_ts_tx0s, snapshot.l_tx0s))
+      l_sorted_ts_tx0s = [ts for ts, _ in l_tx0s]
+      d_tx0_bits = dict((tiid, bit) for bit, (_, tiid) in enumerate(l_tx0s))
+      d_rounds = dict(zip(snapshot.l_mix_txs, range(0, nb_mixes)))
+      # Anonsets ordered by mix round (None = not computed yet)
+      l_anonsets = [None] * nb_mixes
+      l_spreads = []
+      # Number of child mixes of each mix round that haven't been computed yet
+      l_nb_pending = [0] * nb_mixes
+      for mix_round, tiid in enumerate(snapshot.l_mix_txs):
+        l_nb_pending[mix_round] = len([t for t in snapshot.d_links.get(tiid, []) if t in d_rounds])
+      # Dictionary mix round => (first bit, bitset of the recent ancestor tx0s shifted by the first bit)
+      # (bitsets still needed by child mixes)
+      d_bitsets = dict()
+      # Heap of the tuples (timestamp, mix round) of the stored bitsets
+      l_heap = []
+      progress = instr.progress('Computed metrics for', nb_mixes)
+
+      for mix_round in range(0, nb_mixes):
+        ts = snapshot.l_ts_mix_txs[mix_round]
+        min_ts = ts - window
+        # Releases the bitsets out of the window
+        # (mix rounds are ordered by timestamp, later windows start later)
+        while (len(l_heap) > 0) and (l_heap[0][0] < min_ts):
+          d_bitsets.pop(heappop(l_heap)[1], None)
+        # Computes the anonset
+        if l_anonsets[mix_round] is None:
+          self.compute_recent_tx0s(mix_round, window, l_anonsets, d_rounds, d_bitsets, l_heap, l_nb_pending, d_tx0_bits, l_sorted_ts_tx0s)
+        anonset = l_anonsets[mix_round]
+        # Computes the spread (tx0s created during the window)
+        nb_tx0s = bisect_right(l_sorted_ts_tx0s, ts) - bisect_left(l_sorted_ts_tx0s, min_ts)
+        spread = float(anonset) * 100.0 / float(nb_tx0s) if nb_tx0s > 0 else 0.0
+        l_spreads.append(spread)
+        progress.update(mix_round + 1)
+
+      self.l_win_anonsets = l_anonsets
+      self.l_win_spreads = l_spreads
+      instr.count('window_nodes_visited', nb_mixes)
+      print('Done!')
+
+
+  def compute_recent_tx0s(self, mix_round, window, l_anonsets, d_rounds, d_bitsets, l_heap, l_nb_pending, d_tx0_bits, l_sorted_ts_tx0s):
+    '''
+    Computes the number of tx0s created during the window of a mix and from which the mix descends
+    (stored in l_anonsets). The ancestor mixes that haven't been computed yet
+    (e.g. mixes of the same block) are computed first.
+    Parameters:
+      mix_round        = mix round of the mix
+      window           = size of the window (in seconds)
+      l_anonsets       = list of the anonsets ordered by mix round (None = not computed yet)
+      d_rounds         = dictionary tiid of mix => mix round
+      d_bitsets        = dictionary mix round => (first bit, bitset) of the bitsets still needed
+      l_heap           = heap of the tuples (timestamp, mix round) of the stored bitsets
+      l_nb_pending     = list of the numbers of child mixes not computed yet (by mix round)
+      d_tx0_bits       = dictionary tiid of tx0 => bit
+      l_sorted_ts_tx0s = sorted list of the timestamps of the tx0s
+    '''
+    snapshot = self.snapshot
+    l_ts_mix_txs = snapshot.l_ts_mix_txs
+    l_stack = [mix_round]
+
+    while len(l_stack) > 0:
+      cur_round = l_stack[-1]
+      if l_anonsets[cur_round] is not None:
+        l_stack.pop()
+        continue
+      cur_tiid = snapshot.l_mix_txs[cur_round]
+      min_ts = l_ts_mix_txs[cur_round] - window
+      l_prev_rounds = [d_rounds[t] for t in snapshot.d_reverse_links[cur_tiid] if t in d_rounds]
+      l_missing = [r for r in l_prev_rounds if (l_ts_mix_txs[r] >= min_ts) and (l_anonsets[r] is None)]
+      if len(l_missing) > 0:
+        l_stack.extend(l_missing)
+        continue
+      l_stack.pop()
+      first_bit = bisect_left(l_sorted_ts_tx0s, min_ts)
+      bitset = 0
+      for prev_tiid in snapshot.d_reverse_links[cur_tiid]:
+        bit = d_tx0_bits.get(prev_tiid)
+        if (bit is not None) and (bit >= first_bit):
+          bitset |= 1 << (bit - first_bit)
+      for prev_round in l_prev_rounds:
+        if l_ts_mix_txs[prev_round] >= min_ts:
+          prev_first_bit, prev_bitset = d_bitsets[prev_round]
+          shift = first_bit - prev_first_bit
+          bitset |= (prev_bitset >> shift) if shift >= 0 else (prev_bitset << -shift)
+        # Releases the bitsets of the parents once all their children have been computed
+        l_nb_pending[prev_round] -= 1
+        if l_nb_pending[prev_round] == 0:
+          d_bitsets.pop(prev_round, None)
+      l_anonsets[cur_round] = bin(bitset).count('1')
+      if l_nb_pending[cur_round] > 0:
+        d_bitsets[cur_round] = (first_bit, bitset)
+        heappush(l_heap, (l_ts_mix_txs[cur_round], cur_round))
+
+
+  def compute_asof(self, date):
+    '''
+    Computes the forward-looking anonsets as of a given date
+    (i.e. for the state of the snapshot at the end of this day)
+    Parameters:
+      date = utc datetime
+    '''
+    snapshot = self.snapshot
+
+    with snapshot.instr.phase('compute asof'):
+      print('Start computing forward-looking metrics as of %s' % date.strftime('%d/%m/%Y'))
+      # Restricts the snapshot to the txs confirmed before the end of the day
+      # and reuses the forward-looking metrics on this state of the snapshot
+      past_snapshot = snapshot.get_snapshot_until(to_timestamp(date) + 86399)
+      fwd_metrics = ForwardMetrics(past_snapshot)
+      fwd_metrics.backend_name = self.backend_name
+      fwd_metrics.compute()
+      self.asof_date = date
+      self.l_asof_anonsets = fwd_metrics.l_anonsets
+      self.l_asof_spreads = fwd_metrics.l_spreads
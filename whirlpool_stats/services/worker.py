@@ -0,0 +1,176 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Worker computing the anonsets for a coordinator (see backends/distributed.py)
+
+A worker listens on a socket and serves each coordinator connected to it
+in a separate thread. It receives the transaction graph of a snapshot,
+then computes the tasks (ranges of mix rounds, groups of mixes) sent by
+the coordinator with a local backend.
+'''
+import os
+import sys
+import getopt
+import threading
+from itertools import islice
+from array import array
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+from whirlpool_stats.services.snapshot import Snapshot
+from whirlpool_stats.backends import BACKENDS, DEFAULT_BACKEND, create_backend, get_backend_class
+from whirlpool_stats.backends.distributed import DistributedBackend, WORKERS_ENV, AUTHKEY_ENV,\
+  MSG_LOAD, MSG_LOADED, MSG_TASK, MSG_RESULT, MSG_ERROR, TASK_FWD, TASK_BWD, TASK_GROUPS
+
+
+# Exit codes
+EXIT_OK = 0
+EXIT_USAGE = 2
+
+# Default port of the workers
+DEFAULT_PORT = 7001
+
+
+def compute_task(backend, task):
+  '''
+  Computes a task
+  Returns the list of anonsets computed by the task
+  Parameters:
+    backend = local backend
+    task    = task (see backends/distributed.py)
+  '''
+  if task[0] == TASK_FWD:
+    _, start, end = task
+    return array('q', islice(backend.iter_fwd_anonsets(start), end - start))
+  elif task[0] == TASK_BWD:
+    _, start, end = task
+    return array('q', islice(backend.iter_bwd_anonsets(start), end - start))
+  elif task[0] == TASK_GROUPS:
+    return array('q', backend.get_fwd_anonsets(task[1]))
+  raise ValueError('Unknown task %s' % task[0])
+
+
+def serve_connection(conn, backend_name=DEFAULT_BACKEND):
+  '''
+  Serves a coordinator until it closes the connection
+  Parameters:
+    conn         = connection with the coordinator
+    backend_name = name of the backend computing the tasks
+  '''
+  backend = None
+
+  while True:
+    try:
+      msg = conn.recv()
+    except (EOFError, OSError):
+      break
+
+    try:
+      if msg[0] == MSG_LOAD:
+        _, digest, graph = msg
+        snapshot = Snapshot(None)
+        snapshot.set_graph(graph)
+        backend = create_backend(backend_name, snapshot)
+        reply = (MSG_LOADED, digest)
+      elif msg[0] == MSG_TASK:
+        _, task_id, task = msg
+        if backend is None:
+          raise ValueError('No snapshot loaded')
+        reply = (MSG_RESULT, task_id, compute_task(backend, task))
+      else:
+        raise ValueError('Unknown message %s' % msg[0])
+    except Exception as e:
+      reply = (MSG_ERROR, '%s: %s' % (type(e).__name__, e))
+
+    try:
+      conn.send(reply)
+    except (OSError, ValueError):
+      break
+
+  conn.close()
+
+
+def serve(host, port, authkey, backend_name=DEFAULT_BACKEND):
+  '''
+  Listens on a socket and serves the coordinators connecting to it
+  Parameters:
+    host         = host (interface) of the socket
+    port         = port of the socket
+    authkey      = secret shared with the coordinators (bytes)
+    backend_name = name of the backend computing the tasks
+  '''
+  with Listener((host, port), authkey=authkey) as listener:
+    sys.stderr.write('Worker listening on %s:%d (backend %s)\n' % (host, port, backend_name))
+    sys.stderr.flush()
+    while True:
+      try:
+        conn = listener.accept()
+      except (OSError, EOFError, AuthenticationError) as e:
+        # Failed authentication or connection closed during the handshake
+        sys.stderr.write('Connection rejected (%s)\n' % e)
+        sys.stderr.flush()
+        continue
+      sys.stderr.write('Coordinator connected from %s\n' % str(listener.last_accepted))
+      sys.stderr.flush()
+      thread = threading.Thread(target=serve_connection, args=(conn, backend_name), daemon=True)
+      thread.start()
+
+
+def main(argv):
+  '''
+  Main function of the worker subcommand
+  Returns the exit code
+  Parameters:
+    argv = list of command line arguments
+  '''
+  host = 'localhost'
+  port = DEFAULT_PORT
+  backend = DEFAULT_BACKEND
+
+  try:
+    opts, args = getopt.getopt(argv, 'hl:b:', ['help', 'listen=', 'backend='])
+  except getopt.GetoptError:
+    usage()
+    return EXIT_USAGE
+
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      return EXIT_OK
+    elif opt in ('-l', '--listen'):
+      host, _, port = arg.rpartition(':')
+      if (len(host) == 0) or not port.isdigit():
+        usage()
+        return EXIT_USAGE
+      port = int(port)
+    elif opt in ('-b', '--backend'):
+      backend = arg
+
+  authkey = os.environ.get(AUTHKEY_ENV)
+  if (len(args) > 0) or (backend not in BACKENDS) or \
+    (backend == DistributedBackend.name) or not authkey:
+    usage()
+    return EXIT_USAGE
+  # Only the selected backend is imported (numpy and numba are slow to import)
+  if get_backend_class(backend) is None:
+    sys.stderr.write('Backend %s is not available (missing package).\n' % backend)
+    return EXIT_USAGE
+
+  try:
+    serve(host, port, authkey.encode('utf-8'), backend)
+  except KeyboardInterrupt:
+    pass
+  return EXIT_OK
+
+
+def usage():
+  '''
+  Usage message for the worker subcommand
+  '''
+  sys.stderr.write('python wst.py worker [--listen=localhost:%d] [--backend=python]\n' % DEFAULT_PORT)
+  sys.stderr.write('\n\n[-l OR --listen] = Address (host:port) of the socket receiving the tasks of the coordinators.')
+  sys.stderr.write('\n\n[-b OR --backend] = Backend computing the tasks (%s, default: %s).' % (
+    ', '.join([b for b in BACKENDS if b != DistributedBackend.name]), DEFAULT_BACKEND
+  ))
+  sys.stderr.write('\n\nThe secret shared with the coordinators must be set in the %s environment variable.' % AUTHKEY_ENV)
+  sys.stderr.write('\nCoordinators use the workers with the distributed backend (%s=host:port,host:port).\n' % WORKERS_ENV)
+  sys.stderr.flush()
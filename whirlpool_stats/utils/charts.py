@@ -3,7 +3,14 @@ Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
 
 A set of function for plotting charts
 '''
+import math
 import plotly.graph_objects as go
+from whirlpool_stats.utils.constants import DEFAULT_MAX_POINTS
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 
 '''
@@ -18,9 +25,251 @@ CT_BARCHART = 1
 # Chart type Linearchart
 CT_LINEARCHART = 2
 
+# Number of points above which scatterplots are rendered with WebGL
+WEBGL_THRESHOLD = 10000
 
-def scatterplot(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y):
-  scatter = go.Scatter(
+# Number of bins used for histograms
+NB_HISTOGRAM_BINS = 100
+
+# Number of bins (per axis) used for density charts
+NB_DENSITY_BINS = 200
+
+
+def lttb(x_values, y_values, nb_points):
+  '''
+  Downsamples a series with the Largest-Triangle-Three-Buckets algorithm
+  (keeps the visual shape of the series with a reduced number of points)
+  Returns a tuple (x_values, y_values)
+  Parameters:
+    x_values  = list of x values (sorted in ascending order)
+    y_values  = list of y values
+    nb_points = maximum number of points returned
+  '''
+  nb_values = len(x_values)
+  if (nb_points >= nb_values) or (nb_points < 3):
+    return x_values, y_values
+  if is_array(x_values) and is_array(y_values):
+    return lttb_array(x_values, y_values, nb_points)
+
+  out_x = [x_values[0]]
+  out_y = [y_values[0]]
+  # Size of the buckets (first and last points are kept as is)
+  bucket_size = float(nb_values - 2) / float(nb_points - 2)
+  a = 0
+
+  for i in range(0, nb_points - 2):
+    # Average point of the next bucket
+    next_start = int((i + 1) * bucket_size) + 1
+    next_end = min(int((i + 2) * bucket_size) + 1, nb_values)
+    nb_next = next_end - next_start
+    avg_x = float(sum(x_values[next_start:next_end])) / nb_next
+    avg_y = float(sum(y_values[next_start:next_end])) / nb_next
+    # Selects the point of the current bucket
+    # forming the largest triangle with the previous selected point
+    # and the average point of the next bucket
+    ax = x_values[a]
+    ay = y_values[a]
+    max_area = -1.0
+    for j in range(int(i * bucket_size) + 1, next_start):
+      area = abs((ax - avg_x) * (y_values[j] - ay) - (ax - x_values[j]) * (avg_y - ay))
+      if area > max_area:
+        max_area = area
+        a_next = j
+    out_x.append(x_values[a_next])
+    out_y.append(y_values[a_next])
+    a = a_next
+
+  out_x.append(x_values[-1])
+  out_y.append(y_values[-1])
+  return out_x, out_y
+
+
+def lttb_array(x_values, y_values, nb_points):
+  '''
+  Numpy version of lttb (averages of the buckets computed from cumulative sums,
+  areas computed per bucket)
+  Returns a tuple (x_values, y_values)
+  Parameters:
+    x_values  = numpy array of x values (sorted in ascending order)
+    y_values  = numpy array of y values
+    nb_points = maximum number of points returned
+  '''
+  nb_values = len(x_values)
+  x_values = x_values.astype(np.float64)
+  y_values = y_values.astype(np.float64)
+  bucket_size = float(nb_values - 2) / float(nb_points - 2)
+  # Bounds of the buckets (bucket i = [bounds[i], bounds[i+1]))
+  bounds = (np.arange(0, nb_points - 1) * bucket_size).astype(np.int64) + 1
+  bounds[-1] = nb_values - 1
+  cum_x = np.concatenate(([0.0], np.cumsum(x_values)))
+  cum_y = np.concatenate(([0.0], np.cumsum(y_values)))
+
+  selected = np.empty(nb_points, dtype=np.int64)
+  selected[0] = 0
+  selected[-1] = nb_values - 1
+  a = 0
+
+  for i in range(0, nb_points - 2):
+    start = bounds[i]
+    next_start = bounds[i + 1]
+    next_end = bounds[i + 2] if i + 2 < len(bounds) else nb_values
+    nb_next = next_end - next_start
+    avg_x = (cum_x[next_end] - cum_x[next_start]) / nb_next
+    avg_y = (cum_y[next_end] - cum_y[next_start]) / nb_next
+    ax = x_values[a]
+    ay = y_values[a]
+    areas = np.abs((ax - avg_x) * (y_values[start:next_start] - ay)
+                   - (ax - x_values[start:next_start]) * (avg_y - ay))
+    a = start + int(np.argmax(areas))
+    selected[i + 1] = a
+
+  return x_values[selected], y_values[selected]
+
+
+def is_array(values):
+  '''
+  Checks if a series of values is a numpy array
+  Parameters:
+    values = series of values
+  '''
+  return (np is not None) and isinstance(values, np.ndarray)
+
+
+def is_sorted(values):
+  '''
+  Checks if a series of values is sorted in ascending order
+  Parameters:
+    values = series of values
+  '''
+  if is_array(values):
+    return bool(np.all(values[:-1] <= values[1:]))
+  return all(values[i] <= values[i+1] for i in range(0, len(values) - 1))
+
+
+def histogram_bins(values, nb_bins=NB_HISTOGRAM_BINS):
+  '''
+  Computes the bins of an histogram (values expressed in percentage of all values)
+  Returns a tuple (bins_centers, bins_percentages, bins_width)
+  Parameters:
+    values  = list of values
+    nb_bins = number of bins
+  '''
+  if len(values) == 0:
+    return [], [], 0
+  if is_array(values):
+    min_val = float(values.min())
+    max_val = float(values.max())
+    width = (max_val - min_val) / nb_bins if max_val > min_val else 1.0
+    counts, _ = np.histogram(values, bins=nb_bins, range=(min_val, min_val + nb_bins * width))
+    centers = min_val + (np.arange(0, nb_bins) + 0.5) * width
+    return centers, counts * 100.0 / len(values), width
+  min_val = min(values)
+  max_val = max(values)
+  width = float(max_val - min_val) / nb_bins if max_val > min_val else 1.0
+  counts = [0] * nb_bins
+  for v in values:
+    idx = min(int((v - min_val) / width), nb_bins - 1)
+    counts[idx] += 1
+  nb_values = float(len(values))
+  centers = [min_val + (i + 0.5) * width for i in range(0, nb_bins)]
+  percents = [c * 100.0 / nb_values for c in counts]
+  return centers, percents, width
+
+
+def density_bins(x_values, y_values, log_scale, nb_bins=NB_DENSITY_BINS):
+  '''
+  Computes a 2D histogram of a series of points
+  Returns a tuple (x_centers, y_centers, counts) where counts[j][i] is the number
+  of points stored in the bin (x_centers[i], y_centers[j])
+  Parameters:
+    x_values  = list of x values
+    y_values  = list of y values
+    log_scale = flag indicating if the y-axis uses a log scale
+    nb_bins   = number of bins per axis
+  '''
+  if is_array(x_values) and is_array(y_values):
+    return density_bins_array(x_values, y_values, log_scale, nb_bins)
+  if log_scale:
+    points = [(x, math.log10(y)) for x, y in zip(x_values, y_values) if y > 0]
+  else:
+    points = list(zip(x_values, y_values))
+  if len(points) == 0:
+    return [], [], []
+
+  min_x = min(p[0] for p in points)
+  max_x = max(p[0] for p in points)
+  min_y = min(p[1] for p in points)
+  max_y = max(p[1] for p in points)
+  width_x = float(max_x - min_x) / nb_bins if max_x > min_x else 1.0
+  width_y = float(max_y - min_y) / nb_bins if max_y > min_y else 1.0
+  counts = [[0] * nb_bins for _ in range(0, nb_bins)]
+  for x, y in points:
+    i = min(int((x - min_x) / width_x), nb_bins - 1)
+    j = min(int((y - min_y) / width_y), nb_bins - 1)
+    counts[j][i] += 1
+
+  x_centers = [min_x + (i + 0.5) * width_x for i in range(0, nb_bins)]
+  y_centers = [min_y + (j + 0.5) * width_y for j in range(0, nb_bins)]
+  if log_scale:
+    y_centers = [math.pow(10, y) for y in y_centers]
+  return x_centers, y_centers, counts
+
+
+def density_bins_array(x_values, y_values, log_scale, nb_bins=NB_DENSITY_BINS):
+  '''
+  Numpy version of density_bins
+  Parameters:
+    x_values  = numpy array of x values
+    y_values  = numpy array of y values
+    log_scale = flag indicating if the y-axis uses a log scale
+    nb_bins   = number of bins per axis
+  '''
+  x_values = x_values.astype(np.float64)
+  y_values = y_values.astype(np.float64)
+  if log_scale:
+    mask = y_values > 0
+    x_values = x_values[mask]
+    y_values = np.log10(y_values[mask])
+  if len(x_values) == 0:
+    return [], [], []
+
+  min_x, max_x = x_values.min(), x_values.max()
+  min_y, max_y = y_values.min(), y_values.max()
+  width_x = (max_x - min_x) / nb_bins if max_x > min_x else 1.0
+  width_y = (max_y - min_y) / nb_bins if max_y > min_y else 1.0
+  counts, _, _ = np.histogram2d(
+    y_values, x_values, bins=nb_bins,
+    range=[(min_y, min_y + nb_bins * width_y), (min_x, min_x + nb_bins * width_x)]
+  )
+
+  x_centers = min_x + (np.arange(0, nb_bins) + 0.5) * width_x
+  y_centers = min_y + (np.arange(0, nb_bins) + 0.5) * width_y
+  if log_scale:
+    y_centers = np.power(10, y_centers)
+  return x_centers, y_centers, counts.astype(np.int64)
+
+
+def scatterplot(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y,
+                max_points=DEFAULT_MAX_POINTS, density=False, show=True):
+  if density and (len(x_values) > max_points):
+    return densitychart(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y, show)
+
+  if len(x_values) > max_points:
+    # Sorts the points by x values if needed (required by lttb)
+    if is_array(x_values) and is_array(y_values):
+      if not is_sorted(x_values):
+        order = np.argsort(x_values, kind='stable')
+        x_values = x_values[order]
+        y_values = y_values[order]
+    elif not is_sorted(x_values):
+      l_points = sorted(zip(x_values, y_values))
+      x_values = [p[0] for p in l_points]
+      y_values = [p[1] for p in l_points]
+    x_values, y_values = lttb(x_values, y_values, max_points)
+
+  # Uses WebGL for large series
+  trace_type = go.Scattergl if len(x_values) > WEBGL_THRESHOLD else go.Scatter
+  scatter = trace_type(
     x=x_values,
     y=y_values,
     mode='markers'
@@ -66,17 +315,77 @@ def scatterplot(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y):
     )
   )
 
-  fig.show(config={
-    'scrollZoom': True,
-    'displayModeBar': True,
-    'editable': True
-  })
+  if show:
+    fig.show(config={
+      'scrollZoom': True,
+      'displayModeBar': True,
+      'editable': True
+    })
+  return fig
 
 
-def barchart(x_values, chart_title, lbl_x, lbl_y):
-  histo = go.Histogram(
-    x=x_values,
-    histnorm='percent'
+def densitychart(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y, show=True):
+  x_centers, y_centers, counts = density_bins(x_values, y_values, log_scale)
+
+  heatmap = go.Heatmap(
+    x=x_centers,
+    y=y_centers,
+    z=counts,
+    colorscale='Viridis'
+  )
+
+  fig = go.Figure(data=heatmap)
+
+  font_title = dict(
+    family="Courier New, monospace",
+    size=18,
+    color="#9f9f9f"
+  )
+
+  font_axes = dict(
+    family="Courier New, monospace",
+    size=13,
+    color="#8f8f8f"
+  )
+
+  fig.update_layout(
+    template='plotly_dark',
+    yaxis_type = 'log' if log_scale else 'linear',
+    title=go.layout.Title(
+      text=chart_title,
+      font=font_title
+    ),
+    xaxis=go.layout.XAxis(
+      title=go.layout.xaxis.Title(
+        text=lbl_x,
+        font=font_axes
+      )
+    ),
+    yaxis=go.layout.YAxis(
+      title=go.layout.yaxis.Title(
+        text=lbl_y,
+        font=font_axes
+      )
+    )
+  )
+
+  if show:
+    fig.show(config={
+      'scrollZoom': True,
+      'displayModeBar': True,
+      'editable': True
+    })
+  return fig
+
+
+def barchart(x_values, chart_title, lbl_x, lbl_y, show=True):
+  # Bins are computed here in order to send a fixed number of bars to the browser
+  centers, percents, width = histogram_bins(x_values)
+
+  histo = go.Bar(
+    x=centers,
+    y=percents,
+    width=width
   )
 
   fig = go.Figure(data=histo)
@@ -113,13 +422,15 @@ def barchart(x_values, chart_title, lbl_x, lbl_y):
     )
   )
 
-  fig.show(config={
-    'displayModeBar': True,
-    'editable': True
-  })
+  if show:
+    fig.show(config={
+      'displayModeBar': True,
+      'editable': True
+    })
+  return fig
 
 
-def linearchart(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y):
+def linearchart(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y, show=True):
   scatter = go.Scatter(
     x=x_values,
     y=y_values,
@@ -167,8 +478,10 @@ def linearchart(x_values, y_values, log_scale, chart_title, lbl_x, lbl_y):
     )
   )
 
-  fig.show(config={
-    'scrollZoom': True,
-    'displayModeBar': True,
-    'editable': True
-  })
+  if show:
+    fig.show(config={
+      'scrollZoom': True,
+      'displayModeBar': True,
+      'editable': True
+    })
+  return fig
@@ -0,0 +1,169 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Typed columnar containers storing the results of the metrics
+
+Each column is an array of machine values (array module) written by the
+computations. Consumers (exporter, plotter) read the columns through views
+sharing their memory (numpy arrays if numpy is installed, the arrays otherwise).
+numpy is imported when a view is built for the first time (fast startup of the shell).
+'''
+from array import array
+
+
+# numpy module (None = not imported yet, False = not installed)
+_numpy = None
+
+
+def get_numpy():
+  '''
+  Returns the numpy module (imported on first use) or None if numpy isn't installed
+  '''
+  global _numpy
+  if _numpy is None:
+    try:
+      import numpy
+      _numpy = numpy
+    except ImportError:
+      _numpy = False
+  return _numpy or None
+
+
+# Columns of the metrics of the mix rounds (the mix round is the position in the columns)
+ROUND_COLUMNS = [
+  ('anonset', 'q'),
+  ('spread', 'd'),
+  # Index of the day of the mix (see get_day_index)
+  ('day', 'l')
+]
+
+# Columns of the metrics of the tx0s (the tx0 index is the position in the columns)
+TX0_COLUMNS = [
+  ('nb_outputs', 'l'),
+  ('nb_mixed_outputs', 'l'),
+  ('nb_counterparties', 'l'),
+  ('anonset', 'q')
+]
+
+
+def get_view(values):
+  '''
+  Returns a view of a column sharing its memory
+  (numpy array if numpy is installed, the column otherwise)
+  Parameters:
+    values = column (array)
+  '''
+  np = get_numpy()
+  if np is None:
+    return values
+  return np.frombuffer(values, dtype=values.typecode)
+
+
+def get_positions(nb_values):
+  '''
+  Returns the positions of the values of a column (x values of the charts)
+  Parameters:
+    nb_values = number of values of the column
+  '''
+  np = get_numpy()
+  if np is None:
+    return list(range(0, nb_values))
+  return np.arange(0, nb_values)
+
+
+def select(values, indices):
+  '''
+  Returns the values stored at given positions of a column (or of a view)
+  Parameters:
+    values  = column or view
+    indices = positions of the values
+  '''
+  np = get_numpy()
+  if (np is not None) and isinstance(values, np.ndarray):
+    return values[indices]
+  return [values[idx] for idx in indices]
+
+
+class Columns(object):
+
+  def __init__(self, schema):
+    '''
+    Constructor
+    Parameters:
+      schema = list of tuples (name, typecode) describing the columns
+    '''
+    self.schema = schema
+    self.reset()
+
+
+  def reset(self):
+    '''
+    Resets the columns (new empty arrays, views of the previous arrays remain valid)
+    '''
+    for name, typecode in self.schema:
+      setattr(self, name, array(typecode))
+
+
+  def __len__(self):
+    return len(getattr(self, self.schema[0][0]))
+
+
+  def get_column(self, name):
+    '''
+    Returns a column (array)
+    Parameters:
+      name = name of the column
+    '''
+    return getattr(self, name)
+
+
+  def set_column(self, name, values):
+    '''
+    Replaces the values of a column
+    Parameters:
+      name   = name of the column
+      values = iterable of values
+    '''
+    typecode = dict(self.schema)[name]
+    setattr(self, name, array(typecode, values))
+
+
+  def append(self, name, value):
+    '''
+    Appends a value to a column
+    Parameters:
+      name  = name of the column
+      value = value
+    '''
+    try:
+      getattr(self, name).append(value)
+    except BufferError:
+      self.extend(name, [value])
+
+
+  def extend(self, name, values):
+    '''
+    Appends values to a column
+    An array shared with a view can't be resized, the column is copied in this case
+    (the view keeps the previous values)
+    Parameters:
+      name   = name of the column
+      values = iterable of values
+    '''
+    column = getattr(self, name)
+    values = array(column.typecode, values)
+    try:
+      column.extend(values)
+    except BufferError:
+      column = array(column.typecode, column)
+      column.extend(values)
+      setattr(self, name, column)
+
+
+  def get_view(self, name):
+    '''
+    Returns a view of a column sharing its memory
+    Parameters:
+      name = name of the column
+    '''
+    return get_view(getattr(self, name))
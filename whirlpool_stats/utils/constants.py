@@ -34,3 +34,10 @@ NB_PARTICIPANTS = 5
 
 # TXID prefix length (in bytes)
 TXID_PREFIX_LENGTH = 8
+
+# Default maximum number of points sent to the browser for a scatterplot
+DEFAULT_MAX_POINTS = 50000
+
+# Minimum value of the maximum number of points of a scatterplot
+# (downsampling keeps the first and the last points of the series)
+MIN_MAX_POINTS = 3
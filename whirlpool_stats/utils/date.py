@@ -7,6 +7,10 @@ import calendar
 from datetime import datetime
 
 
+# Number of seconds per day
+SECONDS_PER_DAY = 86400
+
+
 def to_utcdate(timestamp): 
   '''
   Converts a unix timestamp to an utc datetime
@@ -50,3 +54,26 @@ def get_datetime_of_day(timestamp):
   tmp = to_utcdate(timestamp)
   return datetime(tmp.year, tmp.month, tmp.day, 0, 0, 0, 0)
 
+
+def get_day_index(timestamp):
+  '''
+  Returns the index of the day of a timestamp (number of days since 01/01/1970)
+  Parameters:
+    timestamp = unix timestamp
+  '''
+  return timestamp // SECONDS_PER_DAY
+
+
+def parse_date(date_str):
+  '''
+  Parses a date (formats: YYYY-MM-DD or DD/MM/YYYY)
+  Returns the utc datetime (or None if the date is invalid)
+  Parameters:
+    date_str = date
+  '''
+  for fmt in ['%Y-%m-%d', '%d/%m/%Y']:
+    try:
+      return datetime.strptime(date_str, fmt)
+    except ValueError:
+      pass
+  return None
@@ -0,0 +1,43 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A set of functions writing files atomically
+(readers never see a partially written file)
+'''
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_path(filepath):
+  '''
+  Context manager returning the path of a temporary file (<filepath>.tmp)
+  renamed to filepath when the context exits without error
+  (the temporary file is deleted if an error occurs)
+  Parameters:
+    filepath = path of the file
+  '''
+  tmp_filepath = '%s.tmp' % filepath
+  try:
+    yield tmp_filepath
+    os.replace(tmp_filepath, filepath)
+  except BaseException:
+    if os.path.exists(tmp_filepath):
+      os.remove(tmp_filepath)
+    raise
+
+
+@contextmanager
+def atomic_write(filepath, mode='w', **kwargs):
+  '''
+  Context manager returning a file object writing a temporary file
+  renamed to filepath when the context exits without error
+  (the temporary file is deleted if an error occurs)
+  Parameters:
+    filepath = path of the file
+    mode     = mode of the file ('w' or 'wb')
+    kwargs   = other arguments of open (e.g. encoding, newline)
+  '''
+  with atomic_path(filepath) as tmp_filepath:
+    with open(tmp_filepath, mode, **kwargs) as f:
+      yield f
@@ -0,0 +1,161 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+HyperLogLog sketches estimating the cardinality of sets of integers
+with a fixed amount of memory (mergeable)
+
+The registers of a sketch are stored in a python integer (one byte per register)
+so that merges are computed with a few operations on big integers (SWAR)
+instead of a loop over the registers.
+'''
+import math
+
+
+# Default precision (2^10 registers, relative standard error ~3.25%)
+DEFAULT_PRECISION = 10
+
+# Bounds of the precision
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+# Mask for 64 bits integers
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def hash64(x):
+  '''
+  Hashes an integer (splitmix64 finalizer)
+  Returns a 64 bits integer
+  Parameters:
+    x = integer
+  '''
+  x = (x + 0x9E3779B97F4A7C15) & MASK_64
+  x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+  x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+  return x ^ (x >> 31)
+
+
+def get_error(precision):
+  '''
+  Returns the relative standard error of a sketch
+  Parameters:
+    precision = precision of the sketch (number of registers = 2^precision)
+  '''
+  return 1.04 / math.sqrt(1 << precision)
+
+
+class HyperLogLog(object):
+
+  __slots__ = ['p', 'm', 'registers']
+
+  def __init__(self, precision=DEFAULT_PRECISION, registers=0):
+    '''
+    Constructor
+    Parameters:
+      precision = precision of the sketch (number of registers = 2^precision)
+      registers = registers (integer storing one register per byte)
+    '''
+    self.p = precision
+    self.m = 1 << precision
+    self.registers = registers
+
+
+  def singleton(self, item):
+    '''
+    Returns the registers of a sketch storing a single item
+    Parameters:
+      item = integer
+    '''
+    h = hash64(item)
+    idx = h >> (64 - self.p)
+    w = (h << self.p) & MASK_64
+    rank = min(64 - w.bit_length() + 1, 64 - self.p + 1)
+    return rank << (8 * idx)
+
+
+  def add(self, item):
+    '''
+    Adds an item to the sketch
+    Parameters:
+      item = integer
+    '''
+    self.registers = merge_registers(self.registers, self.singleton(item), self.m)
+
+
+  def merge(self, other):
+    '''
+    Merges another sketch into this sketch
+    Parameters:
+      other = sketch (same precision)
+    '''
+    self.registers = merge_registers(self.registers, other.registers, self.m)
+
+
+  def cardinality(self):
+    '''
+    Returns the estimated cardinality of the set
+    '''
+    return estimate_cardinality(self.registers, self.p)
+
+
+# Masks used by merge_registers (indexed by number of registers)
+_d_masks = dict()
+
+
+def merge_registers(a, b, m):
+  '''
+  Computes the element-wise max of 2 sets of registers
+  Returns the merged registers
+  Parameters:
+    a = registers (integer storing one register per byte)
+    b = registers (integer storing one register per byte)
+    m = number of registers
+  '''
+  if a == 0:
+    return b
+  if b == 0:
+    return a
+  masks = _d_masks.get(m)
+  if masks is None:
+    masks = (int.from_bytes(b'\x80' * m, 'little'), int.from_bytes(b'\xff' * m, 'little'))
+    _d_masks[m] = masks
+  high, full = masks
+  # Registers are lower than 128, so that bit 7 of each byte of (a|high)-b
+  # is set if and only if a >= b for this byte (no borrow between bytes)
+  ge = (((a | high) - b) & high) >> 7
+  sel = ge * 0xFF
+  return (a & sel) | (b & (full ^ sel))
+
+
+def estimate_cardinality(registers, precision):
+  '''
+  Returns the cardinality estimated from a set of registers
+  Parameters:
+    registers = registers (integer storing one register per byte)
+    precision = precision of the sketch
+  '''
+  m = 1 << precision
+  if registers == 0:
+    return 0
+  raw = registers.to_bytes(m, 'little')
+  total = 0.0
+  nb_zeros = 0
+  for rank in range(0, 64 - precision + 2):
+    nb = raw.count(rank)
+    if nb > 0:
+      total += nb * math.pow(2.0, -rank)
+      if rank == 0:
+        nb_zeros = nb
+  if m >= 128:
+    alpha = 0.7213 / (1.0 + 1.079 / m)
+  elif m == 64:
+    alpha = 0.709
+  elif m == 32:
+    alpha = 0.697
+  else:
+    alpha = 0.673
+  estimate = alpha * m * m / total
+  # Small range correction (linear counting)
+  if (estimate <= 2.5 * m) and (nb_zeros > 0):
+    estimate = m * math.log(float(m) / nb_zeros)
+  return int(round(estimate))
@@ -0,0 +1,270 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+A set of classes measuring the time and the memory used by the processing phases
+'''
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from whirlpool_stats.utils.files import atomic_write
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows
+  resource = None
+
+
+# Minimum delay (in seconds) between 2 progress reports
+PROGRESS_INTERVAL = 2.0
+
+# Objects notified of the start and of the end of the phases of all the instrumentations
+# (methods enter_phase(name) and exit_phase(name) called by the thread executing the phase,
+# e.g. profilers attributing their measures to the phases, see utils/profiler.py)
+PHASE_LISTENERS = []
+
+
+def get_peak_rss():
+  '''
+  Returns the peak resident set size of the process since its start
+  (in bytes) or None if unavailable
+  '''
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is expressed in bytes on macOS and in kilobytes on Linux
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_current_rss():
+  '''
+  Returns the current resident set size of the process (in bytes)
+  or None if unavailable (only available on Linux)
+  '''
+  try:
+    with open('/proc/self/statm', 'r') as f:
+      nb_pages = int(f.read().split()[1])
+  except (OSError, ValueError, IndexError):
+    return None
+  return nb_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def get_rss_growth(d_phase):
+  '''
+  Returns the variation of the resident set size during a phase
+  (in bytes) or None if unavailable
+  Parameters:
+    d_phase = measures of the phase
+  '''
+  rss_start = d_phase.get('rss_start')
+  rss_end = d_phase.get('rss_end')
+  if (rss_start is None) or (rss_end is None):
+    return None
+  return rss_end - rss_start
+
+
+def print_progress(label, nb_done, nb_total, unit, rate, eta):
+  '''
+  Default progress callback (prints a trace)
+  Parameters:
+    label    = label of the task
+    nb_done  = number of items processed
+    nb_total = total number of items
+    unit     = name of the items
+    rate     = number of items processed per second
+    eta      = estimated remaining time (in seconds)
+  '''
+  pct_progress = nb_done * 100 / nb_total if nb_total > 0 else 100
+  print('  %s %d/%d %s (%d%%) - %d %s/s - ETA %s' % (
+    label, nb_done, nb_total, unit, pct_progress, rate, unit, timedelta(seconds=int(eta))
+  ))
+
+
+class Progress(object):
+
+  def __init__(self, label, nb_total, unit, callback, interval=PROGRESS_INTERVAL):
+    '''
+    Constructor
+    Parameters:
+      label    = label of the task
+      nb_total = total number of items to process
+      unit     = name of the items
+      callback = function called with (label, nb_done, nb_total, unit, rate, eta)
+      interval = minimum delay (in seconds) between 2 calls to the callback
+    '''
+    self.label = label
+    self.nb_total = nb_total
+    self.unit = unit
+    self.callback = callback
+    self.interval = interval
+    self.start = time.time()
+    self.last_report = self.start
+    self.nb_start = 0
+
+
+  def set_start(self, nb_done):
+    '''
+    Sets the number of items already processed before the task was started
+    (rates are computed for the items processed by this task)
+    Parameters:
+      nb_done = number of items
+    '''
+    self.nb_start = nb_done
+
+
+  def update(self, nb_done):
+    '''
+    Reports the progress of the task (rate-limited)
+    Parameters:
+      nb_done = number of items processed
+    '''
+    now = time.time()
+    if now - self.last_report < self.interval:
+      return
+    self.last_report = now
+    self.report(nb_done, now)
+
+
+  def report(self, nb_done, now=None):
+    '''
+    Reports the progress of the task
+    Parameters:
+      nb_done = number of items processed
+      now     = current time
+    '''
+    if now is None:
+      now = time.time()
+    elapsed = max(now - self.start, 1e-6)
+    rate = (nb_done - self.nb_start) / elapsed
+    eta = (self.nb_total - nb_done) / rate if rate > 0 else 0
+    self.callback(self.label, nb_done, self.nb_total, self.unit, rate, eta)
+
+
+class Instrumentation(object):
+
+  def __init__(self):
+    '''
+    Constructor
+    '''
+    # Flag indicating if memory allocations are traced with tracemalloc
+    # (slows down the computations)
+    self.trace_memory = False
+    # Function called to report the progress of long tasks
+    self.progress_callback = print_progress
+    # Data reset
+    self.reset()
+
+
+  def reset(self):
+    '''
+    Resets the measures
+    '''
+    # Ordered list of phases (dictionaries)
+    self.l_phases = []
+    # Dictionary counter name => value
+    self.d_counters = dict()
+
+
+  @contextmanager
+  def phase(self, name):
+    '''
+    Context manager measuring a processing phase
+    Parameters:
+      name = name of the phase
+    '''
+    tracing = self.trace_memory
+    if tracing:
+      # Imported on demand (fast startup of the shell)
+      import tracemalloc
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+      if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    for listener in list(PHASE_LISTENERS):
+      listener.enter_phase(name)
+    start_wall = time.time()
+    start_cpu = time.process_time()
+    # Resident set sizes at the start and at the end of the phase
+    # (the peak rss is the peak of the process since its start,
+    # which may have been reached by a previous phase)
+    d_phase = {'name': name, 'rss_start': get_current_rss()}
+    try:
+      yield d_phase
+    finally:
+      d_phase['wall_time'] = time.time() - start_wall
+      d_phase['cpu_time'] = time.process_time() - start_cpu
+      d_phase['rss_end'] = get_current_rss()
+      d_phase['process_peak_rss'] = get_peak_rss()
+      d_phase['peak_traced'] = tracemalloc.get_traced_memory()[1] if tracing else None
+      self.l_phases.append(d_phase)
+      for listener in list(PHASE_LISTENERS):
+        listener.exit_phase(name)
+
+
+  def count(self, name, value):
+    '''
+    Increments a counter
+    Parameters:
+      name  = name of the counter
+      value = value added to the counter
+    '''
+    self.d_counters[name] = self.d_counters.get(name, 0) + value
+
+
+  def progress(self, label, nb_total, unit='rounds'):
+    '''
+    Returns a progress tracker reporting through the progress callback
+    Parameters:
+      label    = label of the task
+      nb_total = total number of items to process
+      unit     = name of the items
+    '''
+    return Progress(label, nb_total, unit, self.progress_callback)
+
+
+  def to_dict(self):
+    '''
+    Returns the measures as a dictionary
+    '''
+    return {
+      'phases': self.l_phases,
+      'counters': self.d_counters
+    }
+
+
+  def save(self, filepath):
+    '''
+    Saves the measures in a json file
+    Parameters:
+      filepath = path of the file
+    '''
+    with atomic_write(filepath) as f:
+      json.dump(self.to_dict(), f, indent=2)
+
+
+  def display(self):
+    '''
+    Displays the measures
+    '''
+    if len(self.l_phases) == 0:
+      print('No measures available.')
+      return
+
+    print('%-30s %12s %12s %12s %12s %16s %12s' % (
+      'phase', 'wall (s)', 'cpu (s)', 'rss (MB)', 'growth (MB)', 'proc. peak (MB)', 'traced (MB)'
+    ))
+    for d_phase in self.l_phases:
+      l_mem = [d_phase.get('rss_end'), get_rss_growth(d_phase), d_phase.get('process_peak_rss'), d_phase['peak_traced']]
+      print('%-30s %12.3f %12.3f %12s %12s %16s %12s' % tuple(
+        [d_phase['name'], d_phase['wall_time'], d_phase['cpu_time']] +
+        ['%.1f' % (v / 1048576.0) if v is not None else '-' for v in l_mem]
+      ))
+    print('(rss at the end of the phase, growth during the phase, peak of the process so far)')
+
+    if len(self.d_counters) > 0:
+      print('')
+      for k in sorted(self.d_counters.keys()):
+        print('%-30s %12d' % (k, self.d_counters[k]))
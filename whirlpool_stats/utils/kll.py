@@ -0,0 +1,201 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+KLL sketches estimating the quantiles of a stream of values
+with a bounded amount of memory (mergeable)
+
+Values are stored in a hierarchy of compactors. The compactor of level h
+stores values with a weight of 2^h. When a compactor is full, its values
+are sorted and one value out of 2 (randomly odd or even) is promoted
+to the next level.
+'''
+import math
+import random
+
+
+# Default size parameter (rank error ~1.5% with k = 200)
+DEFAULT_K = 200
+
+# Ratio between the capacities of 2 consecutive compactors
+CAPACITY_RATIO = 2.0 / 3.0
+
+
+class KLLSketch(object):
+
+  def __init__(self, k=DEFAULT_K, seed=None):
+    '''
+    Constructor
+    Parameters:
+      k    = size parameter of the sketch (capacity of the highest compactor)
+      seed = seed of the random generator (or None)
+    '''
+    self.k = k
+    self.rand = random.Random(seed)
+    # List of compactors (lists of values) ordered by level
+    self.compactors = []
+    # Number of values stored in the compactors
+    self.size = 0
+    # Maximum number of values stored before a compaction
+    self.max_size = 0
+    # Number of values added to the sketch
+    self.count = 0
+    # Minimum and maximum values
+    self.min_value = None
+    self.max_value = None
+    self.grow()
+
+
+  def grow(self):
+    '''
+    Adds a compactor
+    '''
+    self.compactors.append([])
+    self.max_size = sum([self.get_capacity(h) for h in range(0, len(self.compactors))])
+
+
+  def get_capacity(self, level):
+    '''
+    Returns the capacity of the compactor of a given level
+    Parameters:
+      level = level of the compactor
+    '''
+    depth = len(self.compactors) - level - 1
+    return int(math.ceil(math.pow(CAPACITY_RATIO, depth) * self.k)) + 1
+
+
+  def update(self, value):
+    '''
+    Adds a value to the sketch
+    Parameters:
+      value = value
+    '''
+    self.compactors[0].append(value)
+    self.size += 1
+    self.count += 1
+    if (self.min_value is None) or (value < self.min_value):
+      self.min_value = value
+    if (self.max_value is None) or (value > self.max_value):
+      self.max_value = value
+    if self.size >= self.max_size:
+      self.compress()
+
+
+  def compress(self):
+    '''
+    Compacts the full compactors until the sketch fits in its capacity
+    '''
+    for h in range(0, len(self.compactors)):
+      compactor = self.compactors[h]
+      if len(compactor) >= self.get_capacity(h):
+        if h + 1 >= len(self.compactors):
+          self.grow()
+        compactor.sort()
+        # Keeps the last value if the number of values is odd
+        last = compactor.pop() if len(compactor) % 2 == 1 else None
+        offset = self.rand.randint(0, 1)
+        self.compactors[h+1].extend(compactor[offset::2])
+        del compactor[:]
+        if last is not None:
+          compactor.append(last)
+        self.size = sum([len(c) for c in self.compactors])
+        if self.size < self.max_size:
+          break
+
+
+  def merge(self, other):
+    '''
+    Merges another sketch into this sketch
+    Parameters:
+      other = sketch
+    '''
+    while len(self.compactors) < len(other.compactors):
+      self.grow()
+    for h in range(0, len(other.compactors)):
+      self.compactors[h].extend(other.compactors[h])
+    self.size = sum([len(c) for c in self.compactors])
+    self.count += other.count
+    if other.count > 0:
+      if (self.min_value is None) or (other.min_value < self.min_value):
+        self.min_value = other.min_value
+      if (self.max_value is None) or (other.max_value > self.max_value):
+        self.max_value = other.max_value
+    while self.size >= self.max_size:
+      self.compress()
+
+
+  def get_quantile(self, q):
+    '''
+    Returns the estimated quantile of the values (None if the sketch is empty)
+    Parameters:
+      q = quantile (0-1)
+    '''
+    return self.get_quantiles([q])[0]
+
+
+  def get_quantiles(self, l_q):
+    '''
+    Returns a list of estimated quantiles of the values
+    Parameters:
+      l_q = list of quantiles (0-1)
+    '''
+    if self.count == 0:
+      return [None for q in l_q]
+
+    l_items = []
+    for h in range(0, len(self.compactors)):
+      weight = 1 << h
+      l_items.extend([(v, weight) for v in self.compactors[h]])
+    l_items.sort()
+    total = sum([w for v, w in l_items])
+
+    l_results = []
+    for q in l_q:
+      if q <= 0:
+        l_results.append(self.min_value)
+        continue
+      if q >= 1:
+        l_results.append(self.max_value)
+        continue
+      target = q * total
+      cum = 0
+      result = l_items[-1][0]
+      for v, w in l_items:
+        cum += w
+        if cum >= target:
+          result = v
+          break
+      l_results.append(result)
+    return l_results
+
+
+  def to_dict(self):
+    '''
+    Returns the state of the sketch as a dictionary (json serializable)
+    '''
+    return {
+      'k': self.k,
+      'count': self.count,
+      'min': self.min_value,
+      'max': self.max_value,
+      'compactors': self.compactors
+    }
+
+
+  @staticmethod
+  def from_dict(d_sketch, seed=None):
+    '''
+    Creates a sketch from a dictionary returned by to_dict()
+    Parameters:
+      d_sketch = dictionary
+      seed     = seed of the random generator (or None)
+    '''
+    sketch = KLLSketch(d_sketch['k'], seed)
+    sketch.compactors = [list(c) for c in d_sketch['compactors']]
+    if len(sketch.compactors) == 0:
+      sketch.compactors = [[]]
+    sketch.max_size = sum([sketch.get_capacity(h) for h in range(0, len(sketch.compactors))])
+    sketch.size = sum([len(c) for c in sketch.compactors])
+    sketch.count = d_sketch['count']
+    sketch.min_value = d_sketch['min']
+    sketch.max_value = d_sketch['max']
+    return sketch
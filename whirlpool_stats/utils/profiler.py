@@ -0,0 +1,345 @@
+'''
+Copyright (c) 2019 Katana Cryptographic Ltd. All Rights Reserved.
+
+Profiler of the commands of the interactive mode (see the profile command)
+
+A sampling thread records the call stack of the profiled thread at a regular
+interval. Optionally, cProfile measures exactly the calls of the profiled thread.
+Measures are attributed to the innermost phase of the instrumentation being
+executed by the profiled thread (load, compute fwd, export, plot fwd anonset, ...)
+or to the command itself outside of the phases.
+
+Outputs:
+  <prefix>.collapsed = collapsed stacks (one line per stack: phase;frame;...;frame nb_samples),
+                       ready for flamegraph.pl or speedscope
+  <prefix>.txt       = time by phase and top functions (overall and per phase)
+  <prefix>.prof      = statistics of cProfile (deterministic mode only, see pstats)
+'''
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import defaultdict
+from whirlpool_stats.utils.files import atomic_path, atomic_write
+from whirlpool_stats.utils.instrumentation import PHASE_LISTENERS
+
+
+# Default interval (in seconds) between 2 samples
+DEFAULT_INTERVAL = 0.005
+
+# Default number of functions listed in the tables of top functions
+DEFAULT_TOP = 20
+
+# Name of the pseudo phase grouping the measures done outside of the phases
+COMMAND_PHASE = '(command)'
+
+
+def get_frame_label(code):
+  '''
+  Returns the label of the function executed by a frame (function (file:line))
+  Parameters:
+    code = code object of the frame
+  '''
+  name = getattr(code, 'co_qualname', code.co_name)
+  return '%s (%s:%d)' % (name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def get_pstats_label(func):
+  '''
+  Returns the label of a function of pstats (see get_frame_label)
+  Parameters:
+    func = tuple (filename, line, name)
+  '''
+  filename, line, name = func
+  if filename == '~':
+    # Builtin function
+    return name
+  return '%s (%s:%d)' % (name, os.path.basename(filename), line)
+
+
+class Profiler(object):
+
+  def __init__(self, interval=DEFAULT_INTERVAL, deterministic=False):
+    '''
+    Constructor
+    Parameters:
+      interval      = interval (in seconds) between 2 samples
+      deterministic = flag indicating if calls are measured with cProfile
+    '''
+    self.interval = interval
+    self.deterministic = deterministic
+    # Id of the profiled thread and frame calling start (root of the recorded stacks)
+    self.thread_id = None
+    self.base_frame = None
+    # Stack of the phases executed by the profiled thread
+    self.l_phases = []
+    # Dictionary (phase, frame label, ..., frame label) => number of samples
+    self.d_stacks = defaultdict(int)
+    self.nb_samples = 0
+    # Dictionary phase => wall time (in seconds)
+    self.d_phase_times = defaultdict(float)
+    # Stack of the start times of the phases being executed
+    self.l_phase_starts = []
+    # Dictionary phase => cProfile profile (deterministic mode)
+    self.d_profiles = dict()
+    # Stack of the cProfile profiles enabled for the phases being executed
+    self.l_profiles = []
+    # Dictionary phase => statistics of cProfile (built when the profiler is stopped)
+    self.d_stats = dict()
+    self.start_time = None
+    self.wall_time = 0
+    self.stop_event = threading.Event()
+    self.thread = None
+
+
+  def start(self):
+    '''
+    Starts profiling the current thread (from the caller of this method)
+    '''
+    self.thread_id = threading.get_ident()
+    self.base_frame = sys._getframe(1)
+    self.start_time = time.time()
+    PHASE_LISTENERS.append(self)
+    self.thread = threading.Thread(target=self.run, name='wst-profiler', daemon=True)
+    self.thread.start()
+    if self.deterministic:
+      profile = self.d_profiles.setdefault(COMMAND_PHASE, cProfile.Profile())
+      self.l_profiles.append(profile)
+      profile.enable()
+
+
+  def stop(self):
+    '''
+    Stops profiling
+    '''
+    if self.deterministic:
+      for profile in self.l_profiles:
+        profile.disable()
+      self.l_profiles = []
+      # Profiles of the phases that haven't recorded any call are ignored
+      for phase, profile in self.d_profiles.items():
+        if len(profile.getstats()) > 0:
+          self.d_stats[phase] = pstats.Stats(profile)
+    self.stop_event.set()
+    self.thread.join()
+    PHASE_LISTENERS.remove(self)
+    self.wall_time = time.time() - self.start_time
+    # Phases interrupted by an exception
+    now = time.time()
+    while len(self.l_phases) > 0:
+      self.d_phase_times[self.l_phases.pop()] += now - self.l_phase_starts.pop()
+
+
+  def enter_phase(self, name):
+    '''
+    Called at the start of a phase of an instrumentation
+    Parameters:
+      name = name of the phase
+    '''
+    if threading.get_ident() != self.thread_id:
+      return
+    if self.deterministic:
+      self.l_profiles[-1].disable()
+      profile = self.d_profiles.setdefault(name, cProfile.Profile())
+      self.l_profiles.append(profile)
+      profile.enable()
+    self.l_phase_starts.append(time.time())
+    self.l_phases.append(name)
+
+
+  def exit_phase(self, name):
+    '''
+    Called at the end of a phase of an instrumentation
+    Parameters:
+      name = name of the phase
+    '''
+    if (threading.get_ident() != self.thread_id) or (len(self.l_phases) == 0):
+      return
+    self.l_phases.pop()
+    self.d_phase_times[name] += time.time() - self.l_phase_starts.pop()
+    if self.deterministic:
+      self.l_profiles.pop().disable()
+      self.l_profiles[-1].enable()
+
+
+  def run(self):
+    '''
+    Main loop of the sampling thread
+    '''
+    while not self.stop_event.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      if frame is None:
+        continue
+      l_labels = []
+      while (frame is not None) and (frame is not self.base_frame):
+        l_labels.append(get_frame_label(frame.f_code))
+        frame = frame.f_back
+      if frame is None:
+        # The profiled thread has left the frame calling start
+        continue
+      l_phases = self.l_phases
+      phase = l_phases[-1] if len(l_phases) > 0 else COMMAND_PHASE
+      l_labels.append(phase)
+      l_labels.reverse()
+      self.d_stacks[tuple(l_labels)] += 1
+      self.nb_samples += 1
+
+
+  def get_phases(self):
+    '''
+    Returns the list of the profiled phases (ordered by wall time)
+    '''
+    s_phases = set(self.d_phase_times.keys()) | set(self.d_stats.keys())
+    s_phases |= set(stack[0] for stack in self.d_stacks.keys())
+    s_phases.discard(COMMAND_PHASE)
+    l_phases = sorted(s_phases, key=lambda p: -self.d_phase_times.get(p, 0))
+    return [COMMAND_PHASE] + l_phases
+
+
+  def get_phase_samples(self):
+    '''
+    Returns a dictionary phase => number of samples
+    '''
+    d_samples = defaultdict(int)
+    for stack, nb in self.d_stacks.items():
+      d_samples[stack[0]] += nb
+    return d_samples
+
+
+  def get_top_samples(self, phase=None, top=DEFAULT_TOP):
+    '''
+    Returns the functions with the largest number of samples
+    as a list of tuples (function, self samples, total samples)
+    Parameters:
+      phase = phase (None = all the phases)
+      top   = number of functions
+    '''
+    d_self = defaultdict(int)
+    d_total = defaultdict(int)
+    for stack, nb in self.d_stacks.items():
+      if (phase is not None) and (stack[0] != phase):
+        continue
+      if len(stack) > 1:
+        d_self[stack[-1]] += nb
+      for label in set(stack[1:]):
+        d_total[label] += nb
+    l_funcs = sorted(d_total.keys(), key=lambda f: (-d_self[f], -d_total[f]))
+    return [(f, d_self[f], d_total[f]) for f in l_funcs[:top]]
+
+
+  def get_top_calls(self, phase=None, top=DEFAULT_TOP):
+    '''
+    Returns the functions with the largest internal time measured by cProfile
+    as a list of tuples (function, nb calls, internal time, cumulative time)
+    Parameters:
+      phase = phase (None = all the phases)
+      top   = number of functions
+    '''
+    stats = self.get_stats(phase)
+    if stats is None:
+      return []
+    l_funcs = sorted(stats.stats.items(), key=lambda item: -item[1][2])
+    return [
+      (get_pstats_label(func), nc, tt, ct)
+      for func, (cc, nc, tt, ct, callers) in l_funcs[:top]
+    ]
+
+
+  def get_stats(self, phase=None):
+    '''
+    Returns the statistics of cProfile (None if not available)
+    Parameters:
+      phase = phase (None = all the phases)
+    '''
+    if phase is not None:
+      return self.d_stats.get(phase)
+    if len(self.d_stats) == 0:
+      return None
+    stats = pstats.Stats()
+    for phase_stats in self.d_stats.values():
+      stats.add(phase_stats)
+    return stats
+
+
+  def get_report_lines(self, command, top=DEFAULT_TOP, details=True):
+    '''
+    Returns the lines of the report of the profile
+    Parameters:
+      command = profiled command
+      top     = number of functions listed per table
+      details = flag indicating if the top functions of each phase are listed
+    '''
+    l_lines = []
+    mode = 'sampling (interval %d ms)' % round(self.interval * 1000)
+    if self.deterministic:
+      mode += ' + cProfile'
+    l_lines.append('Profile of command: %s' % command)
+    l_lines.append('Mode: %s' % mode)
+    l_lines.append('Wall time: %.3f s - %d samples' % (self.wall_time, self.nb_samples))
+    l_lines.append('')
+
+    # Time by phase
+    d_samples = self.get_phase_samples()
+    nb_samples = max(self.nb_samples, 1)
+    l_lines.append('%-40s %10s %9s %7s' % ('phase', 'wall (s)', 'samples', '%'))
+    for phase in self.get_phases():
+      # Time spent outside of the phases is only estimated by the samples
+      wall_time = '-' if phase == COMMAND_PHASE else '%.3f' % self.d_phase_times.get(phase, 0)
+      l_lines.append('%-40s %10s %9d %7.1f' % (
+        phase, wall_time, d_samples.get(phase, 0), d_samples.get(phase, 0) * 100 / nb_samples
+      ))
+
+    l_phases = [None]
+    if details:
+      l_phases += [p for p in self.get_phases() if (d_samples.get(p, 0) > 0) or (p in self.d_stats)]
+    for phase in l_phases:
+      title = 'all phases' if phase is None else 'phase %s' % phase
+      l_lines.append('')
+      if self.deterministic:
+        l_lines.append('Top %d functions by internal time (cProfile) - %s' % (top, title))
+        l_lines.append('%10s %10s %10s  %s' % ('calls', 'self (s)', 'total (s)', 'function'))
+        for label, nb_calls, self_time, total_time in self.get_top_calls(phase, top):
+          l_lines.append('%10d %10.3f %10.3f  %s' % (nb_calls, self_time, total_time, label))
+      else:
+        l_lines.append('Top %d functions by samples - %s' % (top, title))
+        l_lines.append('%10s %10s  %s' % ('self %', 'total %', 'function'))
+        for label, nb_self, nb_total in self.get_top_samples(phase, top):
+          l_lines.append('%10.1f %10.1f  %s' % (
+            nb_self * 100 / nb_samples, nb_total * 100 / nb_samples, label
+          ))
+    return l_lines
+
+
+  def save(self, prefix, command, top=DEFAULT_TOP):
+    '''
+    Saves the outputs of the profile
+    Returns the list of the paths of the files
+    Parameters:
+      prefix  = prefix of the paths of the files
+      command = profiled command
+      top     = number of functions listed per table
+    '''
+    l_filepaths = []
+
+    filepath = '%s.collapsed' % prefix
+    with atomic_write(filepath) as f:
+      for stack, nb in sorted(self.d_stacks.items()):
+        f.write('%s %d\n' % (';'.join(l.replace(';', ',') for l in stack), nb))
+    l_filepaths.append(filepath)
+
+    filepath = '%s.txt' % prefix
+    with atomic_write(filepath) as f:
+      for line in self.get_report_lines(command, top):
+        f.write('%s\n' % line)
+    l_filepaths.append(filepath)
+
+    stats = self.get_stats() if self.deterministic else None
+    if stats is not None:
+      filepath = '%s.prof' % prefix
+      with atomic_path(filepath) as tmp_filepath:
+        stats.dump_stats(tmp_filepath)
+      l_filepaths.append(filepath)
+
+    return l_filepaths
@@ -6,19 +6,34 @@ A tool proniding a set of commands to compute statistics related to Whirpool
 import os
 import sys
 import getopt
+import threading
 from cmd import Cmd
 
 # Adds whirlpool_stats directory into path
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
 
-from whirlpool_stats.utils.constants import ALL_DENOMS, TXID_PREFIX_LENGTH
-from whirlpool_stats.services.downloader import Downloader
+# Note: modules depending on heavy packages (requests, plotly)
+# are imported by the commands needing them
+from whirlpool_stats.utils.constants import ALL_DENOMS, TXID_PREFIX_LENGTH, DEFAULT_MAX_POINTS, MIN_MAX_POINTS
+from whirlpool_stats.utils.date import parse_date, to_timestamp, to_utcdate
+from whirlpool_stats.utils.hyperloglog import DEFAULT_PRECISION, MIN_PRECISION, MAX_PRECISION
 from whirlpool_stats.services.snapshot import Snapshot
 from whirlpool_stats.services.forward_metrics import ForwardMetrics
 from whirlpool_stats.services.backward_metrics import BackwardMetrics
 from whirlpool_stats.services.tx0s_metrics import Tx0sMetrics
+from whirlpool_stats.services.windowed_metrics import WindowedMetrics
+from whirlpool_stats.services.depth_metrics import DepthMetrics, DEFAULT_MAX_DEPTH
+from whirlpool_stats.services.reach_index import ReachIndex
+from whirlpool_stats.services.range_index import MetricsIndexes, INDEXED_METRICS
+from whirlpool_stats.services.summary import MetricsSummary
+from whirlpool_stats.services.activity_metrics import ActivityMetrics, ALL_PERIODS
 from whirlpool_stats.services.exporter import Exporter
-from whirlpool_stats.services.metrics_plotter import Plotter
+from whirlpool_stats.services.jobs import JobTable
+from whirlpool_stats.backends import BACKENDS, DEFAULT_BACKEND, get_available_backends, get_backend_class
+
+
+# Commands that can be executed in background (command line ending with &)
+BACKGROUND_COMMANDS = ['download', 'load', 'export', 'report', 'forecast']
 
 
 class WhirlpoolStats(Cmd):
@@ -30,27 +45,148 @@ class WhirlpoolStats(Cmd):
     super(WhirlpoolStats, self).__init__()
     self.working_dir = working_dir
     self.socks5 = socks5
-    
+    # Backend computing the exact anonsets (applied by the next load)
+    self.backend_name = DEFAULT_BACKEND
+    # Flag indicating if the memory allocations are traced (see stats memory)
+    self.trace_memory = False
+    # Jobs executing commands in background
+    self.jobs = JobTable()
+    # Lock held while a command is executed
+    # (a state computed by a background job is swapped in between 2 commands)
+    self.lock = threading.RLock()
+    # Snapshot loaded in memory and its metrics
+    self.set_state(self.create_state())
+
+
+  def create_state(self):
+    '''
+    Returns a new state (dictionary attribute => value) storing
+    an empty snapshot and its metrics
+    '''
     # Snapshot loaded in memory
-    self.snapshot = Snapshot(self.working_dir)
+    snapshot = Snapshot(self.working_dir)
+    snapshot.instr.trace_memory = self.trace_memory
+    snapshot.instr.progress_callback = self.jobs.progress_callback
     # Forward looking metrics
-    self.fwd_metrics = ForwardMetrics(self.snapshot)
+    fwd_metrics = ForwardMetrics(snapshot)
+    fwd_metrics.backend_name = self.backend_name
     # Backward looking metrics
-    self.bwd_metrics = BackwardMetrics(self.snapshot)
+    bwd_metrics = BackwardMetrics(snapshot)
+    bwd_metrics.backend_name = self.backend_name
+    # Quantile sketches of the anonsets and spreads (updated by the metrics)
+    summary = MetricsSummary()
+    fwd_metrics.summary = summary
+    bwd_metrics.summary = summary
+    # Interrupted computations are resumed from their last checkpoint
+    fwd_metrics.resumable = True
+    bwd_metrics.resumable = True
     # Tx0s metrics
-    self.tx0_metrics = Tx0sMetrics(self.snapshot)
-    # Exporter
-    self.exporter = Exporter(
-      self.fwd_metrics,
-      self.bwd_metrics,
-      self.tx0_metrics
-    )
-    # Metrics plotter
-    self.plotter = Plotter(
-      self.fwd_metrics,
-      self.bwd_metrics,
-      self.tx0_metrics
-    )
+    tx0_metrics = Tx0sMetrics(snapshot, fwd_metrics)
+    # Time-windowed metrics (computed on demand)
+    win_metrics = WindowedMetrics(snapshot)
+    win_metrics.backend_name = self.backend_name
+    # Anonsets by depth (computed on demand)
+    depth_metrics = DepthMetrics(snapshot)
+    # Rollups of the activity metrics (built on demand)
+    activity_metrics = ActivityMetrics(bwd_metrics, tx0_metrics)
+    return {
+      'snapshot': snapshot,
+      'summary': summary,
+      'fwd_metrics': fwd_metrics,
+      'bwd_metrics': bwd_metrics,
+      'tx0_metrics': tx0_metrics,
+      'win_metrics': win_metrics,
+      'depth_metrics': depth_metrics,
+      'activity_metrics': activity_metrics,
+      # Reachability index (built or loaded with the snapshot)
+      'reach_index': ReachIndex(snapshot),
+      # Range indexes over the metrics (built on demand)
+      'metrics_indexes': MetricsIndexes(fwd_metrics, bwd_metrics, tx0_metrics),
+      # Exporter
+      'exporter': Exporter(
+        fwd_metrics,
+        bwd_metrics,
+        tx0_metrics,
+        win_metrics,
+        depth_metrics,
+        activity_metrics
+      ),
+      # Metrics plotter (lazily created)
+      '_plotter': None
+    }
+
+
+  def set_state(self, d_state):
+    '''
+    Swaps in a new state (between 2 commands, the swap of a job
+    waiting for the end of a command can be cancelled)
+    Parameters:
+      d_state = state returned by create_state
+    '''
+    while not self.lock.acquire(timeout=0.1):
+      self.jobs.check_cancelled()
+    try:
+      for name, value in d_state.items():
+        setattr(self, name, value)
+    finally:
+      self.lock.release()
+
+
+  def onecmd(self, line):
+    '''
+    Executes a command line (executed in background if it ends with &)
+    '''
+    if line.strip().endswith('&'):
+      self.submit_job(line.strip()[:-1])
+      return False
+    # The state isn't swapped while the command is executed
+    with self.lock:
+      return super(WhirlpoolStats, self).onecmd(line)
+
+
+  def postcmd(self, stop, line):
+    '''
+    Reports the jobs finished since the previous command
+    '''
+    for job in self.jobs.pop_finished():
+      print('[%d] %s  %s' % (job.job_id, job.status, job.command))
+    return stop
+
+
+  def submit_job(self, line):
+    '''
+    Executes a command in background
+    Parameters:
+      line = command line (without the trailing &)
+    '''
+    print('')
+    cmd, arg, line = self.parseline(line)
+    if cmd not in BACKGROUND_COMMANDS:
+      print('Only the commands %s can be executed in background.' % ', '.join(BACKGROUND_COMMANDS))
+    else:
+      func = getattr(self, 'do_' + cmd)
+      job = self.jobs.submit(line, lambda: func(arg))
+      print('[%d] %s' % (job.job_id, line))
+    print(' ')
+
+
+  @property
+  def plotter(self):
+    '''
+    Metrics plotter
+    (plotly is imported when the plotter is used for the first time)
+    '''
+    if self._plotter is None:
+      from whirlpool_stats.services.metrics_plotter import Plotter
+      self._plotter = Plotter(
+        self.fwd_metrics,
+        self.bwd_metrics,
+        self.tx0_metrics,
+        self.win_metrics,
+        self.depth_metrics,
+        self.activity_metrics
+      )
+    return self._plotter
 
 
   def set_prompt(self):
@@ -100,6 +236,43 @@ Examples:
     print(' ')
 
 
+  def do_backend(self, args):
+    '''
+Displays or sets the backend computing the exact anonsets (used by the next load)
+Syntax: backend [<name> | check [<nb_rounds>]]
+Examples:
+  backend            => displays the current backend and the available backends
+  backend numpy      => computes the anonsets with the vectorized backend (requires numpy)
+  backend numba      => computes the anonsets with compiled walks (requires numba)
+  backend distributed => computes the anonsets on worker processes (requires WST_WORKERS)
+  backend check      => checks that all the available backends return the same anonsets
+                        for the active snapshot
+  backend check 1000 => checks the first 1000 mix rounds and tx0s of the active snapshot
+    '''
+    print('')
+    l_args = args.split()
+
+    if len(l_args) == 0:
+      print('Current backend: %s' % self.backend_name)
+      print('Available backends: %s' % ', '.join(get_available_backends()))
+    elif l_args[0] == 'check':
+      if self.snapshot.denom is None:
+        print('Load a snapshot first.')
+      elif (len(l_args) > 1) and not l_args[1].isdigit():
+        print('Invalid number of mix rounds.')
+      else:
+        nb_rounds = int(l_args[1]) if len(l_args) > 1 else None
+        from whirlpool_stats.backends.conformance import check_snapshot, display
+        display('Snapshot %s' % self.snapshot.denom, check_snapshot(self.snapshot, nb_rounds=nb_rounds))
+    elif (l_args[0] in BACKENDS) and (get_backend_class(l_args[0]) is not None):
+      self.backend_name = l_args[0]
+      print('Set backend to %s (applied by the next load).' % l_args[0])
+    else:
+      print('Invalid backend (available backends: %s).' % ', '.join(get_available_backends()))
+
+    print(' ')
+
+
   def do_download(self, args):
     '''
 Downloads the snapshot(s) for one or several pool denominations
@@ -108,36 +281,263 @@ Examples:
   download 05         => downloads the snapshot of the 0.5BTC pools
   download 005,001    => downloads the snapshots of the 0.05BTC and 0.01BTC pools
   download            => downloads the snapshots of all denominations
+  download 05 &       => downloads the snapshot in background (see jobs)
     '''
     print('')
+    from whirlpool_stats.services.downloader import Downloader
     downloader = Downloader()
     denoms = ALL_DENOMS if (len(args) == 0) else args.split(',') 
     downloader.download(self.working_dir, denoms, self.socks5)
     print(' ')
 
 
+  def do_diff(self, args):
+    '''
+Compares a previous version of a snapshot with the snapshot stored in the working directory
+(new, removed and modified txs and links, rewrites of the history, deltas of the exported anonsets)
+Syntax: diff <old_dir> [denom] [save]
+Examples:
+  diff /data/previous           => compares /data/previous with the working directory (active denomination)
+  diff /data/previous 005       => compares the snapshots of the 0.05BTC pools
+  diff /data/previous 05 save   => also exports the deltas of the anonsets in whirlpool_05_diff.csv
+    '''
+    print('')
+
+    l_args = args.split()
+    denom = self.snapshot.denom
+    save = False
+    for arg in l_args[1:]:
+      if arg == 'save':
+        save = True
+      else:
+        denom = arg
+
+    if len(l_args) == 0:
+      print('The directory storing the previous version of the snapshot is mandatory.')
+    elif denom not in ALL_DENOMS:
+      print('A valid denomination code is mandatory if no snapshot is loaded.')
+    else:
+      from whirlpool_stats.services.differ import SnapshotDiff
+      diff = SnapshotDiff(l_args[0], self.working_dir, denom)
+      try:
+        diff.compute()
+        print('')
+        diff.display()
+        if save:
+          print('')
+          diff.export('%s/whirlpool_%s_diff.csv' % (self.working_dir, denom))
+      except (OSError, ValueError, IndexError) as e:
+        print('Unable to compare the snapshots (%s).' % e)
+
+    print(' ')
+
+
   def do_load(self, args):
     '''
 Loads in memory the snapshot of a given denomination
 and computes its metrics
 Available denomnination codes are 05, 005, 001
+Syntax: load <denom> [approx[=<precision>]]
 Examples:
-  compute 05  => compute metrics for snaphot of the 0.5BTC pools
+  load 05             => compute metrics for snaphot of the 0.5BTC pools
+  load 05 approx      => compute approximate anonsets (HyperLogLog sketches with 2^10 registers)
+  load 05 approx=14   => compute approximate anonsets (HyperLogLog sketches with 2^14 registers)
+  load 05 &           => loads the snapshot in background (see jobs), the active snapshot
+                         and its metrics serve the queries until the new ones are swapped in
     '''
     print('')
 
-    if len(args) == 0:
+    l_args = args.split()
+    approx_precision = None
+    for opt in l_args[1:]:
+      if opt == 'approx':
+        approx_precision = DEFAULT_PRECISION
+      elif opt.startswith('approx=') and opt[7:].isdigit() and \
+        (MIN_PRECISION <= int(opt[7:]) <= MAX_PRECISION):
+        approx_precision = int(opt[7:])
+      else:
+        print('Invalid option %s (values: approx, approx=<%d-%d>).' % (opt, MIN_PRECISION, MAX_PRECISION))
+        print(' ')
+        return
+
+    if len(l_args) == 0:
       print('A denomination code is mandatory.')
-    elif args not in ALL_DENOMS:
+    elif l_args[0] not in ALL_DENOMS:
       print('Invalid denomination code')
     else:
+      jobs = self.jobs
+      # The active snapshot is released before a load in foreground
+      # (it keeps serving the queries during a load in background)
+      if jobs.get_current_job() is None:
+        self.set_state(self.create_state())
+      d_state = self.create_state()
       # Loads the snapshots
-      self.snapshot.set_dir(self.working_dir)
-      self.snapshot.load(args)
+      d_state['snapshot'].load(l_args[0])
+      jobs.check_cancelled()
+      d_state['reach_index'].load_or_build()
+      d_state['summary'].set_denom(l_args[0])
+      jobs.check_cancelled()
       # Computes the metrics
-      self.fwd_metrics.compute()
-      self.bwd_metrics.compute()
-      self.tx0_metrics.compute()
+      d_state['fwd_metrics'].approx_precision = approx_precision
+      d_state['bwd_metrics'].approx_precision = approx_precision
+      d_state['fwd_metrics'].compute()
+      d_state['bwd_metrics'].compute()
+      d_state['tx0_metrics'].compute()
+      self.set_state(d_state)
+
+    print(' ')
+
+
+  def do_window(self, args):
+    '''
+Computes the backward-looking anonsets and spreads of the active snapshot
+only counting the tx0s created during the last N days before each mix
+Syntax: window <nb_days>
+Examples:
+  window 30   => anonsets counting the tx0s created during the 30 days preceding each mix
+    '''
+    print('')
+
+    if len(self.snapshot.l_mix_txs) == 0:
+      print('No snapshot loaded (see command load).')
+    elif (len(args) == 0) or not args.strip().isdigit() or int(args) == 0:
+      print('A window size (number of days > 0) is mandatory.')
+    else:
+      self.win_metrics.compute_window(int(args))
+
+    print(' ')
+
+
+  def do_depth(self, args):
+    '''
+Computes the backward-looking anonsets of the active snapshot reached
+after 1, 2, ... N remix hops (growth of the anonsets with the depth)
+Syntax: depth [max_depth]
+Examples:
+  depth      => anonsets reached at depths 1 to 10
+  depth 20   => anonsets reached at depths 1 to 20
+    '''
+    print('')
+
+    if len(self.snapshot.l_mix_txs) == 0:
+      print('No snapshot loaded (see command load).')
+    elif (len(args) > 0) and (not args.strip().isdigit() or int(args) == 0):
+      print('Invalid maximum depth (integer > 0).')
+    else:
+      max_depth = int(args) if len(args) > 0 else DEFAULT_MAX_DEPTH
+      self.depth_metrics.compute(max_depth)
+
+    print(' ')
+
+
+  def do_asof(self, args):
+    '''
+Computes the forward-looking anonsets and spreads of the active snapshot
+as they were at the end of a given day (mixes confirmed after this day are ignored)
+Syntax: asof <date>
+Examples:
+  asof 2020-01-31   => forward-looking metrics as of 31/01/2020
+  asof 31/01/2020   => same as above
+    '''
+    print('')
+
+    date = parse_date(args.strip())
+
+    if len(self.snapshot.l_mix_txs) == 0:
+      print('No snapshot loaded (see command load).')
+    elif date is None:
+      print('A valid date is mandatory (formats: YYYY-MM-DD, DD/MM/YYYY).')
+    else:
+      self.win_metrics.compute_asof(date)
+
+    print(' ')
+
+
+  def do_preview(self, args):
+    '''
+Estimates the distributions of the anonsets and spreads of a snapshot
+from a stratified random sample of mix rounds (by date) computed in a time budget.
+The active snapshot and its metrics are left untouched.
+Syntax: preview <denom> [time budget in seconds]
+Examples:
+  preview 05       => preview of the 0.5BTC pools computed in 30 seconds
+  preview 05 120   => preview of the 0.5BTC pools computed in 2 minutes
+    '''
+    print('')
+
+    l_args = args.split()
+
+    if len(l_args) == 0:
+      print('A denomination code is mandatory.')
+    elif l_args[0] not in ALL_DENOMS:
+      print('Invalid denomination code')
+    elif (len(l_args) > 1) and not l_args[1].isdigit():
+      print('Invalid time budget')
+    else:
+      from whirlpool_stats.services.preview import Preview, DEFAULT_TIME_BUDGET
+      time_budget = int(l_args[1]) if len(l_args) > 1 else DEFAULT_TIME_BUDGET
+      snapshot = Snapshot(self.working_dir)
+      snapshot.load(l_args[0])
+      preview = Preview(snapshot)
+      preview.compute(time_budget)
+      preview.display()
+
+    print(' ')
+
+
+  def do_forecast(self, args):
+    '''
+Forecasts the forward-looking anonsets of the recent mixes of the active snapshot
+under simulated future mixes (percentile bands of Monte Carlo runs at each week).
+Mixing rate and remix ratio default to the values observed during the last 30 days.
+The active snapshot and its metrics are left untouched.
+Syntax: forecast [days=<n>] [recent=<n>] [rate=<mixes/day>] [remix=<ratio>] [runs=<n>] [seed=<n>] [save [export_dir]]
+Examples:
+  forecast                        => anonsets of the mixes of the last 7 days in 4 weeks (200 runs)
+  forecast days=56 recent=14      => anonsets of the mixes of the last 14 days in 8 weeks
+  forecast rate=300 remix=0.7     => scenario with 300 mixes per day and 70% of remixed inputs
+  forecast runs=500 seed=1 save   => exports the bands in the working directory (whirlpool_<denom>_forecast.csv)
+    '''
+    print('')
+
+    from whirlpool_stats.services.forecast import Forecast, DEFAULT_HORIZON, DEFAULT_RECENT_DAYS, DEFAULT_NB_RUNS
+    d_opts = {
+      'days': DEFAULT_HORIZON,
+      'recent': DEFAULT_RECENT_DAYS,
+      'rate': None,
+      'remix': None,
+      'runs': DEFAULT_NB_RUNS,
+      'seed': None
+    }
+    l_others = []
+    for opt in args.split():
+      name, _, value = opt.partition('=')
+      if name not in d_opts:
+        l_others.append(opt)
+        continue
+      try:
+        d_opts[name] = float(value) if name in ['rate', 'remix'] else int(value)
+      except ValueError:
+        d_opts[name] = -1
+      if (d_opts[name] < 0) or ((name == 'remix') and (d_opts[name] > 1)) or \
+        ((name in ['days', 'recent', 'runs']) and (d_opts[name] == 0)):
+        print('Invalid value of option %s.' % name)
+        print(' ')
+        return
+
+    if len(self.snapshot.l_mix_txs) == 0:
+      print('No snapshot loaded (see command load).')
+    elif (len(l_others) > 0) and ((l_others[0] != 'save') or (len(l_others) > 2)):
+      print('Invalid option %s (values: days=, recent=, rate=, remix=, runs=, seed=, save).' % l_others[0])
+    else:
+      forecast = Forecast(self.snapshot, self.fwd_metrics)
+      forecast.compute(
+        d_opts['days'], d_opts['recent'], d_opts['rate'], d_opts['remix'], d_opts['runs'], d_opts['seed']
+      )
+      forecast.display()
+      if len(l_others) > 0:
+        print('')
+        forecast.save(l_others[1] if len(l_others) == 2 else self.working_dir)
 
     print(' ')
 
@@ -165,15 +565,34 @@ Examples:
       bwd_spread = self.bwd_metrics.l_spreads[mix_round]
 
       print('Backward-looking metrics for the outputs of this mix:')
-      print('  anonset = %d' % bwd_anonset)
+      print('  anonset = %d%s' % (bwd_anonset, self.get_error_label(self.bwd_metrics)))
       print('  spread = %d%%' % bwd_spread)
       print('')
       print('Forward-looking metrics for Tx0s outputs having this transaction as their first mix:')
-      print('  anonset = %d' % fwd_anonset)
+      print('  anonset = %d%s' % (fwd_anonset, self.get_error_label(self.fwd_metrics)))
       print('  spread = %d%%' % fwd_spread)
 
+      win_metrics = self.win_metrics
+      if win_metrics.nb_days is not None:
+        print('')
+        print('Backward-looking metrics (tx0s of the last %d days):' % win_metrics.nb_days)
+        print('  anonset = %d' % win_metrics.l_win_anonsets[mix_round])
+        print('  spread = %d%%' % win_metrics.l_win_spreads[mix_round])
+      if win_metrics.asof_date is not None:
+        print('')
+        if mix_round < len(win_metrics.l_asof_anonsets):
+          print('Forward-looking metrics as of %s:' % win_metrics.asof_date.strftime('%d/%m/%Y'))
+          print('  anonset = %d' % win_metrics.l_asof_anonsets[mix_round])
+          print('  spread = %d%%' % win_metrics.l_asof_spreads[mix_round])
+        else:
+          print('This mix was confirmed after %s.' % win_metrics.asof_date.strftime('%d/%m/%Y'))
+      if self.depth_metrics.max_depth is not None:
+        print('')
+        print('Backward-looking anonsets by depth (1 to %d):' % self.depth_metrics.max_depth)
+        print('  %s' % ' '.join([str(v) for v in self.depth_metrics.get_curve(mix_round)]))
+
     elif txid_prefix in self.snapshot.d_tx0s.keys():
-      tx0_metrics = self.tx0_metrics.d_metrics[txid_prefix]
+      tx0_metrics = self.tx0_metrics.get_metrics(txid_prefix)
       nb_outs = tx0_metrics[0]
       nb_counterparties = tx0_metrics[1]
       heterogeneity = float(nb_counterparties) / float(nb_outs)
@@ -182,6 +601,11 @@ Examples:
       print('  number of mixed outputs = %d' % nb_outs)
       print('  number of counterparties (tx0s) = %d' % nb_counterparties)
       print('  heterogeneity ratio = %.2f' % heterogeneity)
+      l_anonsets = self.tx0_metrics.l_anonsets
+      if tx0_metrics[3] < len(l_anonsets):
+        print('')
+        print('Forward-looking metrics for the outputs of this Tx0:')
+        print('  anonset = %d%s' % (l_anonsets[tx0_metrics[3]], self.get_error_label(self.fwd_metrics)))
 
     else:
       print('Transaction not found in this snapshot.')
@@ -189,11 +613,201 @@ Examples:
     print(' ')
 
 
+  def do_trace(self, args):
+    '''
+Checks if a tx0 (or a mix) is an ancestor of a mix of the active snapshot
+and displays the number of hops separating them
+Syntax: trace <txid tx0> <txid mix>
+Examples:
+  trace 2d5ce8bd97b5f45c5f2d50d12e4f1f5d9fc3c7b0cb2e2d0a5d15a9dc1e6e18b4 450f236d596fc8a43916d624734fa7608cff1f17af5c3ddf81d7ad79021a645d
+    '''
+    print('')
+
+    l_args = args.split()
+
+    if len(l_args) != 2:
+      print('The txids of a tx0 and of a mix transaction are mandatory.')
+    else:
+      src_prefix = l_args[0][0:2*TXID_PREFIX_LENGTH]
+      mix_prefix = l_args[1][0:2*TXID_PREFIX_LENGTH]
+      if (src_prefix not in self.snapshot.d_tx0s) and (src_prefix not in self.snapshot.d_txids):
+        print('Tx0 not found in this snapshot.')
+      elif mix_prefix not in self.snapshot.d_txids:
+        print('Mix transaction not found in this snapshot.')
+      else:
+        nb_hops = self.reach_index.trace(src_prefix, mix_prefix)
+        if nb_hops is None:
+          print('This tx0 is not an ancestor of this mix (not in its backward-looking anonset).')
+        else:
+          print('This tx0 is an ancestor of this mix (in its backward-looking anonset).')
+          print('  shortest path = %d hop(s)' % nb_hops)
+
+    print(' ')
+
+
+  def do_summary(self, args):
+    '''
+Displays the percentiles of the anonsets and spreads of the active snapshot
+(estimated by quantile sketches maintained while the metrics are computed)
+Syntax:
+  summary                             => all-time percentiles
+  summary <date>                      => percentiles of a given day
+  summary save [filepath]             => saves the percentiles and the sketches in a json file
+                                         (default: <workdir>/whirlpool_<denom>_summary.json)
+  summary merge <file1> <file2> ...   => merges summaries saved for several denominations
+                                         and displays the all-time percentiles
+Examples:
+  summary 2020-01-31
+  summary merge /tmp/whirlpool_05_summary.json /tmp/whirlpool_005_summary.json
+    '''
+    print('')
+
+    l_args = args.split()
+
+    if len(l_args) == 0:
+      self.summary.display()
+    elif l_args[0] == 'save':
+      if len(self.summary.d_sketches) == 0:
+        print('No summary available (load a snapshot first).')
+      else:
+        if len(l_args) > 1:
+          filepath = l_args[1]
+        else:
+          filepath = '%s/whirlpool_%s_summary.json' % (self.working_dir, self.snapshot.denom)
+        self.summary.save(filepath)
+        print('Summary saved in %s' % filepath)
+    elif l_args[0] == 'merge':
+      if len(l_args) < 2:
+        print('At least one summary file is mandatory.')
+      else:
+        merged = MetricsSummary()
+        try:
+          for filepath in l_args[1:]:
+            merged.merge(MetricsSummary.load(filepath))
+          merged.display()
+        except (OSError, ValueError, KeyError) as e:
+          print('Unable to load summary %s (%s).' % (filepath, e))
+    else:
+      date = parse_date(l_args[0])
+      if date is None:
+        print('Invalid date %s (formats: YYYY-MM-DD, DD/MM/YYYY).' % l_args[0])
+      else:
+        self.summary.display(to_timestamp(date))
+
+    print(' ')
+
+
+  def do_query(self, args):
+    '''
+Finds the mix rounds (or the Tx0s) with the lowest/highest values of a metrics
+or with values in a range, optionally restricted to a date range
+Syntax:
+  query <category> <name> lowest [k] [from=<date>] [to=<date>]
+  query <category> <name> highest [k] [from=<date>] [to=<date>]
+  query <category> <name> range <min> <max> [from=<date>] [to=<date>]
+Available metrics: fwd anonset, fwd spread, bwd anonset, bwd spread, tx0 hr
+Examples:
+  query fwd anonset lowest 20                       => 20 mix rounds with the lowest forward-looking anonsets
+  query bwd spread highest 5 from=2020-01-01        => 5 highest backward-looking spreads since 01/01/2020
+  query fwd anonset range 0 50 to=2020-03-31        => mix rounds with a forward-looking anonset <= 50 until 31/03/2020
+  query tx0 hr lowest 10                            => 10 Tx0s with the lowest heterogeneity ratios
+    '''
+    print('')
+
+    l_args = args.split()
+    l_opts = [a for a in l_args if a.startswith('from=') or a.startswith('to=')]
+    l_args = [a for a in l_args if a not in l_opts]
+
+    if len(l_args) < 3:
+      print('Category, metrics and query type are mandatory.')
+      print(' ')
+      return
+
+    category, metrics, query_type = l_args[0:3]
+    index = self.metrics_indexes.get_index(category, metrics)
+    if index is None:
+      print('Invalid metrics (values: %s).' % ', '.join(['%s %s' % m for m in INDEXED_METRICS]))
+      print(' ')
+      return
+
+    # Date range
+    from_ts = None
+    to_ts = None
+    for opt in l_opts:
+      name, value = opt.split('=', 1)
+      date = parse_date(value)
+      if date is None:
+        print('Invalid date %s (formats: YYYY-MM-DD, DD/MM/YYYY).' % value)
+        print(' ')
+        return
+      if name == 'from':
+        from_ts = to_timestamp(date)
+      else:
+        to_ts = to_timestamp(date) + 86399
+
+    try:
+      if query_type in ['lowest', 'highest']:
+        k = int(l_args[3]) if len(l_args) > 3 else 10
+        if query_type == 'lowest':
+          l_results = index.get_lowest(k, from_ts, to_ts)
+        else:
+          l_results = index.get_highest(k, from_ts, to_ts)
+      elif (query_type == 'range') and (len(l_args) == 5):
+        l_results = index.get_range(float(l_args[3]), float(l_args[4]), from_ts, to_ts)
+      else:
+        print('Invalid query (values: lowest [k], highest [k], range <min> <max>).')
+        print(' ')
+        return
+    except ValueError:
+      print('Invalid numeric parameter.')
+      print(' ')
+      return
+
+    if category == 'tx0':
+      lbl_id = 'tx0 index'
+      l_ts = self.snapshot.l_ts_tx0s
+    else:
+      lbl_id = 'mix round'
+      l_ts = self.snapshot.l_ts_mix_txs
+
+    print('%-10s  %-10s  %-16s  %s' % (lbl_id, 'date', 'txid', metrics))
+    for item_id, value in l_results:
+      print('%-10d  %-10s  %-16s  %s' % (
+        item_id,
+        to_utcdate(l_ts[item_id]).strftime('%d/%m/%Y'),
+        self.metrics_indexes.get_txid_prefix(category, item_id),
+        ('%d' % value) if metrics == 'anonset' else ('%.2f' % value)
+      ))
+    print('%d result(s)' % len(l_results))
+
+    print(' ')
+
+
+  def get_error_label(self, o_metrics):
+    '''
+    Returns a label describing the error of approximate anonsets
+    (empty string for exact anonsets)
+    Parameters:
+      o_metrics = forward or backward metrics
+    '''
+    if o_metrics.approx_precision is None:
+      return ''
+    return ' (approximate, relative standard error = %.2f%%)' % (o_metrics.get_error() * 100)
+
+
   def do_plot(self, args):
     '''
 Plots a chart for a given metrics.
 
-Syntax: plot <category> <name> [log]
+Syntax: plot <category> <name> [log] [points=<n>] [density] [day|week|month] [from=<date>] [to=<date>]
+
+Options:
+    log                     => display the y-axis in log scale
+    points=<n>              => maximum number of points sent to a scatterplot (default: 50000, minimum: 3)
+                               larger series are downsampled (lttb) and rendered with WebGL
+    density                 => display large series as a density chart instead of downsampling them
+    day|week|month          => period of the activity metrics (default: day)
+    from=<date>, to=<date>  => date range of the activity metrics (formats: YYYY-MM-DD, DD/MM/YYYY)
 
 Available charts:
 
@@ -205,17 +819,30 @@ Available charts:
     plot bwd spread         => plot a scatterplot displaying the backward looking spreads
     plot bwd spread         => plot a scatterplot with the y-axis in log scale
 
+- Time-windowed privacy metrics (see commands window and asof) -----------------------------------------------------------
+    plot win anonset        => plot a scatterplot displaying the backward looking anonsets computed over a window
+    plot win spread         => plot a scatterplot displaying the backward looking spreads computed over a window
+    plot asof anonset       => plot a scatterplot displaying the forward looking anonsets as of a date
+    plot asof spread        => plot a scatterplot displaying the forward looking spreads as of a date
+
+- Anonsets by depth (see command depth) ----------------------------------------------------------------------------------
+    plot depth median       => plot a linechart of the median backward looking anonset reached at each depth
+    plot depth <d>          => plot a scatterplot displaying the backward looking anonsets reached at depth d
+
 - Activity metrics -------------------------------------------------------------------------------------------------------
     plot act inflow         => plot a linechart of the daily inflow expressed in number of UTXOs entering the pool
     plot act mixes          => plot a linechart of the daily number of mixes
     plot act tx0s_created   => plot a linechart of the daily number of Tx0s created
     plot act tx0s_active    => plot a linechart of the daily number of active Tx0s
+    plot act mixes week from=2020-01-01 to=2020-06-30
+                            => plot a linechart of the weekly number of mixes during the first half of 2020
 
 - Tx0s metrics -----------------------------------------------------------------------------------------------------------
     plot tx0 outputs        => plot a scatterplot displaying the number of outputs generated by the Tx0s
     plot tx0 hr             => plot a scatterplot displaying the heteogeneity ratio of the Tx0s
     plot tx0 hrout          => plot a scatterplot displaying the heteogeneity ratio vs the number of mixed Tx0s outputs
     plot tx0 hrdist         => plot a histogram displaying the distribution of Tx0s per heterogeneity ratio
+    plot tx0 anonset        => plot a scatterplot displaying the forward looking anonsets of the Tx0s outputs
     '''
     print('')
 
@@ -224,13 +851,102 @@ Available charts:
     else:
       l_args = args.split(' ')
       category = l_args[0]
-      metrics = l_args[1]
-      log_scale = True if ((len(l_args) == 3) and l_args[2] == 'log') else False
-      self.plotter.plot(category, metrics, log_scale)
+      metrics = l_args[1] if len(l_args) > 1 else ''
+      log_scale = False
+      max_points = DEFAULT_MAX_POINTS
+      density = False
+      activity_opts = self.parse_activity_options(l_args[2:])
+      if activity_opts is None:
+        print('')
+        return
+      period, from_date, to_date, l_opts = activity_opts
+      for opt in l_opts:
+        if opt == 'log':
+          log_scale = True
+        elif opt == 'density':
+          density = True
+        elif opt.startswith('points=') and opt[7:].isdigit():
+          max_points = int(opt[7:])
+          if max_points < MIN_MAX_POINTS:
+            print('Invalid number of points (minimum: %d).' % MIN_MAX_POINTS)
+            print('')
+            return
+        else:
+          print('Invalid option %s (values: log, points=<n>, density, day, week, month, from=<date>, to=<date>).' % opt)
+          print('')
+          return
+      if (category != 'act') and ((period != 'day') or (from_date is not None) or (to_date is not None)):
+        print('Periods and date ranges are only available for the activity metrics (category act).')
+        print('')
+        return
+      self.plotter.plot(category, metrics, log_scale, max_points, density,
+                        period, from_date, to_date)
       
     print('')
 
 
+  def parse_activity_options(self, l_opts):
+    '''
+    Parses the options selecting the period and the date range of the activity metrics
+    Returns a tuple (period, from_date, to_date, list of the other options)
+    or None if a date is invalid
+    Parameters:
+      l_opts = list of options
+    '''
+    period = 'day'
+    from_date = None
+    to_date = None
+    l_others = []
+    for opt in l_opts:
+      if opt in ALL_PERIODS:
+        period = opt
+      elif opt.startswith('from=') or opt.startswith('to='):
+        name, value = opt.split('=', 1)
+        date = parse_date(value)
+        if date is None:
+          print('Invalid date %s (formats: YYYY-MM-DD, DD/MM/YYYY).' % value)
+          return None
+        if name == 'from':
+          from_date = date
+        else:
+          to_date = date
+      elif len(opt) > 0:
+        l_others.append(opt)
+    return period, from_date, to_date, l_others
+
+
+  def do_activity(self, args):
+    '''
+Displays the activity metrics of the active snapshot (mixes, inflow, tx0s created,
+distinct active tx0s) over a date range, by day, week or month
+Syntax: activity [day|week|month] [from=<date>] [to=<date>] [save [export_dir]]
+Examples:
+  activity                                    => daily activity since the first mix
+  activity month                              => monthly activity
+  activity week from=2020-01-01 to=2020-03-31 => weekly activity of the first quarter of 2020
+  activity week save /tmp                     => exports the weekly activity in /tmp/whirlpool_<denom>_activity_week.csv
+    '''
+    print('')
+
+    activity_opts = self.parse_activity_options(args.split())
+    if activity_opts is None:
+      print(' ')
+      return
+    period, from_date, to_date, l_opts = activity_opts
+
+    if len(self.snapshot.l_mix_txs) == 0:
+      print('No snapshot loaded (see command load).')
+    elif (len(l_opts) > 0) and (l_opts[0] == 'save') and (len(l_opts) <= 2):
+      export_dir = l_opts[1] if len(l_opts) == 2 else self.working_dir
+      self.exporter.export_activity_rollups(export_dir, period, from_date, to_date)
+    elif len(l_opts) > 0:
+      print('Invalid option %s (values: day, week, month, from=<date>, to=<date>, save).' % l_opts[0])
+    else:
+      self.activity_metrics.display(period, from_date, to_date)
+
+    print(' ')
+
+
   def do_export(self, args):
     '''
 Exports the computed metrics for the active snapshot (csv format)
@@ -238,6 +954,7 @@ Files are exported in a given directory or in the working directory if none prov
 Examples:
   export /tmp  => exports the results in the /tmp directory
   export       => exports the results in the working directory
+  export &     => exports the results in background (see jobs)
     '''
     print('')
     export_dir = self.working_dir if (len(args) == 0) else args
@@ -245,11 +962,233 @@ Examples:
     print(' ')
 
 
+  def do_report(self, args):
+    '''
+Renders all the charts (fwd, bwd, act, tx0) of one or several denominations
+in a single self-contained HTML file (doesn't require a browser or a display)
+Syntax: report [denoms] [filepath] [png]
+Examples:
+  report                              => report for the active snapshot (stored in the working directory)
+  report 05,005                       => report for the 0.5BTC and 0.05BTC pools
+  report 05 /tmp/report.html png      => report stored in /tmp/report.html with a PNG file per chart
+  report 05,005 &                     => report rendered in background (see jobs)
+    '''
+    print('')
+
+    denoms = [self.snapshot.denom] if self.snapshot.denom is not None else []
+    filepath = '%s/whirlpool_report.html' % self.working_dir
+    png = False
+    for arg in args.split():
+      if arg == 'png':
+        png = True
+      elif all(d in ALL_DENOMS for d in arg.split(',')):
+        denoms = arg.split(',')
+      else:
+        filepath = arg
+
+    if len(denoms) == 0:
+      print('A denomination code is mandatory if no snapshot is loaded.')
+      print(' ')
+      return
+
+    from whirlpool_stats.services.reporter import Reporter
+    reporter = Reporter(self.working_dir)
+    d_plotters = dict()
+    for denom in denoms:
+      # Reuses the metrics of the active snapshot
+      if denom == self.snapshot.denom:
+        d_plotters[denom] = self.plotter
+      else:
+        d_plotters[denom] = reporter.get_plotter(denom)
+    reporter.report(d_plotters, filepath, png)
+
+    print(' ')
+
+
+  def do_stats(self, args):
+    '''
+Displays the time and the memory used by the processing phases
+(load, computations, export, plots) of the active snapshot
+Examples:
+  stats                  => displays the measures
+  stats save             => saves the measures in the working directory (json format)
+  stats save /tmp/s.json => saves the measures in /tmp/s.json
+  stats memory on        => traces the memory allocations of the next phases (slower)
+  stats memory off       => stops tracing the memory allocations
+    '''
+    print('')
+
+    l_args = args.split()
+    instr = self.snapshot.instr
+
+    if len(l_args) == 0:
+      instr.display()
+    elif l_args[0] == 'save':
+      if len(l_args) > 1:
+        filepath = l_args[1]
+      else:
+        filepath = '%s/whirlpool_%s_stats.json' % (self.working_dir, self.snapshot.denom)
+      instr.save(filepath)
+      print('Saved processing stats in %s' % filepath)
+    elif (l_args[0] == 'memory') and (len(l_args) == 2) and (l_args[1] in ['on', 'off']):
+      self.trace_memory = (l_args[1] == 'on')
+      instr.trace_memory = self.trace_memory
+      print('Tracing of memory allocations is %s.' % l_args[1])
+    else:
+      print('Invalid arguments (values: save [filepath], memory on|off).')
+
+    print(' ')
+
+
+  def do_profile(self, args):
+    '''
+Executes a command under a profiler and saves the profile in the working directory
+- whirlpool_profile_<command>.collapsed = collapsed stacks (for flamegraph.pl or speedscope)
+- whirlpool_profile_<command>.txt = time by phase (load, compute fwd, export, plot ...)
+  and top functions of each phase
+- whirlpool_profile_<command>.prof = statistics of cProfile (cprofile mode only)
+By default, the call stack is sampled at a regular interval (low overhead).
+The cprofile mode measures exactly all the calls (slower).
+Syntax: profile [cprofile] [interval=<ms>] [top=<n>] <command>
+Examples:
+  profile load 05                     => profiles the load of the snapshot of the 0.5BTC pools
+  profile cprofile export             => profiles the export with cProfile
+  profile interval=1 plot fwd anonset => samples the call stack every millisecond
+  profile top=50 report               => lists the 50 top functions of each phase
+    '''
+    from whirlpool_stats.utils.profiler import Profiler, DEFAULT_INTERVAL, DEFAULT_TOP
+    print('')
+
+    l_args = args.split()
+    deterministic = False
+    interval = DEFAULT_INTERVAL
+    top = DEFAULT_TOP
+    while (len(l_args) > 0) and ((l_args[0] == 'cprofile') or ('=' in l_args[0])):
+      option = l_args.pop(0)
+      name, _, value = option.partition('=')
+      if option == 'cprofile':
+        deterministic = True
+      elif (name in ['interval', 'top']) and value.isdigit() and (int(value) > 0):
+        if name == 'interval':
+          interval = int(value) / 1000
+        else:
+          top = int(value)
+      else:
+        print('Invalid option %s (values: cprofile, interval=<ms>, top=<n>).' % option)
+        print(' ')
+        return
+
+    if len(l_args) == 0:
+      print('A command is required.')
+      print(' ')
+      return
+    command = ' '.join(l_args)
+    if l_args[0] in ['profile', 'quit']:
+      print('Command %s can\'t be profiled.' % l_args[0])
+      print(' ')
+      return
+
+    print('Profiling command: %s' % command)
+    profiler = Profiler(interval, deterministic)
+    profiler.start()
+    try:
+      super(WhirlpoolStats, self).onecmd(command)
+    finally:
+      # The profile of an interrupted command is saved too
+      profiler.stop()
+      prefix = '%s/whirlpool_profile_%s' % (self.working_dir, l_args[0])
+      l_filepaths = profiler.save(prefix, command, top)
+
+    for line in profiler.get_report_lines(command, min(top, 10), details=False):
+      print(line)
+    print('')
+    for filepath in l_filepaths:
+      print('Saved profile in %s' % filepath)
+
+    print(' ')
+
+
+  def do_jobs(self, args):
+    '''
+Displays the commands executed in background
+(commands download, load, export, report and forecast ending with &, executed one at a time)
+Examples:
+  load 05 &   => loads the snapshot of the 0.5BTC pools in background
+  jobs        => displays the status, the duration and the progress of the jobs
+    '''
+    print('')
+    self.jobs.display()
+    print(' ')
+
+
+  def do_status(self, args):
+    '''
+Displays the active snapshot and the status of a job executed in background
+(progress, messages printed by the job)
+Syntax: status [job_id]
+Examples:
+  status     => active snapshot and status of the running job (or of the last job)
+  status 2   => status of the job 2
+    '''
+    print('')
+
+    if (len(args) > 0) and not args.strip().isdigit():
+      print('Invalid job id.')
+      print(' ')
+      return
+
+    if len(args) == 0:
+      if self.snapshot.denom is None:
+        print('No snapshot loaded.')
+      else:
+        print('Active snapshot: %s (%d mix txs, %d tx0s)' % (
+          self.snapshot.denom, len(self.snapshot.l_mix_txs), len(self.snapshot.l_tx0s)
+        ))
+      print('')
+
+    job = self.jobs.get_job(int(args) if len(args) > 0 else None)
+    if job is not None:
+      job.display()
+    elif len(args) > 0:
+      print('Unknown job.')
+    else:
+      print('No job.')
+
+    print(' ')
+
+
+  def do_cancel(self, args):
+    '''
+Cancels a job executed in background (the active snapshot isn't modified,
+interrupted computations of anonsets are resumed from their last checkpoint by the next load)
+Syntax: cancel [job_id]
+Examples:
+  cancel     => cancels the running job
+  cancel 2   => cancels the job 2
+    '''
+    print('')
+
+    if (len(args) > 0) and not args.strip().isdigit():
+      print('Invalid job id.')
+    else:
+      job = self.jobs.get_job(int(args) if len(args) > 0 else None)
+      if job is None:
+        print('Unknown job.' if len(args) > 0 else 'No job.')
+      elif self.jobs.cancel(job):
+        print('Cancellation of job %d requested.' % job.job_id)
+      else:
+        print('Job %d is already %s.' % (job.job_id, job.status))
+
+    print(' ')
+
+
   def do_quit(self, args):
     ''''
 Quits the program.
     '''
     print('')
+    # Running jobs are cancelled (checkpoints of the computations are saved)
+    self.jobs.cancel_all(timeout=30)
     print('Good bye!')
     raise SystemExit
 
@@ -259,8 +1198,12 @@ def usage():
   Usage message for this module
   '''
   sys.stdout.write('python wst.py [--workdir=/tmp] [--socks5=localhost:9050]\n')
-  sys.stdout.write('\n\n[-w OR --target_dir] = Path of the directory that will store the snapshot files.')
+  sys.stdout.write('\n\n[-w OR --workdir] = Path of the directory that will store the snapshot files.')
   sys.stdout.write('\n\n[-s OR --socks5] = Url of the socks5 proxy to use for downloading the snapshot.')
+  sys.stdout.write('\n\nNon-interactive mode: python wst.py run --help')
+  sys.stdout.write('\n\nDaemon mode (scheduled refresh): python wst.py watch --help')
+  sys.stdout.write('\n\nComparison of 2 versions of the snapshots: python wst.py diff --help')
+  sys.stdout.write('\n\nWorker of a distributed computation: python wst.py worker --help\n')
   sys.stdout.flush()
 
 
@@ -270,12 +1213,32 @@ if __name__ == '__main__':
   socks5 = None
   argv = sys.argv[1:]
 
+  # Non-interactive mode
+  if (len(argv) > 0) and (argv[0] == 'run'):
+    from whirlpool_stats.services import batch
+    sys.exit(batch.main(argv[1:]))
+
+  # Daemon mode refreshing the metrics on a schedule
+  if (len(argv) > 0) and (argv[0] == 'watch'):
+    from whirlpool_stats.services import watcher
+    sys.exit(watcher.main(argv[1:]))
+
+  # Comparison of 2 versions of the snapshots
+  if (len(argv) > 0) and (argv[0] == 'diff'):
+    from whirlpool_stats.services import differ
+    sys.exit(differ.main(argv[1:]))
+
+  # Worker computing the anonsets for a coordinator (distributed backend)
+  if (len(argv) > 0) and (argv[0] == 'worker'):
+    from whirlpool_stats.services import worker
+    sys.exit(worker.main(argv[1:]))
+
   # Processes the command line arguments
   try:
     opts, args = getopt.getopt(
       argv,
       'hw:s:',
-      ['help', 'workdir', 'socks5']
+      ['help', 'workdir=', 'socks5=']
     )
   except getopt.GetoptError:
     usage()
@@ -286,7 +1249,7 @@ if __name__ == '__main__':
       usage()
       sys.exit()
     elif opt in ('-w', '--workdir'):
-      target_dir = arg
+      working_dir = arg
     elif opt in ('-s', '--socks5'):
       socks5 = arg
 